@@ -1,8 +1,9 @@
 -- AIカスタム分析によるデータベース設計例
 -- 元データにない情報をAIが生成してデータベースに保存
+-- ui/api/_lib/storage.py の定義から python ui/bench/write_schema.py で生成（直接編集しない）
 
 -- 基本セッション情報
-CREATE TABLE counseling_sessions (
+CREATE TABLE IF NOT EXISTS counseling_sessions (
     session_id TEXT PRIMARY KEY,
     patient_name TEXT,
     doctor_name TEXT,
@@ -11,7 +12,7 @@ CREATE TABLE counseling_sessions (
 );
 
 -- 元の会話データ
-CREATE TABLE conversation_records (
+CREATE TABLE IF NOT EXISTS conversation_records (
     record_id TEXT PRIMARY KEY,
     session_id TEXT,
     speaker TEXT,
@@ -21,7 +22,7 @@ CREATE TABLE conversation_records (
 );
 
 -- AIが生成する感情分析データ（元データにはない）
-CREATE TABLE ai_emotion_analysis (
+CREATE TABLE IF NOT EXISTS ai_emotion_analysis (
     analysis_id TEXT PRIMARY KEY,
     session_id TEXT,
     patient_anxiety_level REAL,        -- AIが推定
@@ -35,7 +36,7 @@ CREATE TABLE ai_emotion_analysis (
 );
 
 -- AIが生成する治療評価データ（元データにはない）
-CREATE TABLE ai_treatment_assessment (
+CREATE TABLE IF NOT EXISTS ai_treatment_assessment (
     assessment_id TEXT PRIMARY KEY,
     session_id TEXT,
     urgency_level REAL,                -- AIが判断
@@ -48,7 +49,7 @@ CREATE TABLE ai_treatment_assessment (
 );
 
 -- AIが生成するリスク分析（元データにはない）
-CREATE TABLE ai_risk_analysis (
+CREATE TABLE IF NOT EXISTS ai_risk_analysis (
     risk_id TEXT PRIMARY KEY,
     session_id TEXT,
     risk_factor TEXT,                  -- AIが特定
@@ -60,7 +61,7 @@ CREATE TABLE ai_risk_analysis (
 );
 
 -- AIが生成する満足度・成功予測（元データにはない）
-CREATE TABLE ai_satisfaction_prediction (
+CREATE TABLE IF NOT EXISTS ai_satisfaction_prediction (
     prediction_id TEXT PRIMARY KEY,
     session_id TEXT,
     satisfaction_score REAL,           -- AIが予測
@@ -72,7 +73,7 @@ CREATE TABLE ai_satisfaction_prediction (
 );
 
 -- AIが生成するフォローアップ提案（元データにはない）
-CREATE TABLE ai_followup_recommendations (
+CREATE TABLE IF NOT EXISTS ai_followup_recommendations (
     recommendation_id TEXT PRIMARY KEY,
     session_id TEXT,
     recommendation_type TEXT,          -- AIが分類
@@ -84,7 +85,7 @@ CREATE TABLE ai_followup_recommendations (
 );
 
 -- AIが生成する臨床洞察（元データにはない）
-CREATE TABLE ai_clinical_insights (
+CREATE TABLE IF NOT EXISTS ai_clinical_insights (
     insight_id TEXT PRIMARY KEY,
     session_id TEXT,
     patient_education_needs JSON,      -- AIが特定
@@ -96,9 +97,19 @@ CREATE TABLE ai_clinical_insights (
     FOREIGN KEY (session_id) REFERENCES counseling_sessions(session_id)
 );
 
+-- 検索用の索引（セッション単位の取得と日付範囲の検索）
+CREATE INDEX IF NOT EXISTS idx_counseling_sessions_session_date ON counseling_sessions(session_date);
+CREATE INDEX IF NOT EXISTS idx_conversation_records_session_id ON conversation_records(session_id);
+CREATE INDEX IF NOT EXISTS idx_ai_emotion_analysis_session_id ON ai_emotion_analysis(session_id);
+CREATE INDEX IF NOT EXISTS idx_ai_treatment_assessment_session_id ON ai_treatment_assessment(session_id);
+CREATE INDEX IF NOT EXISTS idx_ai_risk_analysis_session_id ON ai_risk_analysis(session_id);
+CREATE INDEX IF NOT EXISTS idx_ai_satisfaction_prediction_session_id ON ai_satisfaction_prediction(session_id);
+CREATE INDEX IF NOT EXISTS idx_ai_followup_recommendations_session_id ON ai_followup_recommendations(session_id);
+CREATE INDEX IF NOT EXISTS idx_ai_clinical_insights_session_id ON ai_clinical_insights(session_id);
+
 -- 検索・分析用のビュー
-CREATE VIEW comprehensive_session_analysis AS
-SELECT 
+CREATE VIEW IF NOT EXISTS comprehensive_session_analysis AS
+SELECT
     cs.session_id,
     cs.patient_name,
     cs.doctor_name,
@@ -116,4 +127,51 @@ LEFT JOIN ai_emotion_analysis aea ON cs.session_id = aea.session_id
 LEFT JOIN ai_treatment_assessment ata ON cs.session_id = ata.session_id
 LEFT JOIN ai_satisfaction_prediction asp ON cs.session_id = asp.session_id
 LEFT JOIN ai_followup_recommendations afr ON cs.session_id = afr.session_id
-GROUP BY cs.session_id;
\ No newline at end of file
+GROUP BY cs.session_id;
+
+-- comprehensive_session_analysis の実体化（ダッシュボード用、セッションごとに最新のAI出力1件ずつ）
+-- ui/api/_lib/storage.py が counseling_sessions・ai_* 表へのトリガーでセッション単位に差分更新する
+CREATE TABLE IF NOT EXISTS session_analysis_summary (
+    session_id TEXT PRIMARY KEY,
+    patient_name TEXT,
+    doctor_name TEXT,
+    session_date DATETIME,
+    patient_anxiety_level REAL,
+    patient_trust_level REAL,
+    emotional_state TEXT,
+    stress_indicators JSON,
+    urgency_level REAL,
+    pain_severity_estimated INTEGER,
+    treatment_success_probability REAL,
+    satisfaction_score REAL,
+    key_factors JSON,
+    total_recommendations INTEGER,
+    refreshed_at DATETIME,
+    stress_indicator_count INTEGER GENERATED ALWAYS AS (
+        CASE WHEN json_valid(stress_indicators) THEN json_array_length(stress_indicators) ELSE 0 END) VIRTUAL,
+    primary_stress_indicator TEXT GENERATED ALWAYS AS (
+        CASE WHEN json_valid(stress_indicators) THEN json_extract(stress_indicators, '$[0]') END) VIRTUAL,
+    key_factor_count INTEGER GENERATED ALWAYS AS (
+        CASE WHEN json_valid(key_factors) THEN json_array_length(key_factors) ELSE 0 END) VIRTUAL
+);
+
+-- stress_indicators の要素ごとの索引（「費用への不安」を含むセッションの検索用）
+CREATE TABLE IF NOT EXISTS session_stress_indicators (
+    session_id TEXT,
+    indicator TEXT,
+    PRIMARY KEY (indicator, session_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_summary_session_date ON session_analysis_summary(session_date);
+CREATE INDEX IF NOT EXISTS idx_summary_anxiety ON session_analysis_summary(patient_anxiety_level);
+CREATE INDEX IF NOT EXISTS idx_summary_satisfaction ON session_analysis_summary(satisfaction_score);
+CREATE INDEX IF NOT EXISTS idx_summary_primary_stress ON session_analysis_summary(primary_stress_indicator);
+CREATE INDEX IF NOT EXISTS idx_summary_stress_count ON session_analysis_summary(stress_indicator_count);
+CREATE INDEX IF NOT EXISTS idx_session_stress_indicators_session_id ON session_stress_indicators(session_id);
+
+-- 発言の全文検索索引（rowid = conversation_records.rowid）
+-- grams は発言を NFKC 正規化した文字 bigram をスペースで区切った列（ui/api/_lib/search.py の index_terms）、
+-- role は話者ラベルから判定した役割。本文を持たない contentless 表で、保存処理が同じトランザクションで更新する
+CREATE VIRTUAL TABLE IF NOT EXISTS conversation_fts USING fts5(
+    grams, role, content='', tokenize='unicode61 remove_diacritics 0'
+);
@@ -0,0 +1,4 @@
+"""api/ 配下のサーバーレス関数で共有するモジュール群
+
+先頭が "_" のディレクトリはVercelの関数としてデプロイされない。
+"""
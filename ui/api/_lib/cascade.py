@@ -0,0 +1,454 @@
+"""品質分析のカスケード（ローカルモデルで先に採点し、確信の持てない会話だけLLMに回す）
+
+ローカルモデルは文字 n-gram（1〜3文字、ハッシュで固定次元に畳み込む）のロジスティック回帰で、
+QUALITY_SCORES の3スコアを 0〜1 の値として予測する（NumPy のみ。LLMの出力したスコアを soft label に学習）。
+
+会話ごとに次のどれかならLLMに回し、それ以外はローカルモデルのスコアを返す（method: local_cascade_model）。
+
+- band: 成約可能性（success_possibility）の予測が不確実帯 [QUALITY_CASCADE_BAND_LOW, QUALITY_CASCADE_BAND_HIGH] に入る
+- coverage: 会話の n-gram のうち学習データに現れたものの割合が QUALITY_CASCADE_MIN_COVERAGE 未満（見慣れない会話）
+- audit: 確信のある会話のうち QUALITY_CASCADE_AUDIT_RATE の割合（帯の外での一致度を偏りなく測るための抜き取り）
+- no_model: モデルファイルがない（カスケードなしと同じ動作）
+- no_numpy: NumPy がない（同じくカスケードなしと同じ動作。requirements.txt に含めているので通常は起きない）
+
+LLMに回した会話ではローカルモデルとLLMのスコアの差（平均絶対誤差）と、成約可能性が 0.5 のどちら側かの
+一致率を集計する。件数と一致度は品質分析を行った関数の GET ?metrics=state の quality_cascade と
+?metrics=1 の dental_quality_cascade_total / dental_quality_cascade_abs_error に出る（インスタンスごとの値）。
+
+学習データは QUALITY_CASCADE_LOG に追記されるLLMの品質分析結果（会話本文とスコアの JSONL）。
+カスケードを有効にする前から記録しておき、python ui/bench/train_cascade.py で学習・帯の評価をする。
+
+環境変数:
+    QUALITY_CASCADE                 1 で有効（既定 無効）
+    QUALITY_CASCADE_MODEL           モデルファイル（既定 一時ディレクトリの dental_ai_quality_cascade.npz）
+    QUALITY_CASCADE_BAND_LOW        不確実帯の下限（既定 0.35）
+    QUALITY_CASCADE_BAND_HIGH       不確実帯の上限（既定 0.65）
+    QUALITY_CASCADE_MIN_COVERAGE    既知の n-gram の割合の下限（既定 0.5）
+    QUALITY_CASCADE_AUDIT_RATE      確信のある会話をLLMにも回す割合（既定 0）
+    QUALITY_CASCADE_LOG             LLMの品質分析結果の追記先（既定 空文字＝記録しない）
+"""
+import hashlib
+import importlib.util
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from .llm_cache import normalize_transcript
+from .telemetry import CASCADE_DECISIONS, CASCADE_ERROR, register_state
+
+SCORES = ('success_possibility', 'patient_understanding', 'treatment_consent')
+METHOD = 'local_cascade_model'
+NGRAM_SIZES = (1, 2, 3)
+DEFAULT_DIM = 1 << 18
+DEFAULT_MODEL_PATH = os.path.join(tempfile.gettempdir(), 'dental_ai_quality_cascade.npz')
+DEFAULT_BAND = (0.35, 0.65)
+DEFAULT_MIN_COVERAGE = 0.5
+# n-gram のハッシュに使う乗数（64bit で桁あふれさせる）
+_HASH_MULTIPLIER = 0x100000001B3
+ESCALATION_REASONS = ('band', 'coverage', 'audit', 'no_model', 'no_numpy')
+
+
+def _numpy():
+    """NumPy（なければ None。カスケードは全件LLMに回す）"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def cascade_enabled():
+    return os.environ.get('QUALITY_CASCADE', '').lower() in ('1', 'true', 'yes')
+
+
+def band():
+    """不確実帯 (下限, 上限)"""
+    return (float(os.environ.get('QUALITY_CASCADE_BAND_LOW', DEFAULT_BAND[0])),
+            float(os.environ.get('QUALITY_CASCADE_BAND_HIGH', DEFAULT_BAND[1])))
+
+
+def min_coverage():
+    return float(os.environ.get('QUALITY_CASCADE_MIN_COVERAGE', DEFAULT_MIN_COVERAGE))
+
+
+def audit_rate():
+    return float(os.environ.get('QUALITY_CASCADE_AUDIT_RATE', 0.0))
+
+
+def featurize(text, dim=DEFAULT_DIM, np=None):
+    """会話を (列番号, 値, 列ごとの出現回数) にする
+
+    文字コードの配列から n-gram のハッシュをまとめて計算し、bincount で数える（Python のループは n の数だけ）。
+    値は log(1 + 出現回数) を L2 正規化したもの。
+    """
+    np = np or _numpy()
+    codes = np.frombuffer(normalize_transcript(text).encode('utf-32-le'), dtype='<u4').astype(np.uint64)
+    hashes = []
+    multiplier = np.uint64(_HASH_MULTIPLIER)
+    for n in NGRAM_SIZES:
+        if len(codes) < n:
+            continue
+        h = np.full(len(codes) - n + 1, n, dtype=np.uint64)
+        for offset in range(n):
+            h = h * multiplier + codes[offset:len(codes) - n + 1 + offset]
+        hashes.append(h % np.uint64(dim))
+    if not hashes:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    counts = np.bincount(np.concatenate(hashes).astype(np.int64), minlength=dim)
+    cols = np.flatnonzero(counts)
+    occurrences = counts[cols].astype(np.float64)
+    values = np.log1p(occurrences)
+    values /= np.linalg.norm(values)
+    return cols, values, occurrences
+
+
+def _sigmoid(np, z):
+    return 1 / (1 + np.exp(-np.clip(z, -30, 30)))
+
+
+class CascadeModel:
+    """文字 n-gram のロジスティック回帰（スコアごとの重み列）"""
+
+    def __init__(self, weights, bias, seen, meta):
+        self.weights = weights  # (dim, スコア数)
+        self.bias = bias        # (スコア数,)
+        self.seen = seen        # 学習データに現れた列
+        self.meta = meta
+
+    @property
+    def dim(self):
+        return self.weights.shape[0]
+
+    def predict(self, text):
+        """({スコア: 予測値}, 既知の n-gram の割合)"""
+        np = _numpy()
+        cols, values, occurrences = featurize(text, self.dim, np)
+        if not len(cols):
+            return None, 0.0
+        z = values @ self.weights[cols] + self.bias
+        coverage = float(occurrences[self.seen[cols]].sum() / occurrences.sum())
+        return {score: float(value) for score, value in zip(SCORES, _sigmoid(np, z))}, coverage
+
+    def save(self, path):
+        np = _numpy()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # 書き込み途中のファイルを読ませないよう、一時ファイルに書いてから置き換える
+        fd, temp_path = tempfile.mkstemp(suffix='.npz', dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, weights=self.weights.astype(np.float32), bias=self.bias,
+                                seen=np.packbits(self.seen), meta=np.array(json.dumps(self.meta)))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        np = _numpy()
+        with np.load(path, allow_pickle=False) as data:
+            weights = data['weights'].astype(np.float64)
+            seen = np.unpackbits(data['seen'])[:weights.shape[0]].astype(bool)
+            return cls(weights, data['bias'], seen, json.loads(str(data['meta'])))
+
+
+def train(examples, dim=DEFAULT_DIM, epochs=200, learning_rate=0.5, l2=1e-5):
+    """[(会話本文, {スコア: LLMの値})] から CascadeModel を学習する（ない値は学習に使わない）
+
+    全件の勾配を AdaGrad で更新する。特徴量は疎なので、予測と勾配は列番号の bincount で計算する。
+    """
+    np = _numpy()
+    if np is None:
+        raise RuntimeError("カスケードの学習には NumPy が必要です")
+    rows, cols, values = [], [], []
+    targets = np.full((len(examples), len(SCORES)), np.nan)
+    seen = np.zeros(dim, dtype=bool)
+    for index, (text, labels) in enumerate(examples):
+        example_cols, example_values, _ = featurize(text, dim, np)
+        rows.append(np.full(len(example_cols), index))
+        cols.append(example_cols)
+        values.append(example_values)
+        seen[example_cols] = True
+        for k, score in enumerate(SCORES):
+            value = labels.get(score)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                targets[index, k] = min(1.0, max(0.0, float(value)))
+    rows, cols, values = np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+    mask = ~np.isnan(targets)
+    targets = np.nan_to_num(targets)
+    labelled = np.maximum(mask.sum(axis=0), 1)
+
+    # 切片は各スコアの平均から始める
+    mean = np.clip((targets * mask).sum(axis=0) / labelled, 0.01, 0.99)
+    bias = np.log(mean / (1 - mean))
+    weights = np.zeros((dim, len(SCORES)))
+    weight_history = np.zeros_like(weights)
+    bias_history = np.zeros_like(bias)
+    for _ in range(epochs):
+        z = np.empty_like(targets)
+        for k in range(len(SCORES)):
+            z[:, k] = np.bincount(rows, weights=values * weights[cols, k], minlength=len(examples))
+        error = (_sigmoid(np, z + bias) - targets) * mask / labelled
+        gradient = np.empty_like(weights)
+        for k in range(len(SCORES)):
+            gradient[:, k] = np.bincount(cols, weights=values * error[rows, k], minlength=dim)
+        gradient += l2 * weights
+        bias_gradient = error.sum(axis=0)
+        weight_history += gradient ** 2
+        bias_history += bias_gradient ** 2
+        weights -= learning_rate * gradient / (np.sqrt(weight_history) + 1e-8)
+        bias -= learning_rate * bias_gradient / (np.sqrt(bias_history) + 1e-8)
+
+    meta = {
+        "trained_at": datetime.utcnow().isoformat() + "Z",
+        "examples": len(examples),
+        "labelled": {score: int(count) for score, count in zip(SCORES, mask.sum(axis=0))},
+        "ngram_sizes": list(NGRAM_SIZES),
+        "epochs": epochs,
+    }
+    return CascadeModel(weights, bias, seen, meta)
+
+
+def load_examples(path):
+    """QUALITY_CASCADE_LOG の JSONL を [(会話本文, {スコア: 値})] にする（同じ会話は最後の結果を使う）"""
+    latest = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            text = record.get('content')
+            scores = record.get('scores') or {}
+            if not text or not any(isinstance(scores.get(score), (int, float)) for score in SCORES):
+                continue
+            latest[hashlib.sha256(normalize_transcript(text).encode('utf-8')).hexdigest()] = (text, scores)
+    return list(latest.values())
+
+
+def sweep(model, examples, bands, coverage=DEFAULT_MIN_COVERAGE):
+    """評価用の [(会話本文, {スコア: LLMの値})] で、帯ごとのLLMに回す割合とローカルで返す会話の一致度を求める
+
+    [{"band", "escalation_rate", "local_mean_abs_error", "local_decision_agreement", "local"}] を返す。
+    """
+    predictions = [(model.predict(text), labels) for text, labels in examples]
+    rows = []
+    for low, high in bands:
+        escalated = 0
+        errors = []
+        agreements = []
+        for (scores, known), labels in predictions:
+            if (scores is None or known < coverage
+                    or low <= scores['success_possibility'] <= high):
+                escalated += 1
+                continue
+            errors.extend(abs(scores[score] - labels[score]) for score in SCORES
+                          if isinstance(labels.get(score), (int, float)))
+            if isinstance(labels.get('success_possibility'), (int, float)):
+                agreements.append((scores['success_possibility'] >= 0.5) == (labels['success_possibility'] >= 0.5))
+        rows.append({
+            "band": [low, high],
+            "escalation_rate": round(escalated / len(predictions), 4) if predictions else 0.0,
+            "local": len(predictions) - escalated,
+            "local_mean_abs_error": round(sum(errors) / len(errors), 4) if errors else None,
+            "local_decision_agreement": round(sum(agreements) / len(agreements), 4) if agreements else None,
+        })
+    return rows
+
+
+class Decision:
+    """1会話のカスケード判定"""
+
+    __slots__ = ('scores', 'coverage', 'escalate', 'reason', 'band', 'model_ms')
+
+    def __init__(self, scores, coverage, escalate, reason, band, model_ms):
+        self.scores = scores
+        self.coverage = coverage
+        self.escalate = escalate
+        self.reason = reason
+        self.band = band
+        self.model_ms = model_ms
+
+    @property
+    def confidence(self):
+        """成約可能性の予測の 0.5 からの距離（0〜1）に既知の n-gram の割合を掛けたもの"""
+        if self.scores is None:
+            return 0.0
+        return round(abs(self.scores['success_possibility'] - 0.5) * 2 * self.coverage, 2)
+
+    def summary(self):
+        return {
+            "escalated": self.escalate,
+            "reason": self.reason,
+            "band": list(self.band),
+            "local_scores": {score: round(value, 3) for score, value in self.scores.items()} if self.scores else None,
+            "coverage": round(self.coverage, 3),
+            "model_ms": round(self.model_ms, 3),
+        }
+
+
+class CascadeStats:
+    """判定の件数と、LLMに回した会話でのローカルモデルとLLMの一致度"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {"local": 0, "escalated": 0, **{reason: 0 for reason in ESCALATION_REASONS}}
+        self._model_ms = 0.0
+        # 全体（band / coverage / audit）と audit のみ（帯の外の会話の偏りのない標本）
+        self._agreement = {name: {"compared": 0, "agreed": 0, "abs_error": dict.fromkeys(SCORES, 0.0)}
+                           for name in ('escalated', 'audit')}
+
+    def record_decision(self, decision):
+        with self._lock:
+            if decision.escalate:
+                self._counts["escalated"] += 1
+                self._counts[decision.reason] += 1
+            else:
+                self._counts["local"] += 1
+            self._model_ms += decision.model_ms
+
+    def record_agreement(self, decision, result):
+        errors = {score: abs(decision.scores[score] - result[score]) for score in SCORES
+                  if isinstance(result.get(score), (int, float))}
+        if not errors:
+            return errors
+        agreed = (decision.scores['success_possibility'] >= 0.5) == (result.get('success_possibility', 0) >= 0.5)
+        with self._lock:
+            for name in ('escalated', 'audit') if decision.reason == 'audit' else ('escalated',):
+                agreement = self._agreement[name]
+                agreement["compared"] += 1
+                agreement["agreed"] += agreed
+                for score, error in errors.items():
+                    agreement["abs_error"][score] += error
+        return errors
+
+    def snapshot(self):
+        with self._lock:
+            counts = dict(self._counts)
+            model_ms = self._model_ms
+            agreement = {name: {"compared": values["compared"], "agreed": values["agreed"],
+                                "abs_error": dict(values["abs_error"])}
+                         for name, values in self._agreement.items()}
+        decided = counts["local"] + counts["escalated"]
+        snapshot = {
+            "sessions": decided,
+            "local": counts["local"],
+            "escalated": counts["escalated"],
+            "escalation_rate": round(counts["escalated"] / decided, 4) if decided else 0.0,
+            "reasons": {reason: counts[reason] for reason in ESCALATION_REASONS},
+            "model_ms_avg": round(model_ms / decided, 3) if decided else 0.0,
+        }
+        for name, values in agreement.items():
+            compared = values["compared"]
+            snapshot[f"{name}_agreement"] = {
+                "compared": compared,
+                "mean_abs_error": {score: round(total / compared, 4) if compared else None
+                                   for score, total in values["abs_error"].items()},
+                "decision_agreement": round(values["agreed"] / compared, 4) if compared else None,
+            }
+        return snapshot
+
+
+class _ModelSlot:
+    """モデルファイルの遅延読み込み（更新時刻が変わったら読み直す）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path = None
+        self._mtime = None
+        self._model = None
+        self.error = None
+
+    def get(self):
+        path = os.environ.get('QUALITY_CASCADE_MODEL', DEFAULT_MODEL_PATH)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        with self._lock:
+            if (path, mtime) != (self._path, self._mtime):
+                self._path, self._mtime = path, mtime
+                try:
+                    self._model, self.error = CascadeModel.load(path), None
+                except Exception as e:
+                    print(f"Quality cascade model unavailable: {e}")
+                    self._model, self.error = None, str(e)
+            return self._model
+
+    def info(self):
+        with self._lock:
+            if self._model is None:
+                return {"path": self._path, "loaded": False, "error": self.error}
+            return {"path": self._path, "loaded": True, **self._model.meta}
+
+
+_stats = CascadeStats()
+_slot = _ModelSlot()
+_log_lock = threading.Lock()
+
+
+def get_cascade_stats():
+    return _stats
+
+
+def decide(text, rng=random):
+    """ローカルモデルで採点し、LLMに回すかを決める"""
+    started = time.perf_counter()
+    low, high = band()
+    has_numpy = _numpy() is not None
+    model = _slot.get() if has_numpy else None
+    scores, coverage = model.predict(text) if model is not None else (None, 0.0)
+    if not has_numpy:
+        # 結果の cascade.reason と ?metrics=1（dental_quality_cascade_total）でカスケードが働いていないことが分かるようにする
+        reason = 'no_numpy'
+    elif scores is None:
+        reason = 'no_model'
+    elif coverage < min_coverage():
+        reason = 'coverage'
+    elif low <= scores['success_possibility'] <= high:
+        reason = 'band'
+    elif rng.random() < audit_rate():
+        reason = 'audit'
+    else:
+        reason = 'confident'
+    decision = Decision(scores, coverage, reason != 'confident', reason, (low, high),
+                        (time.perf_counter() - started) * 1000)
+    _stats.record_decision(decision)
+    CASCADE_DECISIONS.inc(outcome='escalated' if decision.escalate else 'local', reason=reason)
+    return decision
+
+
+def observe_llm_result(text, result, decision=None):
+    """LLMの品質分析結果を学習データに記録し、カスケードでLLMに回した会話ならローカルモデルとの差を集計する"""
+    if decision is not None and decision.scores is not None:
+        for score, error in _stats.record_agreement(decision, result).items():
+            CASCADE_ERROR.observe(error, score=score)
+    path = os.environ.get('QUALITY_CASCADE_LOG', '')
+    scores = {score: result[score] for score in SCORES if isinstance(result.get(score), (int, float))}
+    if not path or not scores:
+        return
+    record = {"content": text, "scores": scores, "method": result.get("method"),
+              "logged_at": datetime.utcnow().isoformat() + "Z"}
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    try:
+        with _log_lock, open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+    except OSError as e:
+        print(f"Quality cascade log unavailable: {e}")
+
+
+def cascade_snapshot():
+    """?metrics=state の quality_cascade"""
+    snapshot = {"enabled": cascade_enabled(), "band": list(band()), "min_coverage": min_coverage(),
+                "audit_rate": audit_rate(), "model": _slot.info(),
+                # 状態の取得では NumPy を読み込まずに有無だけを見る
+                "numpy": importlib.util.find_spec('numpy') is not None}
+    snapshot.update(_stats.snapshot())
+    return snapshot
+
+
+register_state('quality_cascade', cascade_snapshot)
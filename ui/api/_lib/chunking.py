@@ -0,0 +1,145 @@
+"""モデルのコンテキストに収まらない長い会話の分割解析（map-reduce）
+
+発話（行）の境界で会話を分割し、直前チャンクの末尾の発話を重ねて文脈を引き継ぐ。
+各チャンクを並行して解析し（map）、部分結果を元と同じ出力スキーマに統合する（reduce）。
+チャンク数がワーカー数以下なら、所要時間は全体の長さではなく最も遅いチャンクで決まる。
+
+環境変数:
+    CHUNK_MAX_CHARS         1チャンクの最大文字数（既定 3000、これ以下の会話は分割しない）
+    CHUNK_OVERLAP_LINES     次のチャンクに重ねる発話数（既定 3）
+    CHUNK_MAX_WORKERS       並行して解析するチャンク数（既定 8）
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .telemetry import submit_in_context
+
+DEFAULT_MAX_CHARS = 3000
+DEFAULT_OVERLAP_LINES = 3
+DEFAULT_MAX_WORKERS = 8
+
+
+def _split_long_line(line, max_chars):
+    return [line[start:start + max_chars] for start in range(0, len(line), max_chars)]
+
+
+def chunk_transcript(text, max_chars=None, overlap=None):
+    """会話を max_chars 以下のチャンクのリストに分割する（重なり部分も上限に含める）
+
+    max_chars 以下の会話はそのまま1チャンクで返す。1行で上限を超える発話は文字数で切る。
+    """
+    max_chars = int(os.environ.get('CHUNK_MAX_CHARS', DEFAULT_MAX_CHARS)) if max_chars is None else max_chars
+    overlap = int(os.environ.get('CHUNK_OVERLAP_LINES', DEFAULT_OVERLAP_LINES)) if overlap is None else overlap
+    text = text or ''
+    if len(text) <= max_chars:
+        return [text]
+
+    lines = []
+    for line in text.split('\n'):
+        if line.strip():
+            lines.extend(_split_long_line(line, max_chars) if len(line) > max_chars else [line])
+
+    chunks = []
+    current = []
+    size = 0  # '\n'.join(current) の長さ
+    fresh = 0  # current のうち前のチャンクと重なっていない発話数
+    for line in lines:
+        added = len(line) + (1 if current else 0)
+        if current and size + added > max_chars:
+            if fresh:
+                chunks.append('\n'.join(current))
+            # 末尾の発話を次のチャンクに引き継ぐ（新しい発話と合わせて上限を超えない分だけ）
+            carried = current[-overlap:] if overlap else []
+            while carried and sum(len(c) + 1 for c in carried) + len(line) > max_chars:
+                carried = carried[1:]
+            current = list(carried)
+            size = len('\n'.join(current))
+            fresh = 0
+            added = len(line) + (1 if current else 0)
+        current.append(line)
+        size += added
+        fresh += 1
+    if fresh:
+        chunks.append('\n'.join(current))
+    return chunks
+
+
+def _merge_values(values, weights):
+    values_weights = [(value, weight) for value, weight in zip(values, weights) if value is not None]
+    if not values_weights:
+        return None
+    first = values_weights[0][0]
+
+    if isinstance(first, bool):
+        return any(bool(value) for value, _ in values_weights)
+    if isinstance(first, (int, float)):
+        numbers = [(value, weight) for value, weight in values_weights
+                   if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        total = sum(weight for _, weight in numbers)
+        if not total:
+            return first
+        return round(sum(value * weight for value, weight in numbers) / total, 3)
+    if isinstance(first, str):
+        pieces = dict.fromkeys(value.strip() for value, _ in values_weights
+                               if isinstance(value, str) and value.strip())
+        return '\n'.join(pieces)
+    if isinstance(first, list):
+        merged = {}
+        for value, _ in values_weights:
+            for item in value if isinstance(value, list) else [value]:
+                merged.setdefault(json.dumps(item, ensure_ascii=False, sort_keys=True), item)
+        return list(merged.values())
+    if isinstance(first, dict):
+        return merge_partials([value if isinstance(value, dict) else {} for value, _ in values_weights],
+                              [weight for _, weight in values_weights])
+    return first
+
+
+def merge_partials(partials, weights=None):
+    """チャンクごとの部分結果を同じスキーマの1つの結果に統合する
+
+    数値（スコア・信頼度）はチャンクの長さで重み付けした平均、真偽値はいずれかが真なら真、
+    文字列（SOAP各欄・根拠）は重複を除いて出現順に連結、リストは重複を除いた和集合。
+    """
+    weights = weights or [1] * len(partials)
+    keys = list(dict.fromkeys(key for partial in partials for key in partial))
+    return {key: _merge_values([partial.get(key) for partial in partials], weights) for key in keys}
+
+
+def map_reduce(chunks, analyze, max_workers=None):
+    """各チャンクに analyze(chunk) を並行適用し、成功した部分結果を merge_partials で統合する
+
+    一部のチャンクが失敗しても残りで統合し、失敗したチャンク番号を chunking.failed_chunks に残す。
+    全チャンクが失敗した場合は最初の例外を送出する。
+    """
+    max_workers = int(os.environ.get('CHUNK_MAX_WORKERS', DEFAULT_MAX_WORKERS)) if max_workers is None else max_workers
+
+    def run(chunk):
+        try:
+            return analyze(chunk), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+        futures = [submit_in_context(executor, run, chunk) for chunk in chunks]
+        outcomes = [future.result() for future in futures]
+
+    partials, weights, failed = [], [], []
+    for index, (chunk, (result, error)) in enumerate(zip(chunks, outcomes)):
+        if error is not None:
+            print(f"Chunk {index} analysis error: {error}")
+            failed.append(index)
+        else:
+            partials.append(result)
+            weights.append(len(chunk))
+    if not partials:
+        raise outcomes[0][1]
+
+    merged = merge_partials(partials, weights)
+    merged["chunking"] = {
+        "chunks": len(chunks),
+        "failed_chunks": failed,
+        "chunk_chars": [len(chunk) for chunk in chunks]
+    }
+    return merged
@@ -0,0 +1,229 @@
+"""プロバイダ・モデルごとのサーキットブレーカー
+
+障害中のプロバイダに全リクエストが失敗まで待たされるのを防ぐ。(プロバイダ, モデル) ごとに直近
+BREAKER_WINDOW_SECONDS 秒の失敗（例外と、BREAKER_SLOW_CALL_MS を超えた呼び出し）を数え、
+BREAKER_FAILURE_THRESHOLD 件に達したら open にする。
+
+- closed: 通常どおり呼び出す
+- open: 呼び出さずに CircuitOpen を投げる（呼び出し側はすぐにルールベースのフォールバックを返す）
+- half_open: open から BREAKER_OPEN_SECONDS 秒たつと、同時に BREAKER_HALF_OPEN_PROBES 件までの実リクエストを
+  試しに通す。成功すれば closed、失敗すれば再び open（それ以外のリクエストは open と同じく即座に拒否）
+
+打ち切った呼び出しと、応答はあったが JSON として読めなかった呼び出し（llm_json.LLMJSONError）はどちらにも数えない。
+
+状態は各関数の GET ?metrics=state の circuit_breakers に出る（ブレーカーは関数のインスタンスごとに持つので、
+/api/health には出ない）。
+
+環境変数:
+    BREAKER_DISABLED            1 で無効
+    BREAKER_FAILURE_THRESHOLD   open にする失敗件数（既定 5）
+    BREAKER_WINDOW_SECONDS      失敗を数える時間幅秒（既定 60）
+    BREAKER_OPEN_SECONDS        open から half_open に移るまでの秒数（既定 30）
+    BREAKER_HALF_OPEN_PROBES    half_open で同時に通すリクエスト数（既定 1）
+    BREAKER_SLOW_CALL_MS        これを超えた呼び出しはタイムアウトとして失敗に数える（既定 30000、0 で無効）
+"""
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from .llm_json import LLMJSONError
+from .telemetry import BREAKER_REJECTIONS, BREAKER_TRANSITIONS, Cancelled, register_state
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_WINDOW_SECONDS = 60.0
+DEFAULT_OPEN_SECONDS = 30.0
+DEFAULT_HALF_OPEN_PROBES = 1
+DEFAULT_SLOW_CALL_MS = 30000.0
+
+
+class CircuitOpen(Exception):
+    """ブレーカーが open のため呼び出さなかった"""
+
+    def __init__(self, name, retry_in):
+        self.retry_in = retry_in
+        super().__init__(f"circuit open for {name} (retry in {retry_in:.1f}s)")
+
+
+def _isoformat(timestamp):
+    return datetime.utcfromtimestamp(timestamp).isoformat() + "Z" if timestamp else None
+
+
+class CircuitBreaker:
+    """1つの (プロバイダ, モデル) のブレーカー。スレッドセーフ"""
+
+    def __init__(self, provider, model, failure_threshold=None, window_seconds=None, open_seconds=None,
+                 half_open_probes=None, slow_call_ms=None):
+        self.provider = provider
+        self.model = model
+        self.name = f"{provider}:{model}"
+        self.failure_threshold = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', DEFAULT_FAILURE_THRESHOLD)
+                                     if failure_threshold is None else failure_threshold)
+        self.window_seconds = float(os.environ.get('BREAKER_WINDOW_SECONDS', DEFAULT_WINDOW_SECONDS)
+                                    if window_seconds is None else window_seconds)
+        self.open_seconds = float(os.environ.get('BREAKER_OPEN_SECONDS', DEFAULT_OPEN_SECONDS)
+                                  if open_seconds is None else open_seconds)
+        self.half_open_probes = int(os.environ.get('BREAKER_HALF_OPEN_PROBES', DEFAULT_HALF_OPEN_PROBES)
+                                    if half_open_probes is None else half_open_probes)
+        self.slow_call_ms = float(os.environ.get('BREAKER_SLOW_CALL_MS', DEFAULT_SLOW_CALL_MS)
+                                  if slow_call_ms is None else slow_call_ms)
+        self.state = CLOSED
+        self._failures = deque()
+        self._opened_at = None
+        self._probes = 0
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "failures": 0, "timeouts": 0, "rejected": 0, "opened": 0}
+        self._last_failure = None
+
+    def _transition(self, state):
+        self.state = state
+        BREAKER_TRANSITIONS.inc(provider=self.provider, model=self.model, state=state)
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self._counters['opened'] += 1
+        elif state == CLOSED:
+            self._failures.clear()
+            self._opened_at = None
+
+    def acquire(self):
+        """呼び出してよければ half_open の試行かどうかを返す。open なら CircuitOpen"""
+        with self._lock:
+            if self.state == OPEN:
+                elapsed = time.monotonic() - self._opened_at
+                if elapsed < self.open_seconds:
+                    self._reject()
+                    raise CircuitOpen(self.name, self.open_seconds - elapsed)
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    self._reject()
+                    raise CircuitOpen(self.name, 0.0)
+                self._probes += 1
+                self._counters['calls'] += 1
+                return True
+            self._counters['calls'] += 1
+            return False
+
+    def _reject(self):
+        self._counters['rejected'] += 1
+        BREAKER_REJECTIONS.inc(provider=self.provider, model=self.model)
+
+    def release(self, probe, ok, reason=None):
+        """呼び出しの結果を記録する（ok が None なら成否に数えない：打ち切った呼び出しなど）"""
+        with self._lock:
+            if probe:
+                self._probes -= 1
+            if ok is None:
+                return
+            if ok:
+                if probe and self.state == HALF_OPEN:
+                    self._transition(CLOSED)
+                return
+            now = time.monotonic()
+            self._counters['timeouts' if reason == 'timeout' else 'failures'] += 1
+            self._last_failure = (time.time(), reason)
+            if self.state == HALF_OPEN:
+                self._transition(OPEN)
+                return
+            self._failures.append(now)
+            while self._failures and self._failures[0] < now - self.window_seconds:
+                self._failures.popleft()
+            if self.state == CLOSED and len(self._failures) >= self.failure_threshold:
+                self._transition(OPEN)
+
+    def call(self, func):
+        """func() をブレーカー越しに呼ぶ（BREAKER_SLOW_CALL_MS を超えた成功は結果を返しつつ失敗に数える）"""
+        probe = self.acquire()
+        started = time.perf_counter()
+        try:
+            result = func()
+        except (Cancelled, LLMJSONError):
+            # 打ち切った呼び出しと JSON として読めない応答（プロバイダ自体は応答している）は成否に数えない
+            # （half_open の試行でも closed に戻さない）
+            self.release(probe, None)
+            raise
+        except Exception as e:
+            self.release(probe, False, str(e)[:200])
+            raise
+        slow = self.slow_call_ms > 0 and (time.perf_counter() - started) * 1000 > self.slow_call_ms
+        self.release(probe, not slow, 'timeout' if slow else None)
+        return result
+
+    def stream(self, deltas):
+        """ストリーミング応答の差分をブレーカー越しに読むジェネレーター（call() のストリーミング版）
+
+        最初の差分を読む前に acquire し、読み終えた・失敗した時点で結果を記録する。
+        生成に時間のかかる応答でも遅い呼び出しに数えないよう、BREAKER_SLOW_CALL_MS は最初の差分までの時間で見る。
+        """
+        probe = self.acquire()
+        started = time.perf_counter()
+        slow = None
+        try:
+            for delta in deltas:
+                if slow is None:
+                    slow = self.slow_call_ms > 0 and (time.perf_counter() - started) * 1000 > self.slow_call_ms
+                yield delta
+        except (Cancelled, GeneratorExit):
+            # 打ち切り・クライアントの切断は成否に数えない
+            self.release(probe, None)
+            raise
+        except Exception as e:
+            self.release(probe, False, str(e)[:200])
+            raise
+        self.release(probe, not slow, 'timeout' if slow else None)
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            recent = sum(1 for at in self._failures if at >= now - self.window_seconds)
+            snapshot = {
+                "state": self.state,
+                "recent_failures": recent,
+                "failure_threshold": self.failure_threshold,
+                "window_seconds": self.window_seconds,
+                **self._counters
+            }
+            if self.state == OPEN:
+                snapshot["retry_in_seconds"] = round(max(0.0, self.open_seconds - (now - self._opened_at)), 1)
+            if self._last_failure is not None:
+                snapshot["last_failure"] = {"at": _isoformat(self._last_failure[0]), "error": self._last_failure[1]}
+        return snapshot
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_enabled():
+    return os.environ.get('BREAKER_DISABLED', '').lower() not in ('1', 'true', 'yes')
+
+
+def get_breaker(provider, model):
+    """(provider, model) のブレーカー（プロセスで共有）"""
+    key = (provider, model)
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(key)
+            if breaker is None:
+                breaker = _breakers[key] = CircuitBreaker(provider, model)
+    return breaker
+
+
+def guard_call(provider, model, func):
+    """func() を (provider, model) のブレーカー越しに呼ぶよう包む（無効なら func のまま）"""
+    if not breaker_enabled():
+        return func
+    return lambda: get_breaker(provider, model).call(func)
+
+
+def breakers_snapshot():
+    """?metrics=state 用。呼び出しのあった (プロバイダ, モデル) ごとの状態"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in sorted(breakers, key=lambda b: b.name)}
+
+
+register_state('circuit_breakers', breakers_snapshot)
@@ -0,0 +1,222 @@
+"""プロバイダクライアントのレジストリ
+
+ウォームなインスタンスでは (プロバイダ, APIキー, ベースURL) ごとに1つのクライアントを使い回し、
+TLSハンドシェイクとクライアント生成をリクエストのたびに繰り返さない。
+
+- OpenAI / OpenRouter: openai.OpenAI に keep-alive 付きの httpx.Client を渡して共有する
+- Gemini: genai.configure はキーが変わったときだけ呼び、GenerativeModel をモデル名ごとに共有する
+  （モデルは初回呼び出し時に作った gRPC/HTTP クライアントを保持し続ける）
+
+環境変数:
+    LLM_HTTP_MAX_CONNECTIONS    1クライアントあたりの最大接続数（既定 20）
+    LLM_HTTP_MAX_KEEPALIVE      保持するアイドル接続数（既定 10）
+    LLM_HTTP_KEEPALIVE_EXPIRY   アイドル接続を閉じるまでの秒数（既定 60）
+    LLM_HTTP_TIMEOUT            リクエストのタイムアウト秒（既定 60）
+    LLM_PREWARM                 "sync" でハンドラーの import 時に、"background" で別スレッドで、APIキーのある
+                                プロバイダの SDK 読み込みとクライアント生成を済ませておく（既定はしない）
+
+SDK（google.generativeai / openai / httpx）はクライアントを初めて作るときに読み込む。ハンドラーの import では
+読み込まないので、LLMを使わないリクエストやフォールバックだけのコールドスタートは SDK の読み込みを待たない。
+"""
+import hashlib
+import os
+import threading
+import time
+
+from .telemetry import register_state
+
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE = 10
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+DEFAULT_TIMEOUT = 60.0
+
+PROVIDERS = ('gemini', 'openai', 'openrouter')
+API_KEY_ENV = {
+    'gemini': 'GEMINI_API_KEY',
+    'openai': 'OPENAI_API_KEY',
+    'openrouter': 'OPENROUTER_API_KEY'
+}
+
+
+def _key_id(api_key):
+    """統計表示用のキー識別子（キー本体は残さない）"""
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:8]
+
+
+class _Entry:
+    __slots__ = ('provider', 'key_id', 'base_url', 'client', 'http_client', 'created_at', 'uses')
+
+    def __init__(self, provider, key_id, base_url, client, http_client=None):
+        self.provider = provider
+        self.key_id = key_id
+        self.base_url = base_url
+        self.client = client
+        self.http_client = http_client
+        self.created_at = time.time()
+        self.uses = 0
+
+
+def _pool_stats(http_client):
+    """httpx のコネクションプールの接続数（内部属性なので取れなければ None）"""
+    pool = getattr(getattr(http_client, '_transport', None), '_pool', None)
+    connections = getattr(pool, 'connections', None)
+    if connections is None:
+        return None
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {"connections": len(connections), "idle": idle, "active": len(connections) - idle}
+
+
+class ClientRegistry:
+    """スレッドセーフなクライアントの遅延生成・共有"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._gemini_key = None
+        self._counters = {"created": 0, "reused": 0}
+        self.prewarm = None
+
+    def get(self, provider, api_key, base_url, factory):
+        """(provider, api_key, base_url) のクライアントを返す。なければ factory() で作る
+
+        factory() は (client, http_client) を返す。生成はロック内で行い、同じキーで二重に作らない。
+        """
+        key = (provider, api_key, base_url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                client, http_client = factory()
+                entry = _Entry(provider, _key_id(api_key), base_url, client, http_client)
+                self._entries[key] = entry
+                self._counters['created'] += 1
+            else:
+                self._counters['reused'] += 1
+            entry.uses += 1
+            return entry.client
+
+    def openai_client(self, provider, api_key, base_url=None):
+        """OpenAI SDK のクライアント（OpenRouter は base_url を変えて同じSDKを使う）"""
+        def factory():
+            import httpx
+            import openai
+
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=int(os.environ.get('LLM_HTTP_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS)),
+                    max_keepalive_connections=int(os.environ.get('LLM_HTTP_MAX_KEEPALIVE', DEFAULT_MAX_KEEPALIVE)),
+                    keepalive_expiry=float(os.environ.get('LLM_HTTP_KEEPALIVE_EXPIRY', DEFAULT_KEEPALIVE_EXPIRY))
+                ),
+                timeout=float(os.environ.get('LLM_HTTP_TIMEOUT', DEFAULT_TIMEOUT))
+            )
+            kwargs = {"api_key": api_key, "http_client": http_client}
+            if base_url:
+                kwargs["base_url"] = base_url
+            return openai.OpenAI(**kwargs), http_client
+        return self.get(provider, api_key, base_url, factory)
+
+    def gemini_model(self, api_key, model_name='gemini-1.5-flash'):
+        """GenerativeModel（genai.configure はプロセス全体の設定なのでキーが変わったときだけ呼ぶ）"""
+        def factory():
+            import google.generativeai as genai
+
+            if self._gemini_key != api_key:
+                genai.configure(api_key=api_key)
+                self._gemini_key = api_key
+                # 別キーで作ったモデルは古い設定のクライアントを持つので作り直させる
+                for key in [key for key in self._entries if key[0] == 'gemini' and key[1] != api_key]:
+                    del self._entries[key]
+            return genai.GenerativeModel(model_name), None
+        return self.get('gemini', api_key, model_name, factory)
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            counters = dict(self._counters)
+        counters["prewarm"] = self.prewarm
+        now = time.time()
+        counters["clients"] = [
+            {
+                "provider": entry.provider,
+                "key_id": entry.key_id,
+                "base_url": entry.base_url,
+                "uses": entry.uses,
+                "age_seconds": round(now - entry.created_at, 1),
+                "pool": _pool_stats(entry.http_client) if entry.http_client is not None else None
+            }
+            for entry in entries
+        ]
+        return counters
+
+    def close(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._gemini_key = None
+        for entry in entries:
+            if entry.http_client is not None:
+                entry.http_client.close()
+
+
+_registry = ClientRegistry()
+
+
+def get_registry():
+    return _registry
+
+
+register_state('client_pool', _registry.stats)
+
+
+def openai_client(provider, api_key, base_url=None):
+    return _registry.openai_client(provider, api_key, base_url)
+
+
+def gemini_model(api_key, model_name='gemini-1.5-flash'):
+    return _registry.gemini_model(api_key, model_name)
+
+
+def prewarm(providers=PROVIDERS):
+    """APIキーのあるプロバイダの SDK を読み込みクライアントを作っておく（通信はしない）
+
+    リクエスト時と同じ (プロバイダ, APIキー, ベースURL) で作るので、最初のリクエストはそのまま使い回す。
+    プロバイダごとの所要ms（失敗はエラー文字列）を返し、?metrics=state の client_pool.prewarm にも残す。
+    """
+    timings = {}
+    for provider in providers:
+        api_key = os.environ.get(API_KEY_ENV[provider])
+        if not api_key:
+            continue
+        started = time.perf_counter()
+        try:
+            if provider == 'gemini':
+                gemini_model(api_key)
+            elif provider == 'openai':
+                openai_client('openai', api_key)
+            else:
+                openai_client('openrouter', api_key,
+                              os.environ.get('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1'))
+            timings[provider] = round((time.perf_counter() - started) * 1000, 1)
+        except Exception as e:
+            timings[provider] = f"error: {str(e)[:200]}"
+    _registry.prewarm = timings
+    return timings
+
+
+_prewarm_started = False
+_prewarm_lock = threading.Lock()
+
+
+def prewarm_from_env():
+    """LLM_PREWARM に従って prewarm する。LLMを使うハンドラーの import 時に呼ぶ（プロセスで1回だけ）"""
+    global _prewarm_started
+    mode = os.environ.get('LLM_PREWARM', '').lower()
+    if mode not in ('sync', 'background'):
+        return
+    with _prewarm_lock:
+        if _prewarm_started:
+            return
+        _prewarm_started = True
+    if mode == 'sync':
+        prewarm()
+    else:
+        threading.Thread(target=prewarm, name='llm-prewarm', daemon=True).start()
@@ -0,0 +1,214 @@
+"""LLM に送る会話の抽出的圧縮（プロンプトの入力トークン削減）
+
+発話ごとに重要度（臨床キーワード・質問・同意/理解/迷いの表現・直前の発話に対する新規性）を求め、
+推定トークン数が予算を超える会話だけ、重要度の低い発話（挨拶・「はい」などの相づち・繰り返しの確認）
+から落として予算に収める。落とした発話の位置には「（中略）」を1行入れ、残った発話のうち同じ話者の
+連続する発話は1行にまとめる（話者ラベルの分を削る）。予算以下の会話は変更しない。
+
+トークン数は「非ASCII文字は1文字1トークン、ASCIIは4文字1トークン」の概算（日本語の会話ではプロバイダの
+実測とおおむね同じ桁になる）。圧縮率などの統計は結果の compaction と各関数の GET ?metrics=1 に出る。
+
+環境変数:
+    PROMPT_TOKEN_BUDGET     会話部分の推定トークン数の上限（既定 0 = 圧縮しない）
+"""
+import os
+import re
+
+from .keywords import KeywordMatcher
+from .telemetry import record_compaction, span
+from .transcript import PATIENT, Transcript
+
+OMITTED_MARKER = '（中略）'
+NOVELTY_WINDOW = 6
+WEIGHTS = {
+    'clinical': 1.0,        # 臨床キーワード1件あたり（最大3件）
+    'question': 1.5,
+    'consent': 3.0,
+    'hesitation': 3.0,
+    'novelty': 1.0,         # 直前の発話にない文字 bigram の割合
+    'length': 0.3,          # 40文字で最大
+    'patient': 0.5,         # 患者の発話（主訴・S欄の材料）
+}
+MAX_CLINICAL_HITS = 3
+
+SALIENCE_KEYWORDS = KeywordMatcher({
+    'clinical': ['痛', 'しみ', '腫れ', '出血', '違和感', '冷た', '熱い', '噛', '虫歯', 'う蝕', '歯周', '歯茎',
+                 '神経', '歯髄', '抜歯', '根管', '詰め物', '被せ', '充填', 'インプラント', '入れ歯', '矯正',
+                 '麻酔', 'レントゲン', '検査', '診断', '治療', '処置', '症状', '費用', '保険', '自費', '次回',
+                 '予約', '来週', '午前', '午後', '薬', '番', '奥歯', '前歯', '親知らず', '右上', '左上', '右下', '左下',
+                 '週間', 'か月'],
+    # 同意と理解の表明（品質分析の治療同意・患者理解度の根拠になる）
+    'consent': ['同意', '承知', '納得', 'それでお願い', 'お願いします', 'やります', '決めました', 'わかりました',
+                '分かりました', '理解', 'わかります'],
+    'hesitation': ['不安', '心配', '怖', '迷', '考えさせ', '検討', '高い', 'どうしよう', '痛くない'],
+})
+_QUESTION = re.compile(r'(?:[?？]|(?:です|ます|でしょう|ません)か[。．]?)\s*$')
+# 単独では情報のない発話（相づち・挨拶）。句読点と感嘆符を除いた本文がこれに一致すれば重要度 0
+_FILLER = re.compile(
+    r'^(?:はい|ええ|うん|そう|そうですね|そうですか|なるほど|はいはい|ありがとうございます|ありがとうございました|'
+    r'おはようございます|こんにちは|こんばんは|よろしくお願いします|よろしくお願いいたします|失礼します|'
+    r'お大事に|お大事にどうぞ|わかりました|承知しました|了解です)+$')
+_PUNCTUATION = re.compile(r'[\s、。，．,.!！?？ー〜~…]+')
+
+
+def budget_from_env():
+    return int(os.environ.get('PROMPT_TOKEN_BUDGET') or 0)
+
+
+def estimate_tokens(text):
+    """推定トークン数（非ASCII文字は1文字1トークン、ASCIIは4文字1トークン）"""
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return len(text) - ascii_chars + (ascii_chars + 3) // 4
+
+
+CLINICAL_PATTERN = SALIENCE_KEYWORDS.category_pattern('clinical')
+CONSENT_PATTERN = SALIENCE_KEYWORDS.category_pattern('consent')
+HESITATION_PATTERN = SALIENCE_KEYWORDS.category_pattern('hesitation')
+
+
+def _bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+
+def _static_features(content):
+    """発話本文だけで決まる (文字 bigram の集合, 新規性以外の重要度)。相づち・挨拶は重要度 None"""
+    bare = _PUNCTUATION.sub('', content)
+    if not bare:
+        return frozenset(), None
+    grams = frozenset(_bigrams(bare))
+    if _FILLER.match(bare):
+        return grams, None
+    return grams, (
+        WEIGHTS['clinical'] * min(len(CLINICAL_PATTERN.findall(content)), MAX_CLINICAL_HITS)
+        + WEIGHTS['question'] * (_QUESTION.search(content) is not None)
+        + WEIGHTS['consent'] * (CONSENT_PATTERN.search(content) is not None)
+        + WEIGHTS['hesitation'] * (HESITATION_PATTERN.search(content) is not None)
+        + WEIGHTS['length'] * min(len(bare) / 40, 1.0)
+    )
+
+
+def score_utterances(transcript):
+    """発話ごとの重要度（大きいほど残す）のリスト
+
+    新規性は直前 NOVELTY_WINDOW 発話に出た文字 bigram の出現数（スライディングウィンドウ）で求める。
+    同じ本文の発話（繰り返しの確認など）は本文由来の特徴を使い回す。
+    """
+    scores = []
+    window = []
+    seen = {}
+    features = {}
+    roles = transcript.roles()
+    for index in range(len(transcript)):
+        content = transcript.content(index)
+        cached = features.get(content)
+        if cached is None:
+            cached = features[content] = _static_features(content)
+        grams, static = cached
+        if static is None:
+            scores.append(0.0)
+        else:
+            novelty = sum(1 for gram in grams if gram not in seen) / len(grams)
+            scores.append(static + WEIGHTS['novelty'] * novelty
+                          + WEIGHTS['patient'] * (roles[index] == PATIENT))
+        window.append(grams)
+        for gram in grams:
+            seen[gram] = seen.get(gram, 0) + 1
+        if len(window) > NOVELTY_WINDOW:
+            for gram in window.pop(0):
+                if seen[gram] == 1:
+                    del seen[gram]
+                else:
+                    seen[gram] -= 1
+    return scores
+
+
+def _render(transcript, dropped):
+    """残った発話を、落とした区間を OMITTED_MARKER、同じ話者の連続発話を1行にして並べる（統合した行数も返す）"""
+    lines = transcript.lines()
+    speakers = transcript.speakers()
+    output = []
+    merged = 0
+    previous_speaker = None
+    for index, line in enumerate(lines):
+        if dropped[index]:
+            if not output or output[-1] != OMITTED_MARKER:
+                output.append(OMITTED_MARKER)
+            previous_speaker = None
+            continue
+        speaker = speakers[index]
+        if speaker and speaker == previous_speaker:
+            output[-1] += ' ' + transcript.content(index)
+            merged += 1
+        else:
+            output.append(line)
+        previous_speaker = speaker
+    return '\n'.join(output), merged
+
+
+def compact_transcript(conversation_text, budget, transcript=None):
+    """会話を推定 budget トークン以下に圧縮し、(テキスト, 統計) を返す
+
+    予算以下（または budget <= 0）の会話はそのまま返す。重要度の低い発話から順に落とし、
+    同点なら後ろの発話を残す（会話の終盤の結論を優先）。1発話だけで予算を超える場合は超えたまま返す。
+    """
+    original_tokens = estimate_tokens(conversation_text or '')
+    stats = {
+        "budget": budget,
+        "original_tokens": original_tokens,
+        "compacted_tokens": original_tokens,
+        "ratio": 1.0,
+        "utterances": None,
+        "dropped": 0,
+        "merged": 0,
+    }
+    if budget <= 0 or original_tokens <= budget:
+        return conversation_text, stats
+
+    if transcript is None:
+        transcript = Transcript.from_text(conversation_text)
+    lines = transcript.lines()
+    count = len(lines)
+    stats["utterances"] = count
+    scores = score_utterances(transcript)
+    tokens = [estimate_tokens(line) + 1 for line in lines]
+    marker_tokens = estimate_tokens(OMITTED_MARKER) + 1
+
+    dropped = bytearray(count)
+    total = sum(tokens)
+    # 最も重要度の高い1発話は落とさない（予算を超えても（中略）だけの会話にはしない）
+    for index in sorted(range(count), key=lambda i: (scores[i], i))[:-1]:
+        if total <= budget:
+            break
+        left = index > 0 and dropped[index - 1]
+        right = index + 1 < count and dropped[index + 1]
+        # 落とすと前後の省略区間とつながる（マーカーが減る）か、新しい区間になる（マーカーが増える）
+        marker_delta = -marker_tokens if left and right else 0 if left or right else marker_tokens
+        dropped[index] = 1
+        total += marker_delta - tokens[index]
+
+    text, merged = _render(transcript, dropped)
+    compacted_tokens = estimate_tokens(text)
+    stats.update(
+        compacted_tokens=compacted_tokens,
+        ratio=round(compacted_tokens / original_tokens, 4) if original_tokens else 1.0,
+        dropped=sum(dropped),
+        merged=merged,
+    )
+    return text, stats
+
+
+def compact_for_prompt(conversation_text, stage, transcript=None, budget=None):
+    """プロンプトに入れる会話を PROMPT_TOKEN_BUDGET に圧縮して (テキスト, 統計) を返す
+
+    無効な場合と予算以下の会話は (元のテキスト, None)。圧縮した場合だけ圧縮率をメトリクスに記録し、
+    統計を返す（呼び出し側が結果の compaction に入れる）。圧縮済みの会話を分割解析しても各チャンクは
+    予算以下なので、再度圧縮されることはない。
+    """
+    budget = budget_from_env() if budget is None else budget
+    if budget <= 0 or estimate_tokens(conversation_text or '') <= budget:
+        return conversation_text, None
+    with span('compaction', stage=stage) as current:
+        text, stats = compact_transcript(conversation_text, budget, transcript)
+        current.set(ratio=stats["ratio"], dropped=stats["dropped"])
+    record_compaction(stage, stats)
+    return text, stats
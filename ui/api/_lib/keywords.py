@@ -0,0 +1,209 @@
+"""ルールベース（フォールバック）解析用のキーワード照合エンジン
+
+カテゴリ別キーワード表をimport時に1度だけ組み立てて共有する。
+
+- present() / distinct_counts() / count_distinct(): 含まれるキーワードの種類（ルールベース解析の
+  sum(1 for k in kws if k in text) に相当）。残りのキーワードの選択パターンで探し、見つけたキーワードを
+  除いてその位置から探し直すので、キーワードの数によらずテキストをおおむね1回走査するだけで済む
+  （ヒットごとの Python の処理もない）。重なり合うキーワードも、見つけた位置から探し直すので取りこぼさない。
+- scan(): 1本の正規表現（長い順の選択）でテキストを1回走査し、全カテゴリのヒット件数・位置・
+  行番号を得る。ヒットごとに Python で位置を記録するので、種類だけが必要な判定には present() を使う
+  （位置が必要な話者の役割推定・ライブセッション用）。
+- category_pattern(): カテゴリごとのコンパイル済み選択パターン。1行程度の短い文字列の有無判定は
+  any(k in line for k in ...) より速い。
+- contains_any(): 1つでも含むか。長いテキストでは最初に見つかった時点で終わる str の部分文字列探索を使う。
+
+一致したキーワードの内部に含まれる短いキーワードは構築時に求めた相対位置で補う。
+キーワード同士が部分的に重なり得る表（あるキーワードの末尾が別のキーワードの先頭になる）
+の場合だけ、先読み (?=(...)) で全位置を調べる方式に切り替える。
+いずれの場合も Aho-Corasick と同じく重なり合う一致をすべて報告する。
+"""
+import re
+from bisect import bisect_left
+
+_NEWLINE = '\n'
+# これより長いテキストはキーワードごとの部分文字列探索、短いものは正規表現で判定する
+# （present() は逆に、短いテキストではパターンの組み立てを省いてキーワードごとの部分文字列探索にする）
+SHORT_TEXT_LIMIT = 2048
+# present() が残りのキーワードの組ごとに保持するコンパイル済みパターンの上限
+MAX_REMAINING_PATTERNS = 256
+
+
+class KeywordHits:
+    """1回の走査結果（キーワード→位置リスト・行番号リスト）"""
+
+    __slots__ = ('text', '_matcher', '_positions', '_lines', '_category_positions')
+
+    def __init__(self, text, matcher, positions, lines):
+        self.text = text
+        self._matcher = matcher
+        self._positions = positions
+        self._lines = lines
+        self._category_positions = {}
+
+    def _found(self, category):
+        positions = self._positions
+        return [keyword for keyword in self._matcher.tables.get(category, ()) if keyword in positions]
+
+    def count(self, category):
+        """出現回数"""
+        return sum(len(self._positions[keyword]) for keyword in self._found(category))
+
+    def any(self, category):
+        return bool(self._found(category))
+
+    def keywords(self, category, lines=None):
+        """ヒットしたキーワードの集合（lines を渡すとその行番号集合内のヒットに限る）"""
+        found = self._found(category)
+        if lines is None:
+            return set(found)
+        return {keyword for keyword in found if not lines.isdisjoint(self._lines[keyword])}
+
+    def distinct(self, category, lines=None):
+        """ヒットしたキーワードの種類数（従来の sum(1 for k in ... if k in text) に相当）"""
+        return len(self.keywords(category, lines))
+
+    def positions(self, category):
+        """ヒット位置（昇順）"""
+        positions = self._category_positions.get(category)
+        if positions is None:
+            positions = sorted(p for keyword in self._found(category) for p in self._positions[keyword])
+            self._category_positions[category] = positions
+        return positions
+
+    def lines(self, category):
+        """ヒットを含む行番号（0始まり、'\\n' 区切り）の集合"""
+        result = set()
+        for keyword in self._found(category):
+            result.update(self._lines[keyword])
+        return result
+
+    def counts(self):
+        return {category: self.count(category) for category in self._matcher.tables}
+
+    def in_range(self, category, start, end):
+        """[start, end) に位置するヒットがあるか"""
+        positions = self.positions(category)
+        index = bisect_left(positions, start)
+        return index < len(positions) and positions[index] < end
+
+
+class KeywordMatcher:
+    """カテゴリ別キーワード表から作るコンパイル済みマッチャ"""
+
+    def __init__(self, tables):
+        self.tables = {
+            category: tuple(dict.fromkeys(keyword for keyword in keywords if keyword))
+            for category, keywords in tables.items()
+        }
+        ordered = sorted({keyword for keywords in self.tables.values() for keyword in keywords},
+                         key=len, reverse=True)
+
+        # 一致したキーワードの内部に現れる他のキーワードと、その相対位置
+        self._contained = {}
+        for keyword in ordered:
+            contained = []
+            for other in ordered:
+                if other == keyword or len(other) > len(keyword):
+                    continue
+                index = keyword.find(other)
+                while index != -1:
+                    contained.append((other, index))
+                    index = keyword.find(other, index + 1)
+            self._contained[keyword] = tuple(contained)
+
+        self.overlapping = any(
+            keyword[-size:] == other[:size]
+            for keyword in ordered for other in ordered
+            for size in range(1, min(len(keyword), len(other)))
+        )
+        self._category_patterns = {
+            category: re.compile('|'.join(re.escape(k) for k in sorted(keywords, key=len, reverse=True)))
+            for category, keywords in self.tables.items() if keywords
+        }
+        self._remaining_patterns = {}
+        alternation = '|'.join(re.escape(keyword) for keyword in ordered + [_NEWLINE])
+        if self.overlapping:
+            # 先読みでは各位置の最長一致だけが返るので、同位置の短いキーワードは _contained で補う
+            self._pattern = re.compile(f'(?=({alternation}))')
+        else:
+            self._pattern = re.compile(f'({alternation})')
+
+    def category_pattern(self, category):
+        """カテゴリのキーワードのいずれかに一致するコンパイル済みパターン"""
+        return self._category_patterns[category]
+
+    def contains_any(self, text, category):
+        """カテゴリのキーワードがテキストに1つでも含まれるか"""
+        if len(text) <= SHORT_TEXT_LIMIT:
+            pattern = self._category_patterns.get(category)
+            return pattern is not None and pattern.search(text) is not None
+        return any(keyword in text for keyword in self.tables[category])
+
+    def present(self, text, categories):
+        """categories のキーワードのうちテキストに含まれるものの集合"""
+        keywords = tuple(sorted({keyword for category in categories for keyword in self.tables[category]},
+                                key=len, reverse=True))
+        if len(text) <= SHORT_TEXT_LIMIT:
+            return {keyword for keyword in keywords if keyword in text}
+        found = set()
+        position = 0
+        while keywords:
+            match = self._remaining_pattern(keywords).search(text, position)
+            if match is None:
+                break
+            keyword = match.group()
+            found.add(keyword)
+            # 同じ位置から探し直す（見つけたキーワードの内側・途中から始まるキーワードもここで見つかる）
+            position = match.start()
+            keywords = tuple(other for other in keywords if other != keyword)
+        return found
+
+    def _remaining_pattern(self, keywords):
+        pattern = self._remaining_patterns.get(keywords)
+        if pattern is None:
+            if len(self._remaining_patterns) >= MAX_REMAINING_PATTERNS:
+                self._remaining_patterns.clear()
+            pattern = self._remaining_patterns[keywords] = re.compile('|'.join(re.escape(k) for k in keywords))
+        return pattern
+
+    def distinct_counts(self, text, categories):
+        """{カテゴリ: テキストに含まれるキーワードの種類数}（全カテゴリで1回の present()）"""
+        found = self.present(text, categories)
+        return {category: sum(1 for keyword in self.tables[category] if keyword in found)
+                for category in categories}
+
+    def count_distinct(self, text, category):
+        """テキストに含まれるカテゴリのキーワードの種類数"""
+        return len(self.present(text, (category,)))
+
+    def scan(self, text):
+        positions = {}
+        lines = {}
+        if text:
+            contained = self._contained
+            overlapping = self.overlapping
+            line = 0
+            for match in self._pattern.finditer(text):
+                keyword = match.group(1)
+                if keyword == _NEWLINE:
+                    line += 1
+                    continue
+                start = match.start()
+                if keyword in positions:
+                    positions[keyword].append(start)
+                    lines[keyword].append(line)
+                else:
+                    positions[keyword] = [start]
+                    lines[keyword] = [line]
+                for inner, offset in contained[keyword]:
+                    # 先読み方式では offset > 0 の内側キーワードはその位置の走査で見つかる
+                    if overlapping and offset:
+                        continue
+                    if inner in positions:
+                        positions[inner].append(start + offset)
+                        lines[inner].append(line)
+                    else:
+                        positions[inner] = [start + offset]
+                        lines[inner] = [line]
+        return KeywordHits(text, self, positions, lines)
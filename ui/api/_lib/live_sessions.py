@@ -0,0 +1,154 @@
+"""診療中に伸びていく会話のライブセッション（/api/live_session）の保持と LLM 更新の間引き
+
+セッションはプロセス内に保持する（/api/live_session のウォームなインスタンスごと。件数などは
+/api/live_session?metrics=state の live_sessions に出る。最後の更新から LIVE_SESSION_TTL 秒で破棄し、
+LIVE_SESSION_MAX 件を超えたら古いものから破棄する）。別のインスタンスに振り分けられた・破棄された
+セッションへの追記は 404（resync: true）を返し、クライアントは全文を付けて start し直す。
+
+LLM の更新は、前回の更新から LIVE_REFRESH_MIN_UTTERANCES 件以上の発話が追加され、かつ
+LIVE_REFRESH_MIN_SECONDS 秒以上たった追記でだけ行う（refresh / end は間引かない）。
+同じセッションの更新は同時に1つだけ実行し、実行中に届いた追記はローカルの集計だけを返す。
+
+環境変数:
+    LIVE_SESSION_TTL                最後の更新から破棄までの秒数（既定 3600）
+    LIVE_SESSION_MAX                保持するセッション数の上限（既定 256）
+    LIVE_REFRESH_MIN_UTTERANCES     LLM 更新に必要な未反映の発話数（既定 8）
+    LIVE_REFRESH_MIN_SECONDS        LLM 更新の最小間隔秒（既定 30）
+    LIVE_SUMMARY_MAX_CHARS          LLM に保たせる要約の最大文字数（既定 800）
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .telemetry import register_state
+
+DEFAULT_TTL = 3600.0
+DEFAULT_MAX_SESSIONS = 256
+DEFAULT_REFRESH_MIN_UTTERANCES = 8
+DEFAULT_REFRESH_MIN_SECONDS = 30.0
+DEFAULT_SUMMARY_MAX_CHARS = 800
+
+
+class SessionNotFound(KeyError):
+    """保持していない（破棄された・別インスタンスの）セッション"""
+
+
+def refresh_min_utterances():
+    return int(os.environ.get('LIVE_REFRESH_MIN_UTTERANCES', DEFAULT_REFRESH_MIN_UTTERANCES))
+
+
+def refresh_min_seconds():
+    return float(os.environ.get('LIVE_REFRESH_MIN_SECONDS', DEFAULT_REFRESH_MIN_SECONDS))
+
+
+def summary_max_chars():
+    return int(os.environ.get('LIVE_SUMMARY_MAX_CHARS', DEFAULT_SUMMARY_MAX_CHARS))
+
+
+def refresh_due(pending, last_refresh_at, now=None):
+    """未反映の発話数 pending と前回の更新時刻から、追記のついでに LLM を更新するか（理由）を返す
+
+    更新しない場合は (False, 待っている条件)。
+    """
+    if pending <= 0:
+        return False, 'up_to_date'
+    if pending < refresh_min_utterances():
+        return False, 'waiting_for_utterances'
+    now = time.time() if now is None else now
+    if last_refresh_at is not None and now - last_refresh_at < refresh_min_seconds():
+        return False, 'debounced'
+    return True, 'due'
+
+
+class LiveSessionStore:
+    """session_id → セッションの LRU（TTL つき、スレッドセーフ）と件数の集計"""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_sessions=DEFAULT_MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session_id -> (最終更新時刻, セッション)
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(('started', 'expired', 'evicted', 'ended', 'not_found', 'appended',
+                                        'refreshes', 'refresh_errors', 'refresh_skipped', 'prompt_chars',
+                                        'transcript_chars'), 0)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def put(self, session_id, session):
+        with self._lock:
+            self._expire()
+            self._sessions.pop(session_id, None)
+            self._sessions[session_id] = (time.time(), session)
+            self._counters['started'] += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._counters['evicted'] += 1
+
+    def get(self, session_id):
+        """セッションを返し、最終更新時刻を進める（なければ SessionNotFound）"""
+        with self._lock:
+            self._expire()
+            item = self._sessions.pop(session_id, None)
+            if item is None:
+                self._counters['not_found'] += 1
+                raise SessionNotFound(session_id)
+            self._sessions[session_id] = (time.time(), item[1])
+            return item[1]
+
+    def pop(self, session_id):
+        with self._lock:
+            item = self._sessions.pop(session_id, None)
+            if item is None:
+                self._counters['not_found'] += 1
+                raise SessionNotFound(session_id)
+            self._counters['ended'] += 1
+            return item[1]
+
+    def _expire(self):
+        deadline = time.time() - self.ttl
+        while self._sessions:
+            session_id, (touched_at, _) = next(iter(self._sessions.items()))
+            if touched_at >= deadline:
+                break
+            del self._sessions[session_id]
+            self._counters['expired'] += 1
+
+    def stats(self):
+        with self._lock:
+            self._expire()
+            counters = dict(self._counters)
+            active = len(self._sessions)
+        transcript_chars = counters.pop('transcript_chars')
+        return {
+            "active": active,
+            "max_sessions": self.max_sessions,
+            "ttl_seconds": self.ttl,
+            **counters,
+            # 毎回全文を送る場合（更新時点の全文の合計）に対する、差分と要約だけを送ったプロンプトの文字数の比
+            "prompt_ratio": round(counters['prompt_chars'] / transcript_chars, 4) if transcript_chars else None,
+            "refresh_min_utterances": refresh_min_utterances(),
+            "refresh_min_seconds": refresh_min_seconds(),
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_live_store():
+    """環境変数の設定でプロセス共有のセッション保持を遅延生成する"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = LiveSessionStore(
+                    ttl=float(os.environ.get('LIVE_SESSION_TTL', DEFAULT_TTL)),
+                    max_sessions=int(os.environ.get('LIVE_SESSION_MAX', DEFAULT_MAX_SESSIONS)),
+                )
+    return _store
+
+
+register_state('live_sessions', lambda: get_live_store().stats())
@@ -0,0 +1,313 @@
+"""LLM応答のコンテンツアドレス型キャッシュ
+
+キーは (プロバイダ, モデル, プロンプトテンプレート版, 正規化した会話, パラメータ) のハッシュ。
+プロセス内LRU（件数・バイト数・TTLで追い出し）と、再起動後も残るSQLiteファイルの2層構成。
+
+環境変数:
+    LLM_CACHE_DISABLED      "1" でキャッシュを使わない
+    LLM_CACHE_MAX_ENTRIES   メモリ層の最大件数（既定 512）
+    LLM_CACHE_MAX_BYTES     メモリ層の最大バイト数（既定 32MB）
+    LLM_CACHE_TTL           有効期限秒（既定 86400）
+    LLM_CACHE_PATH          SQLiteファイルのパス（空文字でディスク層を無効化）
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from .circuit_breaker import breaker_enabled, get_breaker, guard_call
+from .llm_json import is_complete
+from .provider_health import observe_call, observe_stream
+from .singleflight import coalesce
+from .telemetry import register_state
+
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'dental_ai_llm_cache.sqlite3')
+
+
+def normalize_transcript(text):
+    """改行コード・Unicode表記・行頭末の空白・空行の違いを吸収する"""
+    text = unicodedata.normalize('NFKC', text or '')
+    lines = (line.strip() for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+def cache_key(provider, model, template_version, transcript, params=None):
+    payload = json.dumps(
+        [provider, model, template_version, normalize_transcript(transcript), params or {}],
+        ensure_ascii=False, sort_keys=True, separators=(',', ':')
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryLRU:
+    """件数・バイト数・TTLで追い出すスレッドセーフなLRU（値はJSON文字列）"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._items = OrderedDict()  # key -> (expires_at, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                self._remove(key)
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (time.time() + self.ttl, value)
+            self._bytes += size
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._items)))
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, value = self._items.pop(key)
+        self._bytes -= len(value)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SQLiteTier:
+    """再起動後も残るディスク層（WALモード、期限切れは読み出し時と定期的に削除）"""
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS llm_cache ('
+            ' cache_key TEXT PRIMARY KEY,'
+            ' value TEXT NOT NULL,'
+            ' expires_at REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM llm_cache WHERE cache_key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                self._conn.execute('DELETE FROM llm_cache WHERE cache_key = ?', (key,))
+                self._conn.commit()
+                return None
+            return row[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO llm_cache (cache_key, value, expires_at) VALUES (?, ?, ?)',
+                (key, value, time.time() + self.ttl)
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._conn.execute('DELETE FROM llm_cache WHERE expires_at < ?', (time.time(),))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM llm_cache')
+            self._conn.commit()
+
+
+class LLMCache:
+    """メモリ層→ディスク層の順に引き、ヒットしなければ compute() を呼んで両層に保存する"""
+
+    def __init__(self, memory=None, disk=None):
+        self.memory = memory or MemoryLRU()
+        self.disk = disk
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "errors": 0,
+                          "incomplete": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('memory_hits')
+            return json.loads(value)
+        if self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except sqlite3.Error as e:
+                print(f"LLM cache read error: {e}")
+                self._count('errors')
+                value = None
+            if value is not None:
+                self._count('disk_hits')
+                self.memory.set(key, value)
+                return json.loads(value)
+        self._count('misses')
+        return None
+
+    def set(self, key, result):
+        value = json.dumps(result, ensure_ascii=False)
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value)
+            except sqlite3.Error as e:
+                print(f"LLM cache write error: {e}")
+                self._count('errors')
+
+    def get_or_compute(self, key, compute, bypass=False):
+        """キャッシュ済みなら複製を返し、なければ compute() の結果を保存して返す
+
+        compute() が例外を投げた場合は何も保存しない（失敗応答はキャッシュしない）。途中で切れた・必須フィールドの
+        欠けた応答（llm_json.is_complete が False）も返すだけで保存せず、次の同じリクエストで取り直す。
+        bypass=True のときは読み出しを飛ばして再計算し、結果で上書きする。
+        """
+        if bypass:
+            self._count('bypassed')
+        else:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+        result = compute()
+        if isinstance(result, dict) and not is_complete(result):
+            self._count('incomplete')
+            return result
+        self.set(key, result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        hits = counters['memory_hits'] + counters['disk_hits']
+        lookups = hits + counters['misses']
+        counters.update({
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.size_bytes,
+            "disk_path": self.disk.path if self.disk is not None else None
+        })
+        return counters
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def cache_enabled():
+    return os.environ.get('LLM_CACHE_DISABLED', '').lower() not in ('1', 'true', 'yes')
+
+
+def get_cache():
+    """環境変数の設定でプロセス共有のキャッシュを遅延生成する"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                ttl = float(os.environ.get('LLM_CACHE_TTL', DEFAULT_TTL))
+                memory = MemoryLRU(
+                    max_entries=int(os.environ.get('LLM_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+                    max_bytes=int(os.environ.get('LLM_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+                    ttl=ttl
+                )
+                disk = None
+                path = os.environ.get('LLM_CACHE_PATH', DEFAULT_PATH)
+                if path:
+                    try:
+                        disk = SQLiteTier(path, ttl=ttl)
+                    except sqlite3.Error as e:
+                        print(f"LLM cache disk tier unavailable: {e}")
+                _default_cache = LLMCache(memory, disk)
+    return _default_cache
+
+
+register_state('llm_cache', lambda: get_cache().stats() if cache_enabled() else {"enabled": False})
+
+
+def cached_call(provider, model, template_version, transcript, compute, params=None, bypass=False):
+    """プロバイダ呼び出し compute() をキャッシュ経由で実行する
+
+    実際の呼び出しは稼働統計に記録し、(provider, model) のサーキットブレーカーが open なら呼び出さずに
+    CircuitOpen を投げる（キャッシュのヒットはブレーカーに関係なく返す）。
+    同じキーの呼び出しが実行中なら、その完了を待って同じ結果を返す（キャッシュへの保存までを1回にまとめる）。
+    """
+    compute = guard_call(provider, model, observe_call(provider, compute))
+    key = cache_key(provider, model, template_version, transcript, params)
+    if not cache_enabled():
+        return coalesce(key, compute, provider)
+    # 再解析（bypass）は、キャッシュから返しうる通常の呼び出しとはまとめない
+    return coalesce((key, bypass), lambda: get_cache().get_or_compute(key, compute, bypass=bypass), provider)
+
+
+def guarded_stream(provider, model, deltas):
+    """ストリーミング呼び出しの応答の差分を、cached_call と同じく稼働統計とブレーカーに通す
+
+    (provider, model) のブレーカーが open なら最初の差分を読む時点で CircuitOpen を投げる。
+    ストリーミングは呼び出し元ごとにイベントを送るので、同じ会話の呼び出しでもまとめない。
+    """
+    deltas = observe_stream(provider, deltas)
+    if breaker_enabled():
+        deltas = get_breaker(provider, model).stream(deltas)
+    return deltas
+
+
+def cache_lookup(provider, model, template_version, transcript, params=None):
+    """キャッシュ済みの応答（なければ None）。ストリーミングのように compute() で包めない呼び出し用"""
+    if not cache_enabled():
+        return None
+    return get_cache().get(cache_key(provider, model, template_version, transcript, params))
+
+
+def cache_store(provider, model, template_version, transcript, result, params=None):
+    if cache_enabled():
+        get_cache().set(cache_key(provider, model, template_version, transcript, params), result)
+
+
+def wants_bypass(headers, data):
+    """リクエストがキャッシュ無視を求めているか（"no_cache": true または Cache-Control: no-cache）"""
+    if isinstance(data, dict) and data.get('no_cache'):
+        return True
+    cache_control = (headers.get('Cache-Control') or '') if headers is not None else ''
+    return 'no-cache' in cache_control.lower()
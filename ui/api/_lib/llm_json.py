@@ -0,0 +1,301 @@
+"""LLM応答のJSONデコード（修復つき）
+
+プロバイダのJSONモード（OpenAI の Structured Output、OpenRouter の json_object、Gemini の
+response_mime_type）を使ったうえで、それでも崩れた応答を捨てずに読むための共通デコーダー。
+
+1. clean: 応答全体がそのままJSONとして読める
+2. extracted: ```json のコードフェンスや前後の説明文を除けば読める
+3. repaired: 末尾のカンマ、閉じていない文字列・括弧（max_tokens での打ち切り）、True/False/None などを直せば読める
+4. partial: 直しても読めない場合は、閉じていたトップレベルのフィールドだけを取り出す
+   （ストリーミング時は受信しながら streaming.JSONFieldStream で集めたもの）
+
+取り出したオブジェクトはタスクごとのスキーマ（JSON Schema の type / properties / required / items /
+minimum / maximum のみ）に合わせて型を直す（"0.8" → 0.8、範囲外のスコアを 0〜1 に収める、文字列 → 配列など）。
+必須フィールドが1つもなければ LLMJSONError（ValueError のサブクラス。呼び出し側はこれまでどおりフォールバックする）。
+
+修復や型の修正をした応答には json_repair（outcome / fixes / missing）を付ける。件数は
+各関数の GET ?metrics=1 の dental_llm_json_decodes_total と ?metrics=state の llm_json に出る。
+"""
+import json
+import re
+import threading
+
+from .streaming import JSONFieldStream
+from .telemetry import JSON_DECODES, JSON_PARSE_FAILURES, register_state
+
+OUTCOMES = ('clean', 'extracted', 'repaired', 'partial', 'failed')
+
+# プロバイダのJSONモード
+GEMINI_JSON_MODE = {"response_mime_type": "application/json"}
+OPENAI_JSON_MODE = {"type": "json_object"}
+
+_WORD = re.compile(r'[A-Za-z_]+')
+_PY_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null'}
+# 値のない末尾のキー（"key" や "key":）。打ち切られた応答を閉じる前に落とす
+_DANGLING_KEY = re.compile(r'(?<=[{,])\s*"(?:[^"\\]|\\.)*"\s*:?\s*$')
+_MISSING = object()
+
+
+def _strip_trailing_comma(out):
+    """出力済みの末尾の空白とカンマを1つ取り除き、カンマがあったかを返す"""
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
+        return True
+    return False
+
+
+def repair_json(text):
+    """最初の '{' から始まるJSONの構文を直し、(JSON文字列, 修復内容のリスト) を返す
+
+    トップレベルのオブジェクトが閉じたところで読むのをやめる（後ろの ``` や説明文は捨てる）。
+    """
+    out = []
+    stack = []
+    fixes = []
+    in_string = False
+    escape = False
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                in_string = False
+            elif c in '\n\r\t':
+                c = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}[c]
+                fixes.append('control_character')
+            out.append(c)
+            i += 1
+            continue
+        if c == '"':
+            in_string = True
+        elif c in '{[':
+            stack.append('}' if c == '{' else ']')
+        elif c in '}]':
+            if _strip_trailing_comma(out):
+                fixes.append('trailing_comma')
+            if not stack:
+                break
+            expected = stack.pop()
+            if c != expected:
+                fixes.append('mismatched_bracket')
+            out.append(expected)
+            i += 1
+            if not stack:
+                break
+            continue
+        elif c.isascii() and c.isalpha():
+            word = _WORD.match(text, i).group()
+            out.append(_PY_LITERALS.get(word, word))
+            if word in _PY_LITERALS:
+                fixes.append('python_literal')
+            i += len(word)
+            continue
+        out.append(c)
+        i += 1
+
+    if stack or in_string:
+        fixes.append('truncated')
+        if in_string:
+            if escape:
+                out.pop()
+            out.append('"')
+        tail = ''.join(out)
+        if stack[-1] == '}':
+            tail = _DANGLING_KEY.sub('', tail)
+        out = list(tail)
+        _strip_trailing_comma(out)
+        out.extend(reversed(stack))
+    return ''.join(out), sorted(set(fixes), key=fixes.index)
+
+
+def conform(value, schema, path=''):
+    """value を schema に合わせて直し、(値, 修正内容のリスト) を返す（合わせられなければ値は _MISSING）"""
+    kind = schema.get('type')
+    fixes = []
+    if kind in ('number', 'integer'):
+        percent = False
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            text = str(value).strip()
+            percent = text.endswith('%')
+            try:
+                value = float(text.rstrip('%'))
+            except (TypeError, ValueError):
+                return _MISSING, [f"{path}: dropped"]
+            fixes.append(f"{path}: number")
+        low, high = schema.get('minimum'), schema.get('maximum')
+        # 0〜1 のスコアを百分率で返した応答（"85%" か 1 より大きい整数）。1.2 のような範囲外の小数は下で 1 に収める
+        if high == 1 and ((percent and 0 <= value <= 100) or (1 < value <= 100 and float(value).is_integer())):
+            value, fixes = value / 100, fixes + [f"{path}: percent"]
+        if (low is not None and value < low) or (high is not None and value > high):
+            value = min(max(value, low if low is not None else value), high if high is not None else value)
+            fixes.append(f"{path}: clamped")
+        if kind == 'integer' and not isinstance(value, int):
+            value = int(round(value))
+    elif kind == 'string':
+        if value is None or value == {} or value == []:
+            return _MISSING, [f"{path}: dropped"]
+        if not isinstance(value, str):
+            if isinstance(value, list):
+                value = '\n'.join(str(item) for item in value)
+            else:
+                value = json.dumps(value, ensure_ascii=False) if isinstance(value, dict) else str(value)
+            fixes.append(f"{path}: string")
+    elif kind == 'boolean':
+        if not isinstance(value, bool):
+            if str(value).strip().lower() not in ('true', 'false', '1', '0', 'yes', 'no'):
+                return _MISSING, [f"{path}: dropped"]
+            value = str(value).strip().lower() in ('true', '1', 'yes')
+            fixes.append(f"{path}: boolean")
+    elif kind == 'array':
+        if value is None:
+            value = []
+            fixes.append(f"{path}: array")
+        elif not isinstance(value, list):
+            value = [value]
+            fixes.append(f"{path}: array")
+        item_schema = schema.get('items')
+        if item_schema:
+            items = []
+            for index, item in enumerate(value):
+                item, item_fixes = conform(item, item_schema, f"{path}[{index}]")
+                fixes.extend(item_fixes)
+                if item is not _MISSING:
+                    items.append(item)
+            value = items
+    elif kind == 'object':
+        if not isinstance(value, dict):
+            return _MISSING, [f"{path}: dropped"]
+        value = dict(value)
+        for key, property_schema in schema.get('properties', {}).items():
+            if key not in value:
+                continue
+            item, item_fixes = conform(value[key], property_schema, f"{path}.{key}" if path else key)
+            fixes.extend(item_fixes)
+            if item is _MISSING:
+                del value[key]
+            else:
+                value[key] = item
+    return value, fixes
+
+
+class LLMJSONError(ValueError):
+    """LLMの応答から必須フィールドを1つも読めなかった（プロバイダは応答している）"""
+
+
+class DecodeStats:
+    """(プロバイダ, タスク) ごとのデコード結果の件数"""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider, task, outcome, coerced):
+        with self._lock:
+            counts = self._counts.setdefault((provider, task), dict.fromkeys(OUTCOMES + ('coerced',), 0))
+            counts[outcome] += 1
+            counts['coerced'] += bool(coerced)
+
+    def snapshot(self):
+        with self._lock:
+            items = [(key, dict(counts)) for key, counts in self._counts.items()]
+        snapshot = {}
+        for (provider, task), counts in sorted(items):
+            total = sum(counts[outcome] for outcome in OUTCOMES)
+            repaired = total - counts['clean'] - counts['failed']
+            counts["decoded"] = total
+            counts["repair_rate"] = round(repaired / total, 4) if total else 0.0
+            snapshot[f"{provider}:{task}"] = counts
+        return snapshot
+
+
+_stats = DecodeStats()
+
+
+def get_decode_stats():
+    return _stats
+
+
+register_state('llm_json', _stats.snapshot)
+
+
+class TolerantJSONDecoder(JSONFieldStream):
+    """LLM応答のJSONを受信しながら読み、finish() で修復・スキーマ検証したオブジェクトを返す
+
+    feed() は JSONFieldStream と同じく閉じたトップレベルのフィールドを返す（SSEの field イベント用）。
+    ストリーミングでない応答は feed() せずに finish(text) へ全文を渡す（読めなかった場合だけ走査する）。
+    """
+
+    def __init__(self, provider, task, schema=None):
+        super().__init__()
+        self.provider = provider
+        self.task = task
+        self.schema = schema
+        self.fields = {}
+
+    def feed(self, chunk):
+        fields = super().feed(chunk)
+        self.fields.update(fields)
+        return fields
+
+    def finish(self, text=''):
+        self.extend(text)
+        text = self.text
+        fixes = []
+        try:
+            value = json.loads(text)
+            outcome = 'clean'
+        except ValueError:
+            value = None
+        if not isinstance(value, dict):
+            start = text.find('{')
+            candidate, fixes = repair_json(text[start:]) if start >= 0 else ('', [])
+            try:
+                value = json.loads(candidate)
+                outcome = 'repaired' if fixes else 'extracted'
+            except ValueError:
+                value = None
+            if not isinstance(value, dict):
+                # 読めたところまでのフィールドを使う（feed() していない残りもここで読む）
+                self.feed('')
+                value = dict(self.fields)
+                outcome = 'partial'
+                fixes = ['truncated']
+
+        missing = []
+        coerced = []
+        if self.schema is not None and value:
+            value, coerced = conform(value, self.schema)
+            required = self.schema.get('required', [])
+            missing = [key for key in required if key not in value]
+            if required and len(missing) == len(required):
+                value = {}
+        if not value:
+            _stats.record(self.provider, self.task, 'failed', False)
+            JSON_DECODES.inc(provider=self.provider, task=self.task, outcome='failed')
+            JSON_PARSE_FAILURES.inc(provider=self.provider)
+            raise LLMJSONError(f"{self.provider} の応答からJSONを取り出せませんでした: {text[:200]!r}")
+
+        _stats.record(self.provider, self.task, outcome, bool(coerced))
+        JSON_DECODES.inc(provider=self.provider, task=self.task, outcome=outcome)
+        if outcome != 'clean' or coerced or missing:
+            value["json_repair"] = {"outcome": outcome, "fixes": fixes + coerced, "missing": missing}
+        return value
+
+
+def is_complete(result):
+    """応答全体が読めて（途中で切れておらず）必須フィールドがそろった結果か。キャッシュに保存してよいかの判定"""
+    repair = result.get('json_repair')
+    if repair is None:
+        return True
+    return repair['outcome'] != 'partial' and 'truncated' not in repair['fixes'] and not repair['missing']
+
+
+def decode_llm_json(provider, task, text, schema=None):
+    """LLM応答の全文をデコードする（読めなければ LLMJSONError）"""
+    return TolerantJSONDecoder(provider, task, schema).finish(text or '')
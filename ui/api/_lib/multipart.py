@@ -0,0 +1,171 @@
+"""multipart/form-data のストリーミング解析
+
+リクエスト本文を一括で読み込まず、固定長チャンクごとに境界文字列を探しながら
+ファイル部分だけを SpooledTemporaryFile に書き出す（大きいものはディスクへ退避）。
+"""
+import os
+import re
+import tempfile
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_SPOOL_SIZE = 1024 * 1024
+DEFAULT_MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+MAX_HEADER_BYTES = 16 * 1024
+
+_BOUNDARY = re.compile(r'boundary=(?:"([^"]+)"|([^;\s]+))', re.IGNORECASE)
+_DISPOSITION_PARAM = re.compile(r'(\w+)\*?=(?:"([^"]*)"|([^;\s]*))')
+
+
+class MultipartError(Exception):
+    pass
+
+
+class UploadTooLarge(MultipartError):
+    pass
+
+
+class UploadedFile:
+    """取り出したファイル部分（file は先頭にシーク済みのファイルオブジェクト）"""
+
+    __slots__ = ('name', 'filename', 'content_type', 'file', 'size')
+
+    def __init__(self, name, filename, content_type, file, size):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.file = file
+        self.size = size
+
+    def close(self):
+        self.file.close()
+
+
+def max_upload_bytes():
+    return int(os.environ.get('XLSX_UPLOAD_MAX_BYTES', DEFAULT_MAX_UPLOAD_BYTES))
+
+
+def parse_boundary(content_type):
+    """Content-Type ヘッダーから境界文字列を取り出す"""
+    match = _BOUNDARY.search(content_type or '')
+    if not match or not content_type.lower().startswith('multipart/'):
+        raise MultipartError("multipart/form-data の boundary がありません")
+    return (match.group(1) or match.group(2)).encode('latin-1')
+
+
+def _parse_part_headers(raw):
+    headers = {}
+    for line in raw.decode('utf-8', 'replace').split('\r\n'):
+        key, sep, value = line.partition(':')
+        if sep:
+            headers[key.strip().lower()] = value.strip()
+    params = {}
+    for key, quoted, bare in _DISPOSITION_PARAM.findall(headers.get('content-disposition', '')):
+        params[key.lower()] = quoted if quoted else bare
+    return params.get('name', ''), params.get('filename'), headers.get('content-type', '')
+
+
+class _BodyReader:
+    """Content-Length までを固定長チャンクで読み、bytearray 上で境界を探す"""
+
+    def __init__(self, rfile, content_length, chunk_size):
+        self.rfile = rfile
+        self.remaining = content_length
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+
+    def fill(self):
+        if self.remaining <= 0:
+            return False
+        chunk = self.rfile.read(min(self.chunk_size, self.remaining))
+        if not chunk:
+            self.remaining = 0
+            return False
+        self.remaining -= len(chunk)
+        self.buffer += chunk
+        return True
+
+    def read_until(self, delimiter, sink=None, limit=None):
+        """delimiter の直前までを sink に流し、delimiter は読み捨てる。書き出したバイト数を返す"""
+        written = 0
+        keep = len(delimiter) - 1
+        start = 0
+        while True:
+            index = self.buffer.find(delimiter, start)
+            if index != -1:
+                if sink is not None and index:
+                    with memoryview(self.buffer) as view:
+                        sink(view[:index])
+                written += index
+                del self.buffer[:index + len(delimiter)]
+                if limit is not None and written > limit:
+                    raise UploadTooLarge(f"アップロード上限 {limit} バイトを超えています")
+                return written
+            flush = len(self.buffer) - keep
+            if flush > 0:
+                if sink is not None:
+                    with memoryview(self.buffer) as view:
+                        sink(view[:flush])
+                written += flush
+                del self.buffer[:flush]
+                if limit is not None and written > limit:
+                    raise UploadTooLarge(f"アップロード上限 {limit} バイトを超えています")
+            start = max(0, len(self.buffer) - keep)
+            if not self.fill():
+                raise MultipartError("multipart 本文が途中で終わっています")
+
+    def read_exact(self, size):
+        while len(self.buffer) < size:
+            if not self.fill():
+                raise MultipartError("multipart 本文が途中で終わっています")
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def drain(self):
+        """残りの本文を読み捨てる（keep-alive 接続で次のリクエストと混ざらないように）"""
+        while self.remaining > 0:
+            chunk = self.rfile.read(min(self.chunk_size, self.remaining))
+            if not chunk:
+                break
+            self.remaining -= len(chunk)
+
+
+def read_file_part(rfile, content_type, content_length, accept,
+                   max_bytes=None, chunk_size=DEFAULT_CHUNK_SIZE, spool_size=DEFAULT_SPOOL_SIZE):
+    """accept(filename, content_type) が真になる最初のファイル部分を UploadedFile で返す
+
+    見つからなければ None。ファイル部分以外の本文はバッファに溜めずに読み捨てる。
+    """
+    max_bytes = max_upload_bytes() if max_bytes is None else max_bytes
+    if content_length > max_bytes + MAX_HEADER_BYTES:
+        raise UploadTooLarge(f"アップロード上限 {max_bytes} バイトを超えています")
+
+    boundary = parse_boundary(content_type)
+    reader = _BodyReader(rfile, content_length, chunk_size)
+    delimiter = b'\r\n--' + boundary
+
+    try:
+        # プリアンブルを読み捨て、最初の境界の直後に移動
+        reader.buffer += b'\r\n'
+        reader.read_until(delimiter)
+
+        while reader.read_exact(2) != b'--':
+            raw_headers = bytearray()
+            reader.read_until(b'\r\n\r\n', sink=raw_headers.extend, limit=MAX_HEADER_BYTES)
+            name, filename, part_type = _parse_part_headers(bytes(raw_headers))
+
+            if filename is None or not accept(filename, part_type):
+                reader.read_until(delimiter)
+                continue
+
+            spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+            try:
+                size = reader.read_until(delimiter, sink=spool.write, limit=max_bytes)
+            except Exception:
+                spool.close()
+                raise
+            spool.seek(0)
+            return UploadedFile(name, filename, part_type, spool, size)
+        return None
+    finally:
+        reader.drain()
@@ -0,0 +1,228 @@
+"""プロバイダ（Gemini / OpenAI / OpenRouter）の稼働状況
+
+- 実際のLLM呼び出しの所要時間と成否をプロバイダごとに直近の一定件数・一定時間だけ保持し、
+  パーセンタイルとエラー率を出す（observe_call で包んだ呼び出しが対象）。呼び出した関数のインスタンスごとの値で、
+  各関数の GET ?metrics=state の provider_calls に出る
+- バックグラウンドのスレッドが一定間隔で課金の発生しない軽い疎通確認（モデル一覧・トークン数計算）を行い、
+  結果を保持する。/api/health はこの保持済みの値を返すだけなので外部通信を待たない
+
+環境変数:
+    HEALTH_PROBE_INTERVAL   疎通確認の間隔秒（既定 300、0 で無効）
+    HEALTH_WINDOW_SIZE      保持する呼び出し件数（既定 256）
+    HEALTH_WINDOW_SECONDS   保持する時間幅秒（既定 900）
+"""
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from .clients import API_KEY_ENV, PROVIDERS, gemini_model, openai_client
+from .telemetry import PROVIDER_CALLS, PROVIDER_LATENCY, Cancelled, observe_provider_call, register_state
+
+DEFAULT_PROBE_INTERVAL = 300
+DEFAULT_WINDOW_SIZE = 256
+DEFAULT_WINDOW_SECONDS = 900
+
+
+def _percentile(ordered, fraction):
+    """昇順リストの最近傍順位パーセンタイル"""
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _isoformat(timestamp):
+    return datetime.utcfromtimestamp(timestamp).isoformat() + "Z" if timestamp else None
+
+
+class LatencyWindow:
+    """直近 max_size 件かつ max_age 秒以内の (時刻, 所要ms, 成否) を保持する"""
+
+    def __init__(self, max_size=DEFAULT_WINDOW_SIZE, max_age=DEFAULT_WINDOW_SECONDS):
+        self.max_age = max_age
+        self._samples = deque(maxlen=max_size)
+        self._lock = threading.Lock()
+        self._last_error = None
+
+    def record(self, latency_ms, ok, error=None):
+        with self._lock:
+            self._samples.append((time.time(), latency_ms, ok))
+            if not ok:
+                self._last_error = (time.time(), str(error)[:200] if error is not None else None)
+
+    def stats(self):
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            samples = list(self._samples)
+            last_error = self._last_error
+        if not samples:
+            return {"count": 0}
+        ordered = sorted(latency for _, latency, _ in samples)
+        errors = sum(1 for _, _, ok in samples if not ok)
+        stats = {
+            "count": len(samples),
+            "error_rate": round(errors / len(samples), 3),
+            "p50_ms": round(_percentile(ordered, 0.50), 1),
+            "p90_ms": round(_percentile(ordered, 0.90), 1),
+            "p99_ms": round(_percentile(ordered, 0.99), 1)
+        }
+        if last_error is not None:
+            stats["last_error"] = {"at": _isoformat(last_error[0]), "error": last_error[1]}
+        return stats
+
+    def quantile(self, fraction, min_samples=1):
+        """成功した呼び出しの所要時間（ms）の分位。件数が min_samples 未満なら None"""
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            ordered = sorted(latency for at, latency, ok in self._samples if ok and at >= cutoff)
+        if len(ordered) < max(1, min_samples):
+            return None
+        return _percentile(ordered, fraction)
+
+
+def _probe_gemini(api_key):
+    gemini_model(api_key, 'gemini-1.5-flash').count_tokens("health check")
+
+
+def _probe_openai(api_key):
+    openai_client('openai', api_key).models.list()
+
+
+def _probe_openrouter(api_key):
+    base_url = os.environ.get('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')
+    openai_client('openrouter', api_key, base_url).models.list()
+
+
+PROBES = {
+    'gemini': _probe_gemini,
+    'openai': _probe_openai,
+    'openrouter': _probe_openrouter
+}
+
+
+class ProviderHealth:
+    """プロバイダごとの呼び出し統計と、バックグラウンド疎通確認の最新結果"""
+
+    def __init__(self, probe_interval=None, window_size=None, window_seconds=None):
+        self.probe_interval = float(os.environ.get('HEALTH_PROBE_INTERVAL', DEFAULT_PROBE_INTERVAL)
+                                    if probe_interval is None else probe_interval)
+        window_size = int(os.environ.get('HEALTH_WINDOW_SIZE', DEFAULT_WINDOW_SIZE)
+                          if window_size is None else window_size)
+        window_seconds = float(os.environ.get('HEALTH_WINDOW_SECONDS', DEFAULT_WINDOW_SECONDS)
+                               if window_seconds is None else window_seconds)
+        self.calls = {provider: LatencyWindow(window_size, window_seconds) for provider in PROVIDERS}
+        self.probes = {provider: {"state": "pending"} for provider in PROVIDERS}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, provider, latency_ms, ok, error=None):
+        window = self.calls.get(provider)
+        if window is not None:
+            window.record(latency_ms, ok, error)
+
+    def probe(self, provider):
+        """1プロバイダの疎通確認を実行して結果を保持する"""
+        api_key = os.environ.get(API_KEY_ENV[provider])
+        if not api_key:
+            status = {"state": "no_api_key"}
+        else:
+            started = time.perf_counter()
+            try:
+                PROBES[provider](api_key)
+                status = {"state": "ok"}
+            except Exception as e:
+                status = {"state": "error", "error": str(e)[:200]}
+            status["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        status["checked_at"] = _isoformat(time.time())
+        with self._lock:
+            self.probes[provider] = status
+        return status
+
+    def probe_all(self):
+        for provider in PROVIDERS:
+            self.probe(provider)
+
+    def _run(self):
+        while True:
+            self.probe_all()
+            time.sleep(self.probe_interval)
+
+    def ensure_probing(self):
+        """疎通確認スレッドが動いていなければ起動する（間隔 0 なら何もしない）"""
+        if self.probe_interval <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='provider-health-probe', daemon=True)
+                self._thread.start()
+
+    def snapshot(self):
+        """保持済みの状態だけを返す（外部通信はしない）"""
+        with self._lock:
+            probes = {provider: dict(status) for provider, status in self.probes.items()}
+        return {
+            provider: {
+                "configured": bool(os.environ.get(API_KEY_ENV[provider])),
+                "probe": probes[provider]
+            }
+            for provider in PROVIDERS
+        }
+
+    def calls_snapshot(self):
+        """このインスタンスで行った実呼び出しの件数・エラー率・パーセンタイル"""
+        return {provider: self.calls[provider].stats() for provider in PROVIDERS}
+
+
+_health = ProviderHealth()
+
+
+def get_health():
+    return _health
+
+
+register_state('provider_calls', lambda: _health.calls_snapshot())
+
+
+def observe_call(provider, func):
+    """func() の所要時間と成否を provider の呼び出し統計（とメトリクス・スパン）に記録するよう包む"""
+    func = observe_provider_call(provider, func)
+
+    def observed():
+        started = time.perf_counter()
+        try:
+            result = func()
+        except Cancelled:
+            # 打ち切った呼び出しは失敗ではない。実際の所要時間は打ち切りまでの時間以上なので、その値を
+            # 成功として残す（捨てると遅い呼び出しほど統計から消え、ヘッジの待ち時間が短く偏る）
+            _health.record(provider, (time.perf_counter() - started) * 1000, True)
+            raise
+        except Exception as e:
+            _health.record(provider, (time.perf_counter() - started) * 1000, False, e)
+            raise
+        _health.record(provider, (time.perf_counter() - started) * 1000, True)
+        return result
+    return observed
+
+
+def observe_stream(provider, deltas):
+    """observe_call のストリーミング版。応答の差分を読み終えるまでの時間と成否を記録するジェネレーター"""
+    started = time.perf_counter()
+    outcome, error = 'error', None
+    try:
+        yield from deltas
+        outcome = 'ok'
+    except (Cancelled, GeneratorExit):
+        outcome = 'cancelled'
+        raise
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        _health.record(provider, elapsed * 1000, outcome != 'error', error)
+        PROVIDER_CALLS.inc(provider=provider, outcome=outcome)
+        PROVIDER_LATENCY.observe(elapsed, provider=provider)
@@ -0,0 +1,181 @@
+""""Speaker 1" / "Speaker 2" のような役割の分からない話者ラベルの役割推定（LLMを呼ばない）
+
+Notta の CSV・SRT は話者を "Speaker 1" などで出力するため、ラベルからは医師・患者が分からない。
+話者ごとに次の特徴量を求め、重み付きの和（医師らしさ）で役割を割り当てる。
+
+- question: 質問で終わる発話の割合（問診する側）
+- clinical: 発話あたりの専門用語（う蝕・歯髄・麻酔・充填など）の数
+- instruction: 発話あたりの指示・提案（〜してください・〜しましょう）の数
+- honorific: 発話あたりの「〜さん」（医師が患者を呼ぶ）と「先生」（患者が医師を呼ぶ）の差
+- symptom: 発話あたりの症状・不安・費用の訴え（しみる・痛い・心配・いくら）の数
+- length: 平均発話長（全話者の平均との比。説明の長い側）
+
+キーワードは会話全体を keywords.KeywordMatcher で1回だけ走査して数え、発話位置から話者に振り分ける。
+医師らしさが最も高い話者を医師、最も低い話者を患者とし、その差をロジスティック関数で 0〜1 の信頼度にする
+（発話数が少ない話者がいる場合は下げる）。ラベルから役割が分かる話者（"医師:" など）はそのまま使う。
+ライブセッション（/api/live_session）は utterance_counts で追加された発話の件数だけを足し込み、
+features_from_counts と assign_roles で話者数に比例する手間で割り当て直す。
+"""
+import math
+import os
+from bisect import bisect_right
+
+from .keywords import KeywordMatcher
+from .transcript import DOCTOR, PATIENT, UNKNOWN
+
+DEFAULT_MIN_CONFIDENCE = 0.6
+# 信頼度が十分になる話者あたりの発話数
+MIN_TURNS = 3
+# 医師らしさの差を信頼度に変える傾き
+CONFIDENCE_GAIN = 2.0
+
+ROLE_KEYWORDS = KeywordMatcher({
+    'clinical': ['う蝕', '虫歯', 'むし歯', '歯髄', '神経', '根管', '麻酔', '充填', '修復', '打診', '冷水痛',
+                 '歯周', '歯肉', '歯石', 'レントゲン', '検査', '診断', '診察', '処置', '抜歯', '炎症', '大臼歯',
+                 '小臼歯', '前歯', 'インレー', 'クラウン', 'レジン', 'CR', 'FDI', '所見', '進行', '予後', '陽性'],
+    'instruction': ['てください', 'ましょう', 'ていきます', 'しておきます', 'させていただき', 'いかがでしょう',
+                    '予定です', '予定しています'],
+    'san': ['さん'],
+    'sensei': ['先生', 'ドクター'],
+    'symptom': ['しみる', 'しみて', '痛い', '痛くて', '痛み', 'ズキズキ', '違和感', '気になって', '心配', '不安',
+                '怖い', 'いくら', '費用', '高い', 'お願いします', '分かりました', 'わかりました'],
+})
+QUESTION_ENDINGS = ('？', '?', 'か', 'か。')
+
+# 医師らしさの重み（正なら医師、負なら患者の特徴）
+WEIGHTS = {
+    'question': 1.0,
+    'clinical': 1.5,
+    'instruction': 1.5,
+    'honorific': 1.5,
+    'symptom': -1.5,
+    'length': 0.5,
+}
+
+
+def inference_enabled():
+    return os.environ.get('ROLE_INFERENCE_DISABLED', '').lower() not in ('1', 'true', 'yes')
+
+
+def min_confidence():
+    """推定した役割を Transcript に反映する最低の信頼度"""
+    return float(os.environ.get('ROLE_INFERENCE_MIN_CONFIDENCE', DEFAULT_MIN_CONFIDENCE))
+
+
+# 話者ごとに数える件数（keywords は ROLE_KEYWORDS のカテゴリ）
+KEYWORD_COUNTS = ('clinical', 'instruction', 'san', 'sensei', 'symptom')
+COUNTS = ('question', 'chars') + KEYWORD_COUNTS
+
+
+def utterance_counts(content):
+    """1発話の件数 {"question", "chars", "clinical", ...}（ライブセッションで発話ごとに足し込む用）"""
+    hits = ROLE_KEYWORDS.scan(content)
+    counts = {category: hits.count(category) for category in KEYWORD_COUNTS}
+    counts['question'] = int(content.endswith(QUESTION_ENDINGS))
+    counts['chars'] = len(content)
+    return counts
+
+
+def speaker_features(transcript):
+    """話者ラベルごとの特徴量 {"turns", "question", "clinical", ...}（ラベルのない発話は数えない）"""
+    speakers = transcript.speakers()
+    turns = {}
+    totals = {}
+    for index, speaker in enumerate(speakers):
+        if speaker is None:
+            continue
+        content = transcript.content(index)
+        counts = totals.get(speaker)
+        if counts is None:
+            counts = totals[speaker] = dict.fromkeys(COUNTS, 0)
+            turns[speaker] = 0
+        turns[speaker] += 1
+        counts['chars'] += len(content)
+        counts['question'] += content.endswith(QUESTION_ENDINGS)
+    if not totals:
+        return {}
+
+    # キーワードは本文全体を1回走査し、位置から発話（と話者）を引く
+    hits = ROLE_KEYWORDS.scan(transcript.text)
+    offsets = transcript.offsets()
+    for category in KEYWORD_COUNTS:
+        for position in hits.positions(category):
+            speaker = speakers[bisect_right(offsets, position) - 1]
+            if speaker is not None:
+                totals[speaker][category] += 1
+    return features_from_counts(turns, totals)
+
+
+def features_from_counts(turns, totals):
+    """話者ごとの発話数 {ラベル: 件数} と件数の合計 {ラベル: {"question", "chars", ...}} から特徴量を求める"""
+    if not totals:
+        return {}
+    mean_length = sum(counts['chars'] for counts in totals.values()) / sum(turns.values())
+    features = {}
+    for speaker, counts in totals.items():
+        n = turns[speaker]
+        features[speaker] = {
+            "turns": n,
+            "question": counts['question'] / n,
+            "clinical": counts['clinical'] / n,
+            "instruction": counts['instruction'] / n,
+            "honorific": (counts['san'] - counts['sensei']) / n,
+            "symptom": counts['symptom'] / n,
+            "length": (counts['chars'] / n) / mean_length - 1 if mean_length else 0.0,
+        }
+    return features
+
+
+def doctor_score(features):
+    """医師らしさ（特徴量の重み付きの和）"""
+    return sum(weight * features[name] for name, weight in WEIGHTS.items())
+
+
+def _sigmoid(x):
+    return 1 / (1 + math.exp(-x))
+
+
+def infer_roles(transcript):
+    """役割の分からない話者に医師・患者を割り当てる
+
+    {"roles": {ラベル: 役割}, "confidence", "scores": {ラベル: 医師らしさ}, "method"} を返す。
+    割り当てられる話者がいなければ roles は空で confidence は 0。
+    """
+    return assign_roles(speaker_features(transcript), dict(zip(transcript.speakers(), transcript.label_roles())))
+
+
+def assign_roles(features, label_roles):
+    """話者ごとの特徴量と {ラベル: ラベルから分かる役割} から役割を割り当てる（infer_roles と同じ形を返す）"""
+    known = {role for speaker, role in label_roles.items() if speaker is not None and role != UNKNOWN}
+    unknown = {speaker: doctor_score(values) for speaker, values in features.items()
+               if label_roles[speaker] == UNKNOWN}
+    result = {
+        "roles": {},
+        "confidence": 0.0,
+        "scores": {speaker: round(score, 3) for speaker, score in unknown.items()},
+        "method": "local_role_inference"
+    }
+    if not unknown:
+        return result
+    ranked = sorted(unknown, key=unknown.get, reverse=True)
+    needed = [role for role in (DOCTOR, PATIENT) if role not in known]
+    if not needed:
+        return result
+
+    if len(needed) == 2 and len(ranked) >= 2:
+        doctor, patient = ranked[0], ranked[-1]
+        roles = {doctor: DOCTOR, patient: PATIENT}
+        margin = unknown[doctor] - unknown[patient]
+    elif needed == [DOCTOR] or (len(needed) == 2 and unknown[ranked[0]] >= 0):
+        # 1人しかいない（または患者は既にラベルで分かる）場合は、医師らしさの符号で決める
+        roles = {ranked[0]: DOCTOR}
+        margin = unknown[ranked[0]]
+    else:
+        roles = {ranked[-1]: PATIENT}
+        margin = -unknown[ranked[-1]]
+
+    evidence = min(1.0, min(features[speaker]['turns'] for speaker in roles) / MIN_TURNS)
+    result["roles"] = roles
+    result["confidence"] = round(_sigmoid(CONFIDENCE_GAIN * margin) * evidence, 3) if margin > 0 else 0.0
+    return result
+
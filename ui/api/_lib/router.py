@@ -0,0 +1,184 @@
+"""複数プロバイダへのヘッジ・レース呼び出し
+
+1つの解析を Gemini / OpenAI / OpenRouter のうちAPIキーのあるバックエンドに振り分け、最初に返った有効な結果を使う。
+
+- hedge: 1番目のバックエンドに送り、そのプロバイダの直近の所要時間の HEDGE_QUANTILE 分位（provider_health の
+  呼び出し統計）までに応答がなければ次のバックエンドにも送る。失敗・無効な結果が返り、他に実行中の呼び出しが
+  なければ待ち時間を待たずに次へ送る
+- race: 全バックエンドに同時に送る
+
+検証を通った最初の結果を採用し、負けた側には取り消しを通知する。まだ始まっていない呼び出しは実行せず、
+ストリーミングで本文を読んでいる呼び出しは cancelled() を見て接続を閉じる。SDK の同期呼び出しは途中で
+止められないので応答を待たずに結果を捨てる（LLMキャッシュには入るので同じ会話の再解析では使われる）。
+
+環境変数:
+    ROUTER_MODE             off / hedge / race（既定 off = 従来どおり1プロバイダ）
+    ROUTER_PROVIDERS        送る順番（既定 gemini,openai,openrouter。APIキーのないものは除く）
+    HEDGE_QUANTILE          ヘッジまでの待ち時間に使う分位（既定 0.9）
+    HEDGE_MIN_SAMPLES       分位を使う最低の呼び出し件数（既定 5、未満なら HEDGE_DEFAULT_DELAY_MS）
+    HEDGE_DEFAULT_DELAY_MS  呼び出し統計が足りないときの待ち時間（既定 2000）
+    HEDGE_MIN_DELAY_MS      待ち時間の下限（既定 50）
+    HEDGE_MAX_DELAY_MS      待ち時間の上限（既定 10000）
+    ROUTER_MAX_WORKERS      呼び出しを実行するスレッド数（既定 16）
+"""
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .provider_health import API_KEY_ENV, PROVIDERS, get_health
+from .telemetry import ROUTER_ATTEMPTS, ROUTER_HEDGES, Cancelled, span, submit_in_context
+
+MODES = ('off', 'hedge', 'race')
+DEFAULT_QUANTILE = 0.9
+DEFAULT_MIN_SAMPLES = 5
+DEFAULT_DELAY_MS = 2000.0
+DEFAULT_MIN_DELAY_MS = 50.0
+DEFAULT_MAX_DELAY_MS = 10000.0
+DEFAULT_MAX_WORKERS = 16
+
+# 負けた呼び出しが終わるのを待たずに返すため、呼び出し元ごとの with ブロックではなく共有のプールで実行する
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('ROUTER_MAX_WORKERS', DEFAULT_MAX_WORKERS)),
+                               thread_name_prefix='router')
+_cancel_event = contextvars.ContextVar('dental_router_cancel', default=None)
+
+
+class RouterError(Exception):
+    """全バックエンドが失敗・無効な結果を返した（errors はプロバイダごとの理由）"""
+
+    def __init__(self, stage, errors):
+        self.errors = errors
+        detail = '; '.join(f"{provider}: {reason}" for provider, reason in errors.items()) or 'no backends'
+        super().__init__(f"{stage}: all providers failed ({detail})")
+
+
+def router_mode():
+    mode = (os.environ.get('ROUTER_MODE') or 'off').strip().lower()
+    if mode not in MODES:
+        raise ValueError(f"ROUTER_MODE must be one of {', '.join(MODES)}: {mode}")
+    return mode
+
+
+def routed_providers():
+    """振り分け先のプロバイダ（ROUTER_PROVIDERS の順、APIキーのあるもの）。無効なら空"""
+    if router_mode() == 'off':
+        return []
+    order = os.environ.get('ROUTER_PROVIDERS') or ','.join(PROVIDERS)
+    providers = []
+    for provider in (name.strip().lower() for name in order.split(',')):
+        if provider in API_KEY_ENV and provider not in providers and os.environ.get(API_KEY_ENV[provider]):
+            providers.append(provider)
+    return providers
+
+
+def cancelled():
+    """実行中のヘッジ/レース呼び出しが負けて取り消されたか（ルーター外では常に False）"""
+    event = _cancel_event.get()
+    return event is not None and event.is_set()
+
+
+def hedge_delay_ms(provider, quantile=None):
+    """provider に送ってから次のバックエンドに送るまでの待ち時間（ms）"""
+    quantile = float(os.environ.get('HEDGE_QUANTILE', DEFAULT_QUANTILE)) if quantile is None else quantile
+    min_samples = int(os.environ.get('HEDGE_MIN_SAMPLES', DEFAULT_MIN_SAMPLES))
+    window = get_health().calls.get(provider)
+    delay = window.quantile(quantile, min_samples) if window is not None else None
+    if delay is None:
+        delay = float(os.environ.get('HEDGE_DEFAULT_DELAY_MS', DEFAULT_DELAY_MS))
+    low = float(os.environ.get('HEDGE_MIN_DELAY_MS', DEFAULT_MIN_DELAY_MS))
+    high = float(os.environ.get('HEDGE_MAX_DELAY_MS', DEFAULT_MAX_DELAY_MS))
+    return min(max(delay, low), high)
+
+
+def _attempt(func, cancel):
+    _cancel_event.set(cancel)
+    if cancel.is_set():
+        raise Cancelled()
+    return func()
+
+
+def route(stage, backends, validate=None, mode=None):
+    """backends（(provider, func) の並び）をヘッジ/レースで呼び、(provider, 結果, 経過) を返す
+
+    func() は結果を返すか例外を投げる。validate(結果) が偽の結果は失敗と同じ扱いにする。
+    経過（結果の routing に入れる）は mode・採用したプロバイダ・各呼び出しの結果と所要時間。
+    全て失敗したら RouterError。
+    """
+    mode = mode or router_mode()
+    waiting = list(backends)
+    if not waiting:
+        raise RouterError(stage, {})
+    cancel = threading.Event()
+    started = time.perf_counter()
+    pending = {}
+    attempts = []
+    errors = {}
+    winner = None
+
+    def launch(kind):
+        provider, func = waiting.pop(0)
+        if kind == 'hedge':
+            ROUTER_HEDGES.inc(stage=stage, provider=provider)
+        future = submit_in_context(_executor, _attempt, func, cancel)
+        pending[future] = {"provider": provider, "kind": kind,
+                           "sent_ms": round((time.perf_counter() - started) * 1000, 1)}
+        return provider
+
+    def finish(attempt, outcome):
+        attempt["outcome"] = outcome
+        attempt["latency_ms"] = round((time.perf_counter() - started) * 1000 - attempt["sent_ms"], 1)
+        attempts.append(attempt)
+        ROUTER_ATTEMPTS.inc(stage=stage, provider=attempt["provider"], outcome=outcome)
+
+    with span('route', stage=stage, mode=mode) as current:
+        try:
+            if mode == 'race':
+                while waiting:
+                    launch('race')
+            else:
+                deadline = time.perf_counter() + hedge_delay_ms(launch('primary')) / 1000
+            while pending:
+                timeout = max(0.0, deadline - time.perf_counter()) if mode != 'race' and waiting else None
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    deadline = time.perf_counter() + hedge_delay_ms(launch('hedge')) / 1000
+                    continue
+                for future in done:
+                    attempt = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        errors[attempt["provider"]] = str(e)[:200]
+                        finish(attempt, 'error')
+                        continue
+                    if winner is None and (validate is None or validate(result)):
+                        winner = (attempt["provider"], result)
+                        finish(attempt, 'won')
+                    elif winner is None:
+                        errors[attempt["provider"]] = 'invalid result'
+                        finish(attempt, 'invalid')
+                    else:
+                        finish(attempt, 'lost')
+                if winner is not None:
+                    break
+                if waiting and not pending:
+                    # 実行中の呼び出しがなければ待ち時間を待たずに次へ
+                    deadline = time.perf_counter() + hedge_delay_ms(launch('retry')) / 1000
+        finally:
+            # 負けた側（と、例外で抜けた場合の残り）を取り消す
+            cancel.set()
+            for future, attempt in pending.items():
+                future.cancel()
+                finish(attempt, 'cancelled')
+        current.set(winner=winner[0] if winner else None, attempts=len(attempts))
+
+    if winner is None:
+        raise RouterError(stage, errors)
+    provider, result = winner
+    return provider, result, {
+        "mode": mode,
+        "provider": provider,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "attempts": attempts,
+    }
@@ -0,0 +1,91 @@
+"""会話の全文検索用の文字 bigram 化と検索式・抜粋の組み立て
+
+日本語は分かち書きがないため、FTS5 には発言を「文字 bigram をスペースで区切った列」にして入れる
+（例: "費用が高い" → "費用 用が が高 高い い"）。FTS5 標準の trigram トークナイザでは
+「費用」「不安」のような2文字語を索引で引けないため、bigram を自前で作る。
+
+- 2文字以上の語は bigram のフレーズ（隣接一致）で検索するので、部分文字列検索と同じ結果になる
+- 1文字の語は前方一致（"痛"*）。各連続部分の末尾1文字も索引に入れてあるので語末の出現も拾える
+- NFKC 正規化と小文字化を索引・検索の両方に適用する（全角英数字・半角カナの違いを吸収）
+"""
+import re
+import unicodedata
+from operator import add
+
+_WORD_RUN = re.compile(r'[^\W_]+')
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def _runs(text):
+    return _WORD_RUN.findall(normalize(text))
+
+
+def index_terms(text):
+    """発言を索引用の bigram 列にする"""
+    tokens = []
+    for run in _runs(text):
+        tokens.extend(map(add, run, run[1:]))
+        tokens.append(run[-1])
+    return ' '.join(tokens)
+
+
+def split_query(query):
+    """検索文字列を語のリストにする（空白区切り、重複除去）"""
+    return list(dict.fromkeys(term for term in (query or '').split() if _runs(term)))
+
+
+def term_expression(term):
+    """1語を FTS5 の検索式にする（語の中の記号で区切られた部分はすべて含む＝AND）"""
+    parts = []
+    for run in _runs(term):
+        if len(run) == 1:
+            parts.append(f'"{run}"*')
+        else:
+            parts.append('"' + ' '.join(map(add, run, run[1:])) + '"')
+    return parts[0] if len(parts) == 1 else '(' + ' AND '.join(parts) + ')'
+
+
+def match_expression(terms, mode='all', role=None):
+    """語のリストを MATCH 式にする（mode='any' はいずれか、'all' はすべて。role で話者の役割を限定）"""
+    if not terms:
+        raise ValueError("empty search query")
+    expression = (' OR ' if mode == 'any' else ' AND ').join(term_expression(term) for term in terms)
+    if role:
+        if not _WORD_RUN.fullmatch(role):
+            raise ValueError(f"invalid role: {role}")
+        expression = f'role : "{role}" AND ({expression})'
+    return expression
+
+
+def make_snippet(text, terms, width=24, open_mark='【', close_mark='】'):
+    """最初に一致した語の前後 width 文字を抜き出し、範囲内の一致を印で囲む（正規化後の文字列で返す）"""
+    normalized = normalize(text)
+    needles = [normalize(term) for term in terms]
+    hits = sorted((position, len(needle)) for needle in needles if needle
+                  for position in _find_all(normalized, needle))
+    if not hits:
+        return normalized[:width * 2] + ('…' if len(normalized) > width * 2 else '')
+    first = hits[0][0]
+    start = max(0, first - width)
+    end = min(len(normalized), first + hits[0][1] + width)
+
+    pieces = []
+    cursor = start
+    for position, length in hits:
+        if position < cursor or position + length > end:
+            continue
+        pieces.append(normalized[cursor:position])
+        pieces.append(open_mark + normalized[position:position + length] + close_mark)
+        cursor = position + length
+    pieces.append(normalized[cursor:end])
+    return ('…' if start > 0 else '') + ''.join(pieces) + ('…' if end < len(normalized) else '')
+
+
+def _find_all(text, needle):
+    position = text.find(needle)
+    while position >= 0:
+        yield position
+        position = text.find(needle, position + len(needle))
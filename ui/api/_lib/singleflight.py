@@ -0,0 +1,100 @@
+"""同一リクエストの同時実行をまとめる（single-flight）
+
+同じキー（llm_cache.cache_key: プロバイダ・モデル・テンプレート版・正規化した会話・パラメータ）の呼び出しが
+実行中なら、後から来た呼び出しは新たにプロバイダを呼ばずに最初の呼び出しの完了を待ち、同じ結果を受け取る。
+複数のスタッフが同じセッションを開いたときや、UIの解析ボタンの二重送信でもプロバイダ呼び出しは1回になる。
+
+結果は呼び出し側で書き換えられる（process_log の追加など）ため、待っていた側には完了時点の複製を渡す。
+最初の呼び出しが例外で終わった場合は、待っていた側にも同じ例外を投げる（失敗はまとめて1回で済ませる）。
+
+環境変数:
+    LLM_COALESCE_DISABLED   "1" でまとめない
+"""
+import copy
+import os
+import threading
+
+from .telemetry import COALESCED_CALLS, register_state
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """キーごとに実行中の呼び出しを1つに保つ"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._counters = {"leaders": 0, "followers": 0}
+
+    def do(self, key, func, label=''):
+        """key の呼び出しが実行中ならその結果を待ち、なければ func() を実行する"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self._counters['leaders'] += 1
+                leader = True
+            else:
+                flight.waiters += 1
+                self._counters['followers'] += 1
+                leader = False
+
+        if not leader:
+            COALESCED_CALLS.inc(provider=label)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            result = func()
+        except BaseException as e:
+            flight.error = e
+            self._land(key, flight)
+            flight.done.set()
+            raise
+        if self._land(key, flight):
+            # 呼び出し側が書き換える前の状態を待っていた側に渡す
+            flight.result = copy.deepcopy(result)
+        flight.done.set()
+        return result
+
+    def _land(self, key, flight):
+        """実行中の一覧から外し（以降の呼び出しは新たに実行する）、待っている呼び出しがあるかを返す"""
+        with self._lock:
+            del self._flights[key]
+            return flight.waiters > 0
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._flights), **self._counters}
+
+
+_flights = SingleFlight()
+
+
+def coalescing_enabled():
+    return os.environ.get('LLM_COALESCE_DISABLED', '').lower() not in ('1', 'true', 'yes')
+
+
+def coalesce(key, func, label=''):
+    """func() を key で single-flight 実行する（無効ならそのまま呼ぶ）。label はメトリクスのプロバイダ名"""
+    if not coalescing_enabled():
+        return func()
+    return _flights.do(key, func, label)
+
+
+def get_flights():
+    return _flights
+
+
+register_state('llm_coalescing', lambda: _flights.stats() if coalescing_enabled() else {"enabled": False})
@@ -0,0 +1,699 @@
+"""セッションと解析結果のSQLite保存（custom_database_schema.sql の実装）
+
+スキーマ（SCHEMA ほか）は custom_database_schema.sql の生成元で、同じ表に session_id（各表）と
+session_date（counseling_sessions）の索引を加えたもの。WALモードで開き、1セッション分
+（または複数セッション分）の発話とAI出力を表ごとの executemany で1トランザクションにまとめて書く。
+同じ session_id を再度保存すると、そのセッションの子レコードを置き換える。
+
+comprehensive_session_analysis ビュー（7表の結合）は、セッション単位で差分更新する
+session_analysis_summary 表として実体化する。counseling_sessions と ai_* 表への書き込みごとに
+トリガーがそのセッションの1行だけを作り直すので、ダッシュボードの検索は蓄積量によらず索引で引ける。
+JSON列（stress_indicators・key_factors）は生成列（件数・先頭要素）と、要素ごとの索引表
+session_stress_indicators で絞り込めるようにする。
+
+発言は FTS5 の全文検索索引 conversation_fts（文字 bigram、_lib/search.py）にも同じトランザクションで入れ、
+search() で一致した発言（またはセッション）を bm25 の順位と抜粋付きで返す。
+
+環境変数:
+    SESSION_DB_PATH     SQLiteファイルのパス（既定 一時ディレクトリの dental_ai_sessions.sqlite3、空文字で無効）
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import uuid
+from datetime import datetime
+
+from .search import index_terms, make_snippet, match_expression, split_query
+from .transcript import Transcript, format_timestamp, speaker_role
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), 'dental_ai_sessions.sqlite3')
+
+# スキーマの定義はここだけに置き、custom_database_schema.sql は schema_sql() から生成する
+# （python ui/bench/write_schema.py。関数のデプロイにはリポジトリ直下のファイルが含まれないため）
+SCHEMA_FILE_HEADER = """-- AIカスタム分析によるデータベース設計例
+-- 元データにない情報をAIが生成してデータベースに保存
+-- ui/api/_lib/storage.py の定義から python ui/bench/write_schema.py で生成（直接編集しない）
+"""
+
+SCHEMA = """
+-- 基本セッション情報
+CREATE TABLE IF NOT EXISTS counseling_sessions (
+    session_id TEXT PRIMARY KEY,
+    patient_name TEXT,
+    doctor_name TEXT,
+    session_date DATETIME,
+    original_file_path TEXT
+);
+
+-- 元の会話データ
+CREATE TABLE IF NOT EXISTS conversation_records (
+    record_id TEXT PRIMARY KEY,
+    session_id TEXT,
+    speaker TEXT,
+    original_text TEXT,
+    timestamp_start TEXT,
+    FOREIGN KEY (session_id) REFERENCES counseling_sessions(session_id)
+);
+
+-- AIが生成する感情分析データ（元データにはない）
+CREATE TABLE IF NOT EXISTS ai_emotion_analysis (
+    analysis_id TEXT PRIMARY KEY,
+    session_id TEXT,
+    patient_anxiety_level REAL,        -- AIが推定
+    patient_trust_level REAL,          -- AIが推定
+    doctor_empathy_score REAL,         -- AIが推定
+    emotional_state TEXT,              -- AIが判断
+    communication_comfort REAL,        -- AIが評価
+    stress_indicators JSON,            -- AIが特定
+    generated_at DATETIME,
+    FOREIGN KEY (session_id) REFERENCES counseling_sessions(session_id)
+);
+
+-- AIが生成する治療評価データ（元データにはない）
+CREATE TABLE IF NOT EXISTS ai_treatment_assessment (
+    assessment_id TEXT PRIMARY KEY,
+    session_id TEXT,
+    urgency_level REAL,                -- AIが判断
+    pain_severity_estimated INTEGER,   -- AIが推定（1-10）
+    treatment_complexity TEXT,         -- AIが評価
+    patient_compliance_prediction REAL, -- AIが予測
+    treatment_success_probability REAL, -- AIが予測
+    generated_at DATETIME,
+    FOREIGN KEY (session_id) REFERENCES counseling_sessions(session_id)
+);
+
+-- AIが生成するリスク分析（元データにはない）
+CREATE TABLE IF NOT EXISTS ai_risk_analysis (
+    risk_id TEXT PRIMARY KEY,
+    session_id TEXT,
+    risk_factor TEXT,                  -- AIが特定
+    risk_probability REAL,             -- AIが評価
+    severity_level TEXT,               -- AIが判断
+    mitigation_suggestion TEXT,        -- AIが提案
+    generated_at DATETIME,
+    FOREIGN KEY (session_id) REFERENCES counseling_sessions(session_id)
+);
+
+-- AIが生成する満足度・成功予測（元データにはない）
+CREATE TABLE IF NOT EXISTS ai_satisfaction_prediction (
+    prediction_id TEXT PRIMARY KEY,
+    session_id TEXT,
+    satisfaction_score REAL,           -- AIが予測
+    success_probability REAL,          -- AIが予測
+    confidence_level REAL,             -- AIの予測信頼度
+    key_factors JSON,                  -- AIが特定した要因
+    generated_at DATETIME,
+    FOREIGN KEY (session_id) REFERENCES counseling_sessions(session_id)
+);
+
+-- AIが生成するフォローアップ提案（元データにはない）
+CREATE TABLE IF NOT EXISTS ai_followup_recommendations (
+    recommendation_id TEXT PRIMARY KEY,
+    session_id TEXT,
+    recommendation_type TEXT,          -- AIが分類
+    recommendation_text TEXT,          -- AIが生成
+    priority_level INTEGER,            -- AIが判断（1-5）
+    estimated_timeframe TEXT,          -- AIが提案
+    generated_at DATETIME,
+    FOREIGN KEY (session_id) REFERENCES counseling_sessions(session_id)
+);
+
+-- AIが生成する臨床洞察（元データにはない）
+CREATE TABLE IF NOT EXISTS ai_clinical_insights (
+    insight_id TEXT PRIMARY KEY,
+    session_id TEXT,
+    patient_education_needs JSON,      -- AIが特定
+    communication_style_preference TEXT, -- AIが分析
+    decision_making_pattern TEXT,      -- AIが判断
+    learning_preferences JSON,         -- AIが推定
+    cultural_considerations JSON,      -- AIが考慮
+    generated_at DATETIME,
+    FOREIGN KEY (session_id) REFERENCES counseling_sessions(session_id)
+);
+
+-- 検索用の索引（セッション単位の取得と日付範囲の検索）
+CREATE INDEX IF NOT EXISTS idx_counseling_sessions_session_date ON counseling_sessions(session_date);
+CREATE INDEX IF NOT EXISTS idx_conversation_records_session_id ON conversation_records(session_id);
+CREATE INDEX IF NOT EXISTS idx_ai_emotion_analysis_session_id ON ai_emotion_analysis(session_id);
+CREATE INDEX IF NOT EXISTS idx_ai_treatment_assessment_session_id ON ai_treatment_assessment(session_id);
+CREATE INDEX IF NOT EXISTS idx_ai_risk_analysis_session_id ON ai_risk_analysis(session_id);
+CREATE INDEX IF NOT EXISTS idx_ai_satisfaction_prediction_session_id ON ai_satisfaction_prediction(session_id);
+CREATE INDEX IF NOT EXISTS idx_ai_followup_recommendations_session_id ON ai_followup_recommendations(session_id);
+CREATE INDEX IF NOT EXISTS idx_ai_clinical_insights_session_id ON ai_clinical_insights(session_id);
+"""
+
+# custom_database_schema.sql のビュー（保存には使わない。集計は session_analysis_summary に実体化する）
+ANALYSIS_VIEW = """
+-- 検索・分析用のビュー
+CREATE VIEW IF NOT EXISTS comprehensive_session_analysis AS
+SELECT
+    cs.session_id,
+    cs.patient_name,
+    cs.doctor_name,
+    cs.session_date,
+    aea.patient_anxiety_level,
+    aea.patient_trust_level,
+    aea.emotional_state,
+    ata.urgency_level,
+    ata.pain_severity_estimated,
+    ata.treatment_success_probability,
+    asp.satisfaction_score,
+    COUNT(afr.recommendation_id) as total_recommendations
+FROM counseling_sessions cs
+LEFT JOIN ai_emotion_analysis aea ON cs.session_id = aea.session_id
+LEFT JOIN ai_treatment_assessment ata ON cs.session_id = ata.session_id
+LEFT JOIN ai_satisfaction_prediction asp ON cs.session_id = asp.session_id
+LEFT JOIN ai_followup_recommendations afr ON cs.session_id = afr.session_id
+GROUP BY cs.session_id;
+"""
+
+SUMMARY_SCHEMA = """
+-- comprehensive_session_analysis の実体化（ダッシュボード用、セッションごとに最新のAI出力1件ずつ）
+-- ui/api/_lib/storage.py が counseling_sessions・ai_* 表へのトリガーでセッション単位に差分更新する
+CREATE TABLE IF NOT EXISTS session_analysis_summary (
+    session_id TEXT PRIMARY KEY,
+    patient_name TEXT,
+    doctor_name TEXT,
+    session_date DATETIME,
+    patient_anxiety_level REAL,
+    patient_trust_level REAL,
+    emotional_state TEXT,
+    stress_indicators JSON,
+    urgency_level REAL,
+    pain_severity_estimated INTEGER,
+    treatment_success_probability REAL,
+    satisfaction_score REAL,
+    key_factors JSON,
+    total_recommendations INTEGER,
+    refreshed_at DATETIME,
+    stress_indicator_count INTEGER GENERATED ALWAYS AS (
+        CASE WHEN json_valid(stress_indicators) THEN json_array_length(stress_indicators) ELSE 0 END) VIRTUAL,
+    primary_stress_indicator TEXT GENERATED ALWAYS AS (
+        CASE WHEN json_valid(stress_indicators) THEN json_extract(stress_indicators, '$[0]') END) VIRTUAL,
+    key_factor_count INTEGER GENERATED ALWAYS AS (
+        CASE WHEN json_valid(key_factors) THEN json_array_length(key_factors) ELSE 0 END) VIRTUAL
+);
+
+-- stress_indicators の要素ごとの索引（「費用への不安」を含むセッションの検索用）
+CREATE TABLE IF NOT EXISTS session_stress_indicators (
+    session_id TEXT,
+    indicator TEXT,
+    PRIMARY KEY (indicator, session_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_summary_session_date ON session_analysis_summary(session_date);
+CREATE INDEX IF NOT EXISTS idx_summary_anxiety ON session_analysis_summary(patient_anxiety_level);
+CREATE INDEX IF NOT EXISTS idx_summary_satisfaction ON session_analysis_summary(satisfaction_score);
+CREATE INDEX IF NOT EXISTS idx_summary_primary_stress ON session_analysis_summary(primary_stress_indicator);
+CREATE INDEX IF NOT EXISTS idx_summary_stress_count ON session_analysis_summary(stress_indicator_count);
+CREATE INDEX IF NOT EXISTS idx_session_stress_indicators_session_id ON session_stress_indicators(session_id);
+"""
+
+# 本文を持たない contentless 表なので、削除時は索引に入れたときと同じ grams・role を渡す
+SEARCH_SCHEMA = """
+-- 発言の全文検索索引（rowid = conversation_records.rowid）
+-- grams は発言を NFKC 正規化した文字 bigram をスペースで区切った列（ui/api/_lib/search.py の index_terms）、
+-- role は話者ラベルから判定した役割。本文を持たない contentless 表で、保存処理が同じトランザクションで更新する
+CREATE VIRTUAL TABLE IF NOT EXISTS conversation_fts USING fts5(
+    grams, role, content='', tokenize='unicode61 remove_diacritics 0'
+);
+"""
+
+
+def schema_sql():
+    """custom_database_schema.sql の内容（SCHEMA・ANALYSIS_VIEW・SUMMARY_SCHEMA・SEARCH_SCHEMA の順）"""
+    return SCHEMA_FILE_HEADER + ''.join((SCHEMA, ANALYSIS_VIEW, SUMMARY_SCHEMA, SEARCH_SCHEMA))
+
+
+SEARCH_INSERT = 'INSERT INTO conversation_fts (rowid, grams, role) VALUES (?, ?, ?)'
+SEARCH_DELETE = "INSERT INTO conversation_fts (conversation_fts, rowid, grams, role) VALUES ('delete', ?, ?, ?)"
+SEARCH_BATCH = 10_000
+# 順位付けする一致発言の上限（新しい順）。bm25 は一致行ごとに計算されるため、ごく一般的な語でも
+# 応答時間が蓄積量に比例しないよう、直近の一致に限って順位を付ける
+SEARCH_CANDIDATES = 5_000
+
+
+def _search_row(speaker, text):
+    """索引に入れる (grams, role)。role は保存済みの話者ラベルだけから決める（削除時に同じ値を作り直せるように）"""
+    return index_terms(text), speaker_role(speaker or '')
+
+
+# 1セッション分の集計行を作り直す（{session} はトリガーでは NEW/OLD.session_id、直接実行では ?）
+REFRESH_SUMMARY = """
+INSERT OR REPLACE INTO session_analysis_summary (
+    session_id, patient_name, doctor_name, session_date,
+    patient_anxiety_level, patient_trust_level, emotional_state, stress_indicators,
+    urgency_level, pain_severity_estimated, treatment_success_probability,
+    satisfaction_score, key_factors, total_recommendations, refreshed_at)
+SELECT
+    cs.session_id, cs.patient_name, cs.doctor_name, cs.session_date,
+    aea.patient_anxiety_level, aea.patient_trust_level, aea.emotional_state, aea.stress_indicators,
+    ata.urgency_level, ata.pain_severity_estimated, ata.treatment_success_probability,
+    asp.satisfaction_score, asp.key_factors,
+    (SELECT COUNT(*) FROM ai_followup_recommendations afr WHERE afr.session_id = cs.session_id),
+    strftime('%Y-%m-%dT%H:%M:%fZ', 'now')
+FROM counseling_sessions cs
+LEFT JOIN ai_emotion_analysis aea ON aea.analysis_id = (
+    SELECT analysis_id FROM ai_emotion_analysis WHERE session_id = cs.session_id
+    ORDER BY generated_at DESC LIMIT 1)
+LEFT JOIN ai_treatment_assessment ata ON ata.assessment_id = (
+    SELECT assessment_id FROM ai_treatment_assessment WHERE session_id = cs.session_id
+    ORDER BY generated_at DESC LIMIT 1)
+LEFT JOIN ai_satisfaction_prediction asp ON asp.prediction_id = (
+    SELECT prediction_id FROM ai_satisfaction_prediction WHERE session_id = cs.session_id
+    ORDER BY generated_at DESC LIMIT 1)
+WHERE cs.session_id = {session}
+"""
+
+REFRESH_STRESS_INDICATORS = """
+DELETE FROM session_stress_indicators WHERE session_id = {session};
+INSERT OR IGNORE INTO session_stress_indicators (session_id, indicator)
+SELECT session_id, CAST(value AS TEXT) FROM session_analysis_summary, json_each(stress_indicators)
+WHERE session_id = {session} AND json_valid(stress_indicators) AND json_type(stress_indicators) = 'array';
+"""
+
+# 集計に使う表（これらへの書き込みで該当セッションの集計行を作り直す）
+SUMMARY_SOURCES = ('ai_emotion_analysis', 'ai_treatment_assessment', 'ai_satisfaction_prediction',
+                   'ai_followup_recommendations')
+
+
+def _summary_triggers():
+    """集計行を差分更新するトリガーの DDL"""
+    refresh = {
+        row: (REFRESH_SUMMARY.format(session=f'{row}.session_id').strip() + ';\n'
+              + REFRESH_STRESS_INDICATORS.format(session=f'{row}.session_id').strip())
+        for row in ('NEW', 'OLD')
+    }
+    statements = []
+    for table in ('counseling_sessions',) + SUMMARY_SOURCES:
+        statements.append(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_summary_insert AFTER INSERT ON {table} "
+                          f"BEGIN {refresh['NEW']} END;")
+        statements.append(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_summary_update AFTER UPDATE ON {table} "
+                          f"BEGIN {refresh['OLD']} {refresh['NEW']} END;")
+        if table != 'counseling_sessions':
+            statements.append(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_summary_delete AFTER DELETE ON {table} "
+                              f"BEGIN {refresh['OLD']} END;")
+    statements.append(
+        "CREATE TRIGGER IF NOT EXISTS trg_counseling_sessions_summary_delete AFTER DELETE ON counseling_sessions "
+        "BEGIN DELETE FROM session_analysis_summary WHERE session_id = OLD.session_id; "
+        "DELETE FROM session_stress_indicators WHERE session_id = OLD.session_id; END;")
+    return '\n'.join(statements)
+
+
+SUMMARY_COLUMNS = ('session_id', 'patient_name', 'doctor_name', 'session_date', 'patient_anxiety_level',
+                   'patient_trust_level', 'emotional_state', 'stress_indicators', 'urgency_level',
+                   'pain_severity_estimated', 'treatment_success_probability', 'satisfaction_score',
+                   'key_factors', 'total_recommendations', 'stress_indicator_count',
+                   'primary_stress_indicator', 'refreshed_at')
+
+# 子テーブル: (表名, 主キー列, analysis のキー, 1セッションに複数行か, 値の列)
+CHILD_TABLES = (
+    ('ai_emotion_analysis', 'analysis_id', 'emotion', False,
+     ('patient_anxiety_level', 'patient_trust_level', 'doctor_empathy_score', 'emotional_state',
+      'communication_comfort', 'stress_indicators')),
+    ('ai_treatment_assessment', 'assessment_id', 'treatment', False,
+     ('urgency_level', 'pain_severity_estimated', 'treatment_complexity', 'patient_compliance_prediction',
+      'treatment_success_probability')),
+    ('ai_risk_analysis', 'risk_id', 'risks', True,
+     ('risk_factor', 'risk_probability', 'severity_level', 'mitigation_suggestion')),
+    ('ai_satisfaction_prediction', 'prediction_id', 'satisfaction', False,
+     ('satisfaction_score', 'success_probability', 'confidence_level', 'key_factors')),
+    ('ai_followup_recommendations', 'recommendation_id', 'followups', True,
+     ('recommendation_type', 'recommendation_text', 'priority_level', 'estimated_timeframe')),
+    ('ai_clinical_insights', 'insight_id', 'insights', False,
+     ('patient_education_needs', 'communication_style_preference', 'decision_making_pattern',
+      'learning_preferences', 'cultural_considerations')),
+)
+JSON_COLUMNS = frozenset(('stress_indicators', 'key_factors', 'patient_education_needs',
+                          'learning_preferences', 'cultural_considerations'))
+# ルールベース品質分析が改善提案なしのときに入れる文言（提案としては保存しない）
+NO_IMPROVEMENTS = frozenset(("全体的に良好な会話",))
+SESSION_TABLES = ('conversation_records',) + tuple(table for table, *_ in CHILD_TABLES)
+
+
+def _now():
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def _column_value(column, value):
+    if column in JSON_COLUMNS and value is not None and not isinstance(value, str):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def analysis_from_pipeline(result):
+    """/api/pipeline の結果を ai_* 表の形（CHILD_TABLES のキー）に写す
+
+    品質分析は満足度・成功予測に、改善提案はフォローアップ提案に対応させる。
+    SOAP は対応する表がないため保存しない。
+    """
+    quality = (result or {}).get('quality') or {}
+    analysis = {}
+    if quality:
+        analysis['satisfaction'] = {
+            "satisfaction_score": quality.get('overall_quality'),
+            "success_probability": quality.get('success_possibility'),
+            "confidence_level": quality.get('confidence'),
+            "key_factors": quality.get('positives') or []
+        }
+        analysis['followups'] = [
+            {"recommendation_type": "communication", "recommendation_text": text, "priority_level": 3}
+            for text in quality.get('improvements') or [] if text not in NO_IMPROVEMENTS
+        ]
+    return analysis
+
+
+class SessionRows:
+    """1回の書き込みにまとめる表ごとの行"""
+
+    __slots__ = ('session_ids', 'sessions', 'records', 'search_rows', 'children')
+
+    def __init__(self):
+        self.session_ids = []
+        self.sessions = []
+        self.records = []
+        self.search_rows = []
+        self.children = {table: [] for table, *_ in CHILD_TABLES}
+
+    def add(self, session):
+        """session: {"session_id", "patient_name", "doctor_name", "session_date", "original_file_path",
+        "transcript" (Transcript) または "content"/"utterances", "analysis"}。session_id を返す"""
+        session_id = session.get('session_id') or uuid.uuid4().hex
+        generated_at = session.get('generated_at') or _now()
+        self.session_ids.append(session_id)
+        self.sessions.append((session_id, session.get('patient_name'), session.get('doctor_name'),
+                              session.get('session_date') or generated_at, session.get('original_file_path')))
+
+        transcript = session.get('transcript')
+        if transcript is None:
+            transcript = Transcript.from_text(session.get('content', ''))
+            if session.get('utterances'):
+                transcript.apply_times(session['utterances'])
+        speakers = transcript.speakers()
+        starts = transcript.starts
+        for index in range(len(transcript)):
+            start = starts[index] if starts is not None else None
+            record_id = f"{session_id}:{index:06d}"
+            text = transcript.content(index)
+            self.records.append((record_id, session_id, speakers[index], text, format_timestamp(start)))
+            self.search_rows.append(_search_row(speakers[index], text))
+
+        analysis = session.get('analysis') or {}
+        for table, _, key, many, columns in CHILD_TABLES:
+            value = analysis.get(key)
+            if not value:
+                continue
+            items = value if many else [value]
+            rows = self.children[table]
+            for index, item in enumerate(items):
+                row_id = f"{session_id}:{key}:{index:03d}" if many else f"{session_id}:{key}"
+                rows.append((row_id, session_id)
+                            + tuple(_column_value(column, item.get(column)) for column in columns)
+                            + (item.get('generated_at') or generated_at,))
+        return session_id
+
+
+class SessionStore:
+    """セッション保存用のSQLite接続（WALモード、書き込みは1トランザクションの executemany）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA foreign_keys=ON')
+        self._conn.execute('PRAGMA temp_store=MEMORY')
+        self._conn.executescript(SCHEMA)
+        has_summary = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'session_analysis_summary'").fetchone()
+        self._conn.executescript(SUMMARY_SCHEMA)
+        self._conn.executescript(_summary_triggers())
+        has_search = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversation_fts'").fetchone()
+        self._conn.executescript(SEARCH_SCHEMA)
+        if not has_summary:
+            # 集計表より前に作られたデータベースは初回だけ全件から作る
+            self.rebuild_summary()
+        if not has_search:
+            self.rebuild_search_index()
+
+    def save_session(self, session):
+        """1セッションを保存して session_id を返す"""
+        return self.save_sessions([session])[0]
+
+    def save_sessions(self, sessions):
+        """複数セッションを1トランザクションで保存し、session_id のリストを返す"""
+        rows = SessionRows()
+        for session in sessions:
+            rows.add(session)
+        self.write(rows)
+        return rows.session_ids
+
+    def write(self, rows):
+        if not rows.session_ids:
+            return
+        session_keys = [(session_id,) for session_id in rows.session_ids]
+        with self._lock:
+            conn = self._conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # 再保存時は子レコードを置き換える（session_id の索引で引く）。検索索引からは先に外す
+                old_records = []
+                for key in session_keys:
+                    old_records.extend(conn.execute(
+                        'SELECT rowid, speaker, original_text FROM conversation_records WHERE session_id = ?', key))
+                if old_records:
+                    conn.executemany(SEARCH_DELETE, [(rowid,) + _search_row(speaker, text)
+                                                     for rowid, speaker, text in old_records])
+                for table in SESSION_TABLES:
+                    conn.executemany(f'DELETE FROM {table} WHERE session_id = ?', session_keys)
+                conn.executemany(
+                    'INSERT OR REPLACE INTO counseling_sessions '
+                    '(session_id, patient_name, doctor_name, session_date, original_file_path) '
+                    'VALUES (?, ?, ?, ?, ?)', rows.sessions)
+                # 検索索引と対応させるため rowid を明示する（書き込みロック中なので max(rowid) の続きで衝突しない）
+                base = conn.execute('SELECT coalesce(max(rowid), 0) FROM conversation_records').fetchone()[0]
+                conn.executemany(
+                    'INSERT INTO conversation_records '
+                    '(rowid, record_id, session_id, speaker, original_text, timestamp_start) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(base + n,) + record for n, record in enumerate(rows.records, 1)])
+                conn.executemany(SEARCH_INSERT, [(base + n,) + search_row
+                                                 for n, search_row in enumerate(rows.search_rows, 1)])
+                for table, id_column, _, _, columns in CHILD_TABLES:
+                    if rows.children[table]:
+                        names = (id_column, 'session_id') + columns + ('generated_at',)
+                        conn.executemany(
+                            f'INSERT INTO {table} ({", ".join(names)}) '
+                            f'VALUES ({", ".join("?" * len(names))})', rows.children[table])
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def get_session(self, session_id):
+        """保存済みのセッション（発話とAI出力を含む）。なければ None"""
+        with self._lock:
+            conn = self._conn
+            row = conn.execute(
+                'SELECT session_id, patient_name, doctor_name, session_date, original_file_path '
+                'FROM counseling_sessions WHERE session_id = ?', (session_id,)).fetchone()
+            if row is None:
+                return None
+            session = dict(zip(('session_id', 'patient_name', 'doctor_name', 'session_date',
+                                'original_file_path'), row))
+            session['utterances'] = [
+                {"speaker": speaker, "text": text, "start": start}
+                for speaker, text, start in conn.execute(
+                    'SELECT speaker, original_text, timestamp_start FROM conversation_records '
+                    'WHERE session_id = ? ORDER BY record_id', (session_id,))
+            ]
+            analysis = {}
+            for table, id_column, key, many, columns in CHILD_TABLES:
+                items = []
+                for values in conn.execute(
+                        f'SELECT {", ".join(columns)}, generated_at FROM {table} '
+                        f'WHERE session_id = ? ORDER BY {id_column}', (session_id,)):
+                    item = dict(zip(columns + ('generated_at',), values))
+                    for column in JSON_COLUMNS.intersection(columns):
+                        if isinstance(item[column], str):
+                            item[column] = json.loads(item[column])
+                    items.append(item)
+                if items:
+                    analysis[key] = items if many else items[0]
+            session['analysis'] = analysis
+            return session
+
+    def list_sessions(self, since=None, until=None, limit=100):
+        """session_date の新しい順（session_date の索引で範囲検索）"""
+        clauses, params = [], []
+        if since:
+            clauses.append('session_date >= ?')
+            params.append(since)
+        if until:
+            clauses.append('session_date < ?')
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ''
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT session_id, patient_name, doctor_name, session_date FROM counseling_sessions '
+                f'{where}ORDER BY session_date DESC LIMIT ?', params + [int(limit)]).fetchall()
+        return [dict(zip(('session_id', 'patient_name', 'doctor_name', 'session_date'), row)) for row in rows]
+
+    def refresh_summary(self, session_ids):
+        """指定セッションの集計行を作り直す（通常はトリガーが行うので、外部で表を直接変えた場合用）"""
+        keys = [(session_id,) for session_id in session_ids]
+        with self._lock:
+            conn = self._conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(REFRESH_SUMMARY.format(session='?'), keys)
+                for statement in REFRESH_STRESS_INDICATORS.format(session='?').split(';'):
+                    if statement.strip():
+                        conn.executemany(statement, keys)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def rebuild_summary(self):
+        """集計表を全セッションから作り直す"""
+        with self._lock:
+            session_ids = [row[0] for row in self._conn.execute('SELECT session_id FROM counseling_sessions')]
+        self.refresh_summary(session_ids)
+
+    def summary(self, since=None, until=None, stress_indicator=None, min_anxiety=None,
+                max_satisfaction=None, limit=100):
+        """実体化した comprehensive_session_analysis を索引付きの列で絞り込む（session_date の新しい順）
+
+        stress_indicator を指定すると stress_indicators にその要素を含むセッションに限る。
+        """
+        clauses, params = [], []
+        source = 'session_analysis_summary s'
+        if stress_indicator:
+            source += ' JOIN session_stress_indicators si ON si.session_id = s.session_id AND si.indicator = ?'
+            params.append(stress_indicator)
+        if since:
+            clauses.append('s.session_date >= ?')
+            params.append(since)
+        if until:
+            clauses.append('s.session_date < ?')
+            params.append(until)
+        if min_anxiety is not None:
+            clauses.append('s.patient_anxiety_level >= ?')
+            params.append(float(min_anxiety))
+        if max_satisfaction is not None:
+            clauses.append('s.satisfaction_score <= ?')
+            params.append(float(max_satisfaction))
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ''
+        columns = ', '.join(f's.{column}' for column in SUMMARY_COLUMNS)
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT {columns} FROM {source} {where}ORDER BY s.session_date DESC LIMIT ?',
+                params + [int(limit)]).fetchall()
+        results = []
+        for row in rows:
+            item = dict(zip(SUMMARY_COLUMNS, row))
+            for column in ('stress_indicators', 'key_factors'):
+                if isinstance(item[column], str):
+                    try:
+                        item[column] = json.loads(item[column])
+                    except ValueError:
+                        pass
+            results.append(item)
+        return results
+
+    def rebuild_search_index(self):
+        """全文検索索引を conversation_records から作り直す（外部で発言を直接書き換えた場合用）"""
+        with self._lock:
+            conn = self._conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute("INSERT INTO conversation_fts (conversation_fts) VALUES ('delete-all')")
+                last_rowid = -1
+                while True:
+                    batch = conn.execute(
+                        'SELECT rowid, speaker, original_text FROM conversation_records '
+                        'WHERE rowid > ? ORDER BY rowid LIMIT ?', (last_rowid, SEARCH_BATCH)).fetchall()
+                    if not batch:
+                        break
+                    conn.executemany(SEARCH_INSERT, [(rowid,) + _search_row(speaker, text) for rowid, speaker, text in batch])
+                    last_rowid = batch[-1][0]
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def search(self, query, mode='all', role=None, since=None, until=None, by='utterance', limit=20):
+        """発言の全文検索（bm25 の順位順）
+
+        query は空白区切りの語（mode='all' はすべて、'any' はいずれかを含む発言）。
+        role（patient/doctor/staff/unknown）で話者の役割、since/until で session_date を絞り込む。
+        by='session' ではセッションごとにまとめ、一致した発言数と最も順位の高い発言の抜粋を返す。
+        一致が SEARCH_CANDIDATES 件を超える語は、絞り込み後の新しい方からその件数の中で順位を付ける。
+        """
+        if mode not in ('all', 'any'):
+            raise ValueError(f"invalid mode: {mode}")
+        if by not in ('utterance', 'session'):
+            raise ValueError(f"invalid by: {by}")
+        terms = split_query(query)
+        clauses, params = ['conversation_fts MATCH ?'], [match_expression(terms, mode, role)]
+        if since:
+            clauses.append('cs.session_date >= ?')
+            params.append(since)
+        if until:
+            clauses.append('cs.session_date < ?')
+            params.append(until)
+        columns = ('session_id', 'patient_name', 'doctor_name', 'session_date', 'record_id', 'speaker',
+                   'text', 'timestamp_start', 'score')
+        if by == 'session':
+            # 集約関数 min() と同じ行の値が素の列に入る（SQLite の仕様）ので、最も順位の高い発言が取れる
+            select = '*, min(score) AS best, count(*) AS hits'
+            tail = 'GROUP BY session_id ORDER BY best'
+            columns += ('best', 'hits')
+        else:
+            select = '*'
+            tail = 'ORDER BY score'
+        with self._lock:
+            rows = self._conn.execute(
+                # bm25() は集約の中で使えないので、一致行と順位を先に実体化してから集約・並べ替えする
+                'WITH f AS MATERIALIZED ('
+                'SELECT cr.session_id, cs.patient_name, cs.doctor_name, cs.session_date, cr.record_id, cr.speaker, '
+                'cr.original_text, cr.timestamp_start, bm25(conversation_fts, 1.0, 0.0) AS score '
+                'FROM conversation_fts '
+                'JOIN conversation_records cr ON cr.rowid = conversation_fts.rowid '
+                'JOIN counseling_sessions cs ON cs.session_id = cr.session_id '
+                f'WHERE {" AND ".join(clauses)} ORDER BY conversation_fts.rowid DESC LIMIT ?) '
+                f'SELECT {select} FROM f {tail} LIMIT ?',
+                params + [SEARCH_CANDIDATES, int(limit)]).fetchall()
+        results = []
+        for row in rows:
+            item = dict(zip(columns, row))
+            item['snippet'] = make_snippet(item.pop('text') or '', terms)
+            item['score'] = round(-item.pop('best', item['score']), 4)
+            results.append(item)
+        return results
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_store():
+    """環境変数の設定でプロセス共有の SessionStore を遅延生成する（無効なら None）"""
+    global _default_store
+    if _default_store is None:
+        path = os.environ.get('SESSION_DB_PATH', DEFAULT_PATH)
+        if not path:
+            return None
+        with _default_lock:
+            if _default_store is None:
+                _default_store = SessionStore(path)
+    return _default_store
@@ -0,0 +1,155 @@
+"""LLMのストリーミング応答を Server-Sent Events で中継する
+
+モデルが出力中のJSONを少しずつ読み、トップレベルの各フィールド（SOAPの S/O/A/P や各スコア）が
+閉じた時点で1つのイベントとして送る。応答全体の完了を待たずに最初の欄を表示できる。
+"""
+import json
+
+from .router import Cancelled, cancelled
+
+_KEY, _KEY_STRING, _COLON, _VALUE_WAIT, _VALUE, _AFTER_VALUE = range(6)
+
+
+class JSONFieldStream:
+    """JSONオブジェクトの断片を feed() で受け取り、完成したトップレベルのフィールドを返す
+
+    最初の '{' より前（```json などの前置き）と、最後の '}' より後ろは読み飛ばす。
+    値として読めなかったフィールドは返さない（最終結果は全文をパースして作り直す）。
+    """
+
+    def __init__(self):
+        self._text = ''
+        self._pos = 0
+        self._depth = 0
+        self._state = _KEY
+        self._in_string = False
+        self._escape = False
+        self._key = None
+        self._key_start = 0
+        self._value_start = 0
+        self._value_kind = None
+        self.done = False
+
+    @property
+    def text(self):
+        return self._text
+
+    def extend(self, chunk):
+        """解析せずに本文だけを追加する（続きは次の feed() でまとめて読む）"""
+        self._text += chunk
+
+    def _field(self, end, fields):
+        try:
+            fields.append((self._key, json.loads(self._text[self._value_start:end])))
+        except ValueError:
+            pass
+
+    def feed(self, chunk):
+        self._text += chunk
+        text = self._text
+        fields = []
+        i = self._pos
+        while i < len(text) and not self.done:
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._state == _KEY_STRING:
+                        try:
+                            self._key = json.loads(text[self._key_start:i + 1])
+                        except ValueError:
+                            self._key = text[self._key_start + 1:i]
+                        self._state = _COLON
+                    elif self._depth == 1 and self._state == _VALUE and self._value_kind == 'string':
+                        self._field(i + 1, fields)
+                        self._state = _AFTER_VALUE
+            elif self._depth == 0:
+                if c == '{':
+                    self._depth = 1
+                    self._state = _KEY
+            elif c == '"':
+                self._in_string = True
+                if self._depth == 1 and self._state == _KEY:
+                    self._key_start = i
+                    self._state = _KEY_STRING
+                elif self._depth == 1 and self._state == _VALUE_WAIT:
+                    self._value_start = i
+                    self._value_kind = 'string'
+                    self._state = _VALUE
+            elif c in '{[':
+                if self._depth == 1 and self._state == _VALUE_WAIT:
+                    self._value_start = i
+                    self._value_kind = 'container'
+                    self._state = _VALUE
+                self._depth += 1
+            elif c in '}]':
+                self._depth -= 1
+                if self._depth == 1 and self._state == _VALUE and self._value_kind == 'container':
+                    self._field(i + 1, fields)
+                    self._state = _AFTER_VALUE
+                elif self._depth == 0:
+                    if self._state == _VALUE and self._value_kind == 'scalar':
+                        self._field(i, fields)
+                    self.done = True
+            elif self._depth == 1:
+                if c == ':' and self._state == _COLON:
+                    self._state = _VALUE_WAIT
+                elif c == ',':
+                    if self._state == _VALUE and self._value_kind == 'scalar':
+                        self._field(i, fields)
+                    self._state = _KEY
+                elif not c.isspace() and self._state == _VALUE_WAIT:
+                    self._value_start = i
+                    self._value_kind = 'scalar'
+                    self._state = _VALUE
+            i += 1
+        self._pos = i
+        return fields
+
+
+def iter_completion_text(client, request):
+    """chat.completions.create(stream=True) の本文の差分を順に返す
+
+    ヘッジ/レース呼び出しで負けた場合（router.cancelled()）は接続を閉じて生成を打ち切る。
+    """
+    stream = client.chat.completions.create(stream=True, **request)
+    for event in stream:
+        if cancelled():
+            close = getattr(stream, 'close', None)
+            if close is not None:
+                close()
+            raise Cancelled()
+        if event.choices:
+            delta = event.choices[0].delta.content
+            if delta:
+                yield delta
+
+
+def stream_fields(deltas, parser=None):
+    """本文の差分から ('field', {"key", "value"}) を yield し、最後に全文を返すジェネレーター
+
+    parser に llm_json.TolerantJSONDecoder を渡すと、受信中に集めたフィールドを最後のデコードに使える。
+    """
+    if parser is None:
+        parser = JSONFieldStream()
+    for delta in deltas:
+        for key, value in parser.feed(delta):
+            yield 'field', {"key": key, "value": value}
+    return parser.text
+
+
+def format_sse(event, data):
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n".encode('utf-8')
+
+
+def wants_stream(headers, data):
+    """SSEでの応答を求めているか（"stream": true または Accept: text/event-stream）"""
+    if isinstance(data, dict) and data.get('stream'):
+        return True
+    accept = (headers.get('Accept') or '') if headers is not None else ''
+    return 'text/event-stream' in accept.lower()
@@ -0,0 +1,383 @@
+"""API共通の計測（Prometheus形式のメトリクスとスパンのトレース）
+
+メトリクスはプロセス内に保持する（インスタンスごとの値）。Vercel では api/*.py ごとに別の関数（別プロセス）なので、
+/api/metrics が返すのは /api/metrics 自身の値だけになる。instrument_handler を付けたハンドラーは
+GET ?metrics=1 でその関数のメトリクスをテキスト形式で返す（例: /api/quality?metrics=1）。
+?metrics=state は register_state で登録されたプロセス内の状態（ブレーカー・キャッシュ・カスケードなど）をJSONで返す。
+状態は内部の情報を含むので、METRICS_STATE_TOKEN を設定し、同じ値を X-Metrics-Token ヘッダーで送ったときだけ返す
+（未設定なら 404、不一致なら 403。CORS は許可しない）。
+スパンは parse → prompt_build → provider_call → post_process のように入れ子で記録し、TRACE_FILE を設定したときだけ
+終了したものから1行1スパンのJSONで追記する。書き込みはバッファし、リクエスト（最上位のスパン）の終了ごとに
+書き出す。TRACE_FILE_MAX_BYTES を超えたら TRACE_FILE.1 に移して新しいファイルに書く（世代は1つだけ残す）。
+
+環境変数:
+    METRICS_STATE_TOKEN     ?metrics=state に必要なトークン（既定 なし = ?metrics=state は無効）
+    TRACE_FILE              トレースの出力先（既定 なし = 出力しない）
+    TRACE_FILE_MAX_BYTES    トレースファイルを切り替えるサイズ（既定 50000000）
+"""
+import contextvars
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_TRACE_FILE_MAX_BYTES = 50_000_000
+METRICS_TOKEN_HEADER = 'X-Metrics-Token'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels.get(name, '')) for name in self.labels), 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_number(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # ラベル値 -> [バケットごとの件数..., 合計, 件数]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in items:
+            for bound, count in zip(self.buckets + (float('inf'),), state[:len(self.buckets)] + [state[-1]]):
+                labels = _format_labels(self.labels, key, [('le', _format_number(bound))])
+                lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {_format_number(round(state[-2], 6))}')
+            lines.append(f'{self.name}_count{labels} {state[-1]}')
+        return lines
+
+
+REQUESTS = Counter('dental_api_requests_total', 'APIリクエスト数', ('endpoint', 'method', 'status'))
+REQUEST_LATENCY = Histogram('dental_api_request_duration_seconds', 'APIリクエストの処理時間', ('endpoint',))
+PROVIDER_CALLS = Counter('dental_llm_calls_total', 'LLMプロバイダ呼び出し数', ('provider', 'outcome'))
+PROVIDER_LATENCY = Histogram('dental_llm_call_duration_seconds', 'LLMプロバイダ呼び出しの所要時間', ('provider',))
+TOKENS = Counter('dental_llm_tokens_total', 'LLMの入出力トークン数', ('provider', 'direction'))
+FALLBACKS = Counter('dental_fallback_total', 'ルールベース解析へのフォールバック数', ('endpoint', 'reason'))
+JSON_PARSE_FAILURES = Counter('dental_json_parse_failures_total', 'LLM応答のJSONパース失敗数', ('provider',))
+SPAN_LATENCY = Histogram('dental_span_duration_seconds', 'スパン（解析の各段階）の所要時間', ('span',))
+COMPACTION_RATIO = Histogram('dental_prompt_compaction_ratio', 'プロンプト圧縮後と圧縮前の推定トークン数の比',
+                             ('stage',), buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+COMPACTION_TOKENS = Counter('dental_prompt_compaction_tokens_total', 'プロンプト圧縮前後の推定トークン数',
+                            ('stage', 'kind'))
+ROUTER_ATTEMPTS = Counter('dental_router_attempts_total', 'ヘッジ/レース呼び出しの各プロバイダへの送信と結果',
+                          ('stage', 'provider', 'outcome'))
+ROUTER_HEDGES = Counter('dental_router_hedges_total', '待ち時間を超えて追加で送ったヘッジ呼び出し数',
+                        ('stage', 'provider'))
+BREAKER_TRANSITIONS = Counter('dental_circuit_breaker_transitions_total', 'サーキットブレーカーの状態遷移数',
+                              ('provider', 'model', 'state'))
+BREAKER_REJECTIONS = Counter('dental_circuit_breaker_rejections_total', 'ブレーカーが open のため呼び出さなかった数',
+                             ('provider', 'model'))
+JSON_DECODES = Counter('dental_llm_json_decodes_total',
+                       'LLM応答JSONのデコード結果（clean / extracted / repaired / partial / failed）',
+                       ('provider', 'task', 'outcome'))
+COALESCED_CALLS = Counter('dental_llm_coalesced_total', '実行中の同一呼び出しの結果を待って共有した呼び出し数',
+                          ('provider',))
+CASCADE_DECISIONS = Counter('dental_quality_cascade_total',
+                            '品質分析のカスケード判定（ローカルモデルで返した / LLMへ回した）と理由',
+                            ('outcome', 'reason'))
+CASCADE_ERROR = Histogram('dental_quality_cascade_abs_error',
+                          'LLMへ回した会話でのローカルモデルとLLMのスコアの差（絶対値）', ('score',), buckets=(0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.75, 1.0))
+LIVE_REFRESHES = Counter('dental_live_session_refreshes_total',
+                         'ライブセッションの LLM 更新の結果（refreshed / error / debounced など）', ('outcome',))
+LIVE_UTTERANCES = Counter('dental_live_session_utterances_total', 'ライブセッションに追記された発話数')
+
+METRICS = (REQUESTS, REQUEST_LATENCY, PROVIDER_CALLS, PROVIDER_LATENCY, TOKENS, FALLBACKS,
+           JSON_PARSE_FAILURES, SPAN_LATENCY, COMPACTION_RATIO, COMPACTION_TOKENS, ROUTER_ATTEMPTS,
+           ROUTER_HEDGES, BREAKER_TRANSITIONS, BREAKER_REJECTIONS, COALESCED_CALLS, JSON_DECODES,
+           CASCADE_DECISIONS, CASCADE_ERROR, LIVE_REFRESHES, LIVE_UTTERANCES)
+
+
+_states = {}
+
+
+def render_metrics():
+    """Prometheus テキスト形式（version 0.0.4）"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def register_state(name, snapshot):
+    """?metrics=state で返すプロセス内の状態を登録する（snapshot() は外部通信しないこと）"""
+    _states[name] = snapshot
+
+
+def render_state():
+    """登録された状態。その関数が import したモジュールの分だけが並ぶ"""
+    return {name: snapshot() for name, snapshot in sorted(_states.items())}
+
+
+def record_fallback(endpoint, reason):
+    FALLBACKS.inc(endpoint=endpoint, reason=reason)
+
+
+def record_compaction(stage, stats):
+    """プロンプト圧縮の統計（_lib/compaction.py）を記録する"""
+    COMPACTION_RATIO.observe(stats["ratio"], stage=stage)
+    COMPACTION_TOKENS.inc(stats["original_tokens"], stage=stage, kind='original')
+    COMPACTION_TOKENS.inc(stats["compacted_tokens"], stage=stage, kind='compacted')
+
+
+def record_usage(provider, response):
+    """プロバイダ応答の usage（OpenAI: usage, Gemini: usage_metadata）からトークン数を加算する"""
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        tokens_in = getattr(usage, 'prompt_tokens', None)
+        tokens_out = getattr(usage, 'completion_tokens', None)
+    else:
+        usage = getattr(response, 'usage_metadata', None)
+        tokens_in = getattr(usage, 'prompt_token_count', None)
+        tokens_out = getattr(usage, 'candidates_token_count', None)
+    if isinstance(tokens_in, int):
+        TOKENS.inc(tokens_in, provider=provider, direction='in')
+    if isinstance(tokens_out, int):
+        TOKENS.inc(tokens_out, provider=provider, direction='out')
+
+
+class _TraceWriter:
+    """終了したスパンを1行ずつ追記する（書けなくなったら以降は書かない）
+
+    flush=True の行（最上位のスパン）で書き出し、max_bytes を超えたら path.1 に移して書き直す。
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_TRACE_FILE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._file = None
+        self._size = 0
+        self._lock = threading.Lock()
+        self._failed = False
+
+    def write(self, record, flush=False):
+        if not self.path or self._failed:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._open()
+                elif self.max_bytes > 0 and self._size >= self.max_bytes:
+                    self._file.close()
+                    os.replace(self.path, self.path + '.1')
+                    self._open()
+                self._file.write(line)
+                self._size += len(line.encode('utf-8'))
+                if flush:
+                    self._file.flush()
+            except OSError as e:
+                print(f"Trace file unavailable: {e}")
+                self._failed = True
+
+    def _open(self):
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._size = self._file.tell()
+
+
+_writer = _TraceWriter(os.environ.get('TRACE_FILE', ''),
+                       int(os.environ.get('TRACE_FILE_MAX_BYTES', DEFAULT_TRACE_FILE_MAX_BYTES)))
+_current_span = contextvars.ContextVar('dental_current_span', default=None)
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attributes', 'started', 'start_time')
+
+    def __init__(self, name, parent, attributes):
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.name = name
+        self.attributes = attributes
+        self.start_time = time.time()
+        self.started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+@contextmanager
+def span(name, **attributes):
+    """入れ子のスパン。終了時に所要時間をヒストグラムとトレースファイルに記録する
+
+    スレッドプールに渡す処理は contextvars.copy_context().run 経由で呼ぶと親子関係が引き継がれる。
+    """
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    status = 'ok'
+    try:
+        yield current
+    except BaseException as e:
+        status = 'error'
+        current.attributes['error'] = str(e)[:200]
+        raise
+    finally:
+        _current_span.reset(token)
+        duration = time.perf_counter() - current.started
+        SPAN_LATENCY.observe(duration, span=name)
+        _writer.write({
+            "trace_id": current.trace_id,
+            "span_id": current.span_id,
+            "parent_id": current.parent_id,
+            "name": name,
+            "start": current.start_time,
+            "duration_ms": round(duration * 1000, 3),
+            "status": status,
+            "attributes": current.attributes
+        }, flush=current.parent_id is None)
+
+
+def submit_in_context(executor, func, *args):
+    """現在のスパンを親として引き継いだまま executor で func(*args) を実行する"""
+    return executor.submit(contextvars.copy_context().run, func, *args)
+
+
+class Cancelled(Exception):
+    """ヘッジ/レース呼び出しで他のプロバイダの結果が採用されたため打ち切った（_lib/router.py）"""
+
+
+def observe_provider_call(provider, func):
+    """func()（プロバイダ呼び出し）を provider_call スパンで包み、所要時間と成否を記録する"""
+    def observed():
+        with span('provider_call', provider=provider):
+            started = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = func()
+                outcome = 'ok'
+                return result
+            except Cancelled:
+                outcome = 'cancelled'
+                raise
+            finally:
+                PROVIDER_CALLS.inc(provider=provider, outcome=outcome)
+                PROVIDER_LATENCY.observe(time.perf_counter() - started, provider=provider)
+    return observed
+
+
+def instrument_handler(endpoint):
+    """handler クラスの do_GET / do_POST をリクエストのスパン・件数・処理時間の記録で包むデコレーター
+
+    GET ?metrics=1 にはこの関数（プロセス）のメトリクスを、?metrics=state には状態を返す。GET のないハンドラーにも足す。
+    """
+    def decorate(cls):
+        original_send_response = cls.send_response
+
+        def send_response(self, code, message=None):
+            # 途中でエラー応答に切り替わった場合は最後に送ったステータスを記録する
+            self._telemetry_status = code
+            original_send_response(self, code, message)
+        cls.send_response = send_response
+
+        for method_name in ('do_GET', 'do_POST'):
+            method = cls.__dict__.get(method_name)
+            if method is not None:
+                setattr(cls, method_name, _instrument_method(endpoint, method_name[3:], method))
+        cls.do_GET = _serve_metrics(cls.__dict__.get('do_GET'))
+        return cls
+    return decorate
+
+
+def _serve_metrics(method):
+    """?metrics= 付きの GET はメトリクスか状態を返し、それ以外は元の do_GET に渡す（なければ 501）"""
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        if 'metrics' not in query:
+            if method is None:
+                self.send_error(501, "Unsupported method ('GET')")
+                return
+            return method(self)
+        if query['metrics'][0] == 'state':
+            token = os.environ.get('METRICS_STATE_TOKEN')
+            if not token:
+                self.send_error(404, "?metrics=state is disabled (set METRICS_STATE_TOKEN)")
+                return
+            if not hmac.compare_digest(self.headers.get(METRICS_TOKEN_HEADER, '').encode(), token.encode()):
+                self.send_error(403, f"?metrics=state requires a valid {METRICS_TOKEN_HEADER} header")
+                return
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            body = json.dumps(render_state(), ensure_ascii=False, default=str).encode('utf-8')
+        else:
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            body = render_metrics().encode('utf-8')
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+    return do_GET
+
+
+def _instrument_method(endpoint, http_method, method):
+    def instrumented(self):
+        started = time.perf_counter()
+        self._telemetry_status = None
+        with span('request', endpoint=endpoint, method=http_method) as current:
+            try:
+                return method(self)
+            finally:
+                status = self._telemetry_status or 500
+                current.set(status=status)
+                REQUESTS.inc(endpoint=endpoint, method=http_method, status=status)
+                REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+    instrumented.__name__ = method.__name__
+    instrumented.__doc__ = method.__doc__
+    return instrumented
@@ -0,0 +1,593 @@
+"""会話データの共通表現（発話の列）と形式ごとの読み込み
+
+Plaud TXT / Notta SRT・CSV / XLSX を同じ Transcript に読み込み、以降の解析はこれを共有する。
+発話は行・話者・役割・開始/終了秒の並列配列で持ち、Utterance はその i 番目を参照する __slots__ のビュー。
+行分割と話者ラベルの解釈は1回だけ行い、時刻を使う特徴量も再パースせずに求められる。
+"""
+import csv
+import io
+import os
+import re
+
+
+PATIENT = 'patient'
+DOCTOR = 'doctor'
+STAFF = 'staff'
+UNKNOWN = 'unknown'
+
+# 話者ラベルから役割を決める（上から順に判定。「歯科衛生士」を医師と誤らないようスタッフを先に見る）
+ROLE_LABELS = (
+    (STAFF, ('衛生士', '受付', 'スタッフ', '助手', 'hygienist', 'dh', 'staff')),
+    (PATIENT, ('患者', 'patient')),
+    (DOCTOR, ('医師', '歯科医', '先生', '院長', 'doctor', 'dr.', 'dr')),
+)
+
+
+def _role_pattern(markers):
+    """役割のマーカーのどれかに一致する正規表現。英字のマーカーは単語として一致したときだけ数える
+    （"Andrew" の dr、"Sidharth" の dh を拾わない）"""
+    words = '|'.join(re.escape(marker) for marker in markers if marker.isascii())
+    others = [re.escape(marker) for marker in markers if not marker.isascii()]
+    return re.compile('|'.join(others + [rf'(?<![a-z])(?:{words})(?![a-z])']))
+
+
+ROLE_PATTERNS = tuple((role, _role_pattern(markers)) for role, markers in ROLE_LABELS)
+FORMATS = ('txt', 'srt', 'csv', 'xlsx')
+MAX_LABEL_CHARS = 32
+
+# 話者ラベルには数字以外の文字が必要（"10:30 痛みがあります" の 10 はラベルではない）
+_LABEL_CHARACTER = re.compile(r'[^\d\s]')
+# 本文全体の正規表現で話者ラベルの候補・行を探すときに並べるコロンより前の文字列の上限（超えたら行ごとに解釈する）
+ROLE_LINES_MAX_LABELS = 64
+# role_lines が1回の正規表現で振り分けるラベルを集める本文の先頭の文字数（以降に初めて現れたラベルは残りの行で拾う）
+LABEL_SAMPLE_CHARS = 4096
+_SRT_TIMING = re.compile(r'^\s*(\S+)\s*-->\s*(\S+)')
+_SRT_BLOCK_SEPARATOR = re.compile(r'\r?\n\s*\r?\n')
+
+
+def speaker_role(speaker):
+    """話者ラベルの役割（patient / doctor / staff / unknown）。"Speaker 1" などは unknown"""
+    if not speaker:
+        return UNKNOWN
+    label = speaker.lower()
+    for role, pattern in ROLE_PATTERNS:
+        if pattern.search(label):
+            return role
+    return UNKNOWN
+
+
+def parse_timestamp(value):
+    """"HH:MM:SS"・"HH:MM:SS,mmm"・"MM:SS"・秒数の文字列を秒に変換する（解釈できなければ None）"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    parts = value.strip().replace(',', '.').split(':')
+    if len(parts) > 3:
+        return None
+    seconds = 0.0
+    try:
+        for part in parts:
+            seconds = seconds * 60 + float(part)
+    except ValueError:
+        return None
+    return seconds
+
+
+def format_timestamp(seconds):
+    """秒を "HH:MM:SS.mmm" にする（None は None）"""
+    if seconds is None:
+        return None
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3_600_000)
+    minutes, millis = divmod(millis, 60_000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}.{millis:03d}"
+
+
+def _excel_time(value):
+    """XLSXの時刻セル。書式なしの数値は日の小数（Excelの時刻シリアル値）として秒に直す"""
+    seconds = parse_timestamp(value)
+    if seconds is not None and ':' not in value and seconds < 1:
+        return seconds * 86400
+    return seconds
+
+
+class Utterance:
+    """Transcript の i 番目の発話を参照する軽いビュー（値は Transcript の並列配列にある）"""
+
+    __slots__ = ('transcript', 'index')
+
+    def __init__(self, transcript, index):
+        self.transcript = transcript
+        self.index = index
+
+    @property
+    def speaker(self):
+        return self.transcript.speakers()[self.index]
+
+    @property
+    def role(self):
+        return self.transcript.roles()[self.index]
+
+    @property
+    def start(self):
+        starts = self.transcript.starts
+        return starts[self.index] if starts is not None else None
+
+    @property
+    def end(self):
+        ends = self.transcript.ends
+        return ends[self.index] if ends is not None else None
+
+    @property
+    def line(self):
+        """元の1行（話者ラベルを含む）"""
+        return self.transcript.lines()[self.index]
+
+    @property
+    def text(self):
+        """話者ラベルを除いた発言"""
+        return self.transcript.content(self.index)
+
+    @property
+    def offset(self):
+        """Transcript.text 内での行の開始位置"""
+        return self.transcript.offsets()[self.index]
+
+    @property
+    def duration(self):
+        start, end = self.start, self.end
+        if start is None or end is None:
+            return None
+        return max(0.0, end - start)
+
+    def to_dict(self, include_text=True):
+        record = {"speaker": self.speaker, "role": self.role, "start": self.start, "end": self.end}
+        if include_text:
+            record["text"] = self.text
+        return record
+
+
+class Transcript:
+    """発話の並列配列（行・話者・役割・開始/終了秒）と、その行を改行で連結した本文
+
+    行の分割・話者ラベルの解釈・行の開始位置は最初に参照されたときに1回だけ求める。役割は異なる話者ラベルごとに
+    1回だけ決め（speaker_roles）、本文から読み込んだ Transcript の role_lines は行ごとに解釈せず本文全体の正規表現で選ぶ。
+    """
+
+    __slots__ = ('text', 'source', 'starts', 'ends', 'role_inference', '_lines', '_offsets', '_speakers',
+                 '_label_ends', '_label_roles', '_roles', '_prefixes', '_speaker_roles')
+
+    def __init__(self, text, lines, source='text', speakers=None, label_ends=None, starts=None, ends=None):
+        self.text = text
+        self.source = source
+        self.starts = starts
+        self.ends = ends
+        self.role_inference = None
+        self._lines = lines
+        self._offsets = None
+        self._speakers = speakers
+        self._label_ends = label_ends
+        self._label_roles = None
+        self._roles = None
+        self._prefixes = None
+        self._speaker_roles = None
+
+    def __len__(self):
+        return len(self.lines())
+
+    def __iter__(self):
+        return (Utterance(self, index) for index in range(len(self.lines())))
+
+    def __getitem__(self, index):
+        if not -len(self.lines()) <= index < len(self.lines()):
+            raise IndexError(index)
+        return Utterance(self, index % len(self.lines()))
+
+    # --- 読み込み ------------------------------------------------------------------
+
+    @classmethod
+    def from_text(cls, text, source='text'):
+        """"話者: 発言" 形式の会話テキスト（Plaud TXT など）。text は複製せずそのまま本文にする
+
+        空行は発話に数えない。最初のコロン（: または ：）より前が短ければ話者ラベルとみなす。
+        """
+        return cls(text or '', None, source)
+
+    @classmethod
+    def from_records(cls, records, source='records'):
+        """(話者, 発言, 開始秒, 終了秒) の列から本文を組み立てる（話者が空なら発言だけの行）"""
+        lines, speakers, label_ends, starts, ends = [], [], [], [], []
+        for speaker, text, start, end in records:
+            text = ' '.join(text.split()) if '\n' in text or '\r' in text else text.strip()
+            if not text:
+                continue
+            speaker = (speaker or '').strip() or None
+            line = f"{speaker}: {text}" if speaker else text
+            lines.append(line)
+            speakers.append(speaker)
+            label_ends.append(len(line) - len(text))
+            starts.append(start)
+            ends.append(end)
+        has_times = any(value is not None for value in starts)
+        return cls('\n'.join(lines), lines, source, speakers, label_ends,
+                   starts if has_times else None, ends if has_times else None)
+
+    @classmethod
+    def from_srt(cls, data):
+        """SRT字幕。各ブロックの本文（複数行は空白で連結）が1発話、先頭の "話者:" をラベルとする"""
+        def records():
+            for block in _SRT_BLOCK_SEPARATOR.split(data.strip()):
+                lines = [line.strip() for line in block.splitlines() if line.strip()]
+                timing_index = next((i for i, line in enumerate(lines[:2]) if _SRT_TIMING.match(line)), None)
+                if timing_index is None:
+                    continue
+                timing = _SRT_TIMING.match(lines[timing_index])
+                speaker, text = _split_label(' '.join(lines[timing_index + 1:]))
+                yield speaker, text, parse_timestamp(timing.group(1)), parse_timestamp(timing.group(2))
+        return cls.from_records(records(), 'srt')
+
+    @classmethod
+    def from_csv(cls, data):
+        """Notta CSV（Speaker, Start Time, End Time, Duration, Text）など、ヘッダー付きの表"""
+        # zipfile / XML パーサを含む xlsx モジュールは表形式を読むときだけ読み込む（コールドスタート短縮）
+        from .xlsx import iter_table_rows
+        rows = csv.reader(io.StringIO(data.lstrip('\ufeff')))
+        return cls.from_records(
+            ((speaker, text, parse_timestamp(start), parse_timestamp(end))
+             for speaker, text, start, end in iter_table_rows(rows)),
+            'csv')
+
+    @classmethod
+    def from_xlsx(cls, xlsx_file):
+        """XLSX（全シート）。Start Time / End Time 列があれば時刻も保持する"""
+        from .xlsx import iter_conversation_rows
+        return cls.from_records(
+            ((speaker, text, _excel_time(start), _excel_time(end))
+             for speaker, text, start, end in iter_conversation_rows(xlsx_file)),
+            'xlsx')
+
+    @classmethod
+    def load(cls, data, filename=None, fmt=None):
+        """形式（fmt またはファイル名の拡張子、既定 txt）に応じて読み込む。data は bytes / str / ファイル"""
+        if fmt is None:
+            extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+            fmt = extension if extension in FORMATS else 'txt'
+        if fmt not in FORMATS:
+            raise ValueError(f"unsupported transcript format: {fmt}")
+        if fmt == 'xlsx':
+            return cls.from_xlsx(io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data)
+        if isinstance(data, (bytes, bytearray)):
+            data = data.decode('utf-8-sig')
+        elif hasattr(data, 'read'):
+            data = data.read()
+        if fmt == 'srt':
+            return cls.from_srt(data)
+        if fmt == 'csv':
+            return cls.from_csv(data)
+        return cls.from_text(data, 'txt')
+
+    # --- 並列配列 --------------------------------------------------------------------
+
+    def lines(self):
+        """発話ごとの元の行（空行を除く）。本文から読み込んだ場合は最初に参照されたときに分割する"""
+        if self._lines is None:
+            self._lines = list(filter(str.strip, self.text.split('\n')))
+        return self._lines
+
+    def _parse_labels(self):
+        # 同じ話者のラベルは何度も現れるので、コロンより前の文字列ごとに解釈を使い回す
+        speakers, label_ends = [], []
+        labels = {}
+        for line in self.lines():
+            # _separator_index() と同じ（行ごとの関数呼び出しを避けて展開している）
+            half = line.find(':')
+            index = line.find('：', 0, len(line) if half < 0 else half)
+            if index < 0:
+                index = half
+            if index < 0:
+                speakers.append(None)
+                label_ends.append(0)
+                continue
+            prefix = line[:index]
+            if prefix in labels:
+                label = labels[prefix]
+            else:
+                label = _label_of(prefix)
+                if index <= MAX_LABEL_CHARS * 2:
+                    labels[prefix] = label
+            speakers.append(label)
+            label_ends.append(0 if label is None else index + 1)
+        self._speakers, self._label_ends = speakers, label_ends
+
+    def speakers(self):
+        """発話ごとの話者ラベル（ラベルのない行は None）"""
+        if self._speakers is None:
+            self._parse_labels()
+        return self._speakers
+
+    def label_roles(self):
+        """発話ごとの話者ラベルから分かる役割（"Speaker 1" などは unknown）"""
+        if self._label_roles is None:
+            speakers = self.speakers()
+            by_speaker = {speaker: speaker_role(speaker) for speaker in set(speakers)}
+            self._label_roles = list(map(by_speaker.__getitem__, speakers))
+        return self._label_roles
+
+    def _label_prefixes(self):
+        """{行のコロンより前の文字列: 話者ラベル}。ラベルでないもの（"10:30 …" の 10 など）は含めない
+
+        本文から読み込んだ Transcript では行ごとに解釈せず、見つけた文字列を除いて本文を探し直す（異なる文字列の数
+        だけの走査）。ラベルでない文字列が多ければ行ごとに解釈する。
+        """
+        if self._prefixes is None:
+            found = _distinct_prefixes(self.text) if self._speakers is None else None
+            if found is not None:
+                prefixes = {prefix: _label_of(prefix) for prefix in found}
+            else:
+                prefixes = {speaker: speaker for speaker in self.speakers()}
+            self._prefixes = {prefix: label for prefix, label in prefixes.items() if label is not None}
+        return self._prefixes
+
+    def speaker_roles(self):
+        """話者ラベルごとの役割 {ラベル: 役割}（ラベルのない行の None は unknown）
+
+        役割は異なるラベルごとに1回だけ判定する。役割の分からないラベルがあるときだけ roles.infer_roles で推定し、
+        信頼度が ROLE_INFERENCE_MIN_CONFIDENCE 以上なら反映する（推定結果は role_inference に残る）。
+        """
+        if self._speaker_roles is None:
+            by_speaker = {label: speaker_role(label) for label in set(self._label_prefixes().values())}
+            if UNKNOWN in by_speaker.values():
+                from .roles import inference_enabled, infer_roles, min_confidence
+                if inference_enabled():
+                    self.role_inference = infer_roles(self)
+                    inferred = self.role_inference['roles']
+                    if inferred and self.role_inference['confidence'] >= min_confidence():
+                        by_speaker.update(inferred)
+            by_speaker[None] = UNKNOWN
+            self._speaker_roles = by_speaker
+        return self._speaker_roles
+
+    def roles(self):
+        """発話ごとの役割（patient / doctor / staff / unknown）。speaker_roles() を発話に並べたもの"""
+        if self._roles is None:
+            self._roles = list(map(self.speaker_roles().__getitem__, self.speakers()))
+        return self._roles
+
+    def set_roles(self, roles_by_speaker):
+        """話者ラベルごとの役割を上書きする（"Speaker 1" などの推定結果を反映する）"""
+        self.speaker_roles().update(roles_by_speaker)
+        self._roles = None
+
+    def role_lines(self, markers_by_role, counted=()):
+        """役割ごとの行 {役割: [行, ...]}（ルールベース解析の患者・医師の発言の選び出し用）
+
+        markers_by_role は {役割: マーカー}。その役割の話者の行と、役割の分からない行（ラベルなし・unknown の話者）の
+        うちマーカーのどれかを含む行を元の順に選ぶ。counted の役割は行数だけを返す（行の文字列を作らない）。
+        """
+        if self._speakers is None:
+            selected = self._select_role_lines(markers_by_role, counted)
+            if selected is not None:
+                return selected
+        selected = {role: [] for role in markers_by_role}
+        for line, line_role in zip(self.lines(), self.roles()):
+            _select_line(selected, markers_by_role, line, line_role)
+        return {role: len(lines) if role in counted else lines for role, lines in selected.items()}
+
+    def _select_role_lines(self, markers_by_role, counted):
+        """本文から読み込んだ Transcript の role_lines。行ごとにラベルを解釈しない
+
+        本文の先頭 LABEL_SAMPLE_CHARS 文字で見つけたラベルの行を1回の正規表現で役割ごとに選び、もう1回の正規表現で
+        それ以外の行（ラベルなし・先頭になかったラベル）を集めて Python で調べる。役割の分からないラベルがあり推定が
+        まだなら None（呼び出し側が roles() の推定を使って行ごとに選ぶ）。
+        """
+        by_speaker = self._speaker_roles
+
+        def role_of(label):
+            if label is None:
+                return UNKNOWN
+            return by_speaker.get(label, UNKNOWN) if by_speaker is not None else speaker_role(label)
+
+        head = _distinct_prefixes(self.text[:LABEL_SAMPLE_CHARS])
+        if head is None:
+            return None
+        prefixes = {prefix: _label_of(prefix) for prefix in head}
+        prefixes = {prefix: label for prefix, label in prefixes.items() if label is not None}
+        prefix_roles = {prefix: role_of(label) for prefix, label in prefixes.items()}
+        if by_speaker is None and UNKNOWN in prefix_roles.values():
+            return None
+        text = '\n' + self.text
+
+        # 先頭になかった行: 新しいラベルを集め、選ぶ行があれば元の順に行ごとに選び直す
+        known = [prefix for prefix, prefix_role in prefix_roles.items() if prefix_role != UNKNOWN]
+        rest_pattern = f'\n(?!(?:{_alternation(known)})[:：])([^\n]+)' if known else '\n([^\n]+)'
+        rest_selected = False
+        for line in set(re.findall(rest_pattern, text)):
+            if not line.strip():
+                continue
+            index = _separator_index(line)
+            label = _label_of(line[:index]) if index >= 0 else None
+            line_role = role_of(label)
+            if label is not None:
+                if by_speaker is None and line_role == UNKNOWN:
+                    return None
+                prefixes[line[:index]] = label
+                prefix_roles[line[:index]] = line_role
+            rest_selected = rest_selected or any(
+                line_role == role or (line_role == UNKNOWN and any(marker in line for marker in markers))
+                for role, markers in markers_by_role.items())
+        self._prefixes = prefixes
+        if rest_selected:
+            selected = {role: [] for role in markers_by_role}
+            for line in self.lines():
+                index = _separator_index(line)
+                _select_line(selected, markers_by_role, line,
+                             prefix_roles.get(line[:index], UNKNOWN) if index >= 0 else UNKNOWN)
+            return {role: len(lines) if role in counted else lines for role, lines in selected.items()}
+
+        # 行頭は ^（MULTILINE）ではなく改行の文字で探す（^ は全位置で試されるが、文字で始まるパターンは改行だけを見る）
+        groups = {role: _alternation([prefix for prefix in known if prefix_roles[prefix] == role])
+                  for role in markers_by_role}
+        line_roles = [role for role in markers_by_role if role not in counted]
+        count_roles = [role for role in markers_by_role if role in counted]
+        if len(line_roles) == 1 and len(count_roles) <= 1:
+            # 行を返す役割が1つなら捕捉グループを1つにする（数える役割の行は空文字列になる）
+            line_role = line_roles[0]
+            branches = [f'((?:{groups[line_role]})[:：][^\n]*)' if groups[line_role] else '((?!))']
+            branches += [f'(?:{groups[role]})[:：]' for role in count_roles if groups[role]]
+            matches = re.findall(f'\n(?:{"|".join(branches)})', text)
+            lines = list(filter(None, matches))
+            return {role: lines if role == line_role else len(matches) - len(lines) for role in markers_by_role}
+        branches = []
+        for role in markers_by_role:
+            rest = '' if role in counted else '[^\n]*'
+            branches.append(f'((?:{groups[role]})[:：]{rest})' if groups[role] else '((?!))')
+        matches = re.findall(f'\n(?:{"|".join(branches)})', text)
+        if len(branches) == 1:
+            columns = [matches]
+        else:
+            columns = list(zip(*matches)) if matches else [()] * len(branches)
+        return {role: len(column) - column.count('') if role in counted else list(filter(None, column))
+                for role, column in zip(markers_by_role, columns)}
+
+    def content(self, index):
+        """index 番目の発言（話者ラベルを除き前後の空白を落とす）"""
+        line = self.lines()[index]
+        if self._label_ends is not None:
+            return line[self._label_ends[index]:].strip()
+        return line[_label_span(line)[1]:].strip()
+
+    def contents(self):
+        """全発話の content()（話者ラベルを除いた発言）のリスト"""
+        if self._label_ends is None:
+            self._parse_labels()
+        return [line[end:].strip() for line, end in zip(self.lines(), self._label_ends)]
+
+    def offsets(self):
+        """発話ごとの Transcript.text 内での行の開始位置"""
+        if self._offsets is None:
+            offsets = []
+            position = 0
+            text = self.text
+            for line in self.lines():
+                position = text.index(line, position)
+                offsets.append(position)
+                position += len(line)
+            self._offsets = offsets
+        return self._offsets
+
+    # --- 時刻 ------------------------------------------------------------------------
+
+    @property
+    def has_times(self):
+        return self.starts is not None
+
+    def duration(self):
+        """最初の発話の開始から最後の発話の終了まで（時刻がなければ None）"""
+        if self.starts is None:
+            return None
+        starts = [value for value in self.starts if value is not None]
+        ends = [value for value in self.ends if value is not None]
+        if not starts or not ends:
+            return None
+        return max(0.0, max(ends) - min(starts))
+
+    def speaking_time(self):
+        """役割ごとの発話時間の合計秒（時刻のない発話は数えない）"""
+        totals = {}
+        if self.starts is None:
+            return totals
+        for role, start, end in zip(self.roles(), self.starts, self.ends):
+            if start is not None and end is not None:
+                totals[role] = totals.get(role, 0.0) + max(0.0, end - start)
+        return totals
+
+    def apply_times(self, records):
+        """発話と1対1に並んだ {"start", "end"} の列から時刻を設定する（件数が違えば何もしない）"""
+        if not isinstance(records, list) or len(records) != len(self.lines()):
+            return False
+        records = [record if isinstance(record, dict) else {} for record in records]
+        starts = [parse_timestamp(record.get('start')) for record in records]
+        if all(value is None for value in starts):
+            return False
+        self.starts = starts
+        self.ends = [parse_timestamp(record.get('end')) for record in records]
+        return True
+
+    def to_dict(self, include_text=True):
+        return {
+            "source": self.source,
+            "utterances": [utterance.to_dict(include_text) for utterance in self],
+            "duration_seconds": self.duration()
+        }
+
+
+def _separator_index(line):
+    """最初のコロン（: または ：）の位置（なければ -1）"""
+    half = line.find(':')
+    full = line.find('：', 0, len(line) if half < 0 else half)
+    return half if full < 0 else full
+
+
+def _select_line(selected, markers_by_role, line, line_role):
+    for role, markers in markers_by_role.items():
+        if line_role == role or (line_role == UNKNOWN and any(marker in line for marker in markers)):
+            selected[role].append(line)
+
+
+def _distinct_prefixes(text):
+    """各行の最初のコロンより前の文字列の集合（_separator_index と同じ位置。多すぎれば None）
+
+    見つけた文字列で始まる行を否定先読みで除いて探し直すので、走査は異なる文字列の数 + 1 回で済む。
+    """
+    text = '\n' + text
+    found = []
+    position = 0
+    while len(found) <= ROLE_LINES_MAX_LABELS:
+        guard = f'(?!(?:{_alternation(found)})[:：])' if found else ''
+        match = re.compile(f'\n{guard}([^\n:：]*)[:：]').search(text, position)
+        if match is None:
+            return found
+        found.append(match.group(1))
+        position = match.start()
+    return None
+
+
+def _alternation(strings):
+    return '|'.join(re.escape(string) for string in sorted(strings, key=len, reverse=True))
+
+
+def _label_of(prefix):
+    """コロンより前の文字列が話者ラベルならそのラベル（前後の空白を落とす）、でなければ None"""
+    label = prefix.strip()
+    if label and len(label) <= MAX_LABEL_CHARS and _LABEL_CHARACTER.search(label):
+        return label
+    return None
+
+
+def _label_span(line):
+    """行の (話者ラベル, 発言の開始位置)。ラベルがなければ (None, 0)"""
+    index = _separator_index(line)
+    if index >= 0:
+        label = _label_of(line[:index])
+        if label is not None:
+            return label, index + 1
+    return None, 0
+
+
+def _split_label(line):
+    speaker, label_end = _label_span(line)
+    return speaker, line[label_end:].strip()
+
+
+def transcript_from_request(data, conversation_text=None):
+    """APIリクエスト（content と任意の utterances）から Transcript を作る
+
+    utterances は /api/parse_xlsx が返す発話ごとの時刻（content の行と1対1）。
+    """
+    conversation_text = data.get('content', '') if conversation_text is None else conversation_text
+    transcript = Transcript.from_text(conversation_text)
+    if data.get('utterances'):
+        transcript.apply_times(data['utterances'])
+    return transcript
@@ -0,0 +1,217 @@
+"""XLSX（Office Open XML）のストリーミング読み込み
+
+ワークシートを iterparse で1行ずつ読み、共有文字列は1本の文字列＋オフセット配列で保持する。
+/api/parse_xlsx と会話データの共通読み込み（transcript.py）から使う。
+"""
+import re
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+from array import array
+from io import StringIO
+
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+NS_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+TAG_SI = NS_MAIN + 'si'
+TAG_T = NS_MAIN + 't'
+TAG_R = NS_MAIN + 'r'
+TAG_ROW = NS_MAIN + 'row'
+TAG_C = NS_MAIN + 'c'
+TAG_V = NS_MAIN + 'v'
+TAG_IS = NS_MAIN + 'is'
+TAG_SHEET_DATA = NS_MAIN + 'sheetData'
+
+HEADER_FIRST_CELLS = ('話者', 'Speaker', 'Start Time')
+SPEAKER_HEADERS = ('話者', 'speaker', 'スピーカー')
+TEXT_HEADERS = ('text', 'テキスト', '内容', '発言', '本文')
+START_HEADERS = ('start time', 'start', '開始', '開始時間', '開始時刻')
+END_HEADERS = ('end time', 'end', '終了', '終了時間', '終了時刻')
+
+_CELL_REF = re.compile(r'([A-Z]+)')
+_SHEET_PATH = re.compile(r'^xl/worksheets/sheet(\d+)\.xml$')
+
+
+class SharedStrings:
+    """共有文字列を1本の文字列＋オフセット配列で保持する（要素ごとのstrオブジェクトを持たない）"""
+
+    __slots__ = ('_buffer', '_offsets')
+
+    def __init__(self, buffer='', offsets=None):
+        self._buffer = buffer
+        self._offsets = offsets if offsets is not None else array('L', [0])
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._buffer[self._offsets[index]:self._offsets[index + 1]]
+
+
+def _rich_text(element):
+    """<si>/<is> 内の <t> と <r><t> を連結する（ふりがな <rPh> は除外）"""
+    parts = []
+    for child in element:
+        if child.tag == TAG_T:
+            parts.append(child.text or '')
+        elif child.tag == TAG_R:
+            t_element = child.find(TAG_T)
+            if t_element is not None:
+                parts.append(t_element.text or '')
+    return ''.join(parts)
+
+
+def load_shared_strings(zip_file):
+    """xl/sharedStrings.xml を iterparse で逐次読み込み、コンパクトな索引を作る"""
+    try:
+        source = zip_file.open('xl/sharedStrings.xml')
+    except KeyError:
+        return SharedStrings()
+
+    buffer = StringIO()
+    offsets = array('L', [0])
+    position = 0
+    with source:
+        context = ET.iterparse(source, events=('start', 'end'))
+        _, root = next(context)
+        for event, element in context:
+            if event == 'end' and element.tag == TAG_SI:
+                text = _rich_text(element)
+                buffer.write(text)
+                position += len(text)
+                offsets.append(position)
+                root.clear()
+    return SharedStrings(buffer.getvalue(), offsets)
+
+
+def sheet_paths(zip_file):
+    """workbook.xml のシート順でワークシートのパスを返す"""
+    names = set(zip_file.namelist())
+    try:
+        rels = ET.fromstring(zip_file.read('xl/_rels/workbook.xml.rels'))
+        targets = {
+            rel.get('Id'): rel.get('Target', '')
+            for rel in rels.iter(NS_PKG_REL + 'Relationship')
+        }
+        workbook = ET.fromstring(zip_file.read('xl/workbook.xml'))
+        paths = []
+        for sheet in workbook.iter(NS_MAIN + 'sheet'):
+            target = targets.get(sheet.get(NS_REL + 'id'), '')
+            if target.startswith('/'):
+                path = target.lstrip('/')
+            else:
+                path = posixpath.normpath(posixpath.join('xl', target))
+            if path in names:
+                paths.append(path)
+        if paths:
+            return paths
+    except (KeyError, ET.ParseError):
+        pass
+
+    numbered = [(int(m.group(1)), name) for name in names for m in [_SHEET_PATH.match(name)] if m]
+    return [name for _, name in sorted(numbered)]
+
+
+def _column_index(cell_ref, fallback):
+    match = _CELL_REF.match(cell_ref or '')
+    if not match:
+        return fallback
+    index = 0
+    for letter in match.group(1):
+        index = index * 26 + (ord(letter) - 64)
+    return index - 1
+
+
+def _cell_value(cell, shared_strings):
+    cell_type = cell.get('t', '')
+    if cell_type == 'inlineStr':
+        inline = cell.find(TAG_IS)
+        return _rich_text(inline) if inline is not None else ''
+    v_element = cell.find(TAG_V)
+    if v_element is None:
+        return ''
+    if cell_type == 's':  # Shared string
+        try:
+            return shared_strings[int(v_element.text)]
+        except (TypeError, ValueError, IndexError):
+            return v_element.text or ''
+    return v_element.text or ''
+
+
+def iter_sheet_rows(zip_file, sheet_path, shared_strings):
+    """ワークシートを iterparse で1行ずつ読み、処理済みの要素は即座に破棄する"""
+    with zip_file.open(sheet_path) as worksheet_file:
+        sheet_data = None
+        row_data = []
+        for event, element in ET.iterparse(worksheet_file, events=('start', 'end')):
+            if event == 'start':
+                if element.tag == TAG_SHEET_DATA:
+                    sheet_data = element
+                elif element.tag == TAG_ROW:
+                    row_data = []
+                continue
+
+            if element.tag == TAG_C:
+                index = _column_index(element.get('r'), len(row_data))
+                if index >= len(row_data):
+                    row_data.extend([''] * (index + 1 - len(row_data)))
+                row_data[index] = _cell_value(element, shared_strings)
+            elif element.tag == TAG_ROW:
+                yield row_data
+                if sheet_data is not None:
+                    sheet_data.clear()
+
+
+def _header_columns(row_data):
+    """ヘッダー行から話者・本文・開始・終了列の位置を特定する
+
+    話者・本文が見つからなければ先頭2列、開始・終了が見つからなければ None。
+    """
+    lowered = [value.strip().lower() for value in row_data]
+    speaker_col = next((i for i, v in enumerate(lowered) if v in SPEAKER_HEADERS), 0)
+    text_col = next((i for i, v in enumerate(lowered) if v in TEXT_HEADERS), 1)
+    start_col = next((i for i, v in enumerate(lowered) if v in START_HEADERS), None)
+    end_col = next((i for i, v in enumerate(lowered) if v in END_HEADERS), None)
+    return speaker_col, text_col, start_col, end_col
+
+
+def _cell(row_data, index):
+    return row_data[index] if index is not None and index < len(row_data) else ''
+
+
+def iter_table_rows(rows):
+    """表形式（XLSXのシート・CSV）の行から (話者, 発言, 開始, 終了) を生成する
+
+    先頭セルが HEADER_FIRST_CELLS の行をヘッダーとして列位置を決め、話者か発言が空の行は飛ばす。
+    開始・終了はセルの文字列のまま（列がなければ空文字）。
+    """
+    speaker_col, text_col, start_col, end_col = 0, 1, None, None
+    for row_data in rows:
+        # Skip header row and empty rows
+        if len(row_data) < 2:
+            continue
+        if row_data[0] in HEADER_FIRST_CELLS:
+            speaker_col, text_col, start_col, end_col = _header_columns(row_data)
+            continue
+        speaker = _cell(row_data, speaker_col)
+        text = _cell(row_data, text_col)
+        if speaker and text:
+            yield speaker, text, _cell(row_data, start_col), _cell(row_data, end_col)
+
+
+def iter_conversation_rows(xlsx_file):
+    """全シートから (話者, 発言, 開始, 終了) を遅延生成する（xlsx_file はパスまたはファイルオブジェクト）"""
+    with zipfile.ZipFile(xlsx_file, 'r') as zip_file:
+        shared_strings = load_shared_strings(zip_file)
+        for sheet_path in sheet_paths(zip_file):
+            # 列位置はシートごとに決め直す
+            yield from iter_table_rows(iter_sheet_rows(zip_file, sheet_path, shared_strings))
+
+
+def iter_conversation_lines(xlsx_file):
+    """全シートから "話者: 発言" 行を遅延生成する"""
+    for speaker, text, _, _ in iter_conversation_rows(xlsx_file):
+        yield f"{speaker}: {text}"
@@ -0,0 +1,220 @@
+from http.server import BaseHTTPRequestHandler
+import importlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qs, urlparse
+
+_API_DIR = os.path.dirname(os.path.abspath(__file__))
+if _API_DIR not in sys.path:
+    sys.path.insert(0, _API_DIR)
+
+from _lib.llm_cache import wants_bypass
+from _lib.telemetry import instrument_handler, span, submit_in_context
+
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 8))
+MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 500))
+TASK_TYPES = ('quality', 'identification', 'soap', 'pipeline')
+# pipeline（識別→SOAP・品質の一括）は Gemini の経路にしかない
+PROVIDER_TASK_TYPES = {'openai': ('quality', 'identification', 'soap'),
+                       'openrouter': ('quality', 'identification', 'soap')}
+
+
+class BatchError(Exception):
+    pass
+
+
+def _gemini_runner():
+    from identify import identify_speakers
+    from soap import convert_to_soap
+    from quality import analyze_quality
+    from pipeline import analyze_session
+
+    def run(item, bypass_cache):
+        content = item.get('content', '')
+        task_type = item.get('type', 'quality')
+        if task_type == 'identification':
+            return identify_speakers(content, bypass_cache=bypass_cache)
+        if task_type == 'soap':
+            return convert_to_soap(content, item.get('patient_name', '患者'), item.get('doctor_name', '医師'),
+                                   bypass_cache=bypass_cache)
+        if task_type == 'pipeline':
+            return analyze_session(content, item, bypass_cache=bypass_cache)
+        return analyze_quality(content, item.get('soap', {}), bypass_cache=bypass_cache)
+    return run
+
+
+def _client_runner(module_name):
+    # OpenAI SDK はこのプロバイダを選んだときだけ読み込む
+    module = importlib.import_module(module_name)
+    client = module.create_client()
+
+    def run(item, bypass_cache):
+        return module.run_analysis(client, item, bypass_cache)
+    return run
+
+
+def make_runner(provider):
+    """プロバイダごとに item -> 結果 の関数を作る（クライアントはバッチ全体で1つを共有）"""
+    if provider == 'gemini':
+        return _gemini_runner()
+    if provider == 'openai':
+        return _client_runner('openai_analysis')
+    if provider == 'openrouter':
+        return _client_runner('openrouter_analysis')
+    raise BatchError(f"未対応のプロバイダです: {provider}")
+
+
+def parse_batch(body, content_type='', query=None):
+    """JSON（{"items": [...]}）または JSONL 本文からオプションと item のリストを取り出す
+
+    item は {"id", "content", "type", ...} の辞書か、会話テキストの文字列。
+    JSONL の場合、provider などのオプションはクエリ文字列で指定する。
+    """
+    query = query or {}
+    text = body.decode('utf-8')
+    if 'ndjson' in content_type or 'jsonl' in content_type:
+        options = {}
+        items = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        data = json.loads(text)
+        if isinstance(data, list):
+            options, items = {}, data
+        else:
+            options, items = data, data.get('items', [])
+    for key, values in query.items():
+        options.setdefault(key, values[-1])
+
+    if not isinstance(items, list) or not items:
+        raise BatchError("items が空です")
+    if len(items) > MAX_ITEMS:
+        raise BatchError(f"1回のバッチは {MAX_ITEMS} 件までです（{len(items)} 件）")
+
+    default_type = options.get('type', 'quality')
+    normalized = []
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            item = {"content": item}
+        elif not isinstance(item, dict):
+            raise BatchError(f"items[{index}] はオブジェクトか文字列で指定してください")
+        item = dict(item)
+        item.setdefault('id', index)
+        item.setdefault('type', default_type)
+        normalized.append(item)
+    return options, normalized
+
+
+def run_batch(items, provider='gemini', concurrency=DEFAULT_CONCURRENCY, bypass_cache=False):
+    """item を上限付きスレッドプールで並行解析し、完了順に1件ずつ結果を yield する
+
+    1件の失敗はその item の status="error" 行になるだけで、バッチ全体は止めない。
+    最後に件数と所要時間の summary を yield する。
+    """
+    supported = PROVIDER_TASK_TYPES.get(provider, TASK_TYPES)
+    unsupported = sorted({item.get('type') for item in items} & (set(TASK_TYPES) - set(supported)))
+    if unsupported:
+        raise BatchError(f"provider={provider} では解析タイプ {', '.join(unsupported)} は使えません")
+    run = make_runner(provider)
+    workers = max(1, min(int(concurrency), MAX_CONCURRENCY, len(items)))
+    started = time.perf_counter()
+
+    def task(index, item):
+        item_started = time.perf_counter()
+        try:
+            if item.get('type') not in TASK_TYPES:
+                raise BatchError(f"未対応の解析タイプです: {item.get('type')}")
+            line = {"status": "success", "result": run(item, bypass_cache)}
+        except Exception as e:
+            line = {"status": "error", "error": str(e)}
+        line.update({
+            "id": item['id'],
+            "index": index,
+            "elapsed_ms": round((time.perf_counter() - item_started) * 1000, 1)
+        })
+        return line
+
+    succeeded = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [submit_in_context(executor, task, index, item) for index, item in enumerate(items)]
+        try:
+            for future in as_completed(futures):
+                line = future.result()
+                if line['status'] == 'success':
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield line
+        except GeneratorExit:
+            # 送信先が切断した（呼び出し側が close した）ら、まだ始まっていない item は解析しない
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    yield {
+        "summary": {
+            "total": len(items),
+            "succeeded": succeeded,
+            "failed": failed,
+            "provider": provider,
+            "concurrency": workers,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+    }
+
+
+@instrument_handler('batch')
+class handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        try:
+            with span('parse'):
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length)
+                query = parse_qs(urlparse(self.path).query)
+                options, items = parse_batch(post_data, self.headers.get('Content-Type', ''), query)
+            provider = options.get('provider', 'gemini')
+            concurrency = int(options.get('concurrency', DEFAULT_CONCURRENCY))
+            results = run_batch(items, provider, concurrency, bypass_cache=wants_bypass(self.headers, options))
+            first = next(results)
+        except Exception as e:
+            # 結果を1行も返す前の失敗（本文・プロバイダ設定の誤り）はバッチ全体のエラー
+            self.send_response(400 if isinstance(e, (BatchError, ValueError)) else 500)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            error_response = {"error": str(e), "fallback": True}
+            self.wfile.write(json.dumps(error_response).encode())
+            return
+
+        # NDJSON で完了順にストリーミング
+        self.send_response(200)
+        self.send_header('Content-type', 'application/x-ndjson')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        # ヘッダー送信後はステータスを変えられないので、切断などの失敗はログに残して打ち切る
+        try:
+            self._write_line(first)
+            for line in results:
+                self._write_line(line)
+        except (BrokenPipeError, ConnectionResetError) as e:
+            print(f"Batch client disconnected: {e}")
+        except Exception as e:
+            print(f"Batch stream failed: {e}")
+        finally:
+            results.close()
+
+    def _write_line(self, line):
+        self.wfile.write(json.dumps(line, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
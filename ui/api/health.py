@@ -1,8 +1,21 @@
 from http.server import BaseHTTPRequestHandler
 import json
 import os
+import sys
+import time
 from datetime import datetime
 
+_API_DIR = os.path.dirname(os.path.abspath(__file__))
+if _API_DIR not in sys.path:
+    sys.path.insert(0, _API_DIR)
+
+from _lib.provider_health import get_health
+from _lib.telemetry import instrument_handler
+
+# ブレーカー・呼び出し統計・キャッシュ・カスケード・ライブセッションなどはLLMを呼んだ関数のプロセスにあり、
+# Vercel ではこの関数からは見えない。それらは各エンドポイントの GET ?metrics=state で返す
+
+@instrument_handler('health')
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
         try:
@@ -13,28 +26,32 @@ class handler(BaseHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Headers', 'Content-Type')
             self.end_headers()
             
+            started = time.perf_counter()
+            
+            # プロバイダの状態はバックグラウンドの疎通確認が保持している値を返す（ここでは外部通信しない）
+            health = get_health()
+            health.ensure_probing()
+            providers = health.snapshot()
+            
             # 環境変数チェック
             gemini_key = os.environ.get('GEMINI_API_KEY')
+            gemini_probe = providers['gemini']['probe']
             gemini_status = {
                 "available": gemini_key is not None,
                 "key_length": len(gemini_key) if gemini_key else 0,
-                "key_prefix": gemini_key[:10] + "..." if gemini_key else None
+                "key_prefix": gemini_key[:10] + "..." if gemini_key else None,
+                "checked_at": gemini_probe.get('checked_at')
             }
             
-            # Gemini API接続テスト
-            if gemini_key:
-                try:
-                    import google.generativeai as genai
-                    genai.configure(api_key=gemini_key)
-                    model = genai.GenerativeModel('gemini-1.5-flash')
-                    # 簡単なテスト
-                    test_response = model.generate_content("test")
-                    gemini_status["connection_test"] = "success"
-                    gemini_status["model"] = "gemini-1.5-flash"
-                except Exception as e:
-                    gemini_status["connection_test"] = f"failed: {str(e)}"
+            # Gemini API接続テスト（直近の疎通確認の結果）
+            if gemini_probe['state'] == 'ok':
+                gemini_status["connection_test"] = "success"
+                gemini_status["model"] = "gemini-1.5-flash"
+            elif gemini_probe['state'] == 'error':
+                gemini_status["connection_test"] = f"failed: {gemini_probe['error']}"
             else:
-                gemini_status["connection_test"] = "no_api_key"
+                # no_api_key / pending（初回の疎通確認が未完了）
+                gemini_status["connection_test"] = gemini_probe['state']
             
             response = {
                 "status": "healthy",
@@ -43,16 +60,23 @@ class handler(BaseHTTPRequestHandler):
                 "timestamp": datetime.utcnow().isoformat() + "Z",
                 "endpoints": [
                     "/api/health",
+                    "/api/live",
+                    "/api/metrics",
                     "/api/identify", 
                     "/api/soap",
-                    "/api/quality"
+                    "/api/quality",
+                    "/api/pipeline",
+                    "/api/batch",
+                    "/api/sessions"
                 ],
                 "platform": "vercel_serverless",
                 "gemini_ai": gemini_status,
+                "providers": providers,
                 "debug_info": {
                     "env_vars_count": len(os.environ),
                     "python_path": os.getcwd()
-                }
+                },
+                "health_ms": round((time.perf_counter() - started) * 1000, 3)
             }
             
             self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
@@ -2,7 +2,54 @@ from http.server import BaseHTTPRequestHandler
 import json
 import os
 import re
+import sys
 
+_API_DIR = os.path.dirname(os.path.abspath(__file__))
+if _API_DIR not in sys.path:
+    sys.path.insert(0, _API_DIR)
+
+from _lib.circuit_breaker import CircuitOpen
+from _lib.clients import gemini_model, prewarm_from_env
+from _lib.llm_cache import cached_call, wants_bypass
+from _lib.llm_json import GEMINI_JSON_MODE, decode_llm_json
+from _lib.telemetry import instrument_handler, record_fallback, record_usage, span
+from _lib.transcript import DOCTOR, PATIENT, Transcript, transcript_from_request
+
+# LLM_PREWARM が設定されていれば SDK の読み込みとクライアント生成を import 時に済ませる
+prewarm_from_env()
+
+PROMPT_VERSION = 'gemini-identify-v1'
+# 話者の役割がこの信頼度以上に分かり、患者名も会話から取れればLLMを呼ばない
+DEFAULT_LOCAL_MIN_CONFIDENCE = 0.8
+# 応答の検証に使うスキーマ（型の修正と必須フィールドの確認）
+IDENTIFY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "patient_name": {"type": "string"},
+        "doctor_name": {"type": "string"},
+        "confidence_patient": {"type": "number", "minimum": 0, "maximum": 1},
+        "confidence_doctor": {"type": "number", "minimum": 0, "maximum": 1},
+        "reasoning": {"type": "string"}
+    },
+    "required": ["patient_name", "doctor_name", "confidence_patient", "confidence_doctor"]
+}
+
+PATIENT_PATTERNS = [
+    re.compile(r'([一-龯ぁ-んァ-ン]{2,6})[さ様]'),
+    re.compile(r'患者[：:\s]*([一-龯ぁ-んァ-ン]{2,5})')
+]
+DOCTOR_PATTERNS = [
+    re.compile(r'([一-龯ぁ-んァ-ン]{2,6})\s*先生'),
+    re.compile(r'Dr\.?\s*([一-龯A-Za-z]{2,6})')
+]
+# ローカル識別で医師の発言から患者名を取るパターン。漢字・カタカナだけの名前が単独の「さん」「様」の直前で
+# 終わるものに限る（「開けてください」「どうされましたか」のような活用や「様子」を名前と誤らない）
+LOCAL_PATIENT_NAME = re.compile(r'(?<![一-龯々ァ-ヴー])([一-龯々ァ-ヴー]{2,6})(?:さん|様)(?![一-龯々ァ-ヴー])')
+# 「〜さん」「〜様」の形でも患者名ではない語
+NON_NAMES = frozenset(('患者', '皆', '奥', 'お客', '先生', '医師', '衛生士', '歯科衛生士', '受付', 'スタッフ', '家族',
+                       '親御', '子供', '御家族', '主人', '旦那'))
+
+@instrument_handler('identify')
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
@@ -15,18 +62,15 @@ class handler(BaseHTTPRequestHandler):
             self.end_headers()
             
             # Parse request
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+            with span('parse'):
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length)
+                data = json.loads(post_data.decode('utf-8'))
             
             conversation_text = data.get('content', '')
             
-            # Gemini API処理（環境変数からAPIキー取得）
-            api_key = os.environ.get('GEMINI_API_KEY')
-            if api_key and len(conversation_text) > 10:
-                result = self._gemini_identify(conversation_text, api_key)
-            else:
-                result = self._fallback_identify(conversation_text)
+            result = identify_speakers(conversation_text, bypass_cache=wants_bypass(self.headers, data),
+                                       transcript=transcript_from_request(data, conversation_text))
             
             self.wfile.write(json.dumps(result).encode())
             
@@ -44,15 +88,28 @@ class handler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
-    
-    def _gemini_identify(self, conversation_text, api_key):
-        """Gemini AI による患者・医師識別"""
-        try:
-            import google.generativeai as genai
-            
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            
+
+
+def identify_speakers(conversation_text, bypass_cache=False, transcript=None):
+    """患者・医師識別（ローカルで話者の役割と患者名が分かればそれを返し、なければGemini・フォールバック）"""
+    if transcript is None:
+        transcript = Transcript.from_text(conversation_text)
+    with span('local_identify'):
+        result = _local_identify(transcript)
+    if result is not None:
+        return result
+    # Gemini API処理（環境変数からAPIキー取得）
+    api_key = os.environ.get('GEMINI_API_KEY')
+    if api_key and len(conversation_text) > 10:
+        return _gemini_identify(conversation_text, api_key, bypass_cache)
+    record_fallback('identify', 'no_api_key')
+    return _fallback_identify(conversation_text)
+
+
+def _gemini_identify(conversation_text, api_key, bypass_cache=False):
+    """Gemini AI による患者・医師識別"""
+    try:
+        with span('prompt_build'):
             prompt = f"""
 歯科医療の会話から患者名と医師名を正確に抽出してください。
 
@@ -68,10 +125,20 @@ class handler(BaseHTTPRequestHandler):
   "reasoning": "判断根拠の説明"
 }}
 """
-            
-            response = model.generate_content(prompt)
-            result = json.loads(response.text)
-            
+        
+        def generate():
+            # ウォームインスタンスでは設定済みのモデル（と接続）を使い回す
+            model = gemini_model(api_key, 'gemini-1.5-flash')
+            # JSONモードで返させ、それでも崩れた応答は修復して読む
+            response = model.generate_content(prompt, generation_config=GEMINI_JSON_MODE)
+            record_usage('gemini', response)
+            return decode_llm_json('gemini', 'identify', response.text, IDENTIFY_SCHEMA)
+        
+        # 同一会話・同一プロンプトの再解析はキャッシュから返す
+        result = cached_call('gemini', 'gemini-1.5-flash', PROMPT_VERSION, conversation_text, generate,
+                             bypass=bypass_cache)
+        
+        with span('post_process'):
             # Process log追加
             result["process_log"] = [
                 "🤖 Gemini AI患者・医師識別開始",
@@ -80,50 +147,97 @@ class handler(BaseHTTPRequestHandler):
                 f"✅ 識別完了: 患者「{result.get('patient_name', '不明')}」医師「{result.get('doctor_name', '不明')}」"
             ]
             result["method"] = "gemini_ai_identification"
-            
-            return result
-            
-        except Exception as e:
-            print(f"Gemini API error: {e}")
-            return self._fallback_identify(conversation_text)
-    
-    def _fallback_identify(self, conversation_text):
-        """フォールバック識別"""
-        patient_name = "患者"
-        doctor_name = "医師"
-        
-        # 基本的なパターンマッチング
-        patient_patterns = [
-            r'([一-龯ぁ-んァ-ン]{2,6})[さ様]',
-            r'患者[：:\s]*([一-龯ぁ-んァ-ン]{2,5})'
-        ]
         
-        for pattern in patient_patterns:
-            matches = re.findall(pattern, conversation_text)
-            if matches:
-                patient_name = matches[0]
-                break
+        return result
         
-        doctor_patterns = [
-            r'([一-龯ぁ-んァ-ン]{2,6})\s*先生',
-            r'Dr\.?\s*([一-龯A-Za-z]{2,6})'
-        ]
-        
-        for pattern in doctor_patterns:
-            matches = re.findall(pattern, conversation_text)
-            if matches:
-                doctor_name = matches[0]
-                break
-        
-        return {
-            "patient_name": patient_name,
-            "doctor_name": doctor_name,
-            "confidence_patient": 0.7 if patient_name != "患者" else 0.3,
-            "confidence_doctor": 0.7 if doctor_name != "医師" else 0.3,
-            "reasoning": "パターンマッチングによる識別",
-            "process_log": [
-                "📋 フォールバック識別実行",
-                f"✅ 結果: 患者「{patient_name}」医師「{doctor_name}」"
-            ],
-            "method": "pattern_matching_fallback"
-        }
\ No newline at end of file
+    except Exception as e:
+        print(f"Gemini API error: {e}")
+        # ブレーカーが open の間はプロバイダを待たずにフォールバックする
+        record_fallback('identify', 'circuit_open' if isinstance(e, CircuitOpen) else 'error')
+        return _fallback_identify(conversation_text)
+
+def _role_text(transcript, roles, role):
+    return ' '.join(transcript.content(index) for index, value in enumerate(roles) if value == role)
+
+
+def _search(patterns, text):
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match:
+            return match.group(1)
+    return None
+
+
+def _local_patient_name(text):
+    """医師の発言から患者名（「田中さん」の田中）を取る。名前らしい形がなければ None"""
+    for match in LOCAL_PATIENT_NAME.finditer(text):
+        if match.group(1) not in NON_NAMES:
+            return match.group(1)
+    return None
+
+
+def _local_identify(transcript):
+    """話者ラベル（"Speaker 1" などは roles.infer_roles の推定）から役割が分かれば、医師の発言中の「〜さん」と
+    患者の発言中の「〜先生」から名前を取り、LLMを呼ばずに返す（分からなければ None）"""
+    roles = transcript.roles()
+    if PATIENT not in roles or DOCTOR not in roles:
+        return None
+    inference = transcript.role_inference
+    confidence = inference['confidence'] if inference and inference['roles'] else 1.0
+    if confidence < float(os.environ.get('IDENTIFY_LOCAL_MIN_CONFIDENCE', DEFAULT_LOCAL_MIN_CONFIDENCE)):
+        return None
+    # 名前が取れなければ None を返し、Gemini・フォールバックに任せる
+    patient_name = _local_patient_name(_role_text(transcript, roles, DOCTOR))
+    if patient_name is None:
+        return None
+    doctor_name = (_search(DOCTOR_PATTERNS, _role_text(transcript, roles, PATIENT))
+                   or _search(DOCTOR_PATTERNS, transcript.text) or "医師")
+    speaker_roles = {speaker: role for speaker, role in zip(transcript.speakers(), roles) if speaker is not None}
+    return {
+        "patient_name": patient_name,
+        "doctor_name": doctor_name,
+        "confidence_patient": round(confidence * 0.9, 2),
+        "confidence_doctor": round(confidence * 0.9, 2) if doctor_name != "医師" else 0.3,
+        "speaker_roles": speaker_roles,
+        "role_confidence": confidence,
+        "reasoning": "話者ごとの特徴量（質問の割合・専門用語・「〜さん」「先生」・発話の長さ）による役割推定と、"
+                     "医師の発言中の「〜さん」から患者名を抽出",
+        "process_log": [
+            "🧭 ローカル話者役割推定実行",
+            f"🗂️ 役割: {', '.join(f'{speaker}={role}' for speaker, role in speaker_roles.items())}"
+            f"（信頼度 {confidence:.2f}）",
+            f"✅ 結果: 患者「{patient_name}」医師「{doctor_name}」"
+        ],
+        "method": "local_role_inference"
+    }
+
+def _fallback_identify(conversation_text):
+    """フォールバック識別"""
+    patient_name = "患者"
+    doctor_name = "医師"
+    
+    # 基本的なパターンマッチング（正規表現はimport時にコンパイル済み）
+    for pattern in PATIENT_PATTERNS:
+        match = pattern.search(conversation_text)
+        if match:
+            patient_name = match.group(1)
+            break
+    
+    for pattern in DOCTOR_PATTERNS:
+        match = pattern.search(conversation_text)
+        if match:
+            doctor_name = match.group(1)
+            break
+    
+    return {
+        "patient_name": patient_name,
+        "doctor_name": doctor_name,
+        "confidence_patient": 0.7 if patient_name != "患者" else 0.3,
+        "confidence_doctor": 0.7 if doctor_name != "医師" else 0.3,
+        "reasoning": "パターンマッチングによる識別",
+        "process_log": [
+            "📋 フォールバック識別実行",
+            f"✅ 結果: 患者「{patient_name}」医師「{doctor_name}」"
+        ],
+        "method": "pattern_matching_fallback"
+    }
\ No newline at end of file
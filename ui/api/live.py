@@ -0,0 +1,34 @@
+from http.server import BaseHTTPRequestHandler
+import json
+from datetime import datetime
+
+# 生存確認専用。外部サービスにもキャッシュにも触れず、プロセスが応答できることだけを返す
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        
+        response = {
+            "status": "alive",
+            "service": "dental_ai_vercel",
+            "timestamp": datetime.utcnow().isoformat() + "Z"
+        }
+        self.wfile.write(json.dumps(response).encode('utf-8'))
+    
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+    
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
@@ -0,0 +1,448 @@
+from http.server import BaseHTTPRequestHandler
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import parse_qs, urlparse
+
+_API_DIR = os.path.dirname(os.path.abspath(__file__))
+if _API_DIR not in sys.path:
+    sys.path.insert(0, _API_DIR)
+
+from _lib.circuit_breaker import CircuitOpen
+from _lib.clients import gemini_model, prewarm_from_env
+from _lib.compaction import compact_for_prompt
+from _lib.live_sessions import SessionNotFound, get_live_store, refresh_due, summary_max_chars
+from _lib.llm_cache import cached_call, wants_bypass
+from _lib.llm_json import GEMINI_JSON_MODE, decode_llm_json
+from _lib.roles import (COUNTS, assign_roles, features_from_counts, inference_enabled, min_confidence,
+                        utterance_counts)
+from _lib.telemetry import LIVE_REFRESHES, LIVE_UTTERANCES, instrument_handler, record_fallback, record_usage, span
+from _lib.transcript import DOCTOR, PATIENT, UNKNOWN, Transcript, speaker_role
+from quality import PATIENT_SIGNALS, QUALITY_KEYWORDS, QUALITY_SCORES, pattern_scores
+from soap import ASSESSMENT_PATTERN, PLAN_PATTERN
+
+# LLM_PREWARM が設定されていれば SDK の読み込みとクライアント生成を import 時に済ませる
+prewarm_from_env()
+
+PROMPT_VERSION = 'gemini-live-v1'
+ACTIONS = ('start', 'append', 'refresh', 'end')
+MAX_UTTERANCES_PER_REQUEST = 5000
+# 部分SOAPの各欄に返す発話数（O は最初の発話、それ以外は直近の発話）
+SOAP_ITEMS = 5
+OBJECTIVE_ITEMS = 3
+# 応答の検証に使うスキーマ（型の修正と必須フィールドの確認）
+LIVE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        **{score: {"type": "number", "minimum": 0, "maximum": 1} for score in QUALITY_SCORES},
+        **{field: {"type": "array", "items": {"type": "string"}}
+           for field in ('consent_signals', 'concerns', 'improvements')}
+    },
+    "required": ["summary"] + list(QUALITY_SCORES)
+}
+
+
+class LiveRequestError(ValueError):
+    pass
+
+
+class OffsetAhead(LiveRequestError):
+    """クライアントの offset がサーバーの発話数より先（途中の追記が失われた）"""
+
+
+class SpeakerState:
+    """話者ラベルごとの逐次集計（発話数・秒数・役割推定用の件数・品質キーワード・SOAP欄の発話番号）"""
+
+    __slots__ = ('label_role', 'turns', 'seconds', 'counts', 'signals', 'lines', 'assessment', 'plan')
+
+    def __init__(self, label):
+        self.label_role = speaker_role(label)
+        self.turns = 0
+        self.seconds = 0.0
+        self.counts = dict.fromkeys(COUNTS, 0)
+        self.signals = {category: set() for category in PATIENT_SIGNALS}
+        self.lines = []
+        self.assessment = []
+        self.plan = []
+
+
+class LiveSession:
+    """伸びていく会話の状態。追記は追加された発話の分だけ集計を更新する
+
+    役割（"Speaker 1" などの推定を含む）は話者単位の集計から引くので、役割の割り当てが変わっても
+    過去の発話を数え直さない。
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.lock = threading.Lock()
+        self.utterances = []  # (話者ラベル, 発言, 開始秒, 終了秒)
+        self.speakers = {}
+        self.chars = 0
+        self.consent = False
+        self.first_start = None
+        self.last_end = None
+        self.created_at = datetime.utcnow().isoformat() + "Z"
+        # LLM による更新（llm_cursor 番目より前の発話は summary に反映済み）
+        self.summary = ''
+        self.llm = None
+        self.llm_cursor = 0
+        self.last_refresh_at = None
+        self.refreshing = False
+
+    def append(self, transcript, skip=0):
+        """Transcript の skip 番目以降の発話を追加する（呼び出し側が lock を持つ）。追加した件数を返す"""
+        speakers = transcript.speakers()
+        starts, ends = transcript.starts, transcript.ends
+        appended = 0
+        for index in range(skip, len(transcript)):
+            label = speakers[index]
+            content = transcript.content(index)
+            start = starts[index] if starts is not None else None
+            end = ends[index] if ends is not None else None
+            position = len(self.utterances)
+            self.utterances.append((label, content, start, end))
+            self.chars += len(content) + (len(label) + 2 if label else 0)
+            appended += 1
+            if start is not None:
+                self.first_start = start if self.first_start is None else min(self.first_start, start)
+            if end is not None:
+                self.last_end = end if self.last_end is None else max(self.last_end, end)
+            if not self.consent:
+                self.consent = QUALITY_KEYWORDS.contains_any(content, 'consent')
+
+            state = self.speakers.get(label)
+            if state is None:
+                state = self.speakers[label] = SpeakerState(label)
+            state.turns += 1
+            if start is not None and end is not None:
+                state.seconds += max(0.0, end - start)
+            for name, value in utterance_counts(content).items():
+                state.counts[name] += value
+            hits = QUALITY_KEYWORDS.scan(content)
+            for category in PATIENT_SIGNALS:
+                state.signals[category].update(hits.keywords(category))
+            state.lines.append(position)
+            if ASSESSMENT_PATTERN.search(content):
+                state.assessment.append(position)
+            if PLAN_PATTERN.search(content):
+                state.plan.append(position)
+        return appended
+
+    def roles(self):
+        """({話者ラベル: 役割}, 推定結果)。話者数に比例する手間で求める"""
+        labelled = {label: state for label, state in self.speakers.items() if label is not None}
+        roles = {label: state.label_role for label, state in labelled.items()}
+        inference = None
+        if inference_enabled() and any(role == UNKNOWN for role in roles.values()):
+            features = features_from_counts({label: state.turns for label, state in labelled.items()},
+                                            {label: state.counts for label, state in labelled.items()})
+            inference = assign_roles(features, roles)
+            if inference['roles'] and inference['confidence'] >= min_confidence():
+                roles.update(inference['roles'])
+        return roles, inference
+
+    def _by_role(self, roles, role):
+        return [state for label, state in self.speakers.items() if roles.get(label) == role]
+
+    def indicators(self, roles):
+        """ルールベースの品質分析（/api/quality のフォールバック）と同じ式の途中経過"""
+        counts = {}
+        patients = self._by_role(roles, PATIENT)
+        for category in PATIENT_SIGNALS:
+            counts[category] = len(set().union(*(state.signals[category] for state in patients)))
+        success, understanding, consent = pattern_scores(counts, self.consent)
+        return {
+            "success_possibility": round(success, 2),
+            "patient_understanding": round(understanding, 2),
+            "treatment_consent": round(consent, 2),
+            "overall_quality": round(success * 0.4 + understanding * 0.3 + consent * 0.3, 2),
+            "patient_signals": counts,
+            "treatment_discussed": self.consent,
+            "method": "pattern_based_live_indicators"
+        }
+
+    def soap_partial(self, roles):
+        """部分SOAP（S: 患者の直近の発言、O: 医師の最初の発言、A/P: 医師の診断・計画の直近の発言）"""
+        def latest(states, field, limit=SOAP_ITEMS):
+            positions = sorted(position for state in states for position in getattr(state, field)[-limit:])
+            return positions[-limit:]
+
+        def first(states, limit=OBJECTIVE_ITEMS):
+            return sorted(position for state in states for position in state.lines[:limit])[:limit]
+
+        patients = self._by_role(roles, PATIENT)
+        doctors = self._by_role(roles, DOCTOR)
+        buckets = {
+            "subjective": latest(patients, 'lines'),
+            "objective": first(doctors),
+            "assessment": latest(doctors, 'assessment'),
+            "plan": latest(doctors, 'plan'),
+        }
+        partial = {field: [self.utterances[position][1] for position in positions]
+                   for field, positions in buckets.items()}
+        partial["counts"] = {
+            "subjective": sum(len(state.lines) for state in patients),
+            "objective": sum(len(state.lines) for state in doctors),
+            "assessment": sum(len(state.assessment) for state in doctors),
+            "plan": sum(len(state.plan) for state in doctors),
+        }
+        partial["method"] = "pattern_based_live_soap"
+        return partial
+
+    def snapshot(self, refresh=None):
+        roles, inference = self.roles()
+        speakers = {}
+        for label, state in self.speakers.items():
+            speakers[label if label is not None else ''] = {
+                "role": roles.get(label, UNKNOWN),
+                "turns": state.turns,
+                "chars": state.counts['chars'],
+                "seconds": round(state.seconds, 1),
+            }
+        duration = None
+        if self.first_start is not None and self.last_end is not None:
+            duration = round(max(0.0, self.last_end - self.first_start), 1)
+        llm = dict(self.llm) if self.llm else {}
+        llm.update({
+            "covered_utterances": self.llm_cursor,
+            "pending_utterances": len(self.utterances) - self.llm_cursor,
+            "refreshing": self.refreshing,
+            "refresh": refresh,
+        })
+        return {
+            "session_id": self.session_id,
+            "created_at": self.created_at,
+            "utterances": len(self.utterances),
+            "duration_seconds": duration,
+            "speakers": speakers,
+            "role_inference": inference,
+            "indicators": self.indicators(roles),
+            "soap_partial": self.soap_partial(roles),
+            "llm": llm
+        }
+
+
+def parse_utterances(data):
+    """リクエストの utterances（[{"speaker", "text", "start", "end"}]）または content（"話者: 発言" の行）"""
+    utterances = data.get('utterances')
+    if utterances is not None:
+        if not isinstance(utterances, list) or not all(isinstance(item, dict) for item in utterances):
+            raise LiveRequestError("utterances must be a list of objects")
+        if len(utterances) > MAX_UTTERANCES_PER_REQUEST:
+            raise LiveRequestError(f"too many utterances: {len(utterances)} > {MAX_UTTERANCES_PER_REQUEST}")
+        return Transcript.from_records(
+            ((item.get('speaker'), str(item.get('text') or ''), item.get('start'), item.get('end'))
+             for item in utterances), 'live')
+    return Transcript.from_text(data.get('content') or '', 'live')
+
+
+def _skip_for_offset(session, data, count):
+    """offset（クライアントが送信済みとみなしている発話数）から、再送分として読み飛ばす件数を求める"""
+    offset = data.get('offset')
+    if offset is None:
+        return 0
+    if not isinstance(offset, int) or offset < 0:
+        raise LiveRequestError("offset must be a non-negative integer")
+    if offset > len(session.utterances):
+        raise OffsetAhead(f"offset {offset} is ahead of the session ({len(session.utterances)} utterances)")
+    return min(count, len(session.utterances) - offset)
+
+
+def handle_live(data):
+    """start / append / refresh / end を処理してセッションの状態を返す"""
+    action = data.get('action') or ('append' if data.get('session_id') else 'start')
+    if action not in ACTIONS:
+        raise LiveRequestError(f"unknown action: {action}")
+    store = get_live_store()
+    bypass_cache = bool(data.get('no_cache'))
+    session_id = data.get('session_id')
+
+    if action == 'start':
+        session = LiveSession(session_id or uuid.uuid4().hex)
+        store.put(session.session_id, session)
+    elif not session_id:
+        raise LiveRequestError("session_id is required")
+    else:
+        session = store.get(session_id)
+
+    with span('parse'):
+        transcript = parse_utterances(data) if action in ('start', 'append') else None
+    appended = 0
+    if transcript is not None and len(transcript):
+        with session.lock, span('append', utterances=len(transcript)):
+            appended = session.append(transcript, _skip_for_offset(session, data, len(transcript)))
+        store.count('appended', appended)
+        LIVE_UTTERANCES.inc(appended)
+
+    outcome = refresh_session(session, store, force=action in ('refresh', 'end'), bypass_cache=bypass_cache)
+    if action == 'end':
+        store.pop(session.session_id)
+    with session.lock:
+        result = session.snapshot(outcome)
+    result["appended"] = appended
+    if action == 'end':
+        result["ended"] = True
+    return result
+
+
+def refresh_session(session, store, force=False, bypass_cache=False):
+    """間引きの条件を満たせば、要約と未反映の発話だけで LLM の解析を更新する。結果（outcome）を返す"""
+    api_key = os.environ.get('GEMINI_API_KEY')
+    with session.lock:
+        pending = len(session.utterances) - session.llm_cursor
+        if not api_key:
+            outcome = 'no_api_key'
+        elif session.refreshing:
+            outcome = 'in_flight'
+        elif force:
+            outcome = 'due' if pending > 0 else 'up_to_date'
+        else:
+            outcome = refresh_due(pending, session.last_refresh_at)[1]
+        if outcome != 'due':
+            if api_key:
+                store.count('refresh_skipped')
+            LIVE_REFRESHES.inc(outcome=outcome)
+            return outcome
+        session.refreshing = True
+        end = len(session.utterances)
+        delta = session.utterances[session.llm_cursor:end]
+        summary = session.summary
+        roles = {label: role for label, role in session.roles()[0].items() if role in (DOCTOR, PATIENT)}
+        transcript_chars = session.chars
+
+    try:
+        result, prompt_chars = _gemini_refresh(summary, delta, roles, api_key, bypass_cache)
+    except Exception as e:
+        print(f"Gemini Live Session API error: {e}")
+        record_fallback('live_session', 'circuit_open' if isinstance(e, CircuitOpen) else 'error')
+        store.count('refresh_errors')
+        LIVE_REFRESHES.inc(outcome='error')
+        with session.lock:
+            session.refreshing = False
+        return 'error'
+
+    with session.lock:
+        session.summary = (result.get("summary") or summary)[:summary_max_chars()]
+        session.llm = {key: result[key] for key in ("summary",) + QUALITY_SCORES
+                       + ('consent_signals', 'concerns', 'improvements', 'json_repair', 'compaction') if key in result}
+        session.llm["summary"] = session.summary
+        session.llm["refreshed_at"] = datetime.utcnow().isoformat() + "Z"
+        session.llm["method"] = "gemini_live_delta_refresh"
+        session.llm_cursor = end
+        session.last_refresh_at = time.time()
+        session.refreshing = False
+    store.count('refreshes')
+    store.count('prompt_chars', prompt_chars)
+    store.count('transcript_chars', transcript_chars)
+    LIVE_REFRESHES.inc(outcome='refreshed')
+    return 'refreshed'
+
+
+def _gemini_refresh(summary, delta, roles, api_key, bypass_cache=False):
+    """これまでの要約と追加された発話だけを送り、(更新した要約とスコア, プロンプトの会話部分の文字数) を返す"""
+    delta_text = '\n'.join(f"{label}: {content}" if label else content for label, content, _, _ in delta)
+    # 一度に大量に追記された場合も予算（PROMPT_TOKEN_BUDGET）を超える分は重要度の低い発話を落とす
+    delta_text, compaction = compact_for_prompt(delta_text, 'live_session')
+    max_chars = summary_max_chars()
+    with span('prompt_build'):
+        role_line = ', '.join(f"{label}={'医師' if role == DOCTOR else '患者'}" for label, role in roles.items())
+        prompt_text = f"""これまでの要約:
+{summary or '（まだありません）'}
+
+追加された発話:
+{delta_text}"""
+        prompt = f"""
+以下は診療中に進行している歯科カウンセリング会話のライブ解析です。
+これまでの要約と、前回の解析以降に追加された発話から要約を更新し、現時点の成約可能性などを評価してください。
+{f"話者の役割: {role_line}" if role_line else ""}
+
+{prompt_text}
+
+以下のJSON形式で回答してください:
+{{
+  "summary": "これまでの要約に追加された発話を反映した会話全体の要約（{max_chars}文字以内）",
+  "success_possibility": 0.0から1.0のスコア,
+  "patient_understanding": 0.0から1.0のスコア,
+  "treatment_consent": 0.0から1.0のスコア,
+  "consent_signals": ["治療に前向きな発言・同意の兆候"],
+  "concerns": ["患者の不安・迷い"],
+  "improvements": ["この後の説明で補うとよい点"]
+}}
+"""
+
+    def generate():
+        # ウォームインスタンスでは設定済みのモデル（と接続）を使い回す
+        model = gemini_model(api_key, 'gemini-1.5-flash')
+        # JSONモードで返させ、それでも崩れた応答は修復して読む
+        response = model.generate_content(prompt, generation_config=GEMINI_JSON_MODE)
+        record_usage('gemini', response)
+        return decode_llm_json('gemini', 'live_session', response.text, LIVE_SCHEMA)
+
+    # 同じ要約・同じ追加分の再送（クライアントの再試行）はキャッシュから返す
+    result = cached_call('gemini', 'gemini-1.5-flash', PROMPT_VERSION, prompt_text, generate,
+                         params={"roles": role_line, "summary_max_chars": max_chars}, bypass=bypass_cache)
+    if compaction:
+        result["compaction"] = compaction
+    return result, len(prompt_text)
+
+
+@instrument_handler('live_session')
+class handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        try:
+            with span('parse'):
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length)
+                data = json.loads(post_data.decode('utf-8'))
+            if not isinstance(data, dict):
+                raise LiveRequestError("request body must be an object")
+            data['no_cache'] = wants_bypass(self.headers, data)
+
+            started = time.perf_counter()
+            result = handle_live(data)
+            result["update_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            self._send_json(200, result)
+
+        except SessionNotFound as e:
+            # 破棄された・別インスタンスのセッション。クライアントは全文を付けて start し直す
+            self._send_json(404, {"error": f"live session not found: {e.args[0]}", "resync": True})
+        except OffsetAhead as e:
+            self._send_json(409, {"error": str(e), "resync": True})
+        except Exception as e:
+            status = 400 if isinstance(e, ValueError) else 500
+            self._send_json(status, {"error": str(e), "fallback": True})
+
+    def do_GET(self):
+        try:
+            session_id = parse_qs(urlparse(self.path).query).get('session_id', [None])[0]
+            if not session_id:
+                raise LiveRequestError("session_id is required")
+            session = get_live_store().get(session_id)
+            with session.lock:
+                self._send_json(200, session.snapshot())
+        except SessionNotFound as e:
+            self._send_json(404, {"error": f"live session not found: {e.args[0]}", "resync": True})
+        except Exception as e:
+            self._send_json(400 if isinstance(e, ValueError) else 500, {"error": str(e), "fallback": True})
+
+    def _send_json(self, status, payload):
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
+        self.wfile.write(json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
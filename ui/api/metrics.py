@@ -0,0 +1,38 @@
+from http.server import BaseHTTPRequestHandler
+import os
+import sys
+
+_API_DIR = os.path.dirname(os.path.abspath(__file__))
+if _API_DIR not in sys.path:
+    sys.path.insert(0, _API_DIR)
+
+from _lib.telemetry import render_metrics
+
+# Prometheus 形式のメトリクス（値はこのインスタンスが処理した分のみ）。
+# Vercel では api/*.py ごとに別の関数なので、ここには解析エンドポイントの値は入らない。
+# 各関数の値は GET /api/<エンドポイント>?metrics=1（_lib/telemetry.instrument_handler）で取る
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            body = render_metrics().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(body)
+            
+        except Exception as e:
+            self.send_response(500)
+            self.send_header('Content-type', 'text/plain; charset=utf-8')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(f"# error: {e}\n".encode('utf-8'))
+    
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
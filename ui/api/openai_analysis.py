@@ -1,12 +1,143 @@
 from http.server import BaseHTTPRequestHandler
 import json
 import os
+import sys
 from datetime import datetime
-import openai
 
+_API_DIR = os.path.dirname(os.path.abspath(__file__))
+if _API_DIR not in sys.path:
+    sys.path.insert(0, _API_DIR)
+
+from _lib.chunking import chunk_transcript, map_reduce
+from _lib.clients import openai_client, prewarm_from_env
+from _lib.compaction import compact_for_prompt
+from _lib.llm_cache import cache_lookup, cache_store, cached_call, guarded_stream, wants_bypass
+from _lib.streaming import format_sse, iter_completion_text, stream_fields, wants_stream
+from _lib.llm_json import TolerantJSONDecoder, decode_llm_json, is_complete
+from _lib.telemetry import instrument_handler, record_usage, span
+
+# LLM_PREWARM が設定されていれば SDK の読み込みとクライアント生成を import 時に済ませる
+prewarm_from_env()
+
+QUALITY_PROMPT_VERSION = 'openai-quality-v1'
+IDENTIFY_PROMPT_VERSION = 'openai-identify-v1'
+SOAP_PROMPT_VERSION = 'openai-soap-v1'
+
+# Structured Output のJSONスキーマ（リクエストごとに作り直さないようモジュール読み込み時に組み立てる）
+QUALITY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "success_possibility": {
+            "type": "number",
+            "minimum": 0,
+            "maximum": 1,
+            "description": "成約可能性 (0-1)"
+        },
+        "success_possibility_reasoning": {
+            "type": "string",
+            "description": "成約可能性の詳細な根拠説明"
+        },
+        "patient_understanding": {
+            "type": "number", 
+            "minimum": 0,
+            "maximum": 1,
+            "description": "患者理解度 (0-1)"
+        },
+        "patient_understanding_reasoning": {
+            "type": "string",
+            "description": "患者理解度の詳細な根拠説明"
+        },
+        "treatment_consent_likelihood": {
+            "type": "number",
+            "minimum": 0,
+            "maximum": 1,
+            "description": "治療同意可能性 (0-1)"
+        },
+        "treatment_consent_reasoning": {
+            "type": "string",
+            "description": "治療同意可能性の詳細な根拠説明"
+        },
+        "improvement_suggestions": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "改善提案リスト"
+        },
+        "positive_aspects": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "良い点のリスト"
+        },
+        "confidence": {
+            "type": "number",
+            "minimum": 0,
+            "maximum": 1,
+            "description": "分析の信頼度"
+        }
+    },
+    "required": [
+        "success_possibility", "success_possibility_reasoning",
+        "patient_understanding", "patient_understanding_reasoning", 
+        "treatment_consent_likelihood", "treatment_consent_reasoning",
+        "improvement_suggestions", "positive_aspects", "confidence"
+    ],
+    "additionalProperties": False
+}
+
+IDENTIFY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "patient_name": {"type": "string"},
+        "doctor_name": {"type": "string"},
+        "confidence_patient": {"type": "number", "minimum": 0, "maximum": 1},
+        "confidence_doctor": {"type": "number", "minimum": 0, "maximum": 1},
+        "reasoning": {"type": "string"},
+        "method": {"type": "string"}
+    },
+    "required": ["patient_name", "doctor_name", "confidence_patient", "confidence_doctor", "reasoning", "method"]
+}
+
+SOAP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "S": {"type": "string", "description": "主観的情報"},
+        "O": {"type": "string", "description": "客観的所見"},
+        "A": {"type": "string", "description": "評価・診断"},
+        "P": {"type": "string", "description": "治療計画"},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+        "dental_specifics": {
+            "type": "object",
+            "properties": {
+                "affected_teeth": {"type": "array", "items": {"type": "string"}},
+                "procedures_performed": {"type": "array", "items": {"type": "string"}},
+                "follow_up_needed": {"type": "boolean"}
+            }
+        },
+        "incomplete_info": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["S", "O", "A", "P", "confidence", "dental_specifics", "incomplete_info"]
+}
+
+@instrument_handler('openai_analysis')
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
+            client = create_client()
+            
+            # POSTデータ取得
+            with span('parse'):
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length)
+                request_data = json.loads(post_data.decode('utf-8'))
+            
+            bypass_cache = wants_bypass(self.headers, request_data)
+            
+            # "stream": true ならSSEで各フィールドを完成した順に送る
+            if wants_stream(self.headers, request_data):
+                self._stream(client, request_data, bypass_cache)
+                return
+            
+            result = run_analysis(client, request_data, bypass_cache)
+            
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
@@ -14,33 +145,6 @@ class handler(BaseHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Headers', 'Content-Type')
             self.end_headers()
             
-            # 環境変数からAPIキーを取得
-            openai_key = os.environ.get('OPENAI_API_KEY')
-            if not openai_key:
-                raise Exception("OpenAI API key not found")
-            
-            # OpenAIクライアント初期化
-            client = openai.OpenAI(api_key=openai_key)
-            
-            # POSTデータ取得
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            request_data = json.loads(post_data.decode('utf-8'))
-            
-            conversation_text = request_data.get('content', '')
-            analysis_type = request_data.get('type', 'quality')
-            
-            if analysis_type == 'quality':
-                result = self.analyze_quality_with_gpt41(client, conversation_text)
-            elif analysis_type == 'identification':
-                result = self.identify_speakers_with_gpt41(client, conversation_text)
-            elif analysis_type == 'soap':
-                result = self.convert_to_soap_with_gpt41(client, conversation_text, 
-                                                       request_data.get('patient_name', '患者'),
-                                                       request_data.get('doctor_name', '医師'))
-            else:
-                raise Exception(f"Unknown analysis type: {analysis_type}")
-            
             self.wfile.write(json.dumps(result, ensure_ascii=False).encode('utf-8'))
             
         except Exception as e:
@@ -57,70 +161,67 @@ class handler(BaseHTTPRequestHandler):
             
             self.wfile.write(json.dumps(error_response).encode('utf-8'))
     
-    def analyze_quality_with_gpt41(self, client, conversation_text):
-        """GPT-4.1による高精度品質分析"""
-        
-        # Structured Output用のJSONスキーマ定義
-        quality_schema = {
-            "type": "object",
-            "properties": {
-                "success_possibility": {
-                    "type": "number",
-                    "minimum": 0,
-                    "maximum": 1,
-                    "description": "成約可能性 (0-1)"
-                },
-                "success_possibility_reasoning": {
-                    "type": "string",
-                    "description": "成約可能性の詳細な根拠説明"
-                },
-                "patient_understanding": {
-                    "type": "number", 
-                    "minimum": 0,
-                    "maximum": 1,
-                    "description": "患者理解度 (0-1)"
-                },
-                "patient_understanding_reasoning": {
-                    "type": "string",
-                    "description": "患者理解度の詳細な根拠説明"
-                },
-                "treatment_consent_likelihood": {
-                    "type": "number",
-                    "minimum": 0,
-                    "maximum": 1,
-                    "description": "治療同意可能性 (0-1)"
-                },
-                "treatment_consent_reasoning": {
-                    "type": "string",
-                    "description": "治療同意可能性の詳細な根拠説明"
-                },
-                "improvement_suggestions": {
-                    "type": "array",
-                    "items": {"type": "string"},
-                    "description": "改善提案リスト"
-                },
-                "positive_aspects": {
-                    "type": "array",
-                    "items": {"type": "string"},
-                    "description": "良い点のリスト"
-                },
-                "confidence": {
-                    "type": "number",
-                    "minimum": 0,
-                    "maximum": 1,
-                    "description": "分析の信頼度"
-                }
-            },
-            "required": [
-                "success_possibility", "success_possibility_reasoning",
-                "patient_understanding", "patient_understanding_reasoning", 
-                "treatment_consent_likelihood", "treatment_consent_reasoning",
-                "improvement_suggestions", "positive_aspects", "confidence"
-            ],
-            "additionalProperties": False
-        }
+    def _stream(self, client, request_data, bypass_cache):
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
         
-        prompt = f"""あなたは歯科医療コミュニケーションの専門分析AIです。以下の歯科診療会話を詳細に分析し、医療ビジネスの観点から評価してください。
+        try:
+            for event, data in stream_analysis(client, request_data, bypass_cache):
+                self.wfile.write(format_sse(event, data))
+                self.wfile.flush()
+        except Exception as e:
+            error_response = {
+                "status": "error",
+                "error": str(e),
+                "timestamp": datetime.utcnow().isoformat() + "Z"
+            }
+            self.wfile.write(format_sse('error', error_response))
+    
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
+
+
+def create_client():
+    """環境変数の設定でOpenAIクライアントを作成する"""
+    # 環境変数からAPIキーを取得
+    openai_key = os.environ.get('OPENAI_API_KEY')
+    if not openai_key:
+        raise Exception("OpenAI API key not found")
+    
+    # OpenAIクライアント（ウォームインスタンスでは接続プールごと使い回す）
+    return openai_client('openai', openai_key)
+
+
+def run_analysis(client, request_data, bypass_cache=False):
+    """リクエストの type に応じて分析を実行する（単発・バッチ共通）"""
+    conversation_text = request_data.get('content', '')
+    analysis_type = request_data.get('type', 'quality')
+    
+    if analysis_type == 'quality':
+        return analyze_quality_with_gpt41(client, conversation_text, bypass_cache)
+    elif analysis_type == 'identification':
+        return identify_speakers_with_gpt41(client, conversation_text, bypass_cache)
+    elif analysis_type == 'soap':
+        return convert_to_soap_with_gpt41(client, conversation_text,
+                                           request_data.get('patient_name', '患者'),
+                                           request_data.get('doctor_name', '医師'),
+                                           bypass_cache)
+    else:
+        raise Exception(f"Unknown analysis type: {analysis_type}")
+
+
+def _quality_request(conversation_text):
+    """品質分析のリクエスト（chat.completions.create の引数）"""
+    prompt = f"""あなたは歯科医療コミュニケーションの専門分析AIです。以下の歯科診療会話を詳細に分析し、医療ビジネスの観点から評価してください。
 
 【分析対象の会話】
 {conversation_text}
@@ -155,47 +256,58 @@ class handler(BaseHTTPRequestHandler):
 各評価の根拠説明では、会話中の具体的な発言を引用し、なぜその評価になったかを詳しく説明してください。
 
 改善提案と良い点も具体的に挙げてください。"""
+    
+    return dict(
+        model="gpt-4",
+        messages=[
+            {"role": "system", "content": "あなたは歯科医療コミュニケーションの専門分析AIです。正確で詳細な分析を行い、構造化されたJSONで結果を返してください。"},
+            {"role": "user", "content": prompt}
+        ],
+        response_format={
+            "type": "json_schema",
+            "json_schema": {
+                "name": "quality_analysis",
+                "schema": QUALITY_SCHEMA
+            }
+        },
+        temperature=0.1,  # 一貫性を重視
+        max_tokens=2000
+    )
 
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "あなたは歯科医療コミュニケーションの専門分析AIです。正確で詳細な分析を行い、構造化されたJSONで結果を返してください。"},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "quality_analysis",
-                    "schema": quality_schema
-                }
-            },
-            temperature=0.1,  # 一貫性を重視
-            max_tokens=2000
-        )
-        
-        result = json.loads(response.choices[0].message.content)
-        result["method"] = "gpt-4.1_structured_analysis"
+def analyze_quality_with_gpt41(client, conversation_text, bypass_cache=False):
+    """GPT-4.1による高精度品質分析"""
+    
+    # 予算（PROMPT_TOKEN_BUDGET）を超える会話は重要度の低い発話を落としてから送る
+    conversation_text, compaction = compact_for_prompt(conversation_text, 'openai_quality')
+    
+    # 長い会話は発話境界で分割して並行分析し、スコアを統合する
+    chunks = chunk_transcript(conversation_text)
+    if len(chunks) > 1:
+        result = map_reduce(chunks, lambda chunk: analyze_quality_with_gpt41(client, chunk, bypass_cache))
+        result["method"] = "gpt-4.1_structured_analysis_chunked"
         result["timestamp"] = datetime.utcnow().isoformat() + "Z"
-        
-        return result
+        return _with_compaction(result, compaction)
     
-    def identify_speakers_with_gpt41(self, client, conversation_text):
-        """GPT-4.1による高精度話者識別"""
-        
-        identification_schema = {
-            "type": "object",
-            "properties": {
-                "patient_name": {"type": "string"},
-                "doctor_name": {"type": "string"},
-                "confidence_patient": {"type": "number", "minimum": 0, "maximum": 1},
-                "confidence_doctor": {"type": "number", "minimum": 0, "maximum": 1},
-                "reasoning": {"type": "string"},
-                "method": {"type": "string"}
-            },
-            "required": ["patient_name", "doctor_name", "confidence_patient", "confidence_doctor", "reasoning", "method"]
-        }
-        
-        prompt = f"""以下の歯科診療会話から患者と医師の名前を正確に特定してください。
+    with span('prompt_build'):
+        request = _quality_request(conversation_text)
+    
+    def generate():
+        response = client.chat.completions.create(**request)
+        record_usage('openai', response)
+        return decode_llm_json('openai', 'quality', response.choices[0].message.content, QUALITY_SCHEMA)
+    
+    result = cached_call('openai', 'gpt-4', QUALITY_PROMPT_VERSION, conversation_text, generate,
+                         params={"temperature": 0.1, "max_tokens": 2000},
+                         bypass=bypass_cache)
+    result["method"] = "gpt-4.1_structured_analysis"
+    result["timestamp"] = datetime.utcnow().isoformat() + "Z"
+    
+    return _with_compaction(result, compaction)
+
+def identify_speakers_with_gpt41(client, conversation_text, bypass_cache=False):
+    """GPT-4.1による高精度話者識別"""
+    
+    prompt = f"""以下の歯科診療会話から患者と医師の名前を正確に特定してください。
 
 【会話内容】
 {conversation_text}
@@ -209,6 +321,7 @@ class handler(BaseHTTPRequestHandler):
 
 事実に基づいて正確に特定してください。"""
 
+    def generate():
         response = client.chat.completions.create(
             model="gpt-4",
             messages=[
@@ -219,39 +332,21 @@ class handler(BaseHTTPRequestHandler):
                 "type": "json_schema", 
                 "json_schema": {
                     "name": "speaker_identification",
-                    "schema": identification_schema
+                    "schema": IDENTIFY_SCHEMA
                 }
             },
             temperature=0.1
         )
-        
-        return json.loads(response.choices[0].message.content)
+        record_usage('openai', response)
+        return decode_llm_json('openai', 'identify', response.choices[0].message.content, IDENTIFY_SCHEMA)
     
-    def convert_to_soap_with_gpt41(self, client, conversation_text, patient_name, doctor_name):
-        """GPT-4.1による高精度SOAP形式変換"""
-        
-        soap_schema = {
-            "type": "object",
-            "properties": {
-                "S": {"type": "string", "description": "主観的情報"},
-                "O": {"type": "string", "description": "客観的所見"},
-                "A": {"type": "string", "description": "評価・診断"},
-                "P": {"type": "string", "description": "治療計画"},
-                "confidence": {"type": "number", "minimum": 0, "maximum": 1},
-                "dental_specifics": {
-                    "type": "object",
-                    "properties": {
-                        "affected_teeth": {"type": "array", "items": {"type": "string"}},
-                        "procedures_performed": {"type": "array", "items": {"type": "string"}},
-                        "follow_up_needed": {"type": "boolean"}
-                    }
-                },
-                "incomplete_info": {"type": "array", "items": {"type": "string"}}
-            },
-            "required": ["S", "O", "A", "P", "confidence", "dental_specifics", "incomplete_info"]
-        }
-        
-        prompt = f"""あなたは歯科医療記録の専門家です。以下の歯科診療会話をSOAP形式の診療記録に変換してください。
+    return cached_call('openai', 'gpt-4', IDENTIFY_PROMPT_VERSION, conversation_text, generate,
+                       params={"temperature": 0.1},
+                       bypass=bypass_cache)
+
+def _soap_request(conversation_text, patient_name, doctor_name):
+    """SOAP変換のリクエスト（chat.completions.create の引数）"""
+    prompt = f"""あなたは歯科医療記録の専門家です。以下の歯科診療会話をSOAP形式の診療記録に変換してください。
 
 【会話内容】
 {conversation_text}
@@ -299,29 +394,105 @@ class handler(BaseHTTPRequestHandler):
 - 推測や解釈は避け、記録された事実のみを使用
 - 部位不明な場合は「部位不明」と明記
 - 数値データは正確に転記"""
+    
+    return dict(
+        model="gpt-4",
+        messages=[
+            {"role": "system", "content": "あなたは歯科医療記録の専門家です。正確で詳細なSOAP記録を作成し、構造化されたJSONで結果を返してください。"},
+            {"role": "user", "content": prompt}
+        ],
+        response_format={
+            "type": "json_schema",
+            "json_schema": {
+                "name": "soap_conversion", 
+                "schema": SOAP_SCHEMA
+            }
+        },
+        temperature=0.1,
+        max_tokens=2000
+    )
 
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "あなたは歯科医療記録の専門家です。正確で詳細なSOAP記録を作成し、構造化されたJSONで結果を返してください。"},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "soap_conversion", 
-                    "schema": soap_schema
-                }
-            },
-            temperature=0.1,
-            max_tokens=2000
-        )
-        
-        return json.loads(response.choices[0].message.content)
+def convert_to_soap_with_gpt41(client, conversation_text, patient_name, doctor_name, bypass_cache=False):
+    """GPT-4.1による高精度SOAP形式変換"""
     
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
\ No newline at end of file
+    # 予算（PROMPT_TOKEN_BUDGET）を超える会話は重要度の低い発話を落としてから送る
+    conversation_text, compaction = compact_for_prompt(conversation_text, 'openai_soap')
+    
+    # 長い会話は発話境界で分割して並行変換し、SOAP各欄を統合する
+    chunks = chunk_transcript(conversation_text)
+    if len(chunks) > 1:
+        result = map_reduce(chunks, lambda chunk: convert_to_soap_with_gpt41(client, chunk, patient_name, doctor_name,
+                                                                             bypass_cache))
+        return _with_compaction(result, compaction)
+    
+    with span('prompt_build'):
+        request = _soap_request(conversation_text, patient_name, doctor_name)
+    
+    def generate():
+        response = client.chat.completions.create(**request)
+        record_usage('openai', response)
+        return decode_llm_json('openai', 'soap', response.choices[0].message.content, SOAP_SCHEMA)
+    
+    result = cached_call('openai', 'gpt-4', SOAP_PROMPT_VERSION, conversation_text, generate,
+                         params={"patient_name": patient_name, "doctor_name": doctor_name, "temperature": 0.1, "max_tokens": 2000},
+                         bypass=bypass_cache)
+    return _with_compaction(result, compaction)
+
+def _with_compaction(result, compaction):
+    """プロンプトを圧縮した場合は統計を結果の compaction に入れる"""
+    if compaction:
+        result["compaction"] = compaction
+    return result
+
+def stream_analysis(client, request_data, bypass_cache=False):
+    """SOAP変換・品質分析をストリーミングで実行し、SSEイベント (event, data) を順に yield する
+
+    トップレベルの各フィールド（S/O/A/P、各スコア）が閉じるたびに field イベントを送り、
+    最後に通常の応答と同じ内容の result イベントを送る。
+    それ以外の解析タイプと、分割解析が必要な長い会話は通常どおり解析して result だけを送る。
+    """
+    conversation_text = request_data.get('content', '')
+    analysis_type = request_data.get('type', 'quality')
+    compaction = None
+    if analysis_type in ('quality', 'soap'):
+        conversation_text, compaction = compact_for_prompt(conversation_text, f'openai_{analysis_type}')
+    if analysis_type not in ('quality', 'soap') or len(chunk_transcript(conversation_text)) > 1:
+        # 圧縮済みの会話を渡す（予算以下なので再度は圧縮されない）
+        result = run_analysis(client, dict(request_data, content=conversation_text), bypass_cache)
+        yield 'result', _with_compaction(result, compaction)
+        return
+    
+    if analysis_type == 'quality':
+        with span('prompt_build'):
+            request = _quality_request(conversation_text)
+        version = QUALITY_PROMPT_VERSION
+        params = {}
+        decoder = TolerantJSONDecoder('openai', 'quality', QUALITY_SCHEMA)
+    else:
+        patient_name = request_data.get('patient_name', '患者')
+        doctor_name = request_data.get('doctor_name', '医師')
+        with span('prompt_build'):
+            request = _soap_request(conversation_text, patient_name, doctor_name)
+        version = SOAP_PROMPT_VERSION
+        params = {"patient_name": patient_name, "doctor_name": doctor_name}
+        decoder = TolerantJSONDecoder('openai', 'soap', SOAP_SCHEMA)
+    # キャッシュキーは通常の呼び出しと同じにする
+    params.update(temperature=request['temperature'], max_tokens=request['max_tokens'])
+    
+    cached = None if bypass_cache else cache_lookup('openai', 'gpt-4', version, conversation_text, params)
+    if cached is not None:
+        deltas = [json.dumps(cached, ensure_ascii=False)]
+    else:
+        # 通常の呼び出しと同じくブレーカーと稼働統計（レイテンシ・エラー率）に通す
+        deltas = guarded_stream('openai', 'gpt-4', iter_completion_text(client, request))
+    yield from stream_fields(deltas, decoder)
+    
+    # 受信中に集めたフィールドを使い、途中で切れた応答も読めたところまで結果にする
+    result = decoder.finish()
+    # 途中で切れた・必須フィールドの欠けた結果はキャッシュに残さない
+    if cached is None and is_complete(result):
+        cache_store('openai', 'gpt-4', version, conversation_text, result, params)
+    if analysis_type == 'quality':
+        result["method"] = "gpt-4.1_structured_analysis"
+        result["timestamp"] = datetime.utcnow().isoformat() + "Z"
+    yield 'result', _with_compaction(result, compaction)
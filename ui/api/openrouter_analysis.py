@@ -1,12 +1,105 @@
 from http.server import BaseHTTPRequestHandler
 import json
 import os
+import sys
 from datetime import datetime
-import openai
 
+_API_DIR = os.path.dirname(os.path.abspath(__file__))
+if _API_DIR not in sys.path:
+    sys.path.insert(0, _API_DIR)
+
+from _lib.chunking import chunk_transcript, map_reduce
+from _lib.clients import openai_client, prewarm_from_env
+from _lib.compaction import compact_for_prompt
+from _lib.llm_cache import cache_lookup, cache_store, cached_call, guarded_stream, wants_bypass
+from _lib.llm_json import OPENAI_JSON_MODE, TolerantJSONDecoder, decode_llm_json, is_complete
+from _lib.streaming import format_sse, iter_completion_text, stream_fields, wants_stream
+from _lib.telemetry import instrument_handler, record_usage, span
+
+# LLM_PREWARM が設定されていれば SDK の読み込みとクライアント生成を import 時に済ませる
+prewarm_from_env()
+
+QUALITY_PROMPT_VERSION = 'openrouter-quality-v1'
+IDENTIFY_PROMPT_VERSION = 'openrouter-identify-v1'
+SOAP_PROMPT_VERSION = 'openrouter-soap-v1'
+
+# 応答の検証に使うスキーマ（json_object モードはスキーマを強制しないので、読んだ後に型を直す）
+_SCORE = {"type": "number", "minimum": 0, "maximum": 1}
+_STRINGS = {"type": "array", "items": {"type": "string"}}
+QUALITY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "success_possibility": _SCORE,
+        "success_possibility_reasoning": {"type": "string"},
+        "patient_understanding": _SCORE,
+        "patient_understanding_reasoning": {"type": "string"},
+        "treatment_consent_likelihood": _SCORE,
+        "treatment_consent_reasoning": {"type": "string"},
+        "communication_quality": _SCORE,
+        "communication_quality_reasoning": {"type": "string"},
+        "doctor_explanation": _SCORE,
+        "doctor_explanation_reasoning": {"type": "string"},
+        "improvement_suggestions": _STRINGS,
+        "positive_aspects": _STRINGS,
+        "confidence": _SCORE
+    },
+    "required": ["success_possibility", "patient_understanding", "treatment_consent_likelihood"]
+}
+
+IDENTIFY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "patient_name": {"type": "string"},
+        "doctor_name": {"type": "string"},
+        "confidence_patient": _SCORE,
+        "confidence_doctor": _SCORE,
+        "reasoning": {"type": "string"}
+    },
+    "required": ["patient_name", "doctor_name"]
+}
+
+SOAP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "S": {"type": "string"},
+        "O": {"type": "string"},
+        "A": {"type": "string"},
+        "P": {"type": "string"},
+        "confidence": _SCORE,
+        "dental_specifics": {
+            "type": "object",
+            "properties": {
+                "affected_teeth": _STRINGS,
+                "procedures_performed": _STRINGS,
+                "follow_up_needed": {"type": "boolean"}
+            }
+        },
+        "incomplete_info": _STRINGS
+    },
+    "required": ["S", "O", "A", "P"]
+}
+
+@instrument_handler('openrouter_analysis')
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
+            client = create_client()
+            
+            # POSTデータ取得
+            with span('parse'):
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length)
+                request_data = json.loads(post_data.decode('utf-8'))
+            
+            bypass_cache = wants_bypass(self.headers, request_data)
+            
+            # "stream": true ならSSEで各フィールドを完成した順に送る
+            if wants_stream(self.headers, request_data):
+                self._stream(client, request_data, bypass_cache)
+                return
+            
+            result = run_analysis(client, request_data, bypass_cache)
+            
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
@@ -14,38 +107,6 @@ class handler(BaseHTTPRequestHandler):
             self.send_header('Access-Control-Allow-Headers', 'Content-Type')
             self.end_headers()
             
-            # 環境変数からOpenRouter APIキーを取得
-            openrouter_key = os.environ.get('OPENROUTER_API_KEY')
-            openrouter_base_url = os.environ.get('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')
-            
-            if not openrouter_key:
-                raise Exception("OpenRouter API key not found")
-            
-            # OpenRouterクライアント初期化（OpenAI SDKを使用、base_urlを変更）
-            client = openai.OpenAI(
-                api_key=openrouter_key,
-                base_url=openrouter_base_url
-            )
-            
-            # POSTデータ取得
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            request_data = json.loads(post_data.decode('utf-8'))
-            
-            conversation_text = request_data.get('content', '')
-            analysis_type = request_data.get('type', 'quality')
-            
-            if analysis_type == 'quality':
-                result = self.analyze_quality_with_gpt5(client, conversation_text)
-            elif analysis_type == 'identification':
-                result = self.identify_speakers_with_gpt5(client, conversation_text)
-            elif analysis_type == 'soap':
-                result = self.convert_to_soap_with_gpt5(client, conversation_text, 
-                                                       request_data.get('patient_name', '患者'),
-                                                       request_data.get('doctor_name', '医師'))
-            else:
-                raise Exception(f"Unknown analysis type: {analysis_type}")
-            
             self.wfile.write(json.dumps(result, ensure_ascii=False).encode('utf-8'))
             
         except Exception as e:
@@ -63,11 +124,70 @@ class handler(BaseHTTPRequestHandler):
             
             self.wfile.write(json.dumps(error_response).encode('utf-8'))
     
-    def analyze_quality_with_gpt5(self, client, conversation_text):
-        """GPT-5 via OpenRouterによる最高精度品質分析"""
+    def _stream(self, client, request_data, bypass_cache):
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
         
-        # GPT-5用の詳細分析プロンプト
-        prompt = f"""あなたは歯科医療コミュニケーションの最高位専門分析AIです。GPT-5の高度な推論能力を活用し、以下の歯科診療会話を最高精度で分析してください。
+        try:
+            for event, data in stream_analysis(client, request_data, bypass_cache):
+                self.wfile.write(format_sse(event, data))
+                self.wfile.flush()
+        except Exception as e:
+            error_response = {
+                "status": "error",
+                "error": str(e),
+                "timestamp": datetime.utcnow().isoformat() + "Z"
+            }
+            self.wfile.write(format_sse('error', error_response))
+    
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
+
+
+def create_client():
+    """環境変数の設定でOpenRouterクライアントを作成する"""
+    # 環境変数からOpenRouter APIキーを取得
+    openrouter_key = os.environ.get('OPENROUTER_API_KEY')
+    openrouter_base_url = os.environ.get('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')
+    
+    if not openrouter_key:
+        raise Exception("OpenRouter API key not found")
+    
+    # OpenRouterクライアント（OpenAI SDKを使用、base_urlを変更。接続プールごと使い回す）
+    return openai_client('openrouter', openrouter_key, openrouter_base_url)
+
+
+def run_analysis(client, request_data, bypass_cache=False):
+    """リクエストの type に応じて分析を実行する（単発・バッチ共通）"""
+    conversation_text = request_data.get('content', '')
+    analysis_type = request_data.get('type', 'quality')
+    
+    if analysis_type == 'quality':
+        return analyze_quality_with_gpt5(client, conversation_text, bypass_cache)
+    elif analysis_type == 'identification':
+        return identify_speakers_with_gpt5(client, conversation_text, bypass_cache)
+    elif analysis_type == 'soap':
+        return convert_to_soap_with_gpt5(client, conversation_text,
+                                           request_data.get('patient_name', '患者'),
+                                           request_data.get('doctor_name', '医師'),
+                                           bypass_cache)
+    else:
+        raise Exception(f"Unknown analysis type: {analysis_type}")
+
+
+def _quality_request(conversation_text):
+    """品質分析のリクエスト（chat.completions.create の引数）"""
+    # GPT-5用の詳細分析プロンプト
+    prompt = f"""あなたは歯科医療コミュニケーションの最高位専門分析AIです。GPT-5の高度な推論能力を活用し、以下の歯科診療会話を最高精度で分析してください。
 
 【分析対象の会話】
 {conversation_text}
@@ -129,66 +249,83 @@ class handler(BaseHTTPRequestHandler):
   "confidence": 数値,
   "method": "gpt-5_openrouter_analysis"
 }}"""
+    
+    return dict(
+        model="gpt-5-chat",
+        messages=[
+            {"role": "system", "content": "あなたはGPT-5の能力を最大限活用する歯科医療コミュニケーション最高位専門分析AIです。極めて正確で詳細な分析を行い、必ずJSONフォーマットで結果を返してください。"},
+            {"role": "user", "content": prompt}
+        ],
+        response_format=OPENAI_JSON_MODE,
+        temperature=0.1,  # 一貫性重視
+        max_tokens=3000
+    )
 
-        response = client.chat.completions.create(
-            model="gpt-5-chat",
-            messages=[
-                {"role": "system", "content": "あなたはGPT-5の能力を最大限活用する歯科医療コミュニケーション最高位専門分析AIです。極めて正確で詳細な分析を行い、必ずJSONフォーマットで結果を返してください。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1,  # 一貫性重視
-            max_tokens=3000
-        )
-        
-        result_text = response.choices[0].message.content
-        
-        # JSONの抽出と解析
-        try:
-            # JSONブロックの抽出（```json...```形式対応）
-            if "```json" in result_text:
-                json_start = result_text.find("```json") + 7
-                json_end = result_text.find("```", json_start)
-                json_content = result_text[json_start:json_end].strip()
-            elif "{" in result_text and "}" in result_text:
-                json_start = result_text.find("{")
-                json_end = result_text.rfind("}") + 1
-                json_content = result_text[json_start:json_end]
-            else:
-                raise ValueError("JSONが見つかりません")
-                
-            result = json.loads(json_content)
-            
-        except (json.JSONDecodeError, ValueError) as e:
-            # JSONパースエラーの場合、デフォルト構造で応答
-            result = {
-                "success_possibility": 0.5,
-                "success_possibility_reasoning": "GPT-5応答のJSONパースエラーのためデフォルト値を使用",
-                "patient_understanding": 0.5,
-                "patient_understanding_reasoning": "GPT-5応答のJSONパースエラーのためデフォルト値を使用",
-                "treatment_consent_likelihood": 0.5,
-                "treatment_consent_reasoning": "GPT-5応答のJSONパースエラーのためデフォルト値を使用",
-                "communication_quality": 0.5,
-                "communication_quality_reasoning": "GPT-5応答のJSONパースエラーのためデフォルト値を使用",
-                "doctor_explanation": 0.5,
-                "doctor_explanation_reasoning": "GPT-5応答のJSONパースエラーのためデフォルト値を使用",
-                "improvement_suggestions": ["GPT-5応答解析エラーのため詳細分析不可"],
-                "positive_aspects": ["GPT-5応答解析エラーのため詳細分析不可"],
-                "confidence": 0.3,
-                "method": "gpt-5_openrouter_fallback",
-                "parse_error": str(e),
-                "raw_response": result_text[:500]
-            }
-        
+def _quality_parse_error(error):
+    """スコアを1つも読めなかった応答の代わりに返すデフォルト構造"""
+    return {
+        "success_possibility": 0.5,
+        "success_possibility_reasoning": "GPT-5応答のJSONパースエラーのためデフォルト値を使用",
+        "patient_understanding": 0.5,
+        "patient_understanding_reasoning": "GPT-5応答のJSONパースエラーのためデフォルト値を使用",
+        "treatment_consent_likelihood": 0.5,
+        "treatment_consent_reasoning": "GPT-5応答のJSONパースエラーのためデフォルト値を使用",
+        "communication_quality": 0.5,
+        "communication_quality_reasoning": "GPT-5応答のJSONパースエラーのためデフォルト値を使用",
+        "doctor_explanation": 0.5,
+        "doctor_explanation_reasoning": "GPT-5応答のJSONパースエラーのためデフォルト値を使用",
+        "improvement_suggestions": ["GPT-5応答解析エラーのため詳細分析不可"],
+        "positive_aspects": ["GPT-5応答解析エラーのため詳細分析不可"],
+        "confidence": 0.3,
+        "method": "gpt-5_openrouter_fallback",
+        "parse_error": str(error)
+    }
+
+def _quality_result(result):
+    """デコード済みの品質分析結果に時刻とプロバイダを付ける"""
+    result["timestamp"] = datetime.utcnow().isoformat() + "Z"
+    result["provider"] = "openrouter"
+    result["model"] = "gpt-5"
+    return result
+
+def analyze_quality_with_gpt5(client, conversation_text, bypass_cache=False):
+    """GPT-5 via OpenRouterによる最高精度品質分析"""
+    
+    # 予算（PROMPT_TOKEN_BUDGET）を超える会話は重要度の低い発話を落としてから送る
+    conversation_text, compaction = compact_for_prompt(conversation_text, 'openrouter_quality')
+    
+    # 長い会話は発話境界で分割して並行分析し、スコアを統合する
+    chunks = chunk_transcript(conversation_text)
+    if len(chunks) > 1:
+        result = map_reduce(chunks, lambda chunk: analyze_quality_with_gpt5(client, chunk, bypass_cache))
+        result["method"] = "gpt-5_openrouter_chunked"
         result["timestamp"] = datetime.utcnow().isoformat() + "Z"
-        result["provider"] = "openrouter"
-        result["model"] = "gpt-5"
-        
-        return result
+        return _with_compaction(result, compaction)
     
-    def identify_speakers_with_gpt5(self, client, conversation_text):
-        """GPT-5による超高精度話者識別"""
-        
-        prompt = f"""あなたはGPT-5の高度言語理解能力を活用する話者識別専門AIです。以下の歯科診療会話から患者と医師を最高精度で特定してください。
+    with span('prompt_build'):
+        request = _quality_request(conversation_text)
+    
+    def generate():
+        response = client.chat.completions.create(**request)
+        record_usage('openrouter', response)
+        # コードフェンスや途中で切れたJSONも修復して読む。読めない応答は例外にしてキャッシュに残さない
+        return decode_llm_json('openrouter', 'quality', response.choices[0].message.content, QUALITY_SCHEMA)
+    
+    try:
+        result = cached_call('openrouter', 'gpt-5-chat', QUALITY_PROMPT_VERSION, conversation_text, generate,
+                             params={"temperature": 0.1, "max_tokens": 3000},
+                             bypass=bypass_cache)
+    except ValueError as e:
+        # スコアを1つも読めなかった場合だけ、デフォルト構造で応答
+        result = _quality_parse_error(e)
+    
+    with span('post_process'):
+        return _with_compaction(_quality_result(result), compaction)
+
+def identify_speakers_with_gpt5(client, conversation_text, bypass_cache=False):
+    """GPT-5による超高精度話者識別"""
+    
+    prompt = f"""あなたはGPT-5の高度言語理解能力を活用する話者識別専門AIです。以下の歯科診療会話から患者と医師を最高精度で特定してください。
 
 【会話内容】
 {conversation_text}
@@ -209,48 +346,43 @@ class handler(BaseHTTPRequestHandler):
   "method": "gpt-5_openrouter_identification"
 }}"""
 
+    def generate():
         response = client.chat.completions.create(
             model="gpt-5-chat",
             messages=[
                 {"role": "system", "content": "あなたはGPT-5の能力を最大活用する話者識別専門AIです。正確な分析をJSONで返してください。"},
                 {"role": "user", "content": prompt}
             ],
+            response_format=OPENAI_JSON_MODE,
             temperature=0.1,
             max_tokens=1000
         )
-        
-        result_text = response.choices[0].message.content
-        
-        try:
-            if "```json" in result_text:
-                json_start = result_text.find("```json") + 7
-                json_end = result_text.find("```", json_start)
-                json_content = result_text[json_start:json_end].strip()
-            else:
-                json_start = result_text.find("{")
-                json_end = result_text.rfind("}") + 1
-                json_content = result_text[json_start:json_end]
-                
-            result = json.loads(json_content)
-            
-        except (json.JSONDecodeError, ValueError):
-            result = {
-                "patient_name": "患者",
-                "doctor_name": "医師",
-                "confidence_patient": 0.5,
-                "confidence_doctor": 0.5,
-                "reasoning": "GPT-5応答解析エラーのためデフォルト値を使用",
-                "method": "gpt-5_openrouter_fallback"
-            }
-        
-        result["provider"] = "openrouter"
-        result["model"] = "gpt-5"
-        return result
+        record_usage('openrouter', response)
+        # 読めない応答は例外にしてキャッシュに残さない
+        return decode_llm_json('openrouter', 'identify', response.choices[0].message.content, IDENTIFY_SCHEMA)
     
-    def convert_to_soap_with_gpt5(self, client, conversation_text, patient_name, doctor_name):
-        """GPT-5による最高精度SOAP形式変換"""
+    try:
+        result = cached_call('openrouter', 'gpt-5-chat', IDENTIFY_PROMPT_VERSION, conversation_text, generate,
+                             params={"temperature": 0.1, "max_tokens": 1000},
+                             bypass=bypass_cache)
         
-        prompt = f"""あなたはGPT-5の医療知識とテキスト理解能力を最大活用する歯科SOAP記録専門AIです。以下の診療会話を最高精度でSOAP形式に変換してください。
+    except ValueError:
+        result = {
+            "patient_name": "患者",
+            "doctor_name": "医師",
+            "confidence_patient": 0.5,
+            "confidence_doctor": 0.5,
+            "reasoning": "GPT-5応答解析エラーのためデフォルト値を使用",
+            "method": "gpt-5_openrouter_fallback"
+        }
+    
+    result["provider"] = "openrouter"
+    result["model"] = "gpt-5"
+    return result
+
+def _soap_request(conversation_text, patient_name, doctor_name):
+    """SOAP変換のリクエスト（chat.completions.create の引数）"""
+    prompt = f"""あなたはGPT-5の医療知識とテキスト理解能力を最大活用する歯科SOAP記録専門AIです。以下の診療会話を最高精度でSOAP形式に変換してください。
 
 【会話内容】
 {conversation_text}
@@ -290,61 +422,138 @@ class handler(BaseHTTPRequestHandler):
   "P": "治療計画の詳細記録",
   "confidence": 数値,
   "dental_specifics": {{
-    "affected_teeth": ["影響を受けた歯番号"],
-    "procedures_performed": ["実施された処置"],
-    "follow_up_needed": true/false
+"affected_teeth": ["影響を受けた歯番号"],
+"procedures_performed": ["実施された処置"],
+"follow_up_needed": true/false
   }},
   "incomplete_info": ["不足している情報"],
   "method": "gpt-5_openrouter_soap"
 }}"""
+    
+    return dict(
+        model="gpt-5-chat",
+        messages=[
+            {"role": "system", "content": "あなたはGPT-5の能力を最大活用する歯科SOAP記録専門AIです。正確で詳細な医療記録をJSONで作成してください。"},
+            {"role": "user", "content": prompt}
+        ],
+        response_format=OPENAI_JSON_MODE,
+        temperature=0.1,
+        max_tokens=2500
+    )
 
-        response = client.chat.completions.create(
-            model="gpt-5-chat",
-            messages=[
-                {"role": "system", "content": "あなたはGPT-5の能力を最大活用する歯科SOAP記録専門AIです。正確で詳細な医療記録をJSONで作成してください。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1,
-            max_tokens=2500
-        )
-        
-        result_text = response.choices[0].message.content
-        
-        try:
-            if "```json" in result_text:
-                json_start = result_text.find("```json") + 7
-                json_end = result_text.find("```", json_start)
-                json_content = result_text[json_start:json_end].strip()
-            else:
-                json_start = result_text.find("{")
-                json_end = result_text.rfind("}") + 1
-                json_content = result_text[json_start:json_end]
-                
-            result = json.loads(json_content)
-            
-        except (json.JSONDecodeError, ValueError):
-            result = {
-                "S": "GPT-5応答解析エラーのため詳細分析不可",
-                "O": "GPT-5応答解析エラーのため詳細分析不可",
-                "A": "GPT-5応答解析エラーのため詳細分析不可",
-                "P": "GPT-5応答解析エラーのため詳細分析不可",
-                "confidence": 0.3,
-                "dental_specifics": {
-                    "affected_teeth": [],
-                    "procedures_performed": [],
-                    "follow_up_needed": False
-                },
-                "incomplete_info": ["GPT-5応答解析エラーのため詳細分析不可"],
-                "method": "gpt-5_openrouter_fallback"
-            }
-        
-        result["provider"] = "openrouter"
-        result["model"] = "gpt-5"
-        return result
+def _soap_parse_error():
+    """SOAP記録を読めなかった応答の代わりに返すデフォルト構造"""
+    return {
+        "S": "GPT-5応答解析エラーのため詳細分析不可",
+        "O": "GPT-5応答解析エラーのため詳細分析不可",
+        "A": "GPT-5応答解析エラーのため詳細分析不可",
+        "P": "GPT-5応答解析エラーのため詳細分析不可",
+        "confidence": 0.3,
+        "dental_specifics": {
+            "affected_teeth": [],
+            "procedures_performed": [],
+            "follow_up_needed": False
+        },
+        "incomplete_info": ["GPT-5応答解析エラーのため詳細分析不可"],
+        "method": "gpt-5_openrouter_fallback"
+    }
+
+def _soap_result(result):
+    result["provider"] = "openrouter"
+    result["model"] = "gpt-5"
+    return result
+
+def convert_to_soap_with_gpt5(client, conversation_text, patient_name, doctor_name, bypass_cache=False):
+    """GPT-5による最高精度SOAP形式変換"""
     
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
\ No newline at end of file
+    # 予算（PROMPT_TOKEN_BUDGET）を超える会話は重要度の低い発話を落としてから送る
+    conversation_text, compaction = compact_for_prompt(conversation_text, 'openrouter_soap')
+    
+    # 長い会話は発話境界で分割して並行変換し、SOAP各欄を統合する
+    chunks = chunk_transcript(conversation_text)
+    if len(chunks) > 1:
+        result = map_reduce(chunks, lambda chunk: convert_to_soap_with_gpt5(client, chunk, patient_name, doctor_name,
+                                                                            bypass_cache))
+        return _with_compaction(result, compaction)
+    
+    with span('prompt_build'):
+        request = _soap_request(conversation_text, patient_name, doctor_name)
+    
+    def generate():
+        response = client.chat.completions.create(**request)
+        record_usage('openrouter', response)
+        # コードフェンスや途中で切れたJSONも修復して読む。読めない応答は例外にしてキャッシュに残さない
+        return decode_llm_json('openrouter', 'soap', response.choices[0].message.content, SOAP_SCHEMA)
+    
+    try:
+        result = cached_call('openrouter', 'gpt-5-chat', SOAP_PROMPT_VERSION, conversation_text, generate,
+                             params={"patient_name": patient_name, "doctor_name": doctor_name, "temperature": 0.1, "max_tokens": 2500},
+                             bypass=bypass_cache)
+    except ValueError:
+        result = _soap_parse_error()
+    
+    with span('post_process'):
+        return _with_compaction(_soap_result(result), compaction)
+
+def _with_compaction(result, compaction):
+    """プロンプトを圧縮した場合は統計を結果の compaction に入れる"""
+    if compaction:
+        result["compaction"] = compaction
+    return result
+
+def stream_analysis(client, request_data, bypass_cache=False):
+    """SOAP変換・品質分析をストリーミングで実行し、SSEイベント (event, data) を順に yield する
+
+    トップレベルの各フィールド（S/O/A/P、各スコア）が閉じるたびに field イベントを送り、
+    最後に通常の応答と同じ内容の result イベントを送る。
+    それ以外の解析タイプと、分割解析が必要な長い会話は通常どおり解析して result だけを送る。
+    """
+    conversation_text = request_data.get('content', '')
+    analysis_type = request_data.get('type', 'quality')
+    compaction = None
+    if analysis_type in ('quality', 'soap'):
+        conversation_text, compaction = compact_for_prompt(conversation_text, f'openrouter_{analysis_type}')
+    if analysis_type not in ('quality', 'soap') or len(chunk_transcript(conversation_text)) > 1:
+        # 圧縮済みの会話を渡す（予算以下なので再度は圧縮されない）
+        result = run_analysis(client, dict(request_data, content=conversation_text), bypass_cache)
+        yield 'result', _with_compaction(result, compaction)
+        return
+    
+    if analysis_type == 'quality':
+        with span('prompt_build'):
+            request = _quality_request(conversation_text)
+        version = QUALITY_PROMPT_VERSION
+        params = {}
+        decoder = TolerantJSONDecoder('openrouter', 'quality', QUALITY_SCHEMA)
+    else:
+        patient_name = request_data.get('patient_name', '患者')
+        doctor_name = request_data.get('doctor_name', '医師')
+        with span('prompt_build'):
+            request = _soap_request(conversation_text, patient_name, doctor_name)
+        version = SOAP_PROMPT_VERSION
+        params = {"patient_name": patient_name, "doctor_name": doctor_name}
+        decoder = TolerantJSONDecoder('openrouter', 'soap', SOAP_SCHEMA)
+    # キャッシュキーは通常の呼び出しと同じにする
+    params.update(temperature=request['temperature'], max_tokens=request['max_tokens'])
+    
+    # キャッシュには通常の呼び出しと同じくデコード済みの結果が入っている
+    cached = None if bypass_cache else cache_lookup('openrouter', 'gpt-5-chat', version, conversation_text, params)
+    if cached is not None:
+        deltas = [json.dumps(cached, ensure_ascii=False)]
+    else:
+        # 通常の呼び出しと同じくブレーカーと稼働統計（レイテンシ・エラー率）に通す
+        deltas = guarded_stream('openrouter', 'gpt-5-chat', iter_completion_text(client, request))
+    yield from stream_fields(deltas, decoder)
+    
+    with span('post_process'):
+        try:
+            # 受信中に集めたフィールドを使い、途中で切れた応答も読めたところまで結果にする
+            result = decoder.finish()
+        except ValueError as e:
+            result = _quality_parse_error(e) if analysis_type == 'quality' else _soap_parse_error()
+        else:
+            # 途中で切れた・必須フィールドの欠けた結果はキャッシュに残さない
+            if cached is None and is_complete(result):
+                cache_store('openrouter', 'gpt-5-chat', version, conversation_text, result, params)
+        result = _quality_result(result) if analysis_type == 'quality' else _soap_result(result)
+    yield 'result', _with_compaction(result, compaction)
@@ -0,0 +1,103 @@
+from http.server import BaseHTTPRequestHandler
+import json
+import os
+import sys
+import time
+
+_API_DIR = os.path.dirname(os.path.abspath(__file__))
+if _API_DIR not in sys.path:
+    sys.path.insert(0, _API_DIR)
+
+from _lib.llm_cache import wants_bypass
+from _lib.stages import Stage, run_stages
+from _lib.telemetry import instrument_handler, span
+from _lib.transcript import transcript_from_request
+from identify import identify_speakers
+from soap import convert_to_soap
+from quality import analyze_quality
+
+
+def _soap_stage(conversation_text, data, bypass_cache, transcript):
+    def run(upstream):
+        identification = upstream.get('identify', {})
+        patient_name = data.get('patient_name') or identification.get('patient_name') or '患者'
+        doctor_name = data.get('doctor_name') or identification.get('doctor_name') or '医師'
+        return convert_to_soap(conversation_text, patient_name, doctor_name, bypass_cache=bypass_cache,
+                               transcript=transcript)
+    return run
+
+
+def analyze_session(conversation_text, data=None, bypass_cache=False):
+    """識別・SOAP・品質分析を1リクエストで実行する
+
+    SOAPは識別結果（患者名・医師名）に依存するため識別完了後に開始し、
+    品質分析は識別・SOAPの結果を使わないので最初から並行実行する。
+    会話は最初に1回だけ Transcript に読み込み、各段階で共有する。
+    """
+    data = data or {}
+    started = time.perf_counter()
+    with span('transcript'):
+        transcript = transcript_from_request(data, conversation_text)
+
+    stages = [
+        Stage('identify', lambda upstream: identify_speakers(conversation_text, bypass_cache=bypass_cache,
+                                                            transcript=transcript)),
+        Stage('soap', _soap_stage(conversation_text, data, bypass_cache, transcript), deps=('identify',)),
+        Stage('quality', lambda upstream: analyze_quality(conversation_text, data.get('soap', {}),
+                                                          bypass_cache=bypass_cache, transcript=transcript)),
+    ]
+    results, timings = run_stages(stages)
+
+    timings_ms = {name: round(ms, 1) for name, ms in timings.items()}
+    timings_ms['total'] = round((time.perf_counter() - started) * 1000, 1)
+
+    return {
+        "identification": results['identify'],
+        "soap": results['soap'],
+        "quality": results['quality'],
+        "transcript": {
+            "utterances": len(transcript),
+            "duration_seconds": transcript.duration()
+        },
+        "timings_ms": timings_ms,
+        "method": "pipeline_dependency_graph"
+    }
+
+
+@instrument_handler('pipeline')
+class handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        try:
+            # CORS headers
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+            self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+            self.end_headers()
+            
+            # Parse request（会話データは1回だけ受け取る）
+            with span('parse'):
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length)
+                data = json.loads(post_data.decode('utf-8'))
+            
+            conversation_text = data.get('content', '')
+            result = analyze_session(conversation_text, data, bypass_cache=wants_bypass(self.headers, data))
+            
+            self.wfile.write(json.dumps(result, ensure_ascii=False).encode('utf-8'))
+            
+        except Exception as e:
+            self.send_response(500)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            error_response = {"error": str(e), "fallback": True}
+            self.wfile.write(json.dumps(error_response).encode())
+    
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
@@ -1,8 +1,63 @@
 from http.server import BaseHTTPRequestHandler
+import importlib
 import json
 import os
 import re
+import sys
 
+_API_DIR = os.path.dirname(os.path.abspath(__file__))
+if _API_DIR not in sys.path:
+    sys.path.insert(0, _API_DIR)
+
+from _lib.keywords import KeywordMatcher
+from _lib.cascade import METHOD as CASCADE_METHOD, cascade_enabled, decide, observe_llm_result
+from _lib.circuit_breaker import CircuitOpen
+from _lib.clients import gemini_model, prewarm_from_env
+from _lib.compaction import compact_for_prompt
+from _lib.llm_cache import cached_call, wants_bypass
+from _lib.router import RouterError, route, routed_providers
+from _lib.llm_json import GEMINI_JSON_MODE, decode_llm_json
+from _lib.telemetry import instrument_handler, record_fallback, record_usage, span
+from _lib.transcript import DOCTOR, PATIENT, Transcript, transcript_from_request
+
+# LLM_PREWARM が設定されていれば SDK の読み込みとクライアント生成を import 時に済ませる
+prewarm_from_env()
+
+PROMPT_VERSION = 'gemini-quality-v1'
+FALLBACK_METHOD = 'pattern_based_quality_analysis'
+QUALITY_SCORES = ('success_possibility', 'patient_understanding', 'treatment_consent')
+# 応答の検証に使うスキーマ（型の修正と必須フィールドの確認）
+QUALITY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        **{score: {"type": "number", "minimum": 0, "maximum": 1}
+           for score in QUALITY_SCORES + ('overall_quality', 'confidence')},
+        "improvements": {"type": "array", "items": {"type": "string"}},
+        "positives": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": list(QUALITY_SCORES)
+}
+# ヘッジ/レースで使う OpenAI / OpenRouter の品質分析（モジュール名, 関数名）
+CHAT_QUALITY = {
+    'openai': ('openai_analysis', 'analyze_quality_with_gpt41'),
+    'openrouter': ('openrouter_analysis', 'analyze_quality_with_gpt5'),
+}
+
+QUALITY_KEYWORDS = KeywordMatcher({
+    'patient_marker': ['患者', 'Patient'],
+    'doctor_marker': ['医師', 'Doctor', 'Dr.'],
+    'success': ['はい', 'お願いします', 'やります', '受けます', '同意', 'よろしく'],
+    'hesitation': ['考えさせて', '迷って', '不安', '心配', '高い', '費用'],
+    'understanding': ['分かりました', 'なるほど', '理解', 'わかります'],
+    'confusion': ['分からない', 'よくわからない', '難しい'],
+    'consent': ['治療', '処置', '次回', '予約'],
+})
+PATIENT_MARKERS = QUALITY_KEYWORDS.tables['patient_marker']
+# 患者の発言中の種類数を数えるカテゴリ
+PATIENT_SIGNALS = ('success', 'hesitation', 'understanding', 'confusion')
+DOCTOR_MARKERS = QUALITY_KEYWORDS.tables['doctor_marker']
+
+@instrument_handler('quality')
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
@@ -15,19 +70,16 @@ class handler(BaseHTTPRequestHandler):
             self.end_headers()
             
             # Parse request
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+            with span('parse'):
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length)
+                data = json.loads(post_data.decode('utf-8'))
             
             conversation_text = data.get('content', '')
             soap_data = data.get('soap', {})
             
-            # Gemini API処理
-            api_key = os.environ.get('GEMINI_API_KEY')
-            if api_key and len(conversation_text) > 10:
-                result = self._gemini_quality(conversation_text, soap_data, api_key)
-            else:
-                result = self._fallback_quality(conversation_text, soap_data)
+            result = analyze_quality(conversation_text, soap_data, bypass_cache=wants_bypass(self.headers, data),
+                                     transcript=transcript_from_request(data, conversation_text))
             
             self.wfile.write(json.dumps(result).encode())
             
@@ -45,20 +97,63 @@ class handler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
+
+
+def analyze_quality(conversation_text, soap_data=None, bypass_cache=False, transcript=None):
+    """品質分析（APIキーがあればGemini、なければフォールバック）
+
+    transcript には読み込み済みの Transcript を渡せる（発話の時刻があれば発話時間も集計する）。
+    QUALITY_CASCADE が有効なら先にローカルモデルで採点し、確信の持てない会話だけLLMに回す（_lib/cascade.py）。
+    """
+    soap_data = soap_data or {}
+    # ROUTER_MODE が有効でAPIキーのあるプロバイダが複数あればヘッジ/レースで振り分ける
+    providers = routed_providers() if len(conversation_text) > 10 else []
+    api_key = os.environ.get('GEMINI_API_KEY')
+    if len(providers) <= 1 and not (api_key and len(conversation_text) > 10):
+        record_fallback('quality', 'no_api_key')
+        return _fallback_quality(conversation_text, soap_data, transcript)
     
-    def _gemini_quality(self, conversation_text, soap_data, api_key):
-        """Gemini AI による品質分析"""
-        try:
-            import google.generativeai as genai
-            
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            
-            prompt = f"""
+    decision = None
+    if cascade_enabled():
+        with span('cascade'):
+            decision = decide(conversation_text)
+        if not decision.escalate:
+            return _fallback_quality(conversation_text, soap_data, transcript, cascade=decision)
+    
+    if len(providers) > 1:
+        result = _routed_quality(conversation_text, soap_data, providers, bypass_cache, transcript)
+    else:
+        # Gemini API処理
+        result = _gemini_quality(conversation_text, soap_data, api_key, bypass_cache, transcript)
+    if result.get("method") != FALLBACK_METHOD:
+        # LLMの結果はカスケードの学習データ（QUALITY_CASCADE_LOG）とローカルモデルとの一致度の集計に使う
+        observe_llm_result(conversation_text, result, decision)
+    if decision is not None:
+        result["cascade"] = decision.summary()
+    return result
+
+
+def _gemini_quality(conversation_text, soap_data, api_key, bypass_cache=False, transcript=None):
+    """Gemini AI による品質分析"""
+    try:
+        return _gemini_quality_result(conversation_text, api_key, bypass_cache, transcript)
+    except Exception as e:
+        print(f"Gemini Quality API error: {e}")
+        # ブレーカーが open の間はプロバイダを待たずにフォールバックする
+        record_fallback('quality', 'circuit_open' if isinstance(e, CircuitOpen) else 'error')
+        return _fallback_quality(conversation_text, soap_data, transcript)
+
+
+def _gemini_quality_result(conversation_text, api_key, bypass_cache=False, transcript=None):
+    """Gemini AI による品質分析（失敗は例外のまま返す）"""
+    # 予算（PROMPT_TOKEN_BUDGET）を超える会話は重要度の低い発話を落としてから送る
+    prompt_text, compaction = compact_for_prompt(conversation_text, 'gemini_quality', transcript)
+    with span('prompt_build'):
+        prompt = f"""
 以下の歯科医療会話を分析し、成約可能性（治療受諾の可能性）を評価してください。
 
 会話内容:
-{conversation_text}
+{prompt_text}
 
 以下の観点で0.0-1.0のスコアを算出してください:
 1. success_possibility: 成約可能性（患者の治療受諾意欲）
@@ -76,89 +171,189 @@ class handler(BaseHTTPRequestHandler):
   "confidence": 0.0から1.0の信頼度
 }}
 """
-            
-            response = model.generate_content(prompt)
-            result = json.loads(response.text)
-            
-            # Process log追加
-            result["process_log"] = [
-                "🤖 Gemini AI品質分析開始",
-                f"📝 解析対象: {len(conversation_text)}文字の医療会話データ",
-                "🧠 成約可能性・理解度・同意度の総合評価実行",
-                f"📊 分析結果:",
-                f"  - 成約可能性: {result.get('success_possibility', 0):.2f}",
-                f"  - 患者理解度: {result.get('patient_understanding', 0):.2f}",
-                f"  - 治療同意: {result.get('treatment_consent', 0):.2f}",
-                f"✅ Gemini AI品質分析完了（信頼度: {result.get('confidence', 0):.2f}）"
-            ]
-            result["method"] = "gemini_ai_quality_analysis"
-            
-            return result
-            
-        except Exception as e:
-            print(f"Gemini Quality API error: {e}")
-            return self._fallback_quality(conversation_text, soap_data)
-    
-    def _fallback_quality(self, conversation_text, soap_data):
-        """フォールバック品質分析"""
-        lines = conversation_text.strip().split('\n')
-        patient_lines = [line for line in lines if '患者' in line or 'Patient' in line]
-        doctor_lines = [line for line in lines if '医師' in line or 'Doctor' in line or 'Dr.' in line]
-        
-        # 成約可能性計算（治療受諾重視）
-        success_keywords = ['はい', 'お願いします', 'やります', '受けます', '同意', 'よろしく']
-        hesitation_keywords = ['考えさせて', '迷って', '不安', '心配', '高い', '費用']
-        
-        patient_text = ' '.join(patient_lines)
-        success_count = sum(1 for keyword in success_keywords if keyword in patient_text)
-        hesitation_count = sum(1 for keyword in hesitation_keywords if keyword in patient_text)
-        
-        success_possibility = max(0.1, min(0.9, (success_count - hesitation_count * 0.5) / 3 + 0.3))
-        
-        # 患者理解度計算
-        understanding_keywords = ['分かりました', 'なるほど', '理解', 'わかります']
-        confusion_keywords = ['分からない', 'よくわからない', '難しい']
-        
-        understanding_count = sum(1 for keyword in understanding_keywords if keyword in patient_text)
-        confusion_count = sum(1 for keyword in confusion_keywords if keyword in patient_text)
-        
-        patient_understanding = max(0.1, min(0.9, understanding_count / (understanding_count + confusion_count + 1) + 0.4))
-        
-        # 治療同意計算
-        consent_keywords = ['治療', '処置', '次回', '予約']
-        has_treatment_discussion = any(keyword in conversation_text for keyword in consent_keywords)
-        treatment_consent = max(0.2, min(0.8, success_possibility * 0.7 + (0.2 if has_treatment_discussion else 0)))
-        
-        overall_quality = (success_possibility * 0.4 + patient_understanding * 0.3 + treatment_consent * 0.3)
-        
-        improvements = []
-        positives = []
-        
-        if success_possibility < 0.5:
-            improvements.append("患者の治療意欲を高める説明が必要")
-        if patient_understanding < 0.6:
-            improvements.append("より分かりやすい説明を心がける")
-        if treatment_consent < 0.5:
-            improvements.append("具体的な治療計画の提示が有効")
-        
-        if success_possibility > 0.7:
-            positives.append("患者の治療への積極性が高い")
-        if patient_understanding > 0.7:
-            positives.append("患者の理解度が良好")
-        if len(doctor_lines) > len(patient_lines):
-            positives.append("医師からの丁寧な説明")
-        
-        return {
-            "success_possibility": round(success_possibility, 2),
-            "patient_understanding": round(patient_understanding, 2),
-            "treatment_consent": round(treatment_consent, 2),
-            "overall_quality": round(overall_quality, 2),
-            "improvements": improvements or ["全体的に良好な会話"],
-            "positives": positives or ["基本的なコミュニケーションは成立"],
-            "confidence": 0.7,
-            "process_log": [
-                "📋 フォールバック品質分析実行",
-                f"✅ 分析完了: 成約可能性={success_possibility:.2f}, 理解度={patient_understanding:.2f}"
-            ],
-            "method": "pattern_based_quality_analysis"
-        }
\ No newline at end of file
+    
+    def generate():
+        # ウォームインスタンスでは設定済みのモデル（と接続）を使い回す
+        model = gemini_model(api_key, 'gemini-1.5-flash')
+        # JSONモードで返させ、それでも崩れた応答は修復して読む
+        response = model.generate_content(prompt, generation_config=GEMINI_JSON_MODE)
+        record_usage('gemini', response)
+        return decode_llm_json('gemini', 'quality', response.text, QUALITY_SCHEMA)
+    
+    # 同一会話・同一プロンプトの再解析はキャッシュから返す
+    result = cached_call('gemini', 'gemini-1.5-flash', PROMPT_VERSION, prompt_text, generate,
+                         bypass=bypass_cache)
+    
+    with span('post_process'):
+        # Process log追加
+        result["process_log"] = [
+            "🤖 Gemini AI品質分析開始",
+            f"📝 解析対象: {len(conversation_text)}文字の医療会話データ",
+            "🧠 成約可能性・理解度・同意度の総合評価実行",
+            f"📊 分析結果:",
+            f"  - 成約可能性: {result.get('success_possibility', 0):.2f}",
+            f"  - 患者理解度: {result.get('patient_understanding', 0):.2f}",
+            f"  - 治療同意: {result.get('treatment_consent', 0):.2f}",
+            f"✅ Gemini AI品質分析完了（信頼度: {result.get('confidence', 0):.2f}）"
+        ]
+        result["method"] = "gemini_ai_quality_analysis"
+        if compaction:
+            result["compaction"] = compaction
+    
+    return result
+
+def _routed_quality(conversation_text, soap_data, providers, bypass_cache=False, transcript=None):
+    """複数プロバイダへのヘッジ/レース（ROUTER_MODE）による品質分析。全て失敗したらフォールバック"""
+    def backend(provider):
+        if provider == 'gemini':
+            return lambda: _gemini_quality_result(conversation_text, os.environ.get('GEMINI_API_KEY'),
+                                                  bypass_cache, transcript)
+        return lambda: _chat_quality(provider, conversation_text, bypass_cache)
+    
+    try:
+        provider, result, routing = route('quality', [(provider, backend(provider)) for provider in providers],
+                                          validate=_valid_quality)
+    except RouterError as e:
+        print(f"Routed Quality error: {e}")
+        record_fallback('quality', 'error')
+        return _fallback_quality(conversation_text, soap_data, transcript)
+    result["routing"] = routing
+    return result
+
+
+def _chat_quality(provider, conversation_text, bypass_cache=False):
+    """OpenAI / OpenRouter の品質分析結果を Gemini と同じ形にする"""
+    # openai SDK は振り分け先に選ばれたときだけ読み込む
+    module = importlib.import_module(CHAT_QUALITY[provider][0])
+    analyze = getattr(module, CHAT_QUALITY[provider][1])
+    result = analyze(module.create_client(), conversation_text, bypass_cache)
+    success = result.get("success_possibility")
+    understanding = result.get("patient_understanding")
+    consent = result.get("treatment_consent_likelihood")
+    quality = {
+        "success_possibility": success,
+        "patient_understanding": understanding,
+        "treatment_consent": consent,
+        "improvements": result.get("improvement_suggestions", []),
+        "positives": result.get("positive_aspects", []),
+        "confidence": result.get("confidence", 0.0),
+        "method": f"{provider}_quality_analysis"
+    }
+    if all(isinstance(score, (int, float)) for score in (success, understanding, consent)):
+        # フォールバックと同じ重みで総合品質を求める
+        quality["overall_quality"] = round(success * 0.4 + understanding * 0.3 + consent * 0.3, 2)
+    for key in ("chunking", "compaction"):
+        if key in result:
+            quality[key] = result[key]
+    # パースに失敗した応答（既定値の入った結果）は無効として他のプロバイダの結果を待つ
+    if "parse_error" in result or str(result.get("method", "")).endswith("_fallback"):
+        quality["invalid"] = True
+    return quality
+
+
+def _valid_quality(result):
+    return (isinstance(result, dict) and not result.get("invalid")
+            and all(isinstance(result.get(key), (int, float)) and 0 <= result[key] <= 1 for key in QUALITY_SCORES))
+
+def _fallback_quality(conversation_text, soap_data, transcript=None, cascade=None):
+    """フォールバック品質分析
+
+    cascade（カスケードの判定）を渡すと、キーワードから求めるスコアの代わりにローカルモデルの予測を使う。
+    """
+    if transcript is None:
+        transcript = Transcript.from_text(conversation_text)
+    # 役割が分かる発話は話者ラベルか "Speaker 1" などの推定を使い、分からなければ行に含むマーカーで判定する
+    # （役割は話者ごとに1回だけ決め、行は本文全体の正規表現で選ぶ）
+    selected = transcript.role_lines({PATIENT: PATIENT_MARKERS, DOCTOR: DOCTOR_MARKERS}, counted=(DOCTOR,))
+    patient_lines = selected[PATIENT]
+    doctor_line_count = selected[DOCTOR]
+    
+    patient_text = ' '.join(patient_lines)
+    counts = QUALITY_KEYWORDS.distinct_counts(patient_text, PATIENT_SIGNALS)
+    success_possibility, patient_understanding, treatment_consent = pattern_scores(
+        counts, QUALITY_KEYWORDS.contains_any(conversation_text, 'consent'))
+    
+    if cascade is not None:
+        success_possibility = cascade.scores['success_possibility']
+        patient_understanding = cascade.scores['patient_understanding']
+        treatment_consent = cascade.scores['treatment_consent']
+    
+    overall_quality = (success_possibility * 0.4 + patient_understanding * 0.3 + treatment_consent * 0.3)
+    
+    improvements = []
+    positives = []
+    
+    if success_possibility < 0.5:
+        improvements.append("患者の治療意欲を高める説明が必要")
+    if patient_understanding < 0.6:
+        improvements.append("より分かりやすい説明を心がける")
+    if treatment_consent < 0.5:
+        improvements.append("具体的な治療計画の提示が有効")
+    
+    if success_possibility > 0.7:
+        positives.append("患者の治療への積極性が高い")
+    if patient_understanding > 0.7:
+        positives.append("患者の理解度が良好")
+    if doctor_line_count > len(patient_lines):
+        positives.append("医師からの丁寧な説明")
+    
+    result = {
+        "success_possibility": round(success_possibility, 2),
+        "patient_understanding": round(patient_understanding, 2),
+        "treatment_consent": round(treatment_consent, 2),
+        "overall_quality": round(overall_quality, 2),
+        "improvements": improvements or ["全体的に良好な会話"],
+        "positives": positives or ["基本的なコミュニケーションは成立"],
+        "confidence": 0.7,
+        "process_log": [
+            "📋 フォールバック品質分析実行",
+            f"✅ 分析完了: 成約可能性={success_possibility:.2f}, 理解度={patient_understanding:.2f}"
+        ],
+        "method": FALLBACK_METHOD
+    }
+    if cascade is not None:
+        result["confidence"] = cascade.confidence
+        result["process_log"] = [
+            "🧮 ローカルモデルによる品質分析（カスケード）",
+            f"✅ 分析完了: 成約可能性={success_possibility:.2f}, 理解度={patient_understanding:.2f}"
+            f"（不確実帯 {cascade.band[0]:.2f}〜{cascade.band[1]:.2f} の外のためLLMは呼ばない）"
+        ]
+        result["method"] = CASCADE_METHOD
+        result["cascade"] = cascade.summary()
+    
+    # 発話の時刻がある会話（Notta SRT・CSV・XLSX）は話者ごとの発話時間も返す
+    speaking_time = _speaking_time(transcript)
+    if speaking_time is not None:
+        result["speaking_time"] = speaking_time
+    return result
+
+
+def pattern_scores(counts, has_treatment_discussion):
+    """患者の発言中のキーワードの種類数 {PATIENT_SIGNALS: 件数} から (成約可能性, 患者理解度, 治療同意) を求める"""
+    # 成約可能性計算（治療受諾重視）
+    success_possibility = max(0.1, min(0.9, (counts['success'] - counts['hesitation'] * 0.5) / 3 + 0.3))
+    
+    # 患者理解度計算
+    understanding_count = counts['understanding']
+    patient_understanding = max(0.1, min(0.9, understanding_count / (understanding_count + counts['confusion'] + 1)
+                                         + 0.4))
+    
+    # 治療同意計算
+    treatment_consent = max(0.2, min(0.8, success_possibility * 0.7 + (0.2 if has_treatment_discussion else 0)))
+    return success_possibility, patient_understanding, treatment_consent
+
+
+def _speaking_time(transcript):
+    if not transcript.has_times:
+        return None
+    totals = transcript.speaking_time()
+    patient_seconds = totals.get(PATIENT, 0.0)
+    doctor_seconds = totals.get(DOCTOR, 0.0)
+    spoken = sum(totals.values())
+    return {
+        "patient_seconds": round(patient_seconds, 1),
+        "doctor_seconds": round(doctor_seconds, 1),
+        "total_seconds": round(spoken, 1),
+        "session_seconds": round(transcript.duration() or 0.0, 1),
+        "patient_ratio": round(patient_seconds / spoken, 2) if spoken else None
+    }
\ No newline at end of file
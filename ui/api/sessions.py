@@ -0,0 +1,150 @@
+from http.server import BaseHTTPRequestHandler
+import json
+import os
+import sys
+from urllib.parse import parse_qs, urlparse
+
+_API_DIR = os.path.dirname(os.path.abspath(__file__))
+if _API_DIR not in sys.path:
+    sys.path.insert(0, _API_DIR)
+
+from _lib.storage import analysis_from_pipeline, get_store
+from _lib.telemetry import instrument_handler, span
+
+MAX_SESSIONS_PER_REQUEST = 1000
+MAX_SEARCH_RESULTS = 200
+
+
+class SessionRequestError(ValueError):
+    pass
+
+
+def parse_sessions(data):
+    """1セッション、または {"sessions": [...]} を保存用の辞書のリストにする
+
+    各セッションは content（と任意の utterances）、患者名・医師名・日時と、
+    analysis（ai_* 表の形）または pipeline（/api/pipeline の結果）を持てる。
+    """
+    sessions = data.get('sessions') if isinstance(data, dict) and 'sessions' in data else [data]
+    if not isinstance(sessions, list) or not all(isinstance(session, dict) for session in sessions):
+        raise SessionRequestError("sessions must be a list of objects")
+    if len(sessions) > MAX_SESSIONS_PER_REQUEST:
+        raise SessionRequestError(f"too many sessions: {len(sessions)} > {MAX_SESSIONS_PER_REQUEST}")
+    parsed = []
+    for session in sessions:
+        session = dict(session)
+        pipeline = session.pop('pipeline', None)
+        if pipeline and not session.get('analysis'):
+            session['analysis'] = analysis_from_pipeline(pipeline)
+            identification = pipeline.get('identification') or {}
+            session.setdefault('patient_name', identification.get('patient_name'))
+            session.setdefault('doctor_name', identification.get('doctor_name'))
+        parsed.append(session)
+    return parsed
+
+
+@instrument_handler('sessions')
+class handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        try:
+            with span('parse'):
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length)
+                sessions = parse_sessions(json.loads(post_data.decode('utf-8')))
+
+            store = get_store()
+            if store is None:
+                self._send_json(503, {"error": "session storage is disabled (SESSION_DB_PATH)", "fallback": True})
+                return
+            with span('store', sessions=len(sessions)):
+                session_ids = store.save_sessions(sessions)
+
+            self._send_json(200, {"status": "success", "session_ids": session_ids})
+
+        except Exception as e:
+            status = 400 if isinstance(e, ValueError) else 500
+            self._send_json(status, {"error": str(e), "fallback": True})
+
+    def do_GET(self):
+        try:
+            query = parse_qs(urlparse(self.path).query)
+
+            def param(name):
+                return query.get(name, [None])[0]
+
+            store = get_store()
+            if store is None:
+                self._send_json(503, {"error": "session storage is disabled (SESSION_DB_PATH)", "fallback": True})
+                return
+
+            if 'q' in query:
+                # 発言の全文検索（?q=費用 不安&mode=any&role=patient&since=...&by=session&limit=20）。
+                # 保存と同じ関数で受けるので、既定の一時ディレクトリのDBでも保存したセッションを検索できる
+                self._search(store, param)
+                return
+
+            session_id = param('session_id')
+            if session_id:
+                session = store.get_session(session_id)
+                if session is None:
+                    self._send_json(404, {"error": f"session not found: {session_id}"})
+                else:
+                    self._send_json(200, session)
+                return
+
+            limit = min(int(param('limit') or 100), MAX_SESSIONS_PER_REQUEST)
+
+            if param('view') == 'summary':
+                # 実体化した comprehensive_session_analysis（ダッシュボード用）
+                sessions = store.summary(
+                    since=param('since'),
+                    until=param('until'),
+                    stress_indicator=param('stress_indicator'),
+                    min_anxiety=param('min_anxiety'),
+                    max_satisfaction=param('max_satisfaction'),
+                    limit=limit
+                )
+                self._send_json(200, {"sessions": sessions})
+                return
+
+            sessions = store.list_sessions(
+                since=param('since'),
+                until=param('until'),
+                limit=limit
+            )
+            self._send_json(200, {"sessions": sessions})
+
+        except Exception as e:
+            self._send_json(400 if isinstance(e, ValueError) else 500, {"error": str(e), "fallback": True})
+
+    def _search(self, store, param):
+        q = param('q') or ''
+        by = param('by') or 'utterance'
+        with span('search', by=by):
+            results = store.search(
+                q,
+                mode=param('mode') or 'all',
+                role=param('role'),
+                since=param('since'),
+                until=param('until'),
+                by=by,
+                limit=min(int(param('limit') or 20), MAX_SEARCH_RESULTS)
+            )
+        key = 'sessions' if by == 'session' else 'hits'
+        self._send_json(200, {"query": q, key: results})
+
+    def _send_json(self, status, payload):
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
+        self.wfile.write(json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
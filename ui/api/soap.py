@@ -1,8 +1,56 @@
 from http.server import BaseHTTPRequestHandler
+import importlib
 import json
 import os
 import re
+import sys
 
+_API_DIR = os.path.dirname(os.path.abspath(__file__))
+if _API_DIR not in sys.path:
+    sys.path.insert(0, _API_DIR)
+
+from _lib.keywords import KeywordMatcher
+from _lib.circuit_breaker import CircuitOpen
+from _lib.clients import gemini_model, prewarm_from_env
+from _lib.compaction import compact_for_prompt
+from _lib.llm_cache import cached_call, wants_bypass
+from _lib.router import RouterError, route, routed_providers
+from _lib.llm_json import GEMINI_JSON_MODE, decode_llm_json
+from _lib.telemetry import instrument_handler, record_fallback, record_usage, span
+from _lib.transcript import DOCTOR, PATIENT, UNKNOWN, Transcript, transcript_from_request
+
+# LLM_PREWARM が設定されていれば SDK の読み込みとクライアント生成を import 時に済ませる
+prewarm_from_env()
+
+PROMPT_VERSION = 'gemini-soap-v1'
+SOAP_FIELDS = ('subjective', 'objective', 'assessment', 'plan')
+# 応答の検証に使うスキーマ（型の修正と必須フィールドの確認）
+SOAP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        **{field: {"type": "string"} for field in SOAP_FIELDS},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1}
+    },
+    "required": list(SOAP_FIELDS)
+}
+# ヘッジ/レースで使う OpenAI / OpenRouter の SOAP変換（モジュール名, 関数名）
+CHAT_SOAP = {
+    'openai': ('openai_analysis', 'convert_to_soap_with_gpt41'),
+    'openrouter': ('openrouter_analysis', 'convert_to_soap_with_gpt5'),
+}
+
+SOAP_KEYWORDS = KeywordMatcher({
+    'patient_marker': ['患者'],
+    'doctor_marker': ['医師', 'Dr.'],
+    'assessment': ['診断', '思われ', '考えられ', '可能性', '状態', '症状'],
+    'plan': ['治療', '処置', '次回', '予約', '薬', '経過', '観察'],
+})
+PATIENT_MARKER = SOAP_KEYWORDS.tables['patient_marker'][0]
+DOCTOR_MARKERS = SOAP_KEYWORDS.tables['doctor_marker']
+ASSESSMENT_PATTERN = SOAP_KEYWORDS.category_pattern('assessment')
+PLAN_PATTERN = SOAP_KEYWORDS.category_pattern('plan')
+
+@instrument_handler('soap')
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
@@ -15,20 +63,18 @@ class handler(BaseHTTPRequestHandler):
             self.end_headers()
             
             # Parse request
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+            with span('parse'):
+                content_length = int(self.headers['Content-Length'])
+                post_data = self.rfile.read(content_length)
+                data = json.loads(post_data.decode('utf-8'))
             
             conversation_text = data.get('content', '')
             patient_name = data.get('patient_name', '患者')
             doctor_name = data.get('doctor_name', '医師')
             
-            # Gemini API処理
-            api_key = os.environ.get('GEMINI_API_KEY')
-            if api_key and len(conversation_text) > 10:
-                result = self._gemini_soap(conversation_text, patient_name, doctor_name, api_key)
-            else:
-                result = self._fallback_soap(conversation_text, patient_name, doctor_name)
+            result = convert_to_soap(conversation_text, patient_name, doctor_name,
+                                     bypass_cache=wants_bypass(self.headers, data),
+                                     transcript=transcript_from_request(data, conversation_text))
             
             self.wfile.write(json.dumps(result).encode())
             
@@ -46,23 +92,50 @@ class handler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
-    
-    def _gemini_soap(self, conversation_text, patient_name, doctor_name, api_key):
-        """Gemini AI による SOAP変換"""
-        try:
-            import google.generativeai as genai
-            
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            
-            prompt = f"""
+
+
+def convert_to_soap(conversation_text, patient_name='患者', doctor_name='医師', bypass_cache=False,
+                    transcript=None):
+    """SOAP変換（APIキーがあればGemini、なければフォールバック）
+
+    transcript には読み込み済みの Transcript を渡せる（フォールバックで会話を分割し直さない）。
+    """
+    # ROUTER_MODE が有効でAPIキーのあるプロバイダが複数あればヘッジ/レースで振り分ける
+    providers = routed_providers() if len(conversation_text) > 10 else []
+    if len(providers) > 1:
+        return _routed_soap(conversation_text, patient_name, doctor_name, providers, bypass_cache, transcript)
+    # Gemini API処理
+    api_key = os.environ.get('GEMINI_API_KEY')
+    if api_key and len(conversation_text) > 10:
+        return _gemini_soap(conversation_text, patient_name, doctor_name, api_key, bypass_cache, transcript)
+    record_fallback('soap', 'no_api_key')
+    return _fallback_soap(conversation_text, patient_name, doctor_name, transcript)
+
+
+def _gemini_soap(conversation_text, patient_name, doctor_name, api_key, bypass_cache=False, transcript=None):
+    """Gemini AI による SOAP変換"""
+    try:
+        return _gemini_soap_result(conversation_text, patient_name, doctor_name, api_key, bypass_cache, transcript)
+    except Exception as e:
+        print(f"Gemini SOAP API error: {e}")
+        # ブレーカーが open の間はプロバイダを待たずにフォールバックする
+        record_fallback('soap', 'circuit_open' if isinstance(e, CircuitOpen) else 'error')
+        return _fallback_soap(conversation_text, patient_name, doctor_name, transcript)
+
+
+def _gemini_soap_result(conversation_text, patient_name, doctor_name, api_key, bypass_cache=False, transcript=None):
+    """Gemini AI による SOAP変換（失敗は例外のまま返す）"""
+    # 予算（PROMPT_TOKEN_BUDGET）を超える会話は重要度の低い発話を落としてから送る
+    prompt_text, compaction = compact_for_prompt(conversation_text, 'gemini_soap', transcript)
+    with span('prompt_build'):
+        prompt = f"""
 以下の歯科医療会話をSOAP形式（主観的情報・客観的所見・評価・計画）に変換してください。
 
 患者: {patient_name}
 医師: {doctor_name}
 
 会話内容:
-{conversation_text}
+{prompt_text}
 
 以下のJSON形式で回答してください:
 {{
@@ -73,73 +146,134 @@ class handler(BaseHTTPRequestHandler):
   "confidence": 0.0から1.0の信頼度
 }}
 """
-            
-            response = model.generate_content(prompt)
-            result = json.loads(response.text)
-            
-            # Process log追加
-            subjective_length = len(result.get('subjective', ''))
-            objective_length = len(result.get('objective', ''))
-            assessment_length = len(result.get('assessment', ''))
-            plan_length = len(result.get('plan', ''))
-            
-            result["process_log"] = [
-                "🤖 Gemini AI SOAP変換開始",
-                f"📝 解析対象: {len(conversation_text.split())}行の歯科医療会話データ",
-                "🧠 自然言語処理による医療記録構造化実行",
-                f"📊 SOAP分類結果:",
-                f"  - S (主観的情報): {subjective_length}文字",
-                f"  - O (客観的所見): {objective_length}文字", 
-                f"  - A (評価・診断): {assessment_length}文字",
-                f"  - P (治療計画): {plan_length}文字",
-                f"✅ Gemini AI SOAP変換完了（信頼度: {result.get('confidence', 0):.2f}）"
-            ]
-            result["method"] = "gemini_ai_medical_record_structuring"
-            
-            return result
-            
-        except Exception as e:
-            print(f"Gemini SOAP API error: {e}")
-            return self._fallback_soap(conversation_text, patient_name, doctor_name)
     
-    def _fallback_soap(self, conversation_text, patient_name, doctor_name):
-        """フォールバック SOAP変換"""
-        lines = conversation_text.strip().split('\n')
-        patient_lines = []
-        doctor_lines = []
-        
-        for line in lines:
-            if patient_name in line or '患者' in line:
-                patient_lines.append(line.split(':', 1)[-1].strip())
-            elif doctor_name in line or '医師' in line or 'Dr.' in line:
-                doctor_lines.append(line.split(':', 1)[-1].strip())
-        
-        # 実際のデータからSOAP分類
-        # S: 患者の主観的情報（全ての患者発言を含める）
-        subjective = ' '.join(patient_lines) if patient_lines else ""
-        
-        # O: 医師の客観的所見（医師の観察・検査結果）
-        objective = ' '.join(doctor_lines[:3]) if doctor_lines else ""
-        
-        # A: 評価・診断（医師の診断的発言を抽出）
-        assessment_keywords = ['診断', '思われ', '考えられ', '可能性', '状態', '症状']
-        assessment_lines = [line for line in doctor_lines if any(k in line for k in assessment_keywords)]
-        assessment = ' '.join(assessment_lines) if assessment_lines else doctor_lines[-2] if len(doctor_lines) > 2 else ""
-        
-        # P: 治療計画（治療・処置・次回に関する発言を抽出）
-        plan_keywords = ['治療', '処置', '次回', '予約', '薬', '経過', '観察']
-        plan_lines = [line for line in doctor_lines if any(k in line for k in plan_keywords)]
-        plan = ' '.join(plan_lines) if plan_lines else doctor_lines[-1] if doctor_lines else ""
-        
-        return {
-            "subjective": subjective,
-            "objective": objective,
-            "assessment": assessment,
-            "plan": plan,
-            "confidence": 0.6,
-            "process_log": [
-                "📋 フォールバックSOAP変換実行",
-                f"✅ 変換完了: S={len(subjective)}文字, O={len(objective)}文字"
-            ],
-            "method": "pattern_based_soap_conversion"
-        }
\ No newline at end of file
+    def generate():
+        # ウォームインスタンスでは設定済みのモデル（と接続）を使い回す
+        model = gemini_model(api_key, 'gemini-1.5-flash')
+        # JSONモードで返させ、それでも崩れた応答は修復して読む
+        response = model.generate_content(prompt, generation_config=GEMINI_JSON_MODE)
+        record_usage('gemini', response)
+        return decode_llm_json('gemini', 'soap', response.text, SOAP_SCHEMA)
+    
+    # 同一会話・同一プロンプトの再解析はキャッシュから返す
+    result = cached_call('gemini', 'gemini-1.5-flash', PROMPT_VERSION, prompt_text, generate,
+                         params={"patient_name": patient_name, "doctor_name": doctor_name},
+                         bypass=bypass_cache)
+    
+    with span('post_process'):
+        # Process log追加
+        subjective_length = len(result.get('subjective', ''))
+        objective_length = len(result.get('objective', ''))
+        assessment_length = len(result.get('assessment', ''))
+        plan_length = len(result.get('plan', ''))
+    
+        result["process_log"] = [
+            "🤖 Gemini AI SOAP変換開始",
+            f"📝 解析対象: {len(conversation_text.split())}行の歯科医療会話データ",
+            "🧠 自然言語処理による医療記録構造化実行",
+            f"📊 SOAP分類結果:",
+            f"  - S (主観的情報): {subjective_length}文字",
+            f"  - O (客観的所見): {objective_length}文字", 
+            f"  - A (評価・診断): {assessment_length}文字",
+            f"  - P (治療計画): {plan_length}文字",
+            f"✅ Gemini AI SOAP変換完了（信頼度: {result.get('confidence', 0):.2f}）"
+        ]
+        result["method"] = "gemini_ai_medical_record_structuring"
+        if compaction:
+            result["compaction"] = compaction
+    
+    return result
+
+def _routed_soap(conversation_text, patient_name, doctor_name, providers, bypass_cache=False, transcript=None):
+    """複数プロバイダへのヘッジ/レース（ROUTER_MODE）による SOAP変換。全て失敗したらフォールバック"""
+    def backend(provider):
+        if provider == 'gemini':
+            return lambda: _gemini_soap_result(conversation_text, patient_name, doctor_name,
+                                               os.environ.get('GEMINI_API_KEY'), bypass_cache, transcript)
+        return lambda: _chat_soap(provider, conversation_text, patient_name, doctor_name, bypass_cache)
+    
+    try:
+        provider, result, routing = route('soap', [(provider, backend(provider)) for provider in providers],
+                                          validate=_valid_soap)
+    except RouterError as e:
+        print(f"Routed SOAP error: {e}")
+        record_fallback('soap', 'error')
+        return _fallback_soap(conversation_text, patient_name, doctor_name, transcript)
+    result["routing"] = routing
+    return result
+
+
+def _chat_soap(provider, conversation_text, patient_name, doctor_name, bypass_cache=False):
+    """OpenAI / OpenRouter の SOAP変換結果（S/O/A/P）を Gemini と同じ形にする"""
+    # openai SDK は振り分け先に選ばれたときだけ読み込む
+    module = importlib.import_module(CHAT_SOAP[provider][0])
+    convert = getattr(module, CHAT_SOAP[provider][1])
+    result = convert(module.create_client(), conversation_text, patient_name, doctor_name, bypass_cache)
+    soap = {
+        "subjective": result.get("S", ""),
+        "objective": result.get("O", ""),
+        "assessment": result.get("A", ""),
+        "plan": result.get("P", ""),
+        "confidence": result.get("confidence", 0.0),
+        "method": f"{provider}_medical_record_structuring"
+    }
+    for key in ("dental_specifics", "incomplete_info", "chunking", "compaction"):
+        if key in result:
+            soap[key] = result[key]
+    # パースに失敗した応答（既定値の入った結果）は無効として他のプロバイダの結果を待つ
+    if str(result.get("method", "")).endswith("_fallback"):
+        soap["invalid"] = True
+    return soap
+
+
+def _valid_soap(result):
+    return (isinstance(result, dict) and not result.get("invalid")
+            and all(isinstance(result.get(key), str) and result[key] for key in SOAP_FIELDS))
+
+def _fallback_soap(conversation_text, patient_name, doctor_name, transcript=None):
+    """フォールバック SOAP変換"""
+    if transcript is None:
+        transcript = Transcript.from_text(conversation_text)
+    patient_lines = []
+    doctor_lines = []
+    assessment_lines = []
+    plan_lines = []
+    
+    # 話者判定とA/Pキーワード判定を1回のループで行う
+    # （役割が分かる発話は話者ラベルか "Speaker 1" などの推定を使い、分からなければ行のどこかに名前・マーカーを含むか）
+    doctor_a, doctor_b = DOCTOR_MARKERS
+    for line, role, content in zip(transcript.lines(), transcript.roles(), transcript.contents()):
+        if role == PATIENT or (role == UNKNOWN and (patient_name in line or PATIENT_MARKER in line)):
+            patient_lines.append(content)
+        elif role == DOCTOR or (role == UNKNOWN and (doctor_name in line or doctor_a in line or doctor_b in line)):
+            doctor_lines.append(content)
+            if ASSESSMENT_PATTERN.search(content):
+                assessment_lines.append(content)
+            if PLAN_PATTERN.search(content):
+                plan_lines.append(content)
+    
+    # 実際のデータからSOAP分類
+    # S: 患者の主観的情報（全ての患者発言を含める）
+    subjective = ' '.join(patient_lines) if patient_lines else ""
+    
+    # O: 医師の客観的所見（医師の観察・検査結果）
+    objective = ' '.join(doctor_lines[:3]) if doctor_lines else ""
+    
+    # A: 評価・診断（医師の診断的発言を抽出）
+    assessment = ' '.join(assessment_lines) if assessment_lines else doctor_lines[-2] if len(doctor_lines) > 2 else ""
+    
+    # P: 治療計画（治療・処置・次回に関する発言を抽出）
+    plan = ' '.join(plan_lines) if plan_lines else doctor_lines[-1] if doctor_lines else ""
+    
+    return {
+        "subjective": subjective,
+        "objective": objective,
+        "assessment": assessment,
+        "plan": plan,
+        "confidence": 0.6,
+        "process_log": [
+            "📋 フォールバックSOAP変換実行",
+            f"✅ 変換完了: S={len(subjective)}文字, O={len(objective)}文字"
+        ],
+        "method": "pattern_based_soap_conversion"
+    }
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""品質分析のカスケード（_lib/cascade.py）のベンチマーク
+
+synthetic.py の合成会話の患者の発言を、会話ごとの傾向（治療に前向き〜迷っている）に応じて受諾・ためらい・理解・
+困惑の言い回しに置き換え、それを数えてスコアを返す Gemini のモック（教師）で学習用の会話に採点する。
+学習したローカルモデルで評価用の会話を quality.analyze_quality に通し、カスケードなしと不確実帯ごとに
+
+- escalation: LLM（モック）を呼んだ会話の割合
+- MAE: 返したスコアと教師のスコアの平均絶対誤差（3スコアの平均。LLMに回した会話は 0）
+- agreement: 成約可能性が 0.5 のどちら側かが教師と一致した割合
+- p50 / p99: 1会話あたりの処理時間（モックは --latency 秒待って応答する）
+
+を表示する。最後に /api/quality?metrics=state の quality_cascade と同じ内容を出す。
+
+使い方:
+    python ui/bench/bench_cascade.py
+    python ui/bench/bench_cascade.py --train 1000 --sessions 300 --latency 0.2 --bands 0.45-0.55,0.3-0.7
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ハンドラーの import 前に設定する（LLMキャッシュとトレース出力は計測対象から外す）
+os.environ.setdefault('LLM_CACHE_DISABLED', '1')
+os.environ.setdefault('TRACE_FILE', '')
+os.environ.setdefault('HEALTH_PROBE_INTERVAL', '0')
+
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'api'))
+sys.path.insert(0, BENCH_DIR)
+
+import quality  # noqa: E402
+import synthetic  # noqa: E402
+from _lib import cascade  # noqa: E402
+
+PHRASES = {
+    'accept': ['ぜひその治療でお願いします。', '今日から始めたいです。', '次回の予約を取って進めてください。'],
+    'hesitate': ['少し考えさせてください。', '費用がちょっと心配です。', '家族と相談してから決めます。'],
+    'understand': ['なるほど、よく分かりました。', '説明で納得できました。'],
+    'confused': ['ちょっと難しくてよくわからないです。', 'もう一度説明してもらえますか。'],
+}
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+
+def teacher_scores(text):
+    """教師（LLMの代わり）のスコア。言い回しの数と、会話ごとに決まった小さな揺らぎから求める"""
+    counts = {kind: sum(text.count(phrase) for phrase in phrases) for kind, phrases in PHRASES.items()}
+    noise = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+
+    def squash(x):
+        return round(min(1.0, max(0.0, 1 / (1 + math.exp(-x)) + noise.gauss(0, 0.04))), 3)
+
+    success = squash(0.9 * (counts['accept'] - counts['hesitate']))
+    understanding = squash(0.8 * (counts['understand'] - counts['confused']) + 0.4)
+    consent = squash(0.7 * (counts['accept'] - counts['hesitate']) + 0.2)
+    return {"success_possibility": success, "patient_understanding": understanding, "treatment_consent": consent}
+
+
+class TeacherModel:
+    """GenerativeModel の代わり。latency 秒待ってから、プロンプト中の会話を教師のスコアで返す"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def generate_content(self, prompt, generation_config=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        # 教師のスコアはプロンプトの指示文を除いた会話部分から求める
+        scores = teacher_scores(prompt.split('会話内容:\n', 1)[1].split('\n\n以下の観点', 1)[0])
+        scores.update({"overall_quality": 0.5, "improvements": [], "positives": [], "confidence": 0.9})
+        return _Response(json.dumps(scores, ensure_ascii=False))
+
+
+def conversation(seed):
+    """患者の発言の一部を、会話ごとの傾向に沿った言い回しに置き換えた合成会話"""
+    rng = random.Random(seed)
+    lean = rng.random()
+    lines = []
+    for utterance in synthetic.generate(rng.randint(8, 40), seed=seed):
+        text = utterance.text
+        if utterance.speaker == '患者' and rng.random() < 0.4:
+            kind = rng.choice(('accept', 'hesitate') if rng.random() < 0.6 else ('understand', 'confused'))
+            if kind in ('accept', 'hesitate'):
+                kind = 'accept' if rng.random() < lean else 'hesitate'
+            text = rng.choice(PHRASES[kind])
+        lines.append(f"{utterance.speaker}: {text}")
+    return '\n'.join(lines)
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def run(sessions, model):
+    calls_before = model.calls
+    latencies = []
+    errors = []
+    agreements = 0
+    for text in sessions:
+        truth = teacher_scores(quality.compact_for_prompt(text, 'gemini_quality')[0])
+        started = time.perf_counter()
+        result = quality.analyze_quality(text, bypass_cache=True)
+        latencies.append((time.perf_counter() - started) * 1000)
+        errors.append(sum(abs(result[score] - truth[score]) for score in cascade.SCORES) / len(cascade.SCORES))
+        agreements += (result['success_possibility'] >= 0.5) == (truth['success_possibility'] >= 0.5)
+    latencies.sort()
+    return {
+        "escalation": (model.calls - calls_before) / len(sessions),
+        "mae": sum(errors) / len(errors),
+        "agreement": agreements / len(sessions),
+        "p50": percentile(latencies, 0.50),
+        "p99": percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--train', type=int, default=600, help='学習用の会話数')
+    parser.add_argument('--sessions', type=int, default=200, help='評価用の会話数')
+    parser.add_argument('--latency', type=float, default=0.1, help='モックの応答までの秒数')
+    parser.add_argument('--bands', default='0.45-0.55,0.4-0.6,0.35-0.65,0.3-0.7,0.2-0.8',
+                        help='不確実帯（下限-上限 のカンマ区切り）')
+    parser.add_argument('--epochs', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    model_path = os.path.join(tempfile.mkdtemp(), 'quality_cascade.npz')
+    os.environ.update({'GEMINI_API_KEY': 'bench-mock-key', 'QUALITY_CASCADE_MODEL': model_path,
+                       'QUALITY_CASCADE_LOG': ''})
+    teacher = TeacherModel(args.latency)
+    quality.gemini_model = lambda api_key, model_name='gemini-1.5-flash': teacher
+
+    examples = [(text, teacher_scores(text)) for text in
+                (conversation(args.seed * 1_000_003 + n) for n in range(args.train))]
+    started = time.perf_counter()
+    cascade.train(examples, epochs=args.epochs).save(model_path)
+    print(f"学習 {len(examples)} 会話: {time.perf_counter() - started:.1f} 秒\n")
+    sessions = [conversation(args.seed * 1_000_003 + args.train + n) for n in range(args.sessions)]
+
+    print(f"{'band':>11} {'escalation':>10} {'MAE':>6} {'agreement':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    os.environ['QUALITY_CASCADE'] = ''
+    row = run(sessions, teacher)
+    print(f"{'off':>11} {row['escalation']:>10.3f} {row['mae']:>6.3f} {row['agreement']:>9.3f} "
+          f"{row['p50']:>8.1f} {row['p99']:>8.1f}")
+    os.environ['QUALITY_CASCADE'] = '1'
+    for item in args.bands.split(','):
+        low, high = item.split('-')
+        os.environ.update({'QUALITY_CASCADE_BAND_LOW': low, 'QUALITY_CASCADE_BAND_HIGH': high})
+        row = run(sessions, teacher)
+        print(f"{float(low):>5.2f}-{float(high):<5.2f} {row['escalation']:>10.3f} {row['mae']:>6.3f} "
+              f"{row['agreement']:>9.3f} {row['p50']:>8.1f} {row['p99']:>8.1f}")
+    print(json.dumps(cascade.cascade_snapshot(), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
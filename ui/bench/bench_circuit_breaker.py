@@ -0,0 +1,111 @@
+"""サーキットブレーカー（_lib/circuit_breaker.py）のベンチマーク
+
+/api/soap の処理（soap.convert_to_soap）を Gemini のモックで呼び、次の3段階を順に流す。
+
+- healthy: モックが latency 秒で正常に応答する
+- outage: モックが latency 秒待ってから失敗する（障害中のプロバイダ）
+- recovery: 再び正常に応答する（open の間は half_open の試行で回復を確かめる）
+
+ブレーカーなし（BREAKER_DISABLED=1）とありで、段階ごとの p50 / p99、フォールバック件数、
+実際にモックを呼んだ件数を表示し、最後にブレーカーの状態（?metrics=state の circuit_breakers と同じ内容）を出す。
+
+使い方:
+    python ui/bench/bench_circuit_breaker.py
+    python ui/bench/bench_circuit_breaker.py --requests 100 --latency 0.3 --open-seconds 0.5
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ハンドラーの import 前に設定する（LLMキャッシュとトレース出力は計測対象から外す）
+os.environ.setdefault('LLM_CACHE_DISABLED', '1')
+os.environ.setdefault('TRACE_FILE', '')
+os.environ.setdefault('HEALTH_PROBE_INTERVAL', '0')
+
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'api'))
+
+import soap  # noqa: E402
+from _lib import circuit_breaker  # noqa: E402
+
+CONVERSATION = "医師: 今日はどうされましたか。\n患者: 右上の奥歯が冷たいものでしみます。\n医師: 詰め物の下がむし歯です。"
+RESPONSE = {"subjective": "冷水痛", "objective": "#16 二次う蝕", "assessment": "う蝕", "plan": "再充填",
+            "confidence": 0.9}
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+
+class FlakyModel:
+    """GenerativeModel の代わり。failing の間は latency 秒待ってから失敗する"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.failing = False
+        self.calls = 0
+
+    def generate_content(self, prompt, generation_config=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.failing:
+            raise ConnectionError("503 Service Unavailable (mock outage)")
+        return _Response(json.dumps(RESPONSE, ensure_ascii=False))
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def run_phase(model, requests, failing, interval):
+    model.failing = failing
+    calls_before = model.calls
+    latencies = []
+    fallbacks = 0
+    for _ in range(requests):
+        started = time.perf_counter()
+        result = soap.convert_to_soap(CONVERSATION, bypass_cache=True)
+        latencies.append((time.perf_counter() - started) * 1000)
+        fallbacks += result.get("method") != "gemini_ai_medical_record_structuring"
+        if interval:
+            time.sleep(interval)
+    latencies.sort()
+    return {
+        "p50": percentile(latencies, 0.50),
+        "p99": percentile(latencies, 0.99),
+        "fallbacks": fallbacks,
+        "provider_calls": model.calls - calls_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=60, help='段階ごとのリクエスト数')
+    parser.add_argument('--latency', type=float, default=0.2, help='モックの応答（失敗）までの秒数')
+    parser.add_argument('--interval', type=float, default=0.02, help='リクエストの間隔秒')
+    parser.add_argument('--open-seconds', type=float, default=1.0, help='BREAKER_OPEN_SECONDS')
+    args = parser.parse_args()
+
+    os.environ['GEMINI_API_KEY'] = 'bench-mock-key'
+    os.environ['BREAKER_OPEN_SECONDS'] = str(args.open_seconds)
+    model = FlakyModel(args.latency)
+    soap.gemini_model = lambda api_key, model_name='gemini-1.5-flash': model
+
+    print(f"{'breaker':<8} {'phase':<9} {'p50 ms':>8} {'p99 ms':>8} {'fallbacks':>9} {'provider calls':>14}")
+    for enabled in (False, True):
+        os.environ['BREAKER_DISABLED'] = '' if enabled else '1'
+        circuit_breaker._breakers.clear()
+        for phase, failing in (('healthy', False), ('outage', True), ('recovery', False)):
+            row = run_phase(model, args.requests, failing, args.interval)
+            print(f"{'on' if enabled else 'off':<8} {phase:<9} {row['p50']:>8.1f} {row['p99']:>8.1f} "
+                  f"{row['fallbacks']:>9} {row['provider_calls']:>14}")
+    print(json.dumps(circuit_breaker.breakers_snapshot(), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""同一リクエストの同時実行のまとめ（_lib/singleflight.py）のベンチマーク
+
+/api/soap・/api/quality の処理を Gemini のモック（latency 秒で応答）で呼び、同じ会話への同時リクエスト
+（複数スタッフが同じセッションを開く・解析ボタンの二重送信）を burst 件ずつスレッドで一斉に送る。
+会話の種類（unique）ごとにこれを繰り返し、まとめなし（LLM_COALESCE_DISABLED=1）とありで、
+会話1件あたりのプロバイダ呼び出し数とリクエストの p50 / p99 を表示する。
+
+LLMキャッシュだけでは、同時に届いたリクエストはどれも最初の呼び出しの完了前にキャッシュを引くため
+全件ミスになる（cache 列が on の行）。
+
+使い方:
+    python ui/bench/bench_coalescing.py
+    python ui/bench/bench_coalescing.py --burst 16 --unique 20 --latency 0.5
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ハンドラーの import 前に設定する（トレース出力は計測対象から外す）
+os.environ.setdefault('TRACE_FILE', '')
+os.environ.setdefault('HEALTH_PROBE_INTERVAL', '0')
+os.environ['LLM_CACHE_PATH'] = ''
+
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'api'))
+
+import quality  # noqa: E402
+import soap  # noqa: E402
+from _lib.llm_cache import get_cache  # noqa: E402
+
+RESPONSES = {
+    soap: {"subjective": "冷水痛", "objective": "#16 二次う蝕", "assessment": "う蝕", "plan": "再充填",
+           "confidence": 0.9},
+    quality: {"success_possibility": 0.8, "patient_understanding": 0.7, "treatment_consent": 0.8,
+              "overall_quality": 0.8, "improvements": ["費用の説明"], "positives": ["丁寧な説明"],
+              "confidence": 0.9},
+}
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+
+class CountingModel:
+    """GenerativeModel の代わり。latency 秒待って固定のJSONを返し、呼び出し数を数える"""
+
+    def __init__(self, response, latency):
+        self.response = json.dumps(response, ensure_ascii=False)
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, generation_config=None):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return _Response(self.response)
+
+
+def conversation(n):
+    return f"医師: 今日はどうされましたか。\n患者: {n}番の歯が冷たいものでしみます。\n医師: 詰め物の下がむし歯です。"
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def run(models, burst, unique, coalesce, cache):
+    os.environ['LLM_COALESCE_DISABLED'] = '' if coalesce else '1'
+    os.environ['LLM_CACHE_DISABLED'] = '' if cache else '1'
+    get_cache().clear()
+    for model in models.values():
+        model.calls = 0
+    latencies = []
+    lock = threading.Lock()
+
+    def request(text, analyze):
+        started = time.perf_counter()
+        analyze(text)
+        with lock:
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    for n in range(unique):
+        text = conversation(n)
+        threads = [threading.Thread(target=request, args=(text, analyze))
+                   for _ in range(burst)
+                   for analyze in (soap.convert_to_soap, quality.analyze_quality)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    latencies.sort()
+    return {
+        "calls_per_session": sum(model.calls for model in models.values()) / unique,
+        "p50": percentile(latencies, 0.50),
+        "p99": percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--burst', type=int, default=8, help='同じ会話への同時リクエスト数（SOAP・品質それぞれ）')
+    parser.add_argument('--unique', type=int, default=10, help='会話の種類数')
+    parser.add_argument('--latency', type=float, default=0.3, help='モックの応答秒数')
+    args = parser.parse_args()
+
+    os.environ['GEMINI_API_KEY'] = 'bench-mock-key'
+    models = {}
+    for module, response in RESPONSES.items():
+        model = models[module] = CountingModel(response, args.latency)
+        module.gemini_model = lambda api_key, model_name='gemini-1.5-flash', model=model: model
+
+    print(f"burst {args.burst} × (soap + quality), {args.unique} sessions, provider latency {args.latency * 1000:.0f} ms")
+    print(f"{'coalesce':<9} {'cache':<6} {'calls/session':>13} {'p50 ms':>8} {'p99 ms':>8}")
+    for coalesce, cache in ((False, False), (False, True), (True, False), (True, True)):
+        row = run(models, args.burst, args.unique, coalesce, cache)
+        print(f"{'on' if coalesce else 'off':<9} {'on' if cache else 'off':<6} {row['calls_per_session']:>13.1f} "
+              f"{row['p50']:>8.1f} {row['p99']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""プロンプト圧縮（_lib/compaction.py）の圧縮率と解析結果の一致度のベンチマーク
+
+合成会話（synthetic.py）に実際の録音と同程度の相づち・挨拶（FILLERS）を混ぜ、発話数と予算
+（元の推定トークン数に対する割合）ごとに次を表示する。
+
+- ratio: 圧縮後/圧縮前の推定トークン数
+- ms: 圧縮にかかった時間
+- keywords: 元の会話に出る臨床キーワード（種類）のうち圧縮後にも残る割合
+- salient: 同意・迷いの表現を含む発話のうち残った割合
+- score diff: ルールベース品質分析（_fallback_quality）の4スコアの、元の会話との差の絶対値の平均（最大）
+
+LLM の出力の一致度は API キーのある環境で PROMPT_TOKEN_BUDGET の有無を切り替えて比較する
+（結果の compaction に圧縮の統計が入る）。
+
+使い方:
+    python ui/bench/bench_compaction.py
+    python ui/bench/bench_compaction.py --utterances 200,2000 --budgets 0.3,0.6
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'api'))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic  # noqa: E402
+from _lib.compaction import SALIENCE_KEYWORDS, compact_transcript, estimate_tokens  # noqa: E402
+from quality import _fallback_quality  # noqa: E402
+
+FILLER_RATE = 0.25
+FILLERS = ('はい。', 'ええ、そうですね。', 'なるほど。', 'はい、はい。', 'うん。', 'よろしくお願いします。',
+           'ありがとうございます。')
+SCORES = ('success_possibility', 'patient_understanding', 'treatment_consent', 'overall_quality')
+
+
+def make_conversation(utterances, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for u in synthetic.generate(utterances, seed):
+        lines.append(f"{u.speaker}: {u.text}")
+        if rng.random() < FILLER_RATE:
+            lines.append(f"{'患者' if u.speaker == '医師' else '医師'}: {rng.choice(FILLERS)}")
+    return '\n'.join(lines)
+
+
+def clinical_keywords(text):
+    return SALIENCE_KEYWORDS.scan(text).keywords('clinical')
+
+
+def salient_lines(text):
+    """同意・迷いの表現を含む発話（挨拶の「よろしくお願いします」などの FILLERS は除く）"""
+    return {line for line in text.split('\n')
+            if line.partition(': ')[2] not in FILLERS
+            and (SALIENCE_KEYWORDS.contains_any(line, 'consent') or SALIENCE_KEYWORDS.contains_any(line, 'hesitation'))}
+
+
+def measure(text, fraction):
+    budget = max(1, int(estimate_tokens(text) * fraction))
+    started = time.perf_counter()
+    compacted, stats = compact_transcript(text, budget)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    keywords = clinical_keywords(text)
+    kept_keywords = clinical_keywords(compacted)
+    salient = salient_lines(text)
+    kept_salient = {line for line in salient if line in compacted}
+    full = _fallback_quality(text, None)
+    reduced = _fallback_quality(compacted, None)
+    diffs = [abs(full[key] - reduced[key]) for key in SCORES]
+    return {
+        "ratio": stats["ratio"],
+        "ms": elapsed_ms,
+        "keywords": len(kept_keywords & keywords) / len(keywords) if keywords else 1.0,
+        "salient": len(kept_salient) / len(salient) if salient else 1.0,
+        "diff_mean": sum(diffs) / len(diffs),
+        "diff_max": max(diffs),
+        "dropped": stats["dropped"],
+        "merged": stats["merged"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--utterances', default='100,1000,10000', help='発話数（カンマ区切り）')
+    parser.add_argument('--budgets', default='0.25,0.5,0.75', help='予算（元の推定トークン数に対する割合、カンマ区切り）')
+    args = parser.parse_args()
+
+    print(f"{'utterances':>10} {'tokens':>8} {'budget':>6} {'ratio':>6} {'ms':>8} {'keywords':>8} "
+          f"{'salient':>7} {'score diff':>14} {'dropped':>8} {'merged':>7}")
+    for utterances in (int(value) for value in args.utterances.split(',')):
+        text = make_conversation(utterances)
+        tokens = estimate_tokens(text)
+        for fraction in (float(value) for value in args.budgets.split(',')):
+            row = measure(text, fraction)
+            print(f"{utterances:>10,} {tokens:>8,} {fraction:>6.2f} {row['ratio']:>6.2f} {row['ms']:>8.1f} "
+                  f"{row['keywords']:>8.0%} {row['salient']:>7.0%} "
+                  f"{row['diff_mean']:>6.3f} ({row['diff_max']:.2f}) {row['dropped']:>8,} {row['merged']:>7,}")
+
+
+if __name__ == '__main__':
+    main()
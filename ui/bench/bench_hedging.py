@@ -0,0 +1,301 @@
+"""ヘッジ/レース呼び出し（_lib/router.py）のベンチマーク
+
+ローカルに OpenAI 互換（POST .../chat/completions）のスタブサーバをプロバイダの数だけ立て、
+遅延（基本の遅延と、一定の確率で起きる裾の遅延）と無効な応答の割合を注入する。
+同じリクエスト列を single（1番目のプロバイダだけ）・hedge・race で送り、次を表示する。
+
+- p50 / p90 / p99: 1リクエストの所要時間
+- calls: リクエストあたりのスタブへの送信数（ヘッジ・レースの追加コスト）
+- aborted: 負けた側がストリーミングの途中で接続を閉じた件数（スタブが書き込みに失敗した数）
+- wins: 採用した結果のプロバイダ別件数
+- errors: 全プロバイダが失敗した件数
+
+スタブのクライアントは urllib のストリーミング（SSE）で本文を読み、router.cancelled() で打ち切る。
+openai パッケージがある環境では --handlers で、本番の経路（soap.convert_to_soap → OpenAI / OpenRouter の
+SOAP変換）をスタブに向けて同じ比較を行う（SDK の同期呼び出しなので負けた側は打ち切らずに捨てる）。
+
+使い方:
+    python ui/bench/bench_hedging.py
+    python ui/bench/bench_hedging.py --requests 300 --stub openai=80,2000,0.05,0 --stub openrouter=120,400,0.01,0.02
+    python ui/bench/bench_hedging.py --handlers
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ハンドラーの import 前に設定する（LLMキャッシュとトレース出力は計測対象から外す）
+os.environ.setdefault('LLM_CACHE_DISABLED', '1')
+os.environ.setdefault('TRACE_FILE', '')
+os.environ.setdefault('HEALTH_PROBE_INTERVAL', '0')
+
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'api'))
+
+from _lib import provider_health  # noqa: E402
+from _lib.provider_health import observe_call  # noqa: E402
+from _lib.router import Cancelled, RouterError, cancelled, route  # noqa: E402
+
+# 既定のスタブ: (基本の遅延ms, 裾の遅延ms, 裾の確率, 無効な応答の割合)
+DEFAULT_STUBS = (
+    ('openai', (100, 2500, 0.05, 0.0)),
+    ('openrouter', (140, 1500, 0.03, 0.01)),
+)
+STREAM_CHUNKS = 8
+# SOAP変換・品質分析のどちらの解析でも有効な応答（OpenAI / OpenRouter の出力形式）
+STUB_CONTENT = {
+    "S": "右上の奥歯が冷たいものでしみる", "O": "#16 遠心にう蝕", "A": "C2 う蝕", "P": "CR充填、次回予約",
+    "confidence": 0.9,
+    "success_possibility": 0.8, "success_possibility_reasoning": "スタブ",
+    "patient_understanding": 0.7, "patient_understanding_reasoning": "スタブ",
+    "treatment_consent_likelihood": 0.8, "treatment_consent_reasoning": "スタブ",
+    "improvement_suggestions": ["費用の説明"], "positive_aspects": ["丁寧な説明"],
+}
+
+
+class StubServer:
+    """遅延と無効な応答を注入する OpenAI 互換のスタブ"""
+
+    def __init__(self, name, base_ms, tail_ms, tail_rate, invalid_rate, seed=0):
+        self.name = name
+        self.base_ms = base_ms
+        self.tail_ms = tail_ms
+        self.tail_rate = tail_rate
+        self.invalid_rate = invalid_rate
+        self.rng = random.Random(f"{name}-{seed}")
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "completed": 0, "aborted": 0}
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])) or b'{}')
+                stub.respond(self, body)
+
+            def do_GET(self):
+                # models.list（疎通確認）
+                payload = json.dumps({"object": "list", "data": [{"id": "stub", "object": "model"}]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def _draw(self):
+        with self.lock:
+            latency = self.base_ms * self.rng.uniform(0.8, 1.2)
+            if self.rng.random() < self.tail_rate:
+                latency += self.tail_ms
+            invalid = self.rng.random() < self.invalid_rate
+        return latency / 1000, invalid
+
+    def respond(self, request, body):
+        self._count('requests')
+        latency, invalid = self._draw()
+        content = '申し訳ありません、解析できませんでした。' if invalid else json.dumps(STUB_CONTENT, ensure_ascii=False)
+        try:
+            if body.get('stream'):
+                request.send_response(200)
+                request.send_header('Content-Type', 'text/event-stream')
+                request.end_headers()
+                # 遅延の間、本文を少しずつ送る（負けた側はこの途中で接続を閉じる）
+                step = max(1, len(content) // STREAM_CHUNKS + 1)
+                for start in range(0, len(content), step):
+                    time.sleep(latency / STREAM_CHUNKS)
+                    event = {"choices": [{"index": 0, "delta": {"content": content[start:start + step]}}]}
+                    request.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+                    request.wfile.flush()
+                request.wfile.write(b"data: [DONE]\n\n")
+                request.wfile.flush()
+                request.close_connection = True
+            else:
+                time.sleep(latency)
+                payload = json.dumps({
+                    "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": "stub",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150},
+                }, ensure_ascii=False).encode('utf-8')
+                request.send_response(200)
+                request.send_header('Content-Type', 'application/json')
+                request.send_header('Content-Length', str(len(payload)))
+                request.end_headers()
+                request.wfile.write(payload)
+            self._count('completed')
+        except (BrokenPipeError, ConnectionResetError):
+            self._count('aborted')
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def stub_backend(stub):
+    """スタブに stream=True で送り、本文をつなげてJSONとして返す（負けたら接続を閉じて Cancelled）"""
+    def call():
+        data = json.dumps({"model": "stub", "stream": True,
+                           "messages": [{"role": "user", "content": "SOAP"}]}).encode('utf-8')
+        request = urllib.request.Request(stub.base_url + '/chat/completions', data=data,
+                                         headers={'Content-Type': 'application/json'})
+        parts = []
+        with urllib.request.urlopen(request, timeout=30) as response:
+            for line in response:
+                if cancelled():
+                    raise Cancelled()
+                line = line.decode('utf-8').strip()
+                if line.startswith('data: ') and line != 'data: [DONE]':
+                    parts.append(json.loads(line[6:])['choices'][0]['delta'].get('content') or '')
+        return json.loads(''.join(parts))
+    return observe_call(stub.name, call)
+
+
+def valid_soap(result):
+    return isinstance(result, dict) and all(isinstance(result.get(key), str) and result[key] for key in 'SOAP')
+
+
+def parse_stub(spec):
+    name, _, values = spec.partition('=')
+    base_ms, tail_ms, tail_rate, invalid_rate = (float(value) for value in values.split(','))
+    return name, (base_ms, tail_ms, tail_rate, invalid_rate)
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def reset_health():
+    """モードごとに呼び出し統計を空から始める（前のモードの負けた呼び出しの記録を持ち越さない）"""
+    provider_health._health = provider_health.ProviderHealth(probe_interval=0)
+
+
+def run_mode(mode, stubs, requests, call_once, warmup):
+    reset_health()
+    # ヘッジの待ち時間（分位）に使う呼び出し統計を作る
+    for _ in range(warmup):
+        call_once('single')
+    time.sleep(0.3)
+    for stub in stubs:
+        stub.counts.update(requests=0, completed=0, aborted=0)
+
+    latencies = []
+    wins = {}
+    errors = 0
+    for _ in range(requests):
+        started = time.perf_counter()
+        try:
+            provider = call_once(mode)
+            wins[provider] = wins.get(provider, 0) + 1
+        except RouterError:
+            errors += 1
+        latencies.append((time.perf_counter() - started) * 1000)
+    # 負けた側の打ち切りがスタブに届くのを待つ
+    time.sleep(0.5)
+    latencies.sort()
+    return {
+        "mode": mode,
+        "p50": percentile(latencies, 0.50),
+        "p90": percentile(latencies, 0.90),
+        "p99": percentile(latencies, 0.99),
+        "calls": sum(stub.counts['requests'] for stub in stubs) / requests,
+        "aborted": sum(stub.counts['aborted'] for stub in stubs),
+        "wins": wins,
+        "errors": errors,
+    }
+
+
+def stub_caller(stubs):
+    backends = [(stub.name, stub_backend(stub)) for stub in stubs]
+
+    def call_once(mode):
+        if mode == 'single':
+            mode, selected = 'hedge', backends[:1]
+        else:
+            selected = backends
+        provider, _, _ = route('bench', selected, validate=valid_soap, mode=mode)
+        return provider
+    return call_once
+
+
+def handler_caller(stubs):
+    """soap.convert_to_soap（本番の経路）をスタブに向ける。openai パッケージが必要"""
+    import soap
+    by_name = {stub.name: stub for stub in stubs}
+    os.environ['OPENAI_API_KEY'] = 'stub'
+    os.environ['OPENAI_BASE_URL'] = by_name['openai'].base_url
+    os.environ['OPENROUTER_API_KEY'] = 'stub'
+    os.environ['OPENROUTER_BASE_URL'] = by_name['openrouter'].base_url
+    os.environ['ROUTER_PROVIDERS'] = ','.join(stub.name for stub in stubs)
+    conversation = "医師: 今日はどうされましたか。\n患者: 右上の奥歯が冷たいものでしみます。"
+
+    def call_once(mode):
+        os.environ['ROUTER_MODE'] = 'off' if mode == 'single' else mode
+        if mode == 'single':
+            os.environ['ROUTER_PROVIDERS'] = stubs[0].name
+        else:
+            os.environ['ROUTER_PROVIDERS'] = ','.join(stub.name for stub in stubs)
+        result = soap._routed_soap(conversation, '患者', '医師', soap.routed_providers() or [stubs[0].name],
+                                   bypass_cache=True)
+        if 'routing' not in result:
+            raise RouterError('soap', {"fallback": result.get("method")})
+        return result['routing']['provider']
+    return call_once
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200, help='モードごとのリクエスト数')
+    parser.add_argument('--warmup', type=int, default=30, help='呼び出し統計を作るための事前のリクエスト数')
+    parser.add_argument('--stub', action='append', default=[],
+                        help='name=基本ms,裾ms,裾の確率,無効な応答の割合（送る順。既定 openai と openrouter）')
+    parser.add_argument('--modes', default='single,hedge,race')
+    parser.add_argument('--handlers', action='store_true', help='soap.py の経路で計測する（openai パッケージが必要）')
+    args = parser.parse_args()
+
+    specs = [parse_stub(spec) for spec in args.stub] or list(DEFAULT_STUBS)
+    stubs = [StubServer(name, *values) for name, values in specs]
+    try:
+        if args.handlers:
+            try:
+                import openai  # noqa: F401
+            except ImportError:
+                print("--handlers には openai パッケージが必要です")
+                return
+            call_once = handler_caller(stubs)
+        else:
+            call_once = stub_caller(stubs)
+
+        for name, values in specs:
+            print(f"stub {name}: base {values[0]:.0f} ms, tail +{values[1]:.0f} ms @ {values[2]:.0%}, "
+                  f"invalid {values[3]:.0%}")
+        print(f"{'mode':<8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'calls':>6} {'aborted':>8} {'errors':>7}  wins")
+        for mode in args.modes.split(','):
+            row = run_mode(mode, stubs, args.requests, call_once, args.warmup)
+            print(f"{row['mode']:<8} {row['p50']:>8.1f} {row['p90']:>8.1f} {row['p99']:>8.1f} {row['calls']:>6.2f} "
+                  f"{row['aborted']:>8} {row['errors']:>7}  {row['wins']}")
+    finally:
+        for stub in stubs:
+            stub.close()
+
+
+if __name__ == '__main__':
+    main()
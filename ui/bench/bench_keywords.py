@@ -0,0 +1,81 @@
+"""ルールベース（フォールバック）解析のキーワード照合マイクロベンチマーク
+
+キーワードエンジン導入前の実装（legacy_fallbacks.py）と現在の実装を同じ入力で実行し、
+結果が一致することを確認したうえで会話テキスト1MBあたりの処理時間を表示する。
+SOAP は話者ラベルの役割で発言を振り分けるようになったため（「医師: …田中さん」は医師の発言）、
+一致の確認は役割を unknown にした Transcript（従来の行の文字列による判定）で行う。
+KeywordMatcher.scan()（全カテゴリの件数・位置を1回の走査で取得）の速度も参考に併記する。scan() はヒットごとに
+位置を記録するので種類だけの判定より遅く、フォールバック解析では使わない（種類の判定は present()）。
+
+使い方:
+    python ui/bench/bench_keywords.py
+    python ui/bench/bench_keywords.py --megabytes 4
+"""
+import argparse
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'api'))
+
+from identify import _fallback_identify  # noqa: E402
+from quality import QUALITY_KEYWORDS, _fallback_quality  # noqa: E402
+from soap import _fallback_soap  # noqa: E402
+from _lib.transcript import UNKNOWN, Transcript  # noqa: E402
+from legacy_fallbacks import (  # noqa: E402
+    legacy_fallback_identify, legacy_fallback_quality, legacy_fallback_soap
+)
+
+SAMPLE_PATH = os.path.join(BENCH_DIR, '..', '..', 'sample_data', 'plaud_transcript.txt')
+
+
+def timed(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--megabytes', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with open(SAMPLE_PATH, encoding='utf-8') as f:
+        sample = f.read().strip()
+    copies = max(1, int(args.megabytes * 1024 * 1024) // len(sample.encode('utf-8')))
+    text = '\n'.join([sample] * copies)
+    size_mb = len(text.encode('utf-8')) / 1024 / 1024
+
+    # 結果の一致を確認
+    assert _fallback_quality(text, {}) == legacy_fallback_quality(text, {})
+    unlabeled = Transcript.from_text(text)
+    unlabeled.set_roles(dict.fromkeys(set(unlabeled.speakers()), UNKNOWN))
+    assert _fallback_soap(text, '田中', '医師', unlabeled) == legacy_fallback_soap(text, '田中', '医師')
+    assert _fallback_identify(text) == legacy_fallback_identify(text)
+
+    pairs = [
+        ('identify', lambda: legacy_fallback_identify(text), lambda: _fallback_identify(text)),
+        ('soap', lambda: legacy_fallback_soap(text, '田中', '医師'), lambda: _fallback_soap(text, '田中', '医師')),
+        ('quality', lambda: legacy_fallback_quality(text, {}), lambda: _fallback_quality(text, {})),
+    ]
+    print(f"input: {size_mb:.2f} MB ({text.count(chr(10)) + 1:,} lines)")
+    print(f"{'stage':<10} {'legacy ms/MB':>13} {'current ms/MB':>14} {'MB/s':>8} {'speedup':>8}")
+    for name, legacy, current in pairs:
+        legacy_s = timed(legacy, args.repeat)
+        current_s = timed(current, args.repeat)
+        print(f"{name:<10} {legacy_s * 1000 / size_mb:>13.1f} {current_s * 1000 / size_mb:>14.1f} "
+              f"{size_mb / current_s:>8.1f} {legacy_s / current_s:>7.2f}x")
+
+    scan_s = timed(lambda: QUALITY_KEYWORDS.scan(text), args.repeat)
+    hits = QUALITY_KEYWORDS.scan(text).counts()
+    print(f"{'scan()':<10} {'-':>13} {scan_s * 1000 / size_mb:>14.1f} {size_mb / scan_s:>8.1f} "
+          f"({sum(hits.values()):,} hits, positions included)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""ライブセッション（/api/live_session）のベンチマーク
+
+synthetic.py の合成会話を --batch 発話ずつ届く診療中の会話として流し、届くたびに指標を更新する2通りを比べる。
+
+- resend: これまでの全文を毎回送り直し、ルールベースの品質分析とSOAP変換（/api/quality・/api/soap の
+  フォールバック）をやり直す。LLM も全文で呼ぶ（間引きの条件は live と同じ）
+- live: 追加分だけを live_session.handle_live に追記する。LLM は要約と追加分だけで呼ぶ
+
+会話の長さごとに、ローカル集計の合計時間と最後の1回の時間、LLM の呼び出し回数と送った会話の文字数の合計
+（Gemini のモックで数える。指示文は含まない）を表示する。resend は会話が長くなるほど1回が遅くなり合計は2乗で増えるが、
+live は1回の時間が追加分だけに比例する。
+
+使い方:
+    python ui/bench/bench_live_session.py
+    python ui/bench/bench_live_session.py --lengths 200,1000,4000 --batch 4 --refresh-every 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ハンドラーの import 前に設定する（LLMキャッシュとトレース出力は計測対象から外す）
+os.environ.setdefault('LLM_CACHE_DISABLED', '1')
+os.environ.setdefault('TRACE_FILE', '')
+os.environ.setdefault('HEALTH_PROBE_INTERVAL', '0')
+
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'api'))
+sys.path.insert(0, BENCH_DIR)
+
+import live_session  # noqa: E402
+import quality  # noqa: E402
+import soap  # noqa: E402
+import synthetic  # noqa: E402
+from _lib.live_sessions import get_live_store  # noqa: E402
+from _lib.transcript import Transcript  # noqa: E402
+
+RESPONSE = {"summary": "右上6番の冷水痛。う蝕の説明と充填の提案に前向き。", "success_possibility": 0.7,
+            "patient_understanding": 0.7, "treatment_consent": 0.6, "consent_signals": [], "concerns": [],
+            "improvements": []}
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+
+class CountingModel:
+    """GenerativeModel の代わり。呼び出し回数とプロンプトの会話部分の文字数を数える"""
+
+    def __init__(self):
+        self.calls = 0
+        self.chars = 0
+
+    def generate_content(self, prompt, generation_config=None):
+        self.calls += 1
+        marker = 'これまでの要約:\n' if 'これまでの要約:\n' in prompt else '会話内容:\n'
+        self.chars += len(prompt.split(marker, 1)[-1].split('\n\n以下の', 1)[0])
+        return _Response(json.dumps(RESPONSE, ensure_ascii=False))
+
+
+def run_resend(utterances, batch, refresh_every, model):
+    lines = []
+    local_seconds = last = 0.0
+    pending = 0
+    for start in range(0, len(utterances), batch):
+        lines.extend(f"{u.speaker}: {u.text}" for u in utterances[start:start + batch])
+        pending += min(batch, len(utterances) - start)
+        text = '\n'.join(lines)
+        started = time.perf_counter()
+        transcript = Transcript.from_text(text)
+        quality._fallback_quality(text, {}, transcript)
+        soap._fallback_soap(text, '患者', '医師', transcript)
+        last = time.perf_counter() - started
+        local_seconds += last
+        if pending >= refresh_every:
+            quality._gemini_quality_result(text, 'bench-mock-key', bypass_cache=True, transcript=transcript)
+            pending = 0
+    return local_seconds, last
+
+
+def run_live(utterances, batch, refresh_every):
+    os.environ['LIVE_REFRESH_MIN_UTTERANCES'] = str(refresh_every)
+    records = [{"speaker": u.speaker, "text": u.text, "start": u.start, "end": u.end} for u in utterances]
+    session_id = live_session.handle_live({"action": "start"})['session_id']
+    local_seconds = last = 0.0
+    for start in range(0, len(records), batch):
+        # 計測は LLM の更新を除いたローカル集計だけ（更新は同じ呼び出しの中で行われるので、先に無効にして分ける）
+        os.environ['GEMINI_API_KEY'] = ''
+        started = time.perf_counter()
+        live_session.handle_live({"session_id": session_id, "utterances": records[start:start + batch],
+                                  "offset": start})
+        last = time.perf_counter() - started
+        local_seconds += last
+        os.environ['GEMINI_API_KEY'] = 'bench-mock-key'
+        live_session.handle_live({"session_id": session_id, "utterances": []})
+    live_session.handle_live({"session_id": session_id, "action": "end"})
+    return local_seconds, last
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lengths', default='200,1000,3000', help='会話の発話数（カンマ区切り）')
+    parser.add_argument('--batch', type=int, default=4, help='1回に届く発話数')
+    parser.add_argument('--refresh-every', type=int, default=20, help='LLM を更新する未反映の発話数')
+    args = parser.parse_args()
+
+    os.environ['LIVE_REFRESH_MIN_SECONDS'] = '0'
+    model = CountingModel()
+    quality.gemini_model = lambda api_key, model_name='gemini-1.5-flash': model
+    live_session.gemini_model = quality.gemini_model
+
+    print(f"{'utterances':>10} {'mode':<7} {'local total ms':>14} {'last update ms':>14} {'LLM calls':>9} "
+          f"{'LLM chars':>11}")
+    for length in (int(value) for value in args.lengths.split(',')):
+        utterances = synthetic.generate(length, seed=length)
+        for mode in ('resend', 'live'):
+            calls, chars = model.calls, model.chars
+            if mode == 'resend':
+                total, last = run_resend(utterances, args.batch, args.refresh_every, model)
+            else:
+                total, last = run_live(utterances, args.batch, args.refresh_every)
+            print(f"{length:>10} {mode:<7} {total * 1000:>14.1f} {last * 1000:>14.3f} {model.calls - calls:>9} "
+                  f"{model.chars - chars:>11}")
+    print(json.dumps(get_live_store().stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""parse_xlsx のストリーミング版と旧実装（ET.parse + .// 探索）の比較ベンチマーク
+
+使い方:
+    python ui/bench/bench_parse_xlsx.py            # 50,000行
+    python ui/bench/bench_parse_xlsx.py --rows 200000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+import zipfile
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from _lib.xlsx import iter_conversation_lines  # noqa: E402
+
+NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+UTTERANCES = [
+    ('医師', 'おはようございます。今日はどのような症状でいらっしゃいましたか？'),
+    ('患者', '右上の奥歯が2週間ほど前から冷たいものを飲むとしみるんです。'),
+    ('医師', 'なるほど。では診察させていただきますね。お口を大きく開けてください。'),
+    ('患者', '分かりました。費用はどのくらいかかりますか？'),
+]
+
+
+def build_workbook(rows):
+    """共有文字列を使う2列（話者・発言）のワークブックを生成する"""
+    strings = ['話者', '発言']
+    index = {s: i for i, s in enumerate(strings)}
+    sheet_rows = ['<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c></row>']
+    for n in range(rows):
+        speaker, text = UTTERANCES[n % len(UTTERANCES)]
+        text = f"{text}（{n}）"
+        cells = []
+        for col, value in (('A', speaker), ('B', text)):
+            if value not in index:
+                index[value] = len(strings)
+                strings.append(value)
+            cells.append(f'<c r="{col}{n + 2}" t="s"><v>{index[value]}</v></c>')
+        sheet_rows.append(f'<row r="{n + 2}">{"".join(cells)}</row>')
+
+    shared = ''.join(f'<si><t>{escape(s)}</t></si>' for s in strings)
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('xl/sharedStrings.xml',
+                    f'<sst xmlns="{NS[1:-1]}" count="{len(strings)}">{shared}</sst>')
+        zf.writestr('xl/worksheets/sheet1.xml',
+                    f'<worksheet xmlns="{NS[1:-1]}"><sheetData>{"".join(sheet_rows)}</sheetData></worksheet>')
+    return buffer.getvalue()
+
+
+def legacy_parse(xlsx_data):
+    """ストリーミング化以前の parse_xlsx_content（比較用に保持）"""
+    with zipfile.ZipFile(BytesIO(xlsx_data), 'r') as zip_file:
+        shared_strings = []
+        with zip_file.open('xl/sharedStrings.xml') as shared_strings_file:
+            for si in ET.parse(shared_strings_file).getroot():
+                t_element = si.find(f'.//{NS}t')
+                if t_element is not None:
+                    shared_strings.append(t_element.text or '')
+        with zip_file.open('xl/worksheets/sheet1.xml') as worksheet_file:
+            worksheet_tree = ET.parse(worksheet_file)
+            conversations = []
+            for row in worksheet_tree.getroot().findall(f'.//{NS}row'):
+                row_data = []
+                for cell in row.findall(f'.//{NS}c'):
+                    cell_value = ''
+                    v_element = cell.find(f'.//{NS}v')
+                    if v_element is not None:
+                        if cell.get('t', '') == 's':
+                            cell_value = shared_strings[int(v_element.text)]
+                        else:
+                            cell_value = v_element.text or ''
+                    row_data.append(cell_value)
+                if len(row_data) >= 2 and row_data[0] not in ['話者', 'Speaker', 'Start Time']:
+                    if row_data[0] and row_data[1]:
+                        conversations.append(f"{row_data[0]}: {row_data[1]}")
+            return '\n'.join(conversations)
+
+
+def streaming_parse(xlsx_data):
+    return '\n'.join(iter_conversation_lines(BytesIO(xlsx_data)))
+
+
+def measure(func, xlsx_data, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(xlsx_data)
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    func(xlsx_data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    xlsx_data = build_workbook(args.rows)
+    print(f"workbook: {args.rows:,} rows, {len(xlsx_data) / 1024:.0f} KiB (zip)")
+
+    legacy_text, legacy_time, legacy_peak = measure(legacy_parse, xlsx_data, args.repeat)
+    stream_text, stream_time, stream_peak = measure(streaming_parse, xlsx_data, args.repeat)
+    assert legacy_text == stream_text, "streaming parser output differs from legacy parser"
+
+    print(f"{'implementation':<12} {'time (s)':>10} {'peak (MiB)':>12}")
+    print(f"{'legacy':<12} {legacy_time:>10.3f} {legacy_peak / 2**20:>12.1f}")
+    print(f"{'streaming':<12} {stream_time:>10.3f} {stream_peak / 2**20:>12.1f}")
+    print(f"speedup x{legacy_time / stream_time:.2f}, peak memory x{legacy_peak / stream_peak:.2f} smaller")
+
+
+if __name__ == '__main__':
+    main()
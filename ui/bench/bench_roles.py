@@ -0,0 +1,90 @@
+"""話者の役割推定（_lib/roles.py）のベンチマーク
+
+synthetic.py の合成会話（医師・患者）を、話者の対応を無作為に入れ替えた "Speaker 1" / "Speaker 2" に
+書き換えてから推定し、会話の長さ（発話数）ごとに次を表示する。
+
+- accuracy: 医師・患者を正しく割り当てた会話の割合（割り当てなかった会話は不正解に数える）
+- local: 信頼度が IDENTIFY_LOCAL_MIN_CONFIDENCE（既定 0.8）以上で、/api/identify が LLM を呼ばずに済む会話の割合
+- confidence: 信頼度の平均
+- ms: 1会話あたりの推定時間
+
+最後に realistic_sample_data/notta_transcript.csv（実際の Notta 出力）の推定結果も表示する。
+
+使い方:
+    python ui/bench/bench_roles.py
+    python ui/bench/bench_roles.py --sessions 500 --lengths 4,8,16,64,1000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCH_DIR, '..', '..')
+
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'api'))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic  # noqa: E402
+from _lib.roles import infer_roles  # noqa: E402
+from _lib.transcript import DOCTOR, PATIENT, Transcript  # noqa: E402
+
+ROLE_OF = {'医師': DOCTOR, '患者': PATIENT}
+
+
+def relabeled(utterances, rng):
+    """医師・患者を無作為に Speaker 1 / Speaker 2 に置き換えた Transcript と正解 {ラベル: 役割}"""
+    labels = ['Speaker 1', 'Speaker 2']
+    rng.shuffle(labels)
+    mapping = dict(zip(('医師', '患者'), labels))
+    records = [(mapping[u.speaker], u.text, u.start, u.end) for u in utterances if u.speaker in mapping]
+    truth = {mapping[speaker]: ROLE_OF[speaker] for speaker in mapping}
+    return Transcript.from_records(records, 'csv'), truth
+
+
+def run(length, sessions, threshold, seed):
+    rng = random.Random(seed)
+    correct = local = 0
+    confidences = []
+    elapsed = 0.0
+    for n in range(sessions):
+        transcript, truth = relabeled(synthetic.generate(length, seed=seed * 100_003 + n), rng)
+        started = time.perf_counter()
+        result = infer_roles(transcript)
+        elapsed += time.perf_counter() - started
+        assigned = result['roles']
+        ok = all(assigned.get(label) == role for label, role in truth.items() if label in transcript.speakers())
+        correct += ok and bool(assigned)
+        local += result['confidence'] >= threshold
+        confidences.append(result['confidence'])
+    return {
+        "accuracy": correct / sessions,
+        "local": local / sessions,
+        "confidence": sum(confidences) / sessions,
+        "ms": elapsed / sessions * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=200, help='会話の長さごとの会話数')
+    parser.add_argument('--lengths', default='4,8,16,32,128,1000', help='会話の発話数（カンマ区切り）')
+    parser.add_argument('--threshold', type=float,
+                        default=float(os.environ.get('IDENTIFY_LOCAL_MIN_CONFIDENCE', 0.8)))
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'utterances':>10} {'accuracy':>9} {'local':>7} {'confidence':>10} {'ms':>8}")
+    for length in (int(value) for value in args.lengths.split(',')):
+        row = run(length, args.sessions, args.threshold, args.seed)
+        print(f"{length:>10} {row['accuracy']:>9.3f} {row['local']:>7.3f} {row['confidence']:>10.3f} "
+              f"{row['ms']:>8.3f}")
+
+    with open(os.path.join(ROOT_DIR, 'realistic_sample_data', 'notta_transcript.csv'), 'rb') as f:
+        transcript = Transcript.load(f.read(), fmt='csv')
+    print(f"\nnotta_transcript.csv: {infer_roles(transcript)}")
+
+
+if __name__ == '__main__':
+    main()
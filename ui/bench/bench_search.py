@@ -0,0 +1,120 @@
+"""会話の全文検索（_lib/storage.SessionStore.search）のベンチマーク
+
+合成会話（synthetic.py、seed を変えた複数の会話を使い回す）で既定 100 万発話のセッションを
+一時ディレクトリのSQLiteファイルに保存し（保存と同じトランザクションで FTS5 索引も更新される）、
+代表的な検索（2文字語・1文字語・複数語・役割/日付の絞り込み・セッション単位）の所要時間を計測する。
+合成会話の種は発話が少ないため、一部の発話を PHRASES に置き換えて出現頻度の低い語も作る
+（「痛」「奥歯」のような種由来の語は全発話の数割に一致する、順位付けに最も不利な条件になる）。
+
+使い方:
+    python ui/bench/bench_search.py
+    python ui/bench/bench_search.py --utterances 200000 --per-session 40
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'api'))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic  # noqa: E402
+from _lib.search import match_expression, split_query  # noqa: E402
+from _lib.storage import SessionStore  # noqa: E402
+from _lib.transcript import Transcript  # noqa: E402
+
+VARIANTS = 50
+BATCH = 500
+PHRASE_RATE = 0.05
+PHRASES = (
+    ('患者', '費用がどのくらいかかるのか心配です。'),
+    ('患者', '麻酔が効くかどうか不安なんです。'),
+    ('患者', '保険は使えますか。'),
+    ('医師', '右上6番の詰め物が取れかけています。'),
+    ('医師', '自費の場合の費用は別途ご説明します。'),
+    ('患者', '前回の治療のあと、しばらく不安で眠れませんでした。'),
+)
+QUERIES = (
+    ("費用", {}),
+    ("不安", {"role": "patient"}),
+    ("痛", {}),
+    ("奥歯が", {}),
+    ("費用 不安", {"mode": "any"}),
+    ("費用 心配", {"mode": "all", "since": "2025-03-01", "until": "2025-04-01"}),
+    ("費用 不安", {"mode": "any", "role": "patient", "by": "session"}),
+)
+
+
+def make_sessions(total_utterances, per_session):
+    transcripts = []
+    for seed in range(VARIANTS):
+        rng = random.Random(seed)
+        records = []
+        for u in synthetic.generate(per_session, seed):
+            speaker, text = rng.choice(PHRASES) if rng.random() < PHRASE_RATE else (u.speaker, u.text)
+            records.append((speaker, text, u.start, u.end))
+        transcripts.append(Transcript.from_records(records))
+    for n in range(total_utterances // per_session):
+        yield {
+            "session_id": f"search-{n:07d}",
+            "patient_name": f"患者{n % 500}",
+            "doctor_name": f"医師{n % 7}",
+            "session_date": f"2025-{n % 12 + 1:02d}-{n % 28 + 1:02d}T{n % 10 + 9:02d}:00:00",
+            "transcript": transcripts[n % VARIANTS],
+        }
+
+
+def timed_search(store, query, options, repeat=5):
+    best = float('inf')
+    results = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results = store.search(query, limit=20, **options)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, results
+
+
+def count_matches(store, query, options):
+    """一致した発言の総数（日付の絞り込みを除く参考値、計測対象外）"""
+    expression = match_expression(split_query(query), options.get('mode', 'all'), options.get('role'))
+    return store._conn.execute('SELECT count(*) FROM conversation_fts WHERE conversation_fts MATCH ?',
+                               (expression,)).fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--utterances', type=int, default=1_000_000, help='保存する発話の総数')
+    parser.add_argument('--per-session', type=int, default=40, help='1セッションあたりの発話数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = SessionStore(os.path.join(directory, 'bench-search.sqlite3'))
+        try:
+            started = time.perf_counter()
+            batch = []
+            for session in make_sessions(args.utterances, args.per_session):
+                batch.append(session)
+                if len(batch) == BATCH:
+                    store.save_sessions(batch)
+                    batch = []
+            if batch:
+                store.save_sessions(batch)
+            elapsed = time.perf_counter() - started
+            print(f"indexed {args.utterances:,} utterances in {elapsed:.1f} s "
+                  f"({args.utterances / elapsed:,.0f} utterances/s, including storage)")
+
+            print(f"{'query':<16} {'options':<58} {'matches':>9} {'ms':>8}  top snippet")
+            for query, options in QUERIES:
+                elapsed_ms, results = timed_search(store, query, options)
+                matches = count_matches(store, query, options)
+                top = results[0]['snippet'] if results else '-'
+                print(f"{query:<16} {str(options):<58} {matches:>9,} {elapsed_ms:>8.2f}  {top}")
+        finally:
+            store.close()
+
+
+if __name__ == '__main__':
+    main()
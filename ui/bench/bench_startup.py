@@ -0,0 +1,198 @@
+"""コールドスタートのベンチマーク（ハンドラーごとの import 時間と最初のリクエストのレイテンシ）
+
+Vercel の関数は api/*.py ごとに別プロセスで起動する。ハンドラーごとに新しい Python プロセスを起動して
+
+- import: ハンドラーモジュールの import にかかった時間（インタプリタ起動は含まない）
+- first: import 直後の最初のリクエスト（APIキーなし＝フォールバック経路。GET は一覧・集計、POST は短い会話）
+- second: 2回目の同じリクエスト（遅延読み込みやキャッシュの初期化が済んだ後）
+- heavy: import 時点で読み込まれていた重いSDK（openai / google.generativeai / httpx / numpy）
+
+を --repeat 回計測し、中央値を表示する。import か first が予算（--import-budget-ms / --first-request-budget-ms）を
+超えたハンドラー、または import 時点で重いSDKを読み込んでいるハンドラーがあれば終了コード 1 で終わる
+（CIでコールドスタートの悪化を検出する）。--explain で -X importtime の累積時間上位のモジュールも表示する。
+
+使い方:
+    python ui/bench/bench_startup.py
+    python ui/bench/bench_startup.py --handlers soap,quality --repeat 5 --explain
+    python ui/bench/bench_startup.py --import-budget-ms 200 --first-request-budget-ms 100
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, '..', 'api')
+
+HEAVY_MODULES = ('openai', 'google.generativeai', 'httpx', 'numpy')
+CONVERSATION = "医師: 今日はどうされましたか。\n患者: 右上の奥歯が冷たいものでしみます。\n医師: 詰め物の下がむし歯です。"
+
+# ハンドラーごとの最初のリクエスト（メソッド, パス, 本文）。本文が None なら GET
+REQUESTS = {
+    'health': ('GET', '/api/health', None),
+    'live': ('GET', '/api/live', None),
+    'metrics': ('GET', '/api/metrics', None),
+    'test': ('GET', '/api/test', None),
+    'sessions': ('GET', '/api/sessions?limit=1', None),
+    'identify': ('POST', '/api/identify', {"content": CONVERSATION}),
+    'soap': ('POST', '/api/soap', {"content": CONVERSATION}),
+    'quality': ('POST', '/api/quality', {"content": CONVERSATION}),
+    'pipeline': ('POST', '/api/pipeline', {"content": CONVERSATION}),
+    'batch': ('POST', '/api/batch', {"items": [CONVERSATION]}),
+    'live_session': ('POST', '/api/live_session', {"action": "start", "content": CONVERSATION}),
+    'openai_analysis': ('POST', '/api/openai_analysis', {"content": CONVERSATION, "type": "soap"}),
+    'openrouter_analysis': ('POST', '/api/openrouter_analysis', {"content": CONVERSATION, "type": "soap"}),
+    'parse_xlsx': ('POST', '/api/parse_xlsx', 'xlsx'),
+}
+
+
+def call_handler(handler_cls, method, path, body=b'', content_type='application/json'):
+    """BaseHTTPRequestHandler をソケットなしで1回呼び出し、ステータスを返す"""
+    from http.client import HTTPMessage
+
+    handler = handler_cls.__new__(handler_cls)
+    handler.rfile = io.BytesIO(body)
+    handler.wfile = io.BytesIO()
+    handler.headers = HTTPMessage()
+    handler.headers['Content-Type'] = content_type
+    handler.headers['Content-Length'] = str(len(body))
+    handler.command = method
+    handler.path = path
+    handler.request_version = 'HTTP/1.1'
+    handler.requestline = f'{method} {path} HTTP/1.1'
+    handler.client_address = ('127.0.0.1', 0)
+    handler.close_connection = True
+    handler.log_message = lambda *args: None
+    getattr(handler, f'do_{method}')()
+    return int(handler.wfile.getvalue().split(b' ', 2)[1])
+
+
+def request_body(spec):
+    """(本文, Content-Type)。parse_xlsx には合成会話のXLSXを multipart で送る"""
+    if spec is None:
+        return b'', 'application/json'
+    if spec == 'xlsx':
+        sys.path.insert(0, BENCH_DIR)
+        import synthetic
+
+        data = synthetic.to_xlsx(synthetic.generate(50))
+        boundary = '----dentalbench'
+        head = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="bench.xlsx"\r\n'
+                'Content-Type: application/vnd.openxmlformats-officedocument.spreadsheetml.sheet\r\n\r\n')
+        body = head.encode('utf-8') + data + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        return body, f'multipart/form-data; boundary={boundary}'
+    return json.dumps(spec, ensure_ascii=False).encode('utf-8'), 'application/json'
+
+
+def child(name):
+    """新しいプロセスの中で1ハンドラーを計測し、結果をJSONで標準出力に書く"""
+    sys.path.insert(0, API_DIR)
+    started = time.perf_counter()
+    module = __import__(name)
+    import_ms = (time.perf_counter() - started) * 1000
+    heavy = [heavy for heavy in HEAVY_MODULES if heavy in sys.modules]
+
+    method, path, spec = REQUESTS[name]
+    body, content_type = request_body(spec)
+    timings = []
+    for _ in range(2):
+        started = time.perf_counter()
+        status = call_handler(module.handler, method, path, body, content_type)
+        timings.append((time.perf_counter() - started) * 1000)
+    print(json.dumps({"import_ms": import_ms, "first_ms": timings[0], "second_ms": timings[1],
+                      "status": status, "heavy": heavy}))
+
+
+def child_env(workdir, prewarm):
+    env = dict(os.environ)
+    for key in ('GEMINI_API_KEY', 'OPENAI_API_KEY', 'OPENROUTER_API_KEY'):
+        env.pop(key, None)
+    env.update({
+        'LLM_CACHE_DISABLED': '1',
+        'TRACE_FILE': '',
+        'HEALTH_PROBE_INTERVAL': '0',
+        'SESSION_DB_PATH': os.path.join(workdir, 'sessions.db'),
+    })
+    if prewarm:
+        # ダミーのキーで SDK の読み込みとクライアント生成だけを import 時に行う（通信はしない）
+        env.update({'LLM_PREWARM': 'sync', 'GEMINI_API_KEY': 'bench-dummy', 'OPENAI_API_KEY': 'bench-dummy',
+                    'OPENROUTER_API_KEY': 'bench-dummy'})
+    return env
+
+
+def measure(name, repeat, env):
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, __file__, '--child', name], env=env, capture_output=True,
+                                text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "import_ms": statistics.median(run['import_ms'] for run in runs),
+        "first_ms": statistics.median(run['first_ms'] for run in runs),
+        "second_ms": statistics.median(run['second_ms'] for run in runs),
+        "status": runs[-1]['status'],
+        "heavy": runs[-1]['heavy'],
+    }
+
+
+def explain(name, env, top=5):
+    """-X importtime の累積時間（μs）上位のモジュール"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {name}'], env=env, cwd=API_DIR,
+                            capture_output=True, text=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = (part.strip() for part in line[len('import time:'):].split('|'))
+        rows.append((int(cumulative), module.strip()))
+    return sorted(rows, reverse=True)[1:top + 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--handlers', default=','.join(REQUESTS), help='計測するハンドラー（カンマ区切り）')
+    parser.add_argument('--repeat', type=int, default=3, help='ハンドラーごとのプロセス起動回数（中央値を取る）')
+    parser.add_argument('--import-budget-ms', type=float, default=250.0, help='import 時間の予算')
+    parser.add_argument('--first-request-budget-ms', type=float, default=150.0, help='最初のリクエストの予算')
+    parser.add_argument('--prewarm', action='store_true', help='LLM_PREWARM=sync とダミーのキーで計測する')
+    parser.add_argument('--explain', action='store_true', help='import の累積時間上位のモジュールを表示する')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        env = child_env(workdir, args.prewarm)
+        print(f"{'handler':<20} {'import ms':>9} {'first ms':>9} {'second ms':>9} {'status':>6}  heavy")
+        for name in args.handlers.split(','):
+            row = measure(name, args.repeat, env)
+            print(f"{name:<20} {row['import_ms']:>9.1f} {row['first_ms']:>9.1f} {row['second_ms']:>9.1f} "
+                  f"{row['status']:>6}  {','.join(row['heavy']) or '-'}")
+            if row['import_ms'] > args.import_budget_ms:
+                failures.append(f"{name}: import {row['import_ms']:.1f} ms > {args.import_budget_ms:.0f} ms")
+            if row['first_ms'] > args.first_request_budget_ms:
+                failures.append(f"{name}: first request {row['first_ms']:.1f} ms > "
+                                f"{args.first_request_budget_ms:.0f} ms")
+            if row['heavy'] and not args.prewarm:
+                failures.append(f"{name}: import 時に読み込まれた重いモジュール {', '.join(row['heavy'])}")
+            if args.explain:
+                for cumulative, module in explain(name, env):
+                    print(f"    {cumulative / 1000:>8.1f} ms  {module}")
+
+    if failures:
+        print("\n予算超過:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""セッション保存（_lib/storage.py）の書き込みベンチマーク
+
+合成会話（synthetic.py）とAI出力を持つセッションを生成し、一時ディレクトリのSQLiteファイルに
+1セッション1トランザクション、および複数セッション1トランザクションで書き込んで、
+1分あたりの保存セッション数を表示する（目標: 10,000 セッション/分）。
+続けて、ダッシュボード相当の検索（日付範囲・不安度で絞り込み50件）を comprehensive_session_analysis
+ビュー（7表の結合）と実体化した session_analysis_summary 表のそれぞれで計測する。
+
+使い方:
+    python ui/bench/bench_storage.py
+    python ui/bench/bench_storage.py --sessions 20000 --utterances 60 --batch 1,50,500
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'api'))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic  # noqa: E402
+from _lib.storage import ANALYSIS_VIEW, SessionStore  # noqa: E402
+from _lib.transcript import Transcript  # noqa: E402
+
+TARGET_PER_MINUTE = 10_000
+DASHBOARD_FILTER = "session_date >= '2025-03-01' AND session_date < '2025-04-01' AND patient_anxiety_level >= 0.5"
+
+
+def make_sessions(count, utterances, seed=0):
+    """count 件のセッション（発話は共通の合成会話を時刻をずらさず共有する）"""
+    generated = synthetic.generate(utterances, seed)
+    transcript = Transcript.from_records((u.speaker, u.text, u.start, u.end) for u in generated)
+    analysis = {
+        "emotion": {"patient_anxiety_level": 0.6, "patient_trust_level": 0.7, "doctor_empathy_score": 0.8,
+                    "emotional_state": "やや不安", "communication_comfort": 0.7,
+                    "stress_indicators": ["費用への不安", "痛みへの心配"]},
+        "treatment": {"urgency_level": 0.5, "pain_severity_estimated": 4, "treatment_complexity": "中",
+                      "patient_compliance_prediction": 0.8, "treatment_success_probability": 0.85},
+        "risks": [{"risk_factor": "治療中断", "risk_probability": 0.2, "severity_level": "中",
+                   "mitigation_suggestion": "次回予約の確認"}],
+        "satisfaction": {"satisfaction_score": 0.8, "success_probability": 0.75, "confidence_level": 0.9,
+                         "key_factors": ["丁寧な説明"]},
+        "followups": [{"recommendation_type": "説明", "recommendation_text": "費用の再説明",
+                       "priority_level": 2, "estimated_timeframe": "1週間"}],
+    }
+    return [
+        {
+            "session_id": f"bench-{n:07d}",
+            "patient_name": f"患者{n % 500}",
+            "doctor_name": f"医師{n % 7}",
+            "session_date": f"2025-{n % 12 + 1:02d}-{n % 28 + 1:02d}T{n % 10 + 9:02d}:00:00",
+            "transcript": transcript,
+            "analysis": analysis,
+        }
+        for n in range(count)
+    ]
+
+
+def run(sessions, batch_size, path):
+    store = SessionStore(path)
+    try:
+        started = time.perf_counter()
+        for offset in range(0, len(sessions), batch_size):
+            store.save_sessions(sessions[offset:offset + batch_size])
+        elapsed = time.perf_counter() - started
+    finally:
+        store.close()
+    return elapsed
+
+
+def comprehensive_view_sql():
+    """comprehensive_session_analysis ビュー定義（storage.ANALYSIS_VIEW。比較用に一時ビューとして作る）"""
+    return ANALYSIS_VIEW.replace('CREATE VIEW', 'CREATE TEMP VIEW', 1)
+
+
+def timed_query(conn, sql, repeat=20):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql).fetchall()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def dashboard(path):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(comprehensive_view_sql())
+        view_ms = timed_query(conn, f"SELECT * FROM comprehensive_session_analysis WHERE {DASHBOARD_FILTER} "
+                                    "ORDER BY session_date DESC LIMIT 50", repeat=3)
+        summary_ms = timed_query(conn, f"SELECT * FROM session_analysis_summary WHERE {DASHBOARD_FILTER} "
+                                       "ORDER BY session_date DESC LIMIT 50")
+    finally:
+        conn.close()
+    return view_ms, summary_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=10_000)
+    parser.add_argument('--utterances', type=int, default=40, help='1セッションあたりの発話数')
+    parser.add_argument('--batch', default='1,100', help='1トランザクションあたりのセッション数（カンマ区切り）')
+    args = parser.parse_args()
+
+    sessions = make_sessions(args.sessions, args.utterances)
+    print(f"sessions: {args.sessions:,} x {args.utterances} utterances")
+    print(f"{'batch':>6} {'time (s)':>9} {'sessions/min':>13} {'rows/s':>11}  target")
+    rows_per_session = args.utterances + 6
+    with tempfile.TemporaryDirectory() as directory:
+        for batch_size in (int(value) for value in args.batch.split(',')):
+            path = os.path.join(directory, f'bench-{batch_size}.sqlite3')
+            elapsed = run(sessions, batch_size, path)
+            per_minute = args.sessions / elapsed * 60
+            print(f"{batch_size:>6} {elapsed:>9.2f} {per_minute:>13,.0f} "
+                  f"{args.sessions * rows_per_session / elapsed:>11,.0f}  "
+                  f"{'ok' if per_minute >= TARGET_PER_MINUTE else 'below'}")
+
+        view_ms, summary_ms = dashboard(path)
+        print(f"dashboard query: view {view_ms:.2f} ms, materialized summary {summary_ms:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+"""API ハンドラーのベンチマークスイート
+
+sample_data/ と realistic_sample_data/ を種にした合成会話（synthetic.py）を 1,000〜100,000 発話に拡大し、
+各ハンドラーをプロセス内で（ソケットを使わずに）呼び出して段階ごとに計測する。
+
+- 読み込み: TXT / SRT / CSV は共通ローダー（Transcript.load）、XLSX は /api/parse_xlsx にmultipartで送信
+- 解析: /api/identify・/api/soap・/api/quality・/api/pipeline（ルールベース）
+- LLM経由: /api/pipeline を Gemini のモック（固定JSONを返す）で実行。プロンプト生成・パース・後処理までを計測
+
+段階ごとにスループット（発話/秒・MB/秒）、レイテンシのパーセンタイル、実行中のピークRSSを表示し、
+結果をJSONに保存する。--compare で以前の結果との差を表示する。
+
+使い方:
+    python ui/bench/bench_suite.py
+    python ui/bench/bench_suite.py --sizes 1000,10000 --repeat 3 --output /tmp/bench.json
+    python ui/bench/bench_suite.py --compare ui/bench/results/bench-20250101-000000.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from http.client import HTTPMessage
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, '..', 'api')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+# ハンドラーの import 前に設定する（LLMキャッシュとトレース出力は計測対象から外す）
+os.environ.setdefault('LLM_CACHE_DISABLED', '1')
+os.environ.setdefault('TRACE_FILE', '')
+os.environ.setdefault('HEALTH_PROBE_INTERVAL', '0')
+
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import identify  # noqa: E402
+import parse_xlsx  # noqa: E402
+import pipeline  # noqa: E402
+import quality  # noqa: E402
+import soap  # noqa: E402
+import synthetic  # noqa: E402
+from _lib.transcript import Transcript  # noqa: E402
+
+MOCK_RESPONSES = {
+    identify: {"patient_name": "田中", "doctor_name": "伊藤", "confidence_patient": 0.9,
+               "confidence_doctor": 0.9, "reasoning": "モック応答"},
+    soap: {"subjective": "右上奥歯の冷水痛", "objective": "#16 深在性う蝕", "assessment": "う蝕",
+           "plan": "CR充填", "confidence": 0.9},
+    quality: {"success_possibility": 0.8, "patient_understanding": 0.7, "treatment_consent": 0.8,
+              "overall_quality": 0.8, "improvements": ["費用の説明"], "positives": ["丁寧な説明"],
+              "confidence": 0.9},
+}
+
+
+# --- ハンドラーのプロセス内呼び出し -------------------------------------------------
+
+def call_handler(handler_cls, body, content_type='application/json', path='/'):
+    """BaseHTTPRequestHandler をソケットなしで1回呼び出し、(ステータス, 本文) を返す"""
+    handler = handler_cls.__new__(handler_cls)
+    handler.rfile = io.BytesIO(body)
+    handler.wfile = io.BytesIO()
+    handler.headers = HTTPMessage()
+    handler.headers['Content-Type'] = content_type
+    handler.headers['Content-Length'] = str(len(body))
+    handler.command = 'POST'
+    handler.path = path
+    handler.request_version = 'HTTP/1.1'
+    handler.requestline = f'POST {path} HTTP/1.1'
+    handler.client_address = ('127.0.0.1', 0)
+    handler.close_connection = True
+    handler.log_message = lambda *args: None
+    handler.do_POST()
+
+    raw = handler.wfile.getvalue()
+    head, _, payload = raw.partition(b'\r\n\r\n')
+    return int(head.split(b' ', 2)[1]), payload
+
+
+def post_json(handler_cls, data):
+    status, payload = call_handler(handler_cls, json.dumps(data, ensure_ascii=False).encode('utf-8'))
+    if status != 200:
+        raise RuntimeError(f"{handler_cls.__module__}: HTTP {status} {payload[:200]!r}")
+    return json.loads(payload)
+
+
+def multipart_body(filename, data, boundary='----dentalbench'):
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            'Content-Type: application/vnd.openxmlformats-officedocument.spreadsheetml.sheet\r\n\r\n')
+    body = head.encode('utf-8') + data + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+# --- 形式ごとの読み込み（_lib/transcript.py の共通ローダー） -------------------------
+
+def load_transcript(fmt):
+    return lambda data: Transcript.load(data, fmt=fmt)
+
+
+def load_xlsx(data):
+    body, content_type = multipart_body('session.xlsx', data)
+    status, payload = call_handler(parse_xlsx.handler, body, content_type)
+    if status != 200:
+        raise RuntimeError(f"parse_xlsx: HTTP {status} {payload[:200]!r}")
+    return json.loads(payload)['text_content']
+
+
+LOADERS = {'txt': load_transcript('txt'), 'srt': load_transcript('srt'), 'csv': load_transcript('csv'),
+           'xlsx': load_xlsx}
+
+
+# --- LLM モック ------------------------------------------------------------------
+
+class _MockResponse:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+
+class MockModel:
+    """GenerativeModel の代わりに固定のJSONを返す（latency 秒だけ待つ）"""
+
+    def __init__(self, response, latency):
+        self.response = json.dumps(response, ensure_ascii=False)
+        self.latency = latency
+
+    def generate_content(self, prompt, generation_config=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return _MockResponse(self.response)
+
+
+class mocked_llm:
+    """with の間だけ identify / soap / quality の Gemini 呼び出しをモックに差し替える"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._saved = {}
+
+    def __enter__(self):
+        self._saved['key'] = os.environ.get('GEMINI_API_KEY')
+        os.environ['GEMINI_API_KEY'] = 'bench-mock-key'
+        for module, response in MOCK_RESPONSES.items():
+            self._saved[module] = module.gemini_model
+            model = MockModel(response, self.latency)
+            module.gemini_model = lambda api_key, model_name='gemini-1.5-flash', model=model: model
+        return self
+
+    def __exit__(self, *exc):
+        for module in MOCK_RESPONSES:
+            module.gemini_model = self._saved[module]
+        if self._saved['key'] is None:
+            os.environ.pop('GEMINI_API_KEY', None)
+        else:
+            os.environ['GEMINI_API_KEY'] = self._saved['key']
+
+
+class no_api_key:
+    """with の間だけ GEMINI_API_KEY を外してルールベース解析を通す"""
+
+    def __enter__(self):
+        self._saved = os.environ.pop('GEMINI_API_KEY', None)
+        return self
+
+    def __exit__(self, *exc):
+        if self._saved is not None:
+            os.environ['GEMINI_API_KEY'] = self._saved
+
+
+# --- 計測 ------------------------------------------------------------------------
+
+class RSSSampler:
+    """別スレッドで /proc/self/statm を数ミリ秒ごとに読み、区間内のピークRSSを記録する"""
+
+    INTERVAL = 0.002
+
+    def __init__(self):
+        self.baseline = self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.INTERVAL):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def percentile(ordered, fraction):
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def measure(stage, fmt, utterances, size_bytes, func, repeat):
+    func()  # ウォームアップ（import・正規表現のコンパイル等を除く）
+    latencies = []
+    with RSSSampler() as rss:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - started)
+    ordered = sorted(latencies)
+    median = percentile(ordered, 0.5)
+    return {
+        "stage": stage,
+        "format": fmt,
+        "utterances": utterances,
+        "bytes": size_bytes,
+        "repeat": repeat,
+        "latency_ms": {
+            "min": round(ordered[0] * 1000, 3),
+            "p50": round(median * 1000, 3),
+            "p90": round(percentile(ordered, 0.9) * 1000, 3),
+            "p99": round(percentile(ordered, 0.99) * 1000, 3),
+            "mean": round(sum(ordered) / len(ordered) * 1000, 3)
+        },
+        "throughput": {
+            "utterances_per_s": round(utterances / median, 1) if median else None,
+            "mb_per_s": round(size_bytes / 2**20 / median, 2) if median else None
+        },
+        "peak_rss_mb": round(rss.peak / 2**20, 1),
+        "rss_delta_mb": round((rss.peak - rss.baseline) / 2**20, 1)
+    }
+
+
+def run_suite(sizes, formats, repeat, llm_latency, seed):
+    results = []
+    for utterances in sizes:
+        generated = synthetic.generate(utterances, seed)
+        for fmt in formats:
+            data = synthetic.WRITERS[fmt](generated)
+            size_bytes = len(data if isinstance(data, bytes) else data.encode('utf-8'))
+            stage = 'parse_xlsx' if fmt == 'xlsx' else f'load_{fmt}'
+            results.append(measure(stage, fmt, utterances, size_bytes,
+                                   lambda: LOADERS[fmt](data), repeat))
+            yield results[-1]
+
+        text = '\n'.join(Transcript.from_text(synthetic.to_txt(generated)).lines())
+        size_bytes = len(text.encode('utf-8'))
+        request = {"content": text}
+        with no_api_key():
+            for stage, handler_cls in (('identify', identify.handler), ('soap', soap.handler),
+                                       ('quality', quality.handler), ('pipeline', pipeline.handler)):
+                results.append(measure(stage, 'text', utterances, size_bytes,
+                                       lambda: post_json(handler_cls, request), repeat))
+                yield results[-1]
+        with mocked_llm(llm_latency):
+            result = post_json(pipeline.handler, request)
+            assert result['quality'].get('method') == 'gemini_ai_quality_analysis', "LLM mock was not used"
+            results.append(measure('pipeline_mock_llm', 'text', utterances, size_bytes,
+                                   lambda: post_json(pipeline.handler, request), repeat))
+            yield results[-1]
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def print_row(row):
+    latency = row['latency_ms']
+    print(f"{row['stage']:<18} {row['utterances']:>8,} {row['bytes'] / 2**20:>8.2f} "
+          f"{latency['p50']:>10.2f} {latency['p90']:>10.2f} {latency['p99']:>10.2f} "
+          f"{row['throughput']['utterances_per_s'] or 0:>12,.0f} {row['peak_rss_mb']:>9.1f}")
+
+
+def compare(current, previous_path):
+    with open(previous_path, encoding='utf-8') as f:
+        previous = {(r['stage'], r['utterances']): r for r in json.load(f)['results']}
+    print(f"\ncompared with {previous_path}")
+    print(f"{'stage':<18} {'utter.':>8} {'p50 before':>11} {'p50 now':>10} {'change':>8}")
+    for row in current:
+        before = previous.get((row['stage'], row['utterances']))
+        if before is None:
+            continue
+        old, new = before['latency_ms']['p50'], row['latency_ms']['p50']
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"{row['stage']:<18} {row['utterances']:>8,} {old:>11.2f} {new:>10.2f} {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000', help='発話数（カンマ区切り）')
+    parser.add_argument('--formats', default=','.join(synthetic.FORMATS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--llm-latency', type=float, default=0.0, help='モックLLMの応答待ち秒')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='結果JSONの保存先（既定 ui/bench/results/bench-<日時>.json）')
+    parser.add_argument('--compare', help='比較する以前の結果JSON')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    formats = [fmt for fmt in args.formats.split(',') if fmt]
+    unknown = set(formats) - set(synthetic.FORMATS)
+    if unknown:
+        parser.error(f"unknown formats: {sorted(unknown)}")
+
+    print(f"{'stage':<18} {'utter.':>8} {'MB':>8} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} "
+          f"{'utter./s':>12} {'peak MB':>9}")
+    results = []
+    for row in run_suite(sizes, formats, args.repeat, args.llm_latency, args.seed):
+        print_row(row)
+        results.append(row)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"bench-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    report = {
+        "environment": environment(),
+        "settings": {"sizes": sizes, "formats": formats, "repeat": args.repeat,
+                     "llm_latency": args.llm_latency, "seed": args.seed},
+        "results": results
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nsaved: {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""ベンチマーク比較用: キーワードエンジン導入前のフォールバック実装（挙動・速度の基準）"""
+import re
+
+
+def legacy_fallback_quality(conversation_text, soap_data):
+    """フォールバック品質分析"""
+    lines = conversation_text.strip().split('\n')
+    patient_lines = [line for line in lines if '患者' in line or 'Patient' in line]
+    doctor_lines = [line for line in lines if '医師' in line or 'Doctor' in line or 'Dr.' in line]
+
+    # 成約可能性計算（治療受諾重視）
+    success_keywords = ['はい', 'お願いします', 'やります', '受けます', '同意', 'よろしく']
+    hesitation_keywords = ['考えさせて', '迷って', '不安', '心配', '高い', '費用']
+
+    patient_text = ' '.join(patient_lines)
+    success_count = sum(1 for keyword in success_keywords if keyword in patient_text)
+    hesitation_count = sum(1 for keyword in hesitation_keywords if keyword in patient_text)
+
+    success_possibility = max(0.1, min(0.9, (success_count - hesitation_count * 0.5) / 3 + 0.3))
+
+    # 患者理解度計算
+    understanding_keywords = ['分かりました', 'なるほど', '理解', 'わかります']
+    confusion_keywords = ['分からない', 'よくわからない', '難しい']
+
+    understanding_count = sum(1 for keyword in understanding_keywords if keyword in patient_text)
+    confusion_count = sum(1 for keyword in confusion_keywords if keyword in patient_text)
+
+    patient_understanding = max(0.1, min(0.9, understanding_count / (understanding_count + confusion_count + 1) + 0.4))
+
+    # 治療同意計算
+    consent_keywords = ['治療', '処置', '次回', '予約']
+    has_treatment_discussion = any(keyword in conversation_text for keyword in consent_keywords)
+    treatment_consent = max(0.2, min(0.8, success_possibility * 0.7 + (0.2 if has_treatment_discussion else 0)))
+
+    overall_quality = (success_possibility * 0.4 + patient_understanding * 0.3 + treatment_consent * 0.3)
+
+    improvements = []
+    positives = []
+
+    if success_possibility < 0.5:
+        improvements.append("患者の治療意欲を高める説明が必要")
+    if patient_understanding < 0.6:
+        improvements.append("より分かりやすい説明を心がける")
+    if treatment_consent < 0.5:
+        improvements.append("具体的な治療計画の提示が有効")
+
+    if success_possibility > 0.7:
+        positives.append("患者の治療への積極性が高い")
+    if patient_understanding > 0.7:
+        positives.append("患者の理解度が良好")
+    if len(doctor_lines) > len(patient_lines):
+        positives.append("医師からの丁寧な説明")
+
+    return {
+        "success_possibility": round(success_possibility, 2),
+        "patient_understanding": round(patient_understanding, 2),
+        "treatment_consent": round(treatment_consent, 2),
+        "overall_quality": round(overall_quality, 2),
+        "improvements": improvements or ["全体的に良好な会話"],
+        "positives": positives or ["基本的なコミュニケーションは成立"],
+        "confidence": 0.7,
+        "process_log": [
+            "📋 フォールバック品質分析実行",
+            f"✅ 分析完了: 成約可能性={success_possibility:.2f}, 理解度={patient_understanding:.2f}"
+        ],
+        "method": "pattern_based_quality_analysis"
+    }
+
+
+def legacy_fallback_soap(conversation_text, patient_name, doctor_name):
+    """フォールバック SOAP変換"""
+    lines = conversation_text.strip().split('\n')
+    patient_lines = []
+    doctor_lines = []
+
+    for line in lines:
+        if patient_name in line or '患者' in line:
+            patient_lines.append(line.split(':', 1)[-1].strip())
+        elif doctor_name in line or '医師' in line or 'Dr.' in line:
+            doctor_lines.append(line.split(':', 1)[-1].strip())
+
+    # 実際のデータからSOAP分類
+    # S: 患者の主観的情報（全ての患者発言を含める）
+    subjective = ' '.join(patient_lines) if patient_lines else ""
+
+    # O: 医師の客観的所見（医師の観察・検査結果）
+    objective = ' '.join(doctor_lines[:3]) if doctor_lines else ""
+
+    # A: 評価・診断（医師の診断的発言を抽出）
+    assessment_keywords = ['診断', '思われ', '考えられ', '可能性', '状態', '症状']
+    assessment_lines = [line for line in doctor_lines if any(k in line for k in assessment_keywords)]
+    assessment = ' '.join(assessment_lines) if assessment_lines else doctor_lines[-2] if len(doctor_lines) > 2 else ""
+
+    # P: 治療計画（治療・処置・次回に関する発言を抽出）
+    plan_keywords = ['治療', '処置', '次回', '予約', '薬', '経過', '観察']
+    plan_lines = [line for line in doctor_lines if any(k in line for k in plan_keywords)]
+    plan = ' '.join(plan_lines) if plan_lines else doctor_lines[-1] if doctor_lines else ""
+
+    return {
+        "subjective": subjective,
+        "objective": objective,
+        "assessment": assessment,
+        "plan": plan,
+        "confidence": 0.6,
+        "process_log": [
+            "📋 フォールバックSOAP変換実行",
+            f"✅ 変換完了: S={len(subjective)}文字, O={len(objective)}文字"
+        ],
+        "method": "pattern_based_soap_conversion"
+    }
+
+
+def legacy_fallback_identify(conversation_text):
+    """フォールバック識別"""
+    patient_name = "患者"
+    doctor_name = "医師"
+
+    # 基本的なパターンマッチング
+    patient_patterns = [
+        r'([一-龯ぁ-んァ-ン]{2,6})[さ様]',
+        r'患者[：:\s]*([一-龯ぁ-んァ-ン]{2,5})'
+    ]
+
+    for pattern in patient_patterns:
+        matches = re.findall(pattern, conversation_text)
+        if matches:
+            patient_name = matches[0]
+            break
+
+    doctor_patterns = [
+        r'([一-龯ぁ-んァ-ン]{2,6})\s*先生',
+        r'Dr\.?\s*([一-龯A-Za-z]{2,6})'
+    ]
+
+    for pattern in doctor_patterns:
+        matches = re.findall(pattern, conversation_text)
+        if matches:
+            doctor_name = matches[0]
+            break
+
+    return {
+        "patient_name": patient_name,
+        "doctor_name": doctor_name,
+        "confidence_patient": 0.7 if patient_name != "患者" else 0.3,
+        "confidence_doctor": 0.7 if doctor_name != "医師" else 0.3,
+        "reasoning": "パターンマッチングによる識別",
+        "process_log": [
+            "📋 フォールバック識別実行",
+            f"✅ 結果: 患者「{patient_name}」医師「{doctor_name}」"
+        ],
+        "method": "pattern_matching_fallback"
+    }
@@ -0,0 +1,155 @@
+"""ベンチマーク用の合成会話データ
+
+sample_data/ と realistic_sample_data/ の発話を種にして、任意の発話数の会話を決定的に（seed 固定で）生成し、
+Plaud TXT / Notta SRT / Notta CSV / XLSX の各形式に書き出す。
+
+使い方:
+    python ui/bench/synthetic.py --utterances 10000 --format srt > /tmp/session.srt
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import re
+import sys
+import zipfile
+from xml.sax.saxutils import escape
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+SEED_FILES = (
+    os.path.join(ROOT_DIR, 'sample_data', 'plaud_transcript.txt'),
+    os.path.join(ROOT_DIR, 'sample_data', 'notta_transcript.srt'),
+)
+FORMATS = ('txt', 'srt', 'csv', 'xlsx')
+
+_SPEAKER_LINE = re.compile(r'^(医師|患者|歯科医師|歯科衛生士|受付)[:：]\s*(.+)$')
+_XLSX_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+
+
+class Utterance:
+    __slots__ = ('speaker', 'text', 'start', 'end')
+
+    def __init__(self, speaker, text, start, end):
+        self.speaker = speaker
+        self.text = text
+        self.start = start
+        self.end = end
+
+
+def seed_utterances():
+    """サンプルデータから (話者, 発言) を重複なく集める"""
+    seeds = {}
+    for path in SEED_FILES:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                match = _SPEAKER_LINE.match(line.strip())
+                if match:
+                    seeds.setdefault((match.group(1), match.group(2)), None)
+    return list(seeds)
+
+
+def generate(utterances, seed=0):
+    """発話数 utterances の会話を生成する（医師と患者が概ね交互に話し、1発話2〜8秒）"""
+    rng = random.Random(seed)
+    seeds = seed_utterances()
+    by_speaker = {}
+    for speaker, text in seeds:
+        by_speaker.setdefault(speaker, []).append(text)
+    speakers = sorted(by_speaker)
+
+    result = []
+    clock = 5.0
+    speaker = '医師'
+    for n in range(utterances):
+        text = rng.choice(by_speaker[speaker])
+        duration = rng.uniform(2.0, 8.0)
+        result.append(Utterance(speaker, text, clock, clock + duration))
+        clock += duration + rng.uniform(0.2, 1.5)
+        # 同じ話者が続くこともある
+        if rng.random() < 0.8:
+            speaker = speakers[(speakers.index(speaker) + 1) % len(speakers)]
+    return result
+
+
+def _srt_time(seconds):
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3_600_000)
+    minutes, millis = divmod(millis, 60_000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
+
+
+def _hms(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def to_txt(utterances):
+    """Plaud 形式（「話者: 発言」を空行区切り）"""
+    return '\n\n'.join(f"{u.speaker}: {u.text}" for u in utterances) + '\n'
+
+
+def to_srt(utterances):
+    return ''.join(
+        f"{n}\n{_srt_time(u.start)} --> {_srt_time(u.end)}\n{u.speaker}: {u.text}\n\n"
+        for n, u in enumerate(utterances, 1)
+    )
+
+
+def to_csv(utterances):
+    """Notta 形式（Speaker, Start Time, End Time, Duration, Text）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(['Speaker', 'Start Time', 'End Time', 'Duration', 'Text'])
+    for u in utterances:
+        writer.writerow([u.speaker, _hms(u.start), _hms(u.end), _hms(u.end - u.start), u.text])
+    return buffer.getvalue()
+
+
+def to_xlsx(utterances):
+    """話者・発言・開始・終了の4列（文字列は共有文字列表）のワークブック"""
+    strings = ['Speaker', 'Text', 'Start Time', 'End Time']
+    index = {s: i for i, s in enumerate(strings)}
+
+    def shared(value):
+        if value not in index:
+            index[value] = len(strings)
+            strings.append(value)
+        return index[value]
+
+    rows = ['<row r="1">' + ''.join(
+        f'<c r="{col}1" t="s"><v>{i}</v></c>' for i, col in enumerate('ABCD')) + '</row>']
+    for n, u in enumerate(utterances, 2):
+        values = (shared(u.speaker), shared(u.text), shared(_hms(u.start)), shared(_hms(u.end)))
+        rows.append(f'<row r="{n}">' + ''.join(
+            f'<c r="{col}{n}" t="s"><v>{value}</v></c>' for col, value in zip('ABCD', values)) + '</row>')
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('xl/sharedStrings.xml', f'<sst xmlns="{_XLSX_NS}" count="{len(strings)}">'
+                    + ''.join(f'<si><t>{escape(s)}</t></si>' for s in strings) + '</sst>')
+        zf.writestr('xl/worksheets/sheet1.xml',
+                    f'<worksheet xmlns="{_XLSX_NS}"><sheetData>{"".join(rows)}</sheetData></worksheet>')
+    return buffer.getvalue()
+
+
+WRITERS = {'txt': to_txt, 'srt': to_srt, 'csv': to_csv, 'xlsx': to_xlsx}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--utterances', type=int, default=1000)
+    parser.add_argument('--format', choices=FORMATS, default='txt')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    data = WRITERS[args.format](generate(args.utterances, args.seed))
+    if isinstance(data, bytes):
+        sys.stdout.buffer.write(data)
+    else:
+        sys.stdout.write(data)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""品質分析のカスケード（_lib/cascade.py）のローカルモデルの学習と不確実帯の評価
+
+QUALITY_CASCADE_LOG に記録されたLLMの品質分析結果（会話本文とスコア）を学習・評価用に分け、
+評価用の会話で不確実帯ごとに
+
+- escalation: LLMに回す会話の割合（呼び出し回数・待ち時間・費用に比例）
+- local MAE: ローカルモデルで返す会話での、LLMのスコアとの平均絶対誤差（3スコアの平均）
+- agreement: ローカルモデルで返す会話での、成約可能性が 0.5 のどちら側かがLLMと一致した割合
+
+を表示する。最後に全件で学習し直したモデルを --model（既定 QUALITY_CASCADE_MODEL）に保存する。
+稼働中のインスタンスはモデルファイルの更新を検知して読み直す。
+
+使い方:
+    python ui/bench/train_cascade.py --log /var/data/quality_labels.jsonl
+    python ui/bench/train_cascade.py --log labels.jsonl --bands 0.45-0.55,0.4-0.6,0.3-0.7 --holdout 0.3 --dry-run
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'api'))
+
+from _lib import cascade  # noqa: E402
+
+DEFAULT_BANDS = '0.45-0.55,0.4-0.6,0.35-0.65,0.3-0.7,0.2-0.8'
+
+
+def parse_bands(value):
+    return [tuple(float(bound) for bound in item.split('-')) for item in value.split(',')]
+
+
+def print_sweep(rows):
+    print(f"{'band':>11} {'escalation':>10} {'local':>6} {'local MAE':>9} {'agreement':>9}")
+    for row in rows:
+        low, high = row['band']
+        mae = row['local_mean_abs_error']
+        agreement = row['local_decision_agreement']
+        print(f"{low:>5.2f}-{high:<5.2f} {row['escalation_rate']:>10.3f} {row['local']:>6} "
+              f"{'-' if mae is None else f'{mae:.3f}':>9} {'-' if agreement is None else f'{agreement:.3f}':>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--log', default=os.environ.get('QUALITY_CASCADE_LOG'), help='LLMの品質分析結果の JSONL')
+    parser.add_argument('--model', default=os.environ.get('QUALITY_CASCADE_MODEL', cascade.DEFAULT_MODEL_PATH))
+    parser.add_argument('--bands', default=DEFAULT_BANDS, help='評価する不確実帯（下限-上限 のカンマ区切り）')
+    parser.add_argument('--holdout', type=float, default=0.2, help='評価に使う割合')
+    parser.add_argument('--min-coverage', type=float, default=cascade.min_coverage())
+    parser.add_argument('--epochs', type=int, default=200)
+    parser.add_argument('--dim', type=int, default=cascade.DEFAULT_DIM, help='n-gram のハッシュの次元')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dry-run', action='store_true', help='評価だけしてモデルを保存しない')
+    args = parser.parse_args()
+    if not args.log:
+        parser.error('--log か QUALITY_CASCADE_LOG を指定してください')
+
+    examples = cascade.load_examples(args.log)
+    print(f"{len(examples)} 件（同じ会話は最新の結果のみ）")
+    random.Random(args.seed).shuffle(examples)
+    evaluation = examples[:int(len(examples) * args.holdout)]
+    if evaluation:
+        started = time.perf_counter()
+        model = cascade.train(examples[len(evaluation):], dim=args.dim, epochs=args.epochs)
+        print(f"学習 {len(examples) - len(evaluation)} 件: {time.perf_counter() - started:.1f} 秒、評価 {len(evaluation)} 件\n")
+        print_sweep(cascade.sweep(model, evaluation, parse_bands(args.bands), args.min_coverage))
+
+    if args.dry_run:
+        return
+    model = cascade.train(examples, dim=args.dim, epochs=args.epochs)
+    model.save(args.model)
+    print(f"\n全 {len(examples)} 件で学習したモデルを保存しました: {args.model}")
+
+
+if __name__ == '__main__':
+    main()
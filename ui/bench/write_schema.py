@@ -0,0 +1,41 @@
+"""custom_database_schema.sql を _lib/storage.py のスキーマ定義から生成する
+
+スキーマの定義は storage.py（SCHEMA・ANALYSIS_VIEW・SUMMARY_SCHEMA・SEARCH_SCHEMA）だけに置く。
+定義を変えたらこのスクリプトで書き直す（ui/tests/test_storage.py が一致を確認する）。
+
+使い方:
+    python ui/bench/write_schema.py
+    python ui/bench/write_schema.py --check
+"""
+import argparse
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'api'))
+
+from _lib.storage import schema_sql  # noqa: E402
+
+SCHEMA_PATH = os.path.join(BENCH_DIR, '..', '..', 'custom_database_schema.sql')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--check', action='store_true', help='書き込まずに一致だけを確認する（不一致なら終了コード 1）')
+    args = parser.parse_args()
+
+    with open(SCHEMA_PATH, encoding='utf-8') as f:
+        current = f.read()
+    if current == schema_sql():
+        print(f"{os.path.normpath(SCHEMA_PATH)} is up to date")
+        return
+    if args.check:
+        print(f"{os.path.normpath(SCHEMA_PATH)} is out of date (run python ui/bench/write_schema.py)")
+        sys.exit(1)
+    with open(SCHEMA_PATH, 'w', encoding='utf-8') as f:
+        f.write(schema_sql())
+    print(f"wrote {os.path.normpath(SCHEMA_PATH)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -631,6 +631,42 @@ ${conversationText}
    }
  }
 
+ // 識別・SOAP・品質分析を1回の往復で実行（/pipeline）
+ async analyzeSession(conversationText) {
+   if (!this.isConnected) {
+     return null;
+   }
+
+   try {
+     const response = await fetch(`${this.apiEndpoint}/pipeline`, {
+       method: 'POST',
+       headers: {
+         'Content-Type': 'application/json',
+         'X-API-Version': '2024-01'
+       },
+       body: JSON.stringify({
+         content: conversationText
+       })
+     });
+
+     if (!response.ok) {
+       throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+     }
+
+     const result = await response.json();
+     console.log('⏱️ パイプライン所要時間(ms):', result.timings_ms);
+     return {
+       identification: this.validateIdentificationResult(result.identification),
+       soap: this.validateSOAPResult(result.soap),
+       quality: this.validateQualityResult(result.quality),
+       timings_ms: result.timings_ms
+     };
+   } catch (error) {
+     console.error('パイプライン解析エラー:', error);
+     return null;
+   }
+ }
+
  // 実データベース品質分析（固定値使用禁止）
  fallbackQualityAnalysis(conversationText) {
    console.log('🔍 実データベース品質分析開始 - 固定値一切使用禁止');
@@ -0,0 +1,35 @@
+"""ui/tests 共通のフィクスチャ"""
+import io
+import json
+from http.client import HTTPMessage
+
+import pytest
+
+
+def _call(handler_cls, method, path, payload=None, headers=None):
+    """handler_cls をソケットなしで1リクエスト分呼び、(ステータス, 応答本文の文字列) を返す"""
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else b''
+    handler = handler_cls.__new__(handler_cls)
+    handler.rfile = io.BytesIO(body)
+    handler.wfile = io.BytesIO()
+    handler.headers = HTTPMessage()
+    handler.headers['Content-Type'] = 'application/json'
+    handler.headers['Content-Length'] = str(len(body))
+    for name, value in (headers or {}).items():
+        handler.headers[name] = value
+    handler.command = method
+    handler.path = path
+    handler.request_version = 'HTTP/1.1'
+    handler.requestline = f'{method} {path} HTTP/1.1'
+    handler.client_address = ('127.0.0.1', 0)
+    handler.close_connection = True
+    handler.log_message = lambda *args: None
+    getattr(handler, f'do_{method}')()
+    head, _, response = handler.wfile.getvalue().partition(b'\r\n\r\n')
+    return int(head.split(b' ', 2)[1]), response.decode('utf-8')
+
+
+@pytest.fixture
+def call():
+    """call(handler_cls, method, path, payload=None, headers=None) -> (ステータス, 応答本文の文字列)"""
+    return _call
@@ -0,0 +1,36 @@
+"""一括解析（batch.py）のテスト
+
+使い方:
+    python -m pytest ui/tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import batch  # noqa: E402
+
+
+@pytest.mark.parametrize('provider', ['openai', 'openrouter'])
+def test_pipeline_is_rejected_for_client_providers_before_running(provider, monkeypatch):
+    monkeypatch.setattr(batch, 'make_runner', lambda provider: pytest.fail('解析を始めてはいけない'))
+    items = [{"id": 1, "content": "医師: どうされましたか。", "type": "pipeline"}]
+    with pytest.raises(batch.BatchError, match='pipeline'):
+        next(batch.run_batch(items, provider))
+
+
+def test_closing_the_stream_skips_items_not_yet_started(monkeypatch):
+    started = []
+
+    def run(item, bypass_cache):
+        started.append(item['id'])
+        return {"ok": True}
+
+    monkeypatch.setattr(batch, 'make_runner', lambda provider: run)
+    items = [{"id": index, "content": "", "type": "quality"} for index in range(50)]
+    results = batch.run_batch(items, 'gemini', concurrency=1)
+    next(results)
+    results.close()
+    assert len(started) < len(items)
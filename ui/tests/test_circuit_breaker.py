@@ -0,0 +1,59 @@
+"""サーキットブレーカー（_lib/circuit_breaker.py）のテスト
+
+使い方:
+    python -m pytest ui/tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from _lib.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker  # noqa: E402
+from _lib.llm_json import LLMJSONError, decode_llm_json  # noqa: E402
+from soap import SOAP_SCHEMA  # noqa: E402
+
+
+def unreadable():
+    return decode_llm_json('gemini', 'soap', 'すみません、解析できませんでした', SOAP_SCHEMA)
+
+
+def fail(error):
+    def call():
+        raise error
+    return call
+
+
+def half_open_breaker():
+    breaker = CircuitBreaker('gemini', 'test-model', failure_threshold=1, open_seconds=0, half_open_probes=1)
+    with pytest.raises(RuntimeError):
+        breaker.call(fail(RuntimeError('503')))
+    assert breaker.state == OPEN
+    return breaker
+
+
+def test_unreadable_reply_is_neutral_in_half_open():
+    breaker = half_open_breaker()
+    with pytest.raises(LLMJSONError):
+        breaker.call(unreadable)
+    assert breaker.state == HALF_OPEN
+    # 試行の枠は返っているので次の試行が通り、成功すれば closed に戻る
+    assert breaker.call(lambda: {"ok": True}) == {"ok": True}
+    assert breaker.state == CLOSED
+
+
+def test_unreadable_reply_is_not_counted_as_failure_or_success():
+    breaker = CircuitBreaker('gemini', 'test-model', failure_threshold=2)
+    for _ in range(3):
+        with pytest.raises(LLMJSONError):
+            breaker.call(unreadable)
+    snapshot = breaker.snapshot()
+    assert snapshot['state'] == CLOSED and snapshot['failures'] == 0 and snapshot['recent_failures'] == 0
+
+
+def test_other_value_errors_are_failures():
+    breaker = half_open_breaker()
+    with pytest.raises(ValueError):
+        breaker.call(fail(ValueError('invalid api key format')))
+    assert breaker.state == OPEN
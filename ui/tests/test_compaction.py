@@ -0,0 +1,66 @@
+"""会話の抽出的圧縮（_lib/compaction.py）のテスト
+
+使い方:
+    python -m pytest ui/tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from _lib.compaction import OMITTED_MARKER, compact_for_prompt, compact_transcript, estimate_tokens  # noqa: E402
+
+CONVERSATION = "\n".join([
+    "医師: おはようございます。",
+    "患者: おはようございます。",
+    "医師: 今日はどうされましたか？",
+    "患者: 右上の奥歯が冷たいものでしみます。",
+    "医師: はい。",
+    "患者: はい。",
+    "医師: なるほど。",
+    "医師: 右上6番にう蝕があります。次回 充填処置をします。",
+    "患者: 費用が心配です。",
+    "医師: 保険の範囲で治療できます。",
+    "患者: 分かりました、それでお願いします。",
+])
+
+
+def test_conversation_within_budget_is_unchanged():
+    budget = estimate_tokens(CONVERSATION)
+    text, stats = compact_transcript(CONVERSATION, budget)
+    assert text == CONVERSATION
+    assert stats['ratio'] == 1.0 and stats['dropped'] == 0
+    assert compact_for_prompt(CONVERSATION, 'soap', budget=0) == (CONVERSATION, None)
+
+
+def test_fillers_are_dropped_first_and_marked_once_per_gap():
+    budget = estimate_tokens(CONVERSATION) - 20
+    text, stats = compact_transcript(CONVERSATION, budget)
+    lines = text.split('\n')
+    assert stats['compacted_tokens'] == estimate_tokens(text) <= budget
+    assert stats['dropped'] > 0 and stats['utterances'] == len(CONVERSATION.split('\n'))
+    # 相づち・挨拶を落とし、症状・所見・費用の不安・同意は残す
+    assert not {"医師: はい。", "患者: はい。", "医師: おはようございます。"} & set(lines)
+    for kept in ("患者: 右上の奥歯が冷たいものでしみます。", "患者: 費用が心配です。",
+                 "患者: 分かりました、それでお願いします。"):
+        assert kept in lines
+    # 連続して落とした発話は（中略）1行にまとまる
+    assert OMITTED_MARKER in lines
+    assert all(not (a == b == OMITTED_MARKER) for a, b in zip(lines, lines[1:]))
+
+
+def test_consecutive_lines_of_same_speaker_are_merged():
+    conversation = "\n".join(["患者: はい。"] * 3 + [
+        "医師: 右上6番にう蝕があります。",
+        "医師: 次回 充填処置をします。",
+    ] + ["患者: はい。"] * 3)
+    text, stats = compact_transcript(conversation, estimate_tokens(conversation) - 20)
+    assert text.split('\n') == [OMITTED_MARKER, "医師: 右上6番にう蝕があります。 次回 充填処置をします。", OMITTED_MARKER]
+    assert stats['merged'] == 1 and stats['dropped'] == 6
+
+
+def test_single_utterance_over_budget_is_returned_as_is():
+    conversation = "患者: 右上の奥歯が冷たいものでしみます。"
+    text, stats = compact_transcript(conversation, 5)
+    assert text == conversation
+    assert stats['dropped'] == 0
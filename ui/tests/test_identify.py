@@ -0,0 +1,37 @@
+"""/api/identify のローカル識別（話者の役割推定と医師の発言中の「〜さん」からの患者名）のテスト
+
+使い方:
+    python -m pytest ui/tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import identify  # noqa: E402
+from _lib.transcript import Transcript  # noqa: E402
+
+
+def test_patient_name_ends_at_standalone_honorific():
+    transcript = Transcript.from_text("医師: お口を大きく開けてください…田中さん\n患者: はい、お願いします。")
+    result = identify._local_identify(transcript)
+    assert result['patient_name'] == '田中'
+    assert result['method'] == 'local_role_inference'
+
+
+def test_inflected_doctor_line_is_not_a_name(monkeypatch):
+    # 「今日はどうされましたか」から名前を取らず、Gemini・フォールバックに回す
+    conversation = ("Speaker 1: 今日はどうされましたか\n"
+                    "Speaker 2: 右上の奥歯が冷たいものでしみるんです。\n"
+                    "Speaker 1: 右上の第一大臼歯にう蝕がありますね。治療が必要です。\n"
+                    "Speaker 2: 先生、よろしくお願いします。")
+    assert identify._local_identify(Transcript.from_text(conversation)) is None
+    monkeypatch.delenv('GEMINI_API_KEY', raising=False)
+    assert identify.identify_speakers(conversation)['method'] == 'pattern_matching_fallback'
+
+
+def test_local_patient_name_rejects_verb_forms():
+    assert identify._local_patient_name("お口を大きく開けてください") is None
+    assert identify._local_patient_name("今日はどうされましたか") is None
+    assert identify._local_patient_name("様子を見ましょう。患者様もご安心ください") is None
+    assert identify._local_patient_name("山田様、こんにちは") == '山田'
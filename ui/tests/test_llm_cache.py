@@ -0,0 +1,87 @@
+"""LLM応答キャッシュ（_lib/llm_cache.py）と共通デコーダー（_lib/llm_json.py）のテスト
+
+使い方:
+    python -m pytest ui/tests
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from _lib import llm_cache  # noqa: E402
+from _lib.llm_json import decode_llm_json, is_complete  # noqa: E402
+from soap import SOAP_SCHEMA  # noqa: E402
+
+COMPLETE = {"subjective": "右上の奥歯が冷たいものでしみる", "objective": "右上6番に二次う蝕",
+            "assessment": "二次う蝕", "plan": "次回 充填処置", "confidence": 0.8}
+CONVERSATION = "医師: 今日はどうされましたか。\n患者: 右上の奥歯が冷たいものでしみます。"
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.delenv('LLM_CACHE_DISABLED', raising=False)
+    monkeypatch.setenv('LLM_CACHE_PATH', str(tmp_path / 'llm_cache.sqlite3'))
+    monkeypatch.setattr(llm_cache, '_default_cache', None)
+    yield llm_cache.get_cache()
+    monkeypatch.setattr(llm_cache, '_default_cache', None)
+
+
+def soap_call(text, calls, template_version='test-v1', bypass=False):
+    def generate():
+        calls.append(1)
+        return decode_llm_json('gemini', 'soap', text, SOAP_SCHEMA)
+    return llm_cache.cached_call('gemini', 'test-model', template_version, CONVERSATION, generate, bypass=bypass)
+
+
+def test_complete_reply_is_served_from_cache(cache):
+    calls = []
+    text = json.dumps(COMPLETE, ensure_ascii=False)
+    assert soap_call(text, calls) == COMPLETE
+    assert soap_call(text, calls) == COMPLETE
+    assert len(calls) == 1
+
+
+def test_bypass_and_template_version_skip_the_cached_reply(cache):
+    calls = []
+    text = json.dumps(COMPLETE, ensure_ascii=False)
+    soap_call(text, calls)
+    soap_call(text, calls, bypass=True)
+    soap_call(text, calls, template_version='test-v2')
+    assert len(calls) == 3
+    assert llm_cache.wants_bypass({'Cache-Control': 'no-cache'}, {})
+    assert llm_cache.wants_bypass(None, {"no_cache": True})
+    assert not llm_cache.wants_bypass({}, {})
+
+
+@pytest.mark.parametrize('text', [
+    # 必須フィールド（assessment / plan）が欠けた応答
+    json.dumps({"subjective": "しみる", "objective": "二次う蝕"}, ensure_ascii=False),
+    # max_tokens で打ち切られた応答
+    '{"subjective": "しみる", "objective": "二次う蝕", "assessment": "二次う',
+])
+def test_incomplete_reply_is_returned_but_not_cached(cache, text):
+    calls = []
+    first = soap_call(text, calls)
+    assert first['subjective'] == 'しみる'
+    assert not is_complete(first)
+    soap_call(text, calls)
+    assert len(calls) == 2
+    assert cache.stats()['incomplete'] == 2
+    assert cache.disk.get(llm_cache.cache_key('gemini', 'test-model', 'test-v1', CONVERSATION)) is None
+
+
+def test_decoder_repairs_and_reports_fixes():
+    text = '```json\n{"subjective": "しみる", "objective": "う蝕", "assessment": "う蝕", "plan": "充填", ' \
+           '"confidence": "0.8",}\n```'
+    result = decode_llm_json('gemini', 'soap', text, SOAP_SCHEMA)
+    assert result['confidence'] == 0.8
+    assert result['json_repair']['outcome'] == 'repaired'
+    assert is_complete(result)
+
+
+def test_decoder_raises_when_nothing_required_is_readable():
+    with pytest.raises(ValueError):
+        decode_llm_json('gemini', 'soap', 'すみません、解析できませんでした', SOAP_SCHEMA)
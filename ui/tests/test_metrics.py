@@ -0,0 +1,70 @@
+"""各関数の GET ?metrics=1 / ?metrics=state（_lib/telemetry.instrument_handler）のテスト
+
+使い方:
+    python -m pytest ui/tests
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import soap  # noqa: E402
+
+
+def test_post_only_handler_serves_its_own_metrics(call, monkeypatch):
+    monkeypatch.delenv('GEMINI_API_KEY', raising=False)
+    status, _ = call(soap.handler, 'POST', '/api/soap', {"content": "医師: どうされましたか。\n患者: 奥歯がしみます。"})
+    assert status == 200
+
+    status, text = call(soap.handler, 'GET', '/api/soap?metrics=1')
+    assert status == 200
+    assert 'dental_api_requests_total{endpoint="soap",method="POST",status="200"}' in text
+    # メトリクスの取得自体はリクエスト数に数えない
+    assert 'endpoint="soap",method="GET"' not in text
+
+    status, _ = call(soap.handler, 'GET', '/api/soap')
+    assert status == 501
+
+
+def test_state_requires_token(call, monkeypatch):
+    monkeypatch.delenv('METRICS_STATE_TOKEN', raising=False)
+    status, _ = call(soap.handler, 'GET', '/api/soap?metrics=state')
+    assert status == 404
+
+    monkeypatch.setenv('METRICS_STATE_TOKEN', 'secret')
+    status, _ = call(soap.handler, 'GET', '/api/soap?metrics=state')
+    assert status == 403
+    status, _ = call(soap.handler, 'GET', '/api/soap?metrics=state', headers={'X-Metrics-Token': 'wrong'})
+    assert status == 403
+
+
+def test_state_is_served_by_the_function_not_health(call, monkeypatch):
+    import health
+
+    monkeypatch.setenv('METRICS_STATE_TOKEN', 'secret')
+    status, text = call(soap.handler, 'GET', '/api/soap?metrics=state', headers={'X-Metrics-Token': 'secret'})
+    assert status == 200
+    state = json.loads(text)
+    assert {'circuit_breakers', 'provider_calls', 'llm_cache', 'llm_coalescing'} <= set(state)
+
+    status, text = call(health.handler, 'GET', '/api/health')
+    assert status == 200
+    report = json.loads(text)
+    assert 'circuit_breakers' not in report and 'quality_cascade' not in report
+    assert all('calls' not in provider for provider in report['providers'].values())
+
+
+def test_trace_file_is_flushed_per_request_and_rotated(tmp_path):
+    from _lib import telemetry
+
+    path = tmp_path / 'trace.jsonl'
+    writer = telemetry._TraceWriter(str(path), max_bytes=200)
+    writer.write({"name": "parse"})
+    assert path.read_text() == ''
+    writer.write({"name": "request"}, flush=True)
+    assert [json.loads(line)['name'] for line in path.read_text().splitlines()] == ['parse', 'request']
+    for _ in range(10):
+        writer.write({"name": "request", "pad": 'x' * 50}, flush=True)
+    assert path.stat().st_size <= 200 + 100
+    assert (tmp_path / 'trace.jsonl.1').exists()
@@ -0,0 +1,106 @@
+"""ヘッジ/レース呼び出し（_lib/router.py）のテスト
+
+ui/bench/bench_hedging.py の OpenAI 互換スタブサーバにストリーミングで送る。
+
+使い方:
+    python -m pytest ui/tests
+"""
+import os
+import sys
+import time
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, '..', 'api'))
+sys.path.insert(0, os.path.join(TESTS_DIR, '..', 'bench'))
+
+from _lib.provider_health import get_health  # noqa: E402
+from _lib.router import Cancelled, cancelled, hedge_delay_ms, route  # noqa: E402
+from bench_hedging import StubServer, reset_health, stub_backend, valid_soap  # noqa: E402
+
+
+@pytest.fixture
+def stubs(monkeypatch):
+    """stubs(name=基本ms, ...) で裾の遅延・無効な応答のないスタブを立てる（ヘッジの既定の待ち時間は5秒）"""
+    for name in ('HEDGE_QUANTILE', 'HEDGE_MIN_SAMPLES', 'HEDGE_MIN_DELAY_MS', 'HEDGE_MAX_DELAY_MS'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('HEDGE_DEFAULT_DELAY_MS', '5000')
+    reset_health()
+    started = []
+
+    def start(**specs):
+        for name, base_ms in specs.items():
+            started.append(StubServer(name, base_ms, 0, 0, 0))
+        return started
+    yield start
+    for stub in started:
+        stub.close()
+    reset_health()
+
+
+def backends(servers):
+    return [(stub.name, stub_backend(stub)) for stub in servers]
+
+
+def attempts_by_provider(routing):
+    return {attempt["provider"]: attempt for attempt in routing["attempts"]}
+
+
+def test_hedge_fires_after_quantile_delay(stubs):
+    servers = stubs(openai=1500, openrouter=50)
+    for _ in range(10):
+        get_health().record('openai', 200, True)
+    delay = hedge_delay_ms('openai')
+    assert delay == pytest.approx(200)
+
+    provider, result, routing = route('test', backends(servers), validate=valid_soap, mode='hedge')
+    assert provider == 'openrouter' and valid_soap(result)
+    hedged = attempts_by_provider(routing)['openrouter']
+    assert hedged["kind"] == 'hedge'
+    assert delay <= hedged["sent_ms"] < delay + 150
+    assert attempts_by_provider(routing)['openai']["outcome"] == 'cancelled'
+    assert routing["elapsed_ms"] < 1500
+
+
+def test_race_returns_fastest_backend_and_cancels_loser(stubs):
+    servers = stubs(openai=1200, openrouter=60)
+    seen = []
+
+    def watched(func):
+        def call():
+            try:
+                return func()
+            except Cancelled:
+                seen.append(cancelled())
+                raise
+        return call
+
+    provider, _, routing = route('test', [(name, watched(func)) for name, func in backends(servers)],
+                                 validate=valid_soap, mode='race')
+    assert provider == 'openrouter'
+    assert routing["elapsed_ms"] < 1200
+    assert attempts_by_provider(routing)['openai']["outcome"] == 'cancelled'
+    # 負けた側はストリーミングの途中で cancelled() を見て打ち切る
+    deadline = time.perf_counter() + 3
+    while not seen and time.perf_counter() < deadline:
+        time.sleep(0.02)
+    assert seen == [True]
+    assert servers[0].counts['completed'] == 0
+
+
+def test_invalid_winner_falls_through_to_next_backend(stubs):
+    servers = stubs(openai=30, openrouter=60)
+    (first, first_func), second = backends(servers)
+
+    def without_plan():
+        result = first_func()
+        del result['P']
+        return result
+
+    provider, result, routing = route('test', [(first, without_plan), second], validate=valid_soap, mode='hedge')
+    assert provider == 'openrouter' and valid_soap(result)
+    assert attempts_by_provider(routing)['openai']["outcome"] == 'invalid'
+    # 実行中の呼び出しがなければヘッジの待ち時間（HEDGE_DEFAULT_DELAY_MS）を待たずに次へ送る
+    assert attempts_by_provider(routing)['openrouter']["kind"] == 'retry'
+    assert routing["elapsed_ms"] < 1000
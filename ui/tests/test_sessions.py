@@ -0,0 +1,35 @@
+"""/api/sessions の保存と全文検索（?q=）が同じ関数・同じデータベースで動くことのテスト
+
+使い方:
+    python -m pytest ui/tests
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import sessions  # noqa: E402
+from _lib import storage  # noqa: E402
+
+
+def test_search_finds_session_saved_by_same_handler(call, tmp_path, monkeypatch):
+    monkeypatch.setenv('SESSION_DB_PATH', str(tmp_path / 'sessions.db'))
+    monkeypatch.setattr(storage, '_default_store', None)
+
+    def sessions_call(method, path, payload=None):
+        status, body = call(sessions.handler, method, path, payload)
+        return status, json.loads(body)
+
+    status, saved = sessions_call('POST', '/api/sessions', {
+        "content": "医師: 今日はどうされましたか。\n患者: 右上の奥歯が冷たいものでしみます。",
+        "patient_name": "田中", "doctor_name": "佐藤"})
+    assert status == 200
+
+    status, found = sessions_call('GET', '/api/sessions?q=しみ')
+    assert status == 200
+    assert found['query'] == 'しみ'
+    assert {hit['session_id'] for hit in found['hits']} == set(saved['session_ids'])
+
+    status, _ = sessions_call('GET', '/api/sessions?q=しみ&limit=x')
+    assert status == 400
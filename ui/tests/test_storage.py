@@ -0,0 +1,33 @@
+"""セッション保存のスキーマ（_lib/storage.py）のテスト
+
+使い方:
+    python -m pytest ui/tests
+"""
+import os
+import sqlite3
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, '..', 'api'))
+
+from _lib import storage  # noqa: E402
+
+SCHEMA_PATH = os.path.join(TESTS_DIR, '..', '..', 'custom_database_schema.sql')
+
+
+def test_schema_file_is_generated_from_storage():
+    with open(SCHEMA_PATH, encoding='utf-8') as f:
+        assert f.read() == storage.schema_sql(), 'python ui/bench/write_schema.py で custom_database_schema.sql を更新する'
+
+
+def test_schema_file_creates_the_tables_the_store_uses(tmp_path):
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(storage.schema_sql())
+    documented = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+    store = storage.SessionStore(str(tmp_path / 'sessions.db'))
+    try:
+        created = {row[0] for row in store._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        store.close()
+    assert created <= documented
+    assert 'comprehensive_session_analysis' in documented
@@ -0,0 +1,39 @@
+"""話者ラベルの解釈（_lib/transcript.py）のテスト
+
+使い方:
+    python -m pytest ui/tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from _lib.transcript import DOCTOR, PATIENT, STAFF, UNKNOWN, Transcript, speaker_role  # noqa: E402
+
+
+def test_ascii_markers_match_whole_words_only():
+    assert speaker_role('Andrew') == UNKNOWN
+    assert speaker_role('Sidharth') == UNKNOWN
+    assert speaker_role('Dr. Smith') == DOCTOR
+    assert speaker_role('Dr田中') == DOCTOR
+    assert speaker_role('DH 佐藤') == STAFF
+    assert speaker_role('Patient 2') == PATIENT
+
+
+def test_time_prefix_is_not_a_speaker_label():
+    transcript = Transcript.from_text("10:30 痛みがあります\n医師: 見てみましょう")
+    assert transcript.speakers() == [None, '医師']
+    assert transcript.content(0) == '10:30 痛みがあります'
+
+
+def test_role_lines_from_text_matches_per_line_selection():
+    markers = {PATIENT: ('患者', 'Patient'), DOCTOR: ('医師', 'Doctor', 'Dr.')}
+    text = ("医師: 今日はどうされましたか。\n患者: 奥歯がしみます。\n\n10:30 患者 来院\n"
+            + "受付: 次の方どうぞ\n" * 300 + "Patient: はい\n看護師: 患者さんの番です")
+    for counted in ((), (DOCTOR,)):
+        selected = Transcript.from_text(text).role_lines(markers, counted)
+        parsed = Transcript.from_text(text)
+        parsed.speakers()
+        assert selected == parsed.role_lines(markers, counted)
+    assert selected[PATIENT] == ['患者: 奥歯がしみます。', '10:30 患者 来院', 'Patient: はい', '看護師: 患者さんの番です']
+    assert selected[DOCTOR] == 1